@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Compare generating the cache of ``opm serve`` from scratch with reusing it.
+
+The benchmark generates a synthetic file-based catalog and times ``generate_cache_locally``:
+
+* ``full``: the cache is generated from scratch, as when ``iib_opm_cache_reuse`` is disabled
+* ``store hit``: the cache of the identical catalog is taken from the artifact cache
+* ``seeded, unchanged``: the cache of ``from_index`` matches the catalog, so opm keeps it
+* ``seeded, changed``: one package of the catalog changed, so opm rebuilds the seeded cache
+
+It requires the ``opm`` binary, e.g.::
+
+    python benchmarks/bench_opm_cache.py --opm /usr/bin/opm --packages 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, List
+from unittest import mock
+
+
+def write_catalog(catalog_dir: str, packages: int, bundles: int) -> None:
+    """
+    Write a synthetic file-based catalog.
+
+    :param str catalog_dir: the directory to write the catalog to
+    :param int packages: the number of packages
+    :param int bundles: the number of bundles of every package
+    """
+    for p in range(packages):
+        package = f'operator-{p:05d}'
+        entries = [
+            {
+                'name': f'{package}.v1.{b}.0',
+                **({'replaces': f'{package}.v1.{b - 1}.0'} if b else {}),
+            }
+            for b in range(bundles)
+        ]
+        blobs: List[dict] = [
+            {'schema': 'olm.package', 'name': package, 'defaultChannel': 'stable'},
+            {'schema': 'olm.channel', 'package': package, 'name': 'stable', 'entries': entries},
+        ]
+        for b in range(bundles):
+            blobs.append(
+                {
+                    'schema': 'olm.bundle',
+                    'name': f'{package}.v1.{b}.0',
+                    'package': package,
+                    'image': f'registry.example.com/{package}-bundle@sha256:{p:032x}{b:032x}',
+                    'properties': [
+                        {
+                            'type': 'olm.package',
+                            'value': {'packageName': package, 'version': f'1.{b}.0'},
+                        },
+                        {
+                            'type': 'olm.gvk',
+                            'value': {'group': 'example.com', 'kind': f'K{p}', 'version': 'v1'},
+                        },
+                    ],
+                }
+            )
+        os.makedirs(os.path.join(catalog_dir, package))
+        with open(os.path.join(catalog_dir, package, 'catalog.json'), 'w') as f:
+            for blob in blobs:
+                json.dump(blob, f)
+                f.write('\n')
+
+
+def timed(name: str, func: Callable[[], None]) -> float:
+    """
+    Run the function and print how long it took.
+
+    :param str name: the name of the measurement
+    :param callable func: the function to run
+    :return: the duration in seconds
+    :rtype: float
+    """
+    start = time.monotonic()
+    func()
+    duration = time.monotonic() - start
+    print(f'{name:<20} {duration:8.2f}s')
+    return duration
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--opm', default='opm', help='the path to the opm binary')
+    parser.add_argument('--packages', type=int, default=2000, help='the number of packages')
+    parser.add_argument('--bundles', type=int, default=5, help='the number of bundles per package')
+    args = parser.parse_args()
+
+    from iib.workers import artifact_cache
+    from iib.workers.config import get_worker_config
+    from iib.workers.tasks.opm_operations import Opm, generate_cache_locally
+
+    work_dir = tempfile.mkdtemp(prefix='iib-bench-')
+    conf = get_worker_config()
+    conf.iib_artifact_cache_dir = os.path.join(work_dir, 'artifacts')
+    artifact_cache._artifact_cache = None
+    Opm.opm_version = args.opm
+    try:
+        catalog_dir = os.path.join(work_dir, 'catalog')
+        write_catalog(catalog_dir, args.packages, args.bundles)
+        cache_path = os.path.join(work_dir, 'cache')
+        from_index_cache = os.path.join(work_dir, 'from-index-cache')
+
+        def _generate(from_index=None):
+            generate_cache_locally(work_dir, catalog_dir, cache_path, from_index=from_index)
+
+        def _copy_from_index(image, src_path, dest_path):
+            shutil.copytree(from_index_cache, dest_path)
+
+        print(f'{args.packages} packages with {args.bundles} bundles each')
+        conf.iib_opm_cache_reuse = False
+        full = timed('full', _generate)
+        shutil.copytree(cache_path, from_index_cache)
+
+        conf.iib_opm_cache_reuse = True
+        _generate()
+        timed('store hit', _generate)
+
+        # Simulate copying /tmp/cache from from_index without a cached entry
+        conf.iib_artifact_cache_dir = None
+        with mock.patch('iib.workers.tasks.build._copy_files_from_image', _copy_from_index):
+            seeded = timed('seeded, unchanged', lambda: _generate('from-index'))
+            with open(os.path.join(catalog_dir, 'operator-00000', 'catalog.json'), 'a') as f:
+                f.write('{"schema": "olm.deprecations", "package": "operator-00000"}\n')
+            timed('seeded, changed', lambda: _generate('from-index'))
+        print(f'speedup of the seeded cache: {full / seeded:.1f}x')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
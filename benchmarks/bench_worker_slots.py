@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+r"""
+Measure the requests per hour a worker host completes as the number of worker slots grows.
+
+Every slot is a process set up by ``iib.workers.slots``, the same as a worker started with
+``worker_concurrency`` set to the number of slots and ``iib_worker_slots_dir`` set. With
+``--image``, every request does what a request does with the container storage of its slot: it
+pulls the image with ``podman pull``, builds an image on top of it with ``buildah bud`` and
+removes all the images with ``podman rmi --all``, as ``_cleanup`` does::
+
+    python benchmarks/bench_worker_slots.py --max-slots 8 \
+        --image registry.example.com/ns/binary:latest
+
+With ``--command``, the command is run in the slot for every request instead. Without either,
+the requests are synthetic and the results say so: a request waits on I/O for ``--io-seconds``,
+which stands for the registry requests and the pushes, and is busy for ``--cpu-seconds``, which
+stands for ``opm`` and the compression of the layers. Those are also added to the real requests
+when set explicitly.
+"""
+import argparse
+import multiprocessing
+import os
+import shlex
+import tempfile
+import time
+from typing import List
+
+
+def _init_slot(directory: str, count: int) -> None:
+    """
+    Set up the slot of the pool process.
+
+    :param str directory: the directory of the slots
+    :param int count: the number of slots
+    """
+    from iib.workers.slots import WorkerSlot
+
+    index = multiprocessing.current_process()._identity[0] - 1
+    WorkerSlot(index % count, count, directory).setup()
+
+
+def _get_commands(args: argparse.Namespace, request: int) -> List[List[str]]:
+    """
+    Get the commands run for the request.
+
+    :param argparse.Namespace args: the arguments of the benchmark
+    :param int request: the number of the request
+    :return: the commands to run
+    :rtype: list
+    """
+    if args.command:
+        return [shlex.split(args.command)]
+    if not args.image:
+        return []
+
+    # The temporary directory is the one of the slot once it's set up
+    context_dir = tempfile.mkdtemp(prefix=f'bench-{request}-')
+    dockerfile = os.path.join(context_dir, 'Dockerfile')
+    with open(dockerfile, 'w') as f:
+        f.write(f'FROM {args.image}\nLABEL request="{request}"\n')
+    return [
+        ['podman', 'pull', '--quiet', args.image],
+        ['buildah', 'bud', '--no-cache', '-t', f'bench:{request}', '-f', dockerfile, context_dir],
+        ['podman', 'rmi', '--all', '--force'],
+    ]
+
+
+def _run_request(args: argparse.Namespace, request: int) -> None:
+    """
+    Run a request of the benchmark.
+
+    :param argparse.Namespace args: the arguments of the benchmark
+    :param int request: the number of the request
+    """
+    from iib.workers.tasks.utils import run_cmd
+
+    time.sleep(args.io_seconds)
+    deadline = time.process_time() + args.cpu_seconds
+    while time.process_time() < deadline:
+        pass
+    for cmd in _get_commands(args, request):
+        run_cmd(cmd, exc_msg=f'Failed to run {" ".join(cmd)}')
+
+
+def measure(slots: int, requests: int, args: argparse.Namespace) -> float:
+    """
+    Run the requests with the number of slots.
+
+    :param int slots: the number of slots
+    :param int requests: the number of requests to run
+    :param argparse.Namespace args: the arguments of the benchmark
+    :return: the number of requests per hour
+    :rtype: float
+    """
+    with tempfile.TemporaryDirectory(prefix='iib-slots-') as directory:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(slots, initializer=_init_slot, initargs=(directory, slots)) as pool:
+            start = time.monotonic()
+            pool.starmap(_run_request, [(args, i) for i in range(requests)], chunksize=1)
+            duration = time.monotonic() - start
+    return requests / duration * 3600
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--max-slots', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--requests-per-slot', type=int, default=4)
+    parser.add_argument('--image', help='the image every request pulls and builds on')
+    parser.add_argument('--command', help='the command to run in the slot for every request')
+    parser.add_argument('--io-seconds', type=float, help='the simulated I/O time of a request')
+    parser.add_argument('--cpu-seconds', type=float, help='the simulated CPU time of a request')
+    args = parser.parse_args()
+    synthetic = not args.image and not args.command
+    if args.io_seconds is None:
+        args.io_seconds = 1.0 if synthetic else 0.0
+    if args.cpu_seconds is None:
+        args.cpu_seconds = 0.5 if synthetic else 0.0
+
+    print(f'{multiprocessing.cpu_count()} CPUs')
+    if synthetic:
+        print(
+            f'SYNTHETIC requests: {args.io_seconds}s of sleep and {args.cpu_seconds}s of CPU each, '
+            'no container storage is used. Set --image to measure real pulls and builds.'
+        )
+    elif args.command:
+        print(f'Every request runs: {args.command}')
+    else:
+        print(f'Every request pulls {args.image}, builds on it and removes the images')
+    print(f'{"slots":>5} {"requests/hour":>14} {"speedup":>8}')
+    baseline = None
+    slots = 1
+    while slots <= args.max_slots:
+        throughput = measure(slots, slots * args.requests_per_slot, args)
+        baseline = baseline or throughput
+        print(f'{slots:>5} {throughput:>14.0f} {throughput / baseline:>7.1f}x')
+        slots *= 2
+
+
+if __name__ == '__main__':
+    main()
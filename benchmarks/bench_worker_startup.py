@@ -0,0 +1,109 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Measure the cold start of a worker process and the binary versions logged for every request.
+
+Every run imports the task modules of the worker in a fresh interpreter, the same as Celery does
+when the worker starts, and then determines the binary versions as ``request_logger`` does for
+every request. The time taken and the number of subprocesses spawned are reported for both.
+
+Run it against another checkout of IIB to compare, e.g. the one before the versions were
+cached::
+
+    python benchmarks/bench_worker_startup.py --source /path/to/other/iib --requests 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = '''
+import json
+import subprocess
+import sys
+import time
+
+spawned = []
+original_init = subprocess.Popen.__init__
+
+
+def counting_init(self, args, *a, **kw):
+    spawned.append(args)
+    original_init(self, args, *a, **kw)
+
+
+subprocess.Popen.__init__ = counting_init
+
+start = time.monotonic()
+from iib.workers.config import get_worker_config
+import importlib
+for module in get_worker_config().include:
+    importlib.import_module(module)
+import_time = time.monotonic() - start
+import_spawned = len(spawned)
+
+from iib.common.common_utils import get_binary_versions
+start = time.monotonic()
+for _ in range(int(sys.argv[1])):
+    get_binary_versions()
+requests_time = time.monotonic() - start
+
+json.dump(
+    {
+        'import_time': import_time,
+        'import_spawned': import_spawned,
+        'requests_time': requests_time,
+        'requests_spawned': len(spawned) - import_spawned,
+    },
+    sys.stdout,
+)
+'''
+
+
+def run_once(source: str, requests: int) -> dict:
+    """
+    Start a fresh interpreter importing the worker from the source directory.
+
+    :param str source: the directory of the IIB checkout
+    :param int requests: the number of requests to determine the binary versions for
+    :return: the measurements of the run
+    :rtype: dict
+    """
+    env = dict(os.environ, PYTHONPATH=source)
+    env.setdefault('IIB_TESTING', 'true')
+    output = subprocess.run(
+        [sys.executable, '-c', _CHILD, str(requests)],
+        env=env,
+        cwd=source,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument(
+        '--source',
+        default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        help='the directory of the IIB checkout to measure',
+    )
+    parser.add_argument('--runs', type=int, default=5, help='the number of worker starts')
+    parser.add_argument('--requests', type=int, default=10, help='the number of requests per run')
+    args = parser.parse_args()
+
+    results = [run_once(args.source, args.requests) for _ in range(args.runs)]
+    print(f'{args.source}: median of {args.runs} runs')
+    for label, key in (
+        ('import of the task modules', 'import'),
+        (f'{args.requests} requests logged', 'requests'),
+    ):
+        duration = statistics.median(r[f'{key}_time'] for r in results)
+        print(f'{label:<28} {duration:8.3f}s  {results[0][f"{key}_spawned"]} subprocesses')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,36 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
-from typing import Dict
+import threading
+from typing import Dict, Optional
 from iib.workers.config import get_worker_config
 
+_binary_versions: Optional[Dict] = None
+_binary_versions_lock = threading.Lock()
+
 
 def get_binary_versions() -> Dict:
     """
     Return string containing version of binary files used by IIB.
 
+    The versions are only determined once per process, the first time they're needed.
+
+    :return: Dictionary with all binary used and their version
+    :rtype: dict
+    """
+    global _binary_versions
+    with _binary_versions_lock:
+        if _binary_versions is None:
+            versions = _probe_binary_versions()
+            if not versions['podman']:
+                # Don't remember the binaries missing, they may be installed later
+                return versions
+            _binary_versions = versions
+        return dict(_binary_versions)
+
+
+def _probe_binary_versions() -> Dict:
+    """
+    Run the binaries used by IIB to determine their version.
+
     :return: Dictionary with all binary used and their version
     :rtype: dict
     """
@@ -35,3 +59,10 @@ def get_binary_versions() -> Dict:
         }
     except FileNotFoundError:
         return {'opm': '', 'podman': '', 'buildah': ''}
+
+
+def clear_binary_versions_cache() -> None:
+    """Forget the versions of the binaries determined so far."""
+    global _binary_versions
+    with _binary_versions_lock:
+        _binary_versions = None
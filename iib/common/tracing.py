@@ -18,7 +18,7 @@ import getpass
 import logging
 import socket
 from copy import deepcopy
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Union
 
 
 from flask import Response
@@ -86,13 +86,14 @@ class TracingWrapper:
 
 def instrument_tracing(
     span_name: str = '',
-    attributes: Dict = {},
+    attributes: Union[Dict, Callable[[], Dict]] = {},
 ):
     """
     Instrument tracing for a function.
 
     :param span_name: The name of the span to be created.
-    :param attributes: The attributes to be added to the span.
+    :param attributes: The attributes to be added to the span, or a function returning them
+        which is only called when the span is created.
     :return: The decorated function or class.
     """
 
@@ -118,8 +119,9 @@ def instrument_tracing(
             with tracer.start_as_current_span(
                 span_name or func.__name__, kind=SpanKind.SERVER
             ) as span:
-                for attr in attributes:
-                    span.set_attribute(attr, attributes[attr])
+                span_attributes = attributes() if callable(attributes) else attributes
+                for attr in span_attributes:
+                    span.set_attribute(attr, span_attributes[attr])
                 span.set_attribute('host', socket.getfqdn())
                 span.set_attribute('user', getpass.getuser())
 
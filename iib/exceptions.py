@@ -27,3 +27,7 @@ class ExternalServiceError(BaseException):
 
 class FinalStateOverwriteError(BaseException):
     """Unable to update state if current state is "complete" or "failed"."""
+
+
+class FromIndexChangedError(IIBError):
+    """The ``from_index`` image changed before it could be overwritten."""
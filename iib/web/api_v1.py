@@ -8,6 +8,7 @@ import time
 import flask
 import kombu
 from flask_login import current_user, login_required
+from flask_sqlalchemy.pagination import Pagination
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import aliased, with_polymorphic
 from sqlalchemy.sql import text
@@ -43,7 +44,7 @@ from iib.web.models import (
 )
 from iib.web.s3_utils import get_object_from_s3_bucket
 from botocore.response import StreamingBody
-from iib.web.utils import pagination_metadata, str_to_bool
+from iib.web.utils import keyset_paginate, pagination_metadata, str_to_bool
 from iib.workers.tasks.build import (
     handle_add_request,
     handle_rm_request,
@@ -55,6 +56,7 @@ from iib.workers.tasks.build_recursive_related_bundles import (
 )
 from iib.workers.tasks.build_regenerate_bundle import handle_regenerate_bundle_request
 from iib.workers.tasks.build_merge_index_image import handle_merge_request
+from iib.workers.tasks.build_prefetch import handle_prefetch_request
 from iib.workers.tasks.build_create_empty_index import handle_create_empty_index_request
 from iib.workers.tasks.general import failed_request_callback
 from iib.web.iib_static_types import (
@@ -63,6 +65,7 @@ from iib.web.iib_static_types import (
     AddRmBatchPayload,
     CreateEmptyIndexPayload,
     FbcOperationRequestPayload,
+    KeysetPagination,
     MergeIndexImagesPayload,
     PayloadTypesUnion,
     RecursiveRelatedBundlesRequestPayload,
@@ -383,6 +386,7 @@ def get_builds() -> flask.Response:
     index_image = flask.request.args.get('index_image')
     from_index = flask.request.args.get('from_index')
     from_index_startswith = flask.request.args.get('from_index_startswith')
+    input_digest = flask.request.args.get('input_digest')
     query_params = {}
 
     # Create an alias class to load the polymorphic classes
@@ -413,7 +417,7 @@ def get_builds() -> flask.Response:
         query_params['user'] = user
         query = query.join(Request.user).filter(User.username == user)
 
-    if index_image or from_index or from_index_startswith:
+    if index_image or from_index or from_index_startswith or input_digest:
         # https://sqlalche.me/e/20/xaj2 - Create aliases for self-join (Sqlalchemy 2.0)
         request_create_empty_index_alias = aliased(RequestCreateEmptyIndex, flat=True)
         request_add_alias = aliased(RequestAdd, flat=True)
@@ -472,6 +476,16 @@ def get_builds() -> flask.Response:
                 )
             )
 
+        if input_digest:
+            query_params['input_digest'] = input_digest
+            query = query.filter(
+                or_(
+                    request_add_alias.input_digest == input_digest,
+                    request_rm_alias.input_digest == input_digest,
+                    request_fbc_operations_alias.input_digest == input_digest,
+                )
+            )
+
         if index_image:
             # Get the image id of the image to be searched for
             image_result = Image.query.filter_by(pull_specification=index_image).first()
@@ -498,7 +512,16 @@ def get_builds() -> flask.Response:
                 )
             )
 
-    pagination_query = query.order_by(Request.id.desc()).paginate(max_per_page=max_per_page)
+    pagination_query: Union[Pagination, KeysetPagination]
+    if 'after_id' in flask.request.args or 'before_id' in flask.request.args:
+        estimate_total = str_to_bool(flask.request.args.get('estimate_total'))
+        if estimate_total:
+            query_params['estimate_total'] = 'true'
+        pagination_query = keyset_paginate(
+            query, Request.id, max_per_page=max_per_page, estimate_total=estimate_total
+        )
+    else:
+        pagination_query = query.order_by(Request.id.desc()).paginate(max_per_page=max_per_page)
     requests = pagination_query.items
 
     response = {
@@ -579,6 +602,36 @@ def _get_user_queue(
     return None
 
 
+def _schedule_prefetch(
+    request_id: int,
+    from_index: Optional[str] = None,
+    binary_image: Optional[str] = None,
+    bundles: Optional[List[str]] = None,
+) -> None:
+    """
+    Schedule the prefetch of the images of the request if ``IIB_PREFETCH_QUEUE`` is set.
+
+    The prefetch is only an optimization, so a failure to schedule it doesn't fail the request.
+
+    :param int request_id: the ID of the request
+    :param str from_index: the pull specification of the index image of the request
+    :param str binary_image: the pull specification of the binary image of the request
+    :param list bundles: the pull specifications of the bundles of the request
+    """
+    prefetch_queue = flask.current_app.config['IIB_PREFETCH_QUEUE']
+    if not prefetch_queue:
+        return
+
+    try:
+        handle_prefetch_request.apply_async(
+            args=[request_id, from_index, binary_image, bundles], queue=prefetch_queue
+        )
+    except kombu.exceptions.OperationalError:
+        flask.current_app.logger.warning(
+            'Failed to schedule the prefetch of the request %d', request_id
+        )
+
+
 @api_v1.route('/builds/add', methods=['POST'])
 @login_required
 @instrument_tracing(span_name="web.api_v1.add_bundles")
@@ -627,6 +680,9 @@ def add_bundles() -> Tuple[flask.Response, int]:
     except kombu.exceptions.OperationalError:
         handle_broker_error(request)
 
+    _schedule_prefetch(
+        request.id, from_index_pull_spec, payload.get('binary_image'), payload.get('bundles')
+    )
     flask.current_app.logger.debug('Successfully scheduled request %d', request.id)
     return flask.jsonify(request.to_json()), 201
 
@@ -790,6 +846,9 @@ def patch_request(request_id: int) -> Tuple[flask.Response, int]:
     if 'distribution_scope' in payload:
         request.distribution_scope = payload['distribution_scope']
 
+    if 'input_digest' in payload:
+        request.input_digest = payload['input_digest']
+
     # Handle fbc_fragments_resolved as a list of images
     if 'fbc_fragments_resolved' in payload:
         fbc_fragments_resolved = payload['fbc_fragments_resolved']
@@ -865,6 +924,7 @@ def rm_operators() -> Tuple[flask.Response, int]:
     except kombu.exceptions.OperationalError:
         handle_broker_error(request)
 
+    _schedule_prefetch(request.id, from_index_pull_spec, payload.get('binary_image'))
     flask.current_app.logger.debug('Successfully scheduled request %d', request.id)
     return flask.jsonify(request.to_json()), 201
 
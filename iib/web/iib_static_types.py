@@ -21,6 +21,28 @@ class PaginationMetadata(TypedDict):
     total: int
 
 
+class KeysetPaginationMetadata(TypedDict):
+    """Datastructure of the metadata about the query paginated by the IDs of the requests."""
+
+    first: str
+    last: str
+    next: Optional[str]
+    per_page: int
+    previous: Optional[str]
+    total: int
+
+
+class KeysetPagination(NamedTuple):
+    """Datastructure of a page of a query paginated by the IDs of the requests."""
+
+    items: List[Any]
+    per_page: int
+    total: int
+    # the cursors of the next (older) and previous (newer) pages, None if there is no such page
+    next_id: Optional[int]
+    previous_id: Optional[int]
+
+
 class AddressMessageEnvelope(NamedTuple):
     """Datastructure of the tuple with target address and proton message."""
 
@@ -0,0 +1,41 @@
+"""Add the digest of the resolved inputs to the index image requests.
+
+Revision ID: 1f0e5a7c9d3b
+Revises: c32bffd4dbea
+Create Date: 2026-10-17 10:12:41.208517
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f0e5a7c9d3b'
+down_revision = 'c32bffd4dbea'
+branch_labels = None
+depends_on = None
+
+_TABLES = (
+    'request_add',
+    'request_rm',
+    'request_create_empty_index',
+    'request_fbc_operations',
+    'request_add_deprecations',
+)
+
+
+def upgrade():
+    for table in _TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('input_digest', sa.String(), nullable=True))
+            batch_op.create_index(
+                batch_op.f(f'ix_{table}_input_digest'), ['input_digest'], unique=False
+            )
+
+
+def downgrade():
+    for table in reversed(_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_input_digest'))
+            batch_op.drop_column('input_digest')
@@ -964,6 +964,11 @@ class RequestIndexImageMixin:
         """Return the distribution_scope for the request."""
         return db.mapped_column(db.String, nullable=True)
 
+    @declared_attr
+    def input_digest(cls: DefaultMeta) -> Mapped[Optional[str]]:
+        """Return the digest of the resolved inputs of the request."""
+        return db.mapped_column(db.String, nullable=True, index=True)
+
     # Union for request_kwargs would require exhausting checking of the request_kwargs in the method
     @staticmethod
     def _from_json(
@@ -1125,6 +1130,7 @@ class RequestIndexImageMixin:
             'from_index_resolved',
             'index_image',
             'index_image_resolved',
+            'input_digest',
             'internal_index_image_copy',
             'internal_index_image_copy_resolved',
         }
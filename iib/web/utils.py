@@ -1,21 +1,199 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import json
+from typing import Optional, Union
+
 from flask import request, url_for
 from flask_sqlalchemy.pagination import Pagination
-from typing import Optional
+from flask_sqlalchemy.query import Query
+from sqlalchemy.orm import InstrumentedAttribute
+
+from iib.exceptions import ValidationError
+from iib.web import db
+from iib.web.iib_static_types import (
+    KeysetPagination,
+    KeysetPaginationMetadata,
+    PaginationMetadata,
+)
+
+
+def _get_non_negative_int_arg(name: str) -> Optional[int]:
+    """
+    Get the value of a query parameter which must be a non-negative integer.
+
+    This must be run as part of a Flask request.
+
+    :param str name: the name of the query parameter
+    :return: the value of the query parameter or ``None`` if it's not set or empty
+    :rtype: int
+    :raises ValidationError: if the value isn't a non-negative integer
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ValidationError(f'The {name} value must be a non-negative integer')
+    return int(value)
+
+
+def get_estimated_total(query: Query) -> int:
+    """
+    Get the number of rows the query returns as estimated by the database planner.
 
-from iib.web.iib_static_types import PaginationMetadata
+    Counting the rows of a large table is slow, while the planner estimate is instant. The exact
+    count is returned on databases other than PostgreSQL.
 
+    :param flask_sqlalchemy.query.Query query: the query to estimate the number of rows of
+    :return: the estimated number of rows
+    :rtype: int
+    """
+    query = query.enable_eagerloads(False).order_by(None)
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return query.count()
+
+    compiled = query.statement.compile(dialect=connection.dialect)
+    plan = connection.exec_driver_sql(
+        f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+    ).scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
 
-def pagination_metadata(pagination_query: Pagination, **kwargs) -> PaginationMetadata:
+
+def keyset_paginate(
+    query: Query,
+    id_column: InstrumentedAttribute,
+    max_per_page: int,
+    estimate_total: bool = False,
+) -> KeysetPagination:
+    """
+    Paginate the query by seeking on the ID column instead of using an offset.
+
+    The page is selected with the ``after_id`` or ``before_id`` query parameter, which return the
+    rows with an ID lower or greater than the given one respectively. An empty ``after_id`` returns
+    the first page. The rows are ordered by their ID in descending order in both cases. Unlike an
+    offset, seeking on the ID column uses its index, so every page is as fast to get as the first
+    one.
+
+    This must be run as part of a Flask request.
+
+    :param flask_sqlalchemy.query.Query query: the query to paginate
+    :param InstrumentedAttribute id_column: the unique column to paginate the query by
+    :param int max_per_page: the maximum number of rows on a page
+    :param bool estimate_total: if ``True``, the total number of rows is estimated, see
+        ``get_estimated_total``, instead of counted
+    :return: the requested page of the query
+    :rtype: KeysetPagination
+    :raises ValidationError: if the query parameters are invalid
+    """
+    after_id = _get_non_negative_int_arg('after_id')
+    before_id = _get_non_negative_int_arg('before_id')
+    if 'after_id' in request.args and 'before_id' in request.args:
+        raise ValidationError('The after_id and before_id parameters are mutually exclusive')
+    per_page = _get_non_negative_int_arg('per_page')
+    if per_page == 0:
+        raise ValidationError('The per_page value must be a positive integer')
+    per_page = min(per_page or 20, max_per_page)
+
+    if before_id is None:
+        page_query = query.order_by(id_column.desc())
+        if after_id is not None:
+            page_query = page_query.filter(id_column < after_id)
+    else:
+        page_query = query.filter(id_column > before_id).order_by(id_column.asc())
+    # Get one more row to know if there's another page after this one
+    items = page_query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if before_id is not None:
+        items.reverse()
+
+    if estimate_total:
+        total = get_estimated_total(query)
+    else:
+        total = query.order_by(None).count()
+
+    next_id = previous_id = None
+    if items:
+        if before_id is None:
+            next_id = items[-1].id if has_more else None
+            previous_id = items[0].id if after_id is not None else None
+        else:
+            # There are no rows before the ID 0, which is used for the link to the last page
+            next_id = items[-1].id if before_id else None
+            previous_id = items[0].id if has_more else None
+
+    return KeysetPagination(
+        items=items, per_page=per_page, total=total, next_id=next_id, previous_id=previous_id
+    )
+
+
+def _keyset_pagination_metadata(
+    pagination_query: KeysetPagination, **kwargs
+) -> KeysetPaginationMetadata:
+    """
+    Return a dictionary containing metadata about the query paginated by the IDs of the requests.
+
+    This must be run as part of a Flask request.
+
+    :param KeysetPagination pagination_query: the paginated query
+    :param dict kwargs: the query parameters to add to the URLs
+    :return: a dictionary containing metadata about the paginated query
+    """
+    per_page = pagination_query.per_page
+    pagination_data: KeysetPaginationMetadata = {
+        # The empty after_id keeps the first page paginated by the IDs
+        'first': url_for(
+            str(request.endpoint), after_id='', per_page=per_page, _external=True, **kwargs
+        ),
+        'last': url_for(
+            str(request.endpoint), before_id=0, per_page=per_page, _external=True, **kwargs
+        ),
+        'next': None,
+        'per_page': per_page,
+        'previous': None,
+        'total': pagination_query.total,
+    }
+
+    if pagination_query.previous_id is not None:
+        pagination_data['previous'] = url_for(
+            str(request.endpoint),
+            before_id=pagination_query.previous_id,
+            per_page=per_page,
+            _external=True,
+            **kwargs,
+        )
+    if pagination_query.next_id is not None:
+        pagination_data['next'] = url_for(
+            str(request.endpoint),
+            after_id=pagination_query.next_id,
+            per_page=per_page,
+            _external=True,
+            **kwargs,
+        )
+
+    return pagination_data
+
+
+def pagination_metadata(
+    pagination_query: Union[Pagination, KeysetPagination], **kwargs
+) -> Union[PaginationMetadata, KeysetPaginationMetadata]:
     """
     Return a dictionary containing metadata about the paginated query.
 
+    The queries paginated with ``keyset_paginate`` get the links to their pages using the
+    ``after_id`` and ``before_id`` cursors, without the page numbers.
+
     This must be run as part of a Flask request.
 
-    :param flask_sqlalchemy.Pagination pagination_query: the paginated query
+    :param pagination_query: the paginated query
+    :type pagination_query: flask_sqlalchemy.Pagination or KeysetPagination
     :param dict kwargs: the query parameters to add to the URLs
     :return: a dictionary containing metadata about the paginated query
     """
+    if isinstance(pagination_query, KeysetPagination):
+        return _keyset_pagination_metadata(pagination_query, **kwargs)
+
     pagination_data: PaginationMetadata = {
         'first': url_for(
             str(request.endpoint),
@@ -1,7 +1,7 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 import json
 import logging
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
 import requests
 from urllib3.util.retry import Retry
@@ -77,6 +77,38 @@ def get_request(request_id: int) -> Dict[str, Any]:
     return rv.json()
 
 
+def get_requests(params: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Get the first page of the IIB build requests matching the query parameters from the REST API.
+
+    :param dict params: the query parameters to filter the requests by
+    :return: the requests, newest first
+    :rtype: list
+    :raises IIBError: if the HTTP request fails
+    """
+    request_url = f'{config.iib_api_url.rstrip("/")}/builds'
+    log.info('Getting the requests matching %r', params)
+
+    try:
+        rv = requests_session.get(request_url, params=params, timeout=config.iib_api_timeout)
+    except requests.RequestException:
+        msg = f'The connection failed when getting the requests matching {params!r}'
+        log.exception(msg)
+        raise IIBError(msg)
+
+    if not rv.ok:
+        log.error(
+            'The worker failed to get the requests matching %r. The status was %d. '
+            'The text was:\n%s',
+            params,
+            rv.status_code,
+            rv.text,
+        )
+        raise IIBError(f'The worker failed to get the requests matching {params!r}')
+
+    return rv.json()['items']
+
+
 @instrument_tracing(span_name="workers.api_utils.set_request_state")
 def set_request_state(request_id: int, state: str, state_reason: str) -> Dict[str, Any]:
     """
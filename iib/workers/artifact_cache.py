@@ -0,0 +1,302 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+# The ioctl to share the extents of a file on filesystems supporting reflinks, e.g. XFS and Btrfs
+FICLONE = 0x40049409
+MANIFEST_FILE = 'manifest.json'
+CONTENT = 'content'
+CHUNK_SIZE = 1024 * 1024
+# The prefixes of the directories which are only used while an entry is stored or removed
+STAGING_PREFIXES = ('.tmp-', '.trash-')
+# Staging directories older than this were left behind by a process which died
+STALE_STAGING_DIR_AGE = 3600
+
+
+def _clone_file(src: str, dst: str) -> None:
+    """
+    Create a copy-on-write clone of the file, or copy it if the filesystem doesn't support it.
+
+    :param str src: the path of the file to clone
+    :param str dst: the path of the clone
+    """
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                raise
+            shutil.copyfileobj(src_file, dst_file)
+    shutil.copymode(src, dst)
+
+
+def _clone(src: str, dst: str) -> None:
+    """
+    Clone the file or directory tree.
+
+    :param str src: the path of the file or directory to clone
+    :param str dst: the path of the clone, which must not exist
+    """
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, symlinks=True, copy_function=_clone_file)
+    else:
+        _clone_file(src, dst)
+
+
+def _get_file_digest(path: str) -> str:
+    """
+    Get the digest of the content of the file, or of the target of the symbolic link.
+
+    :param str path: the path of the file
+    :return: the digest
+    :rtype: str
+    """
+    hasher = hashlib.sha256()
+    if os.path.islink(path):
+        hasher.update(os.readlink(path).encode('utf-8'))
+    else:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+    return f'sha256:{hasher.hexdigest()}'
+
+
+def _get_file_digests(path: str) -> Dict[str, List[Any]]:
+    """
+    Get the size and the digest of the content of the files in the file or directory tree.
+
+    :param str path: the path of the file or directory
+    :return: a dictionary mapping the relative paths of the files to their size and digest
+    :rtype: dict
+    """
+    if not os.path.isdir(path):
+        return {'.': [os.stat(path).st_size, _get_file_digest(path)]}
+
+    digests = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            digests[os.path.relpath(file_path, path)] = [
+                os.lstat(file_path).st_size,
+                _get_file_digest(file_path),
+            ]
+    return digests
+
+
+class ArtifactCache:
+    """
+    Cache of the files extracted from container images, keyed by the image digest and the path.
+
+    Every entry is stored as ``<directory>/<key>/content`` together with a manifest recording the
+    size and digest of its files, which are checked before the entry is used. The entries
+    are returned as copy-on-write clones when the filesystem supports reflinks, so the callers are
+    free to modify them. Once the total size of the entries exceeds ``max_size``, the least
+    recently used entries which aren't being cloned are evicted.
+
+    :param str directory: the directory to store the entries in
+    :param int max_size: the disk budget of the cache in bytes
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        """Initialize the ArtifactCache object."""
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_stale_staging_dirs()
+
+    def _get_entry_dir(self, digest: str, path: str) -> str:
+        """
+        Get the directory of the cache entry.
+
+        :param str digest: the digest of the container image
+        :param str path: the path within the container image
+        :return: the directory of the cache entry
+        :rtype: str
+        """
+        path = posixpath.normpath(f'/{path}')
+        return os.path.join(self.directory, hashlib.sha256(f'{digest}:{path}'.encode()).hexdigest())
+
+    def get(self, digest: str, path: str, dest_path: str) -> bool:
+        """
+        Clone the cached file or directory to the destination.
+
+        If ``dest_path`` and the cached entry are both directories, the entry is merged into it,
+        otherwise ``dest_path`` is replaced.
+
+        :param str digest: the digest of the container image
+        :param str path: the path within the container image
+        :param str dest_path: the local path to clone the entry to
+        :return: ``True`` if the entry was cached and valid
+        :rtype: bool
+        """
+        entry_dir = self._get_entry_dir(digest, path)
+        try:
+            with open(os.path.join(entry_dir, MANIFEST_FILE)) as manifest_file:
+                # Prevent the eviction of the entry by other processes while it's cloned
+                fcntl.flock(manifest_file, fcntl.LOCK_SH)
+                manifest = json.load(manifest_file)
+                content = os.path.join(entry_dir, CONTENT)
+                if _get_file_digests(content) != manifest['files']:
+                    log.warning('The cached %s of %s is corrupted, removing it', path, digest)
+                    self._remove_entry(entry_dir)
+                    return False
+
+                os.utime(manifest_file.fileno())
+                staging_dir = tempfile.mkdtemp(
+                    prefix='iib-artifact-', dir=os.path.dirname(os.path.abspath(dest_path))
+                )
+                try:
+                    staging_path = os.path.join(staging_dir, CONTENT)
+                    _clone(content, staging_path)
+                    if os.path.isdir(dest_path) and os.path.isdir(staging_path):
+                        shutil.copytree(staging_path, dest_path, symlinks=True, dirs_exist_ok=True)
+                    else:
+                        os.replace(staging_path, dest_path)
+                finally:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError) as e:
+            log.warning('Failed to use the cached %s of %s: %s', path, digest, e)
+            return False
+
+        log.info('Using the cached %s of %s', path, digest)
+        return True
+
+    def put(self, digest: str, path: str, src_path: str) -> None:
+        """
+        Store a clone of the extracted file or directory in the cache.
+
+        Failing to store the entry is only logged.
+
+        :param str digest: the digest of the container image
+        :param str path: the path within the container image
+        :param str src_path: the local path the file or directory was extracted to
+        """
+        entry_dir = self._get_entry_dir(digest, path)
+        if os.path.exists(entry_dir):
+            return
+
+        staging_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            content = os.path.join(staging_dir, CONTENT)
+            _clone(src_path, content)
+            files = _get_file_digests(content)
+            manifest = {
+                'digest': digest,
+                'path': path,
+                'files': files,
+                'size': sum(size for size, _ in files.values()),
+            }
+            with open(os.path.join(staging_dir, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f)
+            os.rename(staging_dir, entry_dir)
+        except OSError as e:
+            if os.path.exists(entry_dir):
+                # Another process cached the same entry in the meantime
+                return
+            log.warning('Failed to cache %s of %s: %s', path, digest, e)
+            return
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        log.debug('Cached %s of %s', path, digest)
+        self._evict()
+
+    def _remove_stale_staging_dirs(self) -> None:
+        """Remove the staging directories left behind by the processes which died using them."""
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.startswith(STAGING_PREFIXES):
+                continue
+            try:
+                if now - entry.stat().st_mtime <= STALE_STAGING_DIR_AGE:
+                    continue
+            except FileNotFoundError:
+                continue
+            log.debug('Removing the stale staging directory %s', entry.path)
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _evict(self) -> None:
+        """Remove the stale staging directories and the least recently used entries."""
+        self._remove_stale_staging_dirs()
+        entries: List[Tuple[float, int, str]] = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                manifest_path = os.path.join(entry.path, MANIFEST_FILE)
+                with open(manifest_path) as f:
+                    manifest: Dict[str, Any] = json.load(f)
+                entries.append((os.stat(manifest_path).st_mtime, manifest['size'], entry.path))
+            except (OSError, ValueError, KeyError):
+                continue
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                with open(os.path.join(entry_dir, MANIFEST_FILE)) as manifest_file:
+                    fcntl.flock(manifest_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self._remove_entry(entry_dir)
+            except BlockingIOError:
+                continue
+            except FileNotFoundError:
+                pass
+            log.debug('Evicted the cache entry %s', entry_dir)
+            total_size -= size
+
+    def _remove_entry(self, entry_dir: str) -> None:
+        """
+        Remove the cache entry.
+
+        The entry is moved out of the way first, so it's never seen partially removed.
+
+        :param str entry_dir: the directory of the cache entry
+        """
+        trash_dir = tempfile.mkdtemp(prefix='.trash-', dir=self.directory)
+        try:
+            os.rename(entry_dir, os.path.join(trash_dir, 'entry'))
+        except FileNotFoundError:
+            pass
+        finally:
+            shutil.rmtree(trash_dir, ignore_errors=True)
+
+
+_artifact_cache: Optional[ArtifactCache] = None
+_artifact_cache_lock = threading.Lock()
+
+
+def get_artifact_cache() -> Optional[ArtifactCache]:
+    """
+    Get the artifact cache shared by the worker process.
+
+    :return: the artifact cache or ``None`` if ``iib_artifact_cache_dir`` is not set
+    :rtype: ArtifactCache
+    """
+    global _artifact_cache
+    conf = get_worker_config()
+    if not conf.iib_artifact_cache_dir:
+        return None
+
+    with _artifact_cache_lock:
+        if _artifact_cache is None:
+            _artifact_cache = ArtifactCache(
+                conf.iib_artifact_cache_dir, conf.iib_artifact_cache_max_size
+            )
+        return _artifact_cache
@@ -0,0 +1,196 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from collections import Counter
+from contextlib import closing, contextmanager
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Callable, Generator, List, Optional, Tuple
+
+from iib.exceptions import IIBError
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+BLOB_DIGEST_RE = re.compile(r'^sha256:[a-f0-9]{64}$')
+CHUNK_SIZE = 1024 * 1024
+# Temporary files older than this were left behind by a process which died while downloading
+STALE_TEMP_FILE_AGE = 3600
+
+
+class BlobCache:
+    """
+    Content-addressed store of container image blobs on the local disk.
+
+    The blobs are stored as ``<directory>/sha256/<hex digest>`` and verified against their digest
+    when stored. Once the total size of the blobs exceeds ``max_size``, the least recently used
+    blobs are evicted. Blobs which are in use, by this process or by other processes sharing the
+    directory, are never evicted.
+
+    :param str directory: the directory to store the blobs in
+    :param int max_size: the disk budget of the cache in bytes
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        """Initialize the BlobCache object."""
+        self.directory = os.path.join(directory, 'sha256')
+        self.max_size = max_size
+        self._refcounts: Counter = Counter()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_path(self, digest: str) -> str:
+        """
+        Get the path of the blob.
+
+        :param str digest: the digest of the blob
+        :return: the path of the blob file
+        :rtype: str
+        :raises IIBError: if the digest is not a valid sha256 digest
+        """
+        if not BLOB_DIGEST_RE.match(digest):
+            raise IIBError(f'The blob digest {digest} is not supported')
+        return os.path.join(self.directory, digest.split(':', 1)[1])
+
+    @contextmanager
+    def open(self, digest: str, fetch: Callable[[], BinaryIO]) -> Generator[BinaryIO, None, None]:
+        """
+        Open the blob, fetching it first if it's not cached yet.
+
+        The blob can't be evicted while it's open.
+
+        :param str digest: the digest of the blob
+        :param callable fetch: a function returning a stream with the content of the blob
+        :return: the opened blob file
+        :rtype: file
+        :raises IIBError: if the fetched content doesn't match the digest
+        """
+        path = self._get_path(digest)
+        with self._lock:
+            self._refcounts[digest] += 1
+        try:
+            if os.path.exists(path):
+                log.debug('Using the cached blob %s', digest)
+                # The modification time is used to find the least recently used blobs
+                os.utime(path)
+            else:
+                self._store(digest, path, fetch)
+                self._evict()
+
+            with open(path, 'rb') as f:
+                # Let the other processes know the blob is in use
+                fcntl.flock(f, fcntl.LOCK_SH)
+                yield f
+        finally:
+            with self._lock:
+                self._refcounts[digest] -= 1
+                if not self._refcounts[digest]:
+                    del self._refcounts[digest]
+
+    def _store(self, digest: str, path: str, fetch: Callable[[], BinaryIO]) -> None:
+        """
+        Fetch the blob and store it after verifying its digest.
+
+        :param str digest: the digest of the blob
+        :param str path: the path to store the blob at
+        :param callable fetch: a function returning a stream with the content of the blob
+        :raises IIBError: if the fetched content doesn't match the digest
+        """
+        log.debug('Storing the blob %s in the cache', digest)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        try:
+            hasher = hashlib.sha256()
+            with closing(fetch()) as stream, os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                    f.write(chunk)
+            if f'sha256:{hasher.hexdigest()}' != digest:
+                raise IIBError(f'The content of the blob {digest} does not match its digest')
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _evict(self) -> None:
+        """Remove the least recently used blobs which aren't in use until the budget is met."""
+        blobs: List[Tuple[float, int, str]] = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith('.tmp-'):
+                if now - stat.st_mtime > STALE_TEMP_FILE_AGE:
+                    self._remove(entry.path)
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.name))
+
+        total_size = sum(size for _, size, _ in blobs)
+        for _, size, name in sorted(blobs):
+            if total_size <= self.max_size:
+                break
+            with self._lock:
+                if self._refcounts.get(f'sha256:{name}'):
+                    continue
+            if self._remove_unused(os.path.join(self.directory, name)):
+                log.debug('Evicted the blob sha256:%s from the cache', name)
+                total_size -= size
+
+        if total_size > self.max_size:
+            log.warning(
+                'The blob cache uses %d bytes which exceeds its budget since the blobs are in use',
+                total_size,
+            )
+
+    @staticmethod
+    def _remove_unused(path: str) -> bool:
+        """
+        Remove the blob unless another process has it open.
+
+        :param str path: the path of the blob
+        :return: ``True`` if the blob was removed
+        :rtype: bool
+        """
+        try:
+            with open(path, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                os.remove(path)
+        except BlockingIOError:
+            return False
+        except FileNotFoundError:
+            pass
+        return True
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_blob_cache: Optional[BlobCache] = None
+_blob_cache_lock = threading.Lock()
+
+
+def get_blob_cache() -> Optional[BlobCache]:
+    """
+    Get the blob cache shared by the worker process.
+
+    :return: the blob cache or ``None`` if ``iib_blob_cache_dir`` is not set
+    :rtype: BlobCache
+    """
+    global _blob_cache
+    conf = get_worker_config()
+    if not conf.iib_blob_cache_dir:
+        return None
+
+    with _blob_cache_lock:
+        if _blob_cache is None:
+            _blob_cache = BlobCache(conf.iib_blob_cache_dir, conf.iib_blob_cache_max_size)
+        return _blob_cache
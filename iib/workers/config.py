@@ -35,14 +35,34 @@ class Config(object):
     iib_greenwave_url: Optional[str] = None
     iib_grpc_init_wait_time: int = 100
     iib_grpc_max_tries: int = 5
+    # maximum number of threads used to inspect container images concurrently
+    iib_image_inspection_max_workers: int = 10
+    # maximum number of architectures built and pushed concurrently
+    iib_max_concurrent_builds: int = 4
+    # the number of times a request is built again when from_index changed before the overwrite
+    iib_from_index_rebase_attempts: int = 0
+    # the maximum number of queued add or rm requests processed together with a request
+    iib_max_coalesced_requests: int = 0
     # size of both ranges, needs to be the same, ranges neeeds to be exclusive
     iib_opm_port_ranges: Dict[str, Tuple[int, int]] = {
         "opm_port": (50051, 50151),
         "opm_pprof_port": (50151, 50251),
     }
     iib_opm_pprof_lock_required_min_version = "1.29.0"
+    # reuse the opm serve caches of from_index and of identical catalogs built before
+    iib_opm_cache_reuse: bool = False
+    # parse the output of opm render while it's written instead of buffering it
+    iib_opm_render_streaming: bool = True
     iib_image_push_template: str = '{registry}/iib-build:{request_id}'
     iib_index_image_output_registry: Optional[str] = None
+    # how bundles are listed from index.db: 'native', 'opm' or 'compat' (native checked by opm)
+    iib_index_db_reader: str = 'native'
+    # only migrate the packages of index.db changed by an add request to the catalog
+    iib_incremental_fbc_migration: bool = False
+    # write the registry credentials of every request to a private auth file
+    iib_isolated_registry_auths: bool = False
+    # the directory with the container storage and temporary files of every worker process
+    iib_worker_slots_dir: Optional[str] = None
     iib_index_configs_gitlab_tokens_map: Optional[Dict[str, Dict[str, str]]] = None
     iib_log_level: str = 'INFO'
     iib_deprecate_bundles_limit = 200
@@ -51,6 +71,8 @@ class Config(object):
     iib_no_ocp_label_allow_list: List[str] = []
     iib_organization_customizations: iib_organization_customizations_type = {}
     iib_sac_queues: List[str] = []
+    # reuse the index image of a completed request with the same resolved inputs
+    iib_request_deduplication: bool = False
     iib_request_logs_dir: Optional[str] = None
     iib_request_logs_format: str = (
         '%(asctime)s %(name)s %(processName)s {request_id} '
@@ -58,6 +80,8 @@ class Config(object):
     )
     iib_request_logs_level: str = 'DEBUG'
     iib_required_labels: Dict[str, str] = {}
+    # number of seconds to cache the digests floating tags resolve to, 0 disables the cache
+    iib_resolved_image_cache_ttl: int = 0
     iib_request_related_bundles_dir: Optional[str] = None
     # Configuration for dogpile.cache
     # Disabled by default (by using 'dogpile.cache.null').
@@ -65,6 +89,22 @@ class Config(object):
     iib_dogpile_backend: str = 'dogpile.cache.null'
     iib_dogpile_expiration_time: int = 600
     iib_dogpile_arguments: Dict[str, List[str]] = {'url': ['127.0.0.1']}
+    # Local SQLite tier of the cache in front of the backend above. Disabled when set to None.
+    iib_dogpile_local_cache_path: Optional[str] = None
+    iib_dogpile_local_cache_max_size: int = 512 * 1024 * 1024
+    # copy files from images by streaming their layers from the registry instead of using podman
+    iib_extract_files_from_layers: bool = False
+    # content-addressed cache of the streamed layers kept between requests, None disables it
+    iib_blob_cache_dir: Optional[str] = None
+    iib_blob_cache_max_size: int = 20 * 1024 * 1024 * 1024
+    # assemble the FBC index images through the registry API instead of building them with buildah
+    iib_buildless_index_assembly: bool = False
+    # split the catalog into layers by 'package' or by 'bucket' of packages, None disables it
+    iib_catalog_layers: Optional[str] = None
+    iib_catalog_layer_buckets: int = 32
+    # cache of the files extracted from images referenced by digest, None disables it
+    iib_artifact_cache_dir: Optional[str] = None
+    iib_artifact_cache_max_size: int = 10 * 1024 * 1024 * 1024
     iib_skopeo_timeout: str = '300s'
     iib_total_attempts: int = 5
     iib_retry_delay: int = 10
@@ -78,6 +118,11 @@ class Config(object):
     }
     iib_default_opm: str = 'opm'
     iib_related_image_registry_replacement: Optional[Dict[str, Dict[str, str]]] = {}
+    # maximum number of concurrent image inspections against a single registry
+    iib_registry_concurrency_limit: int = 4
+    # the backend to inspect images with, either "skopeo" or "native" for the built-in client
+    iib_registry_client: str = 'skopeo'
+    iib_registry_client_timeout: int = 300
     include: List[str] = [
         'iib.workers.tasks.build',
         'iib.workers.tasks.build_merge_index_image',
@@ -86,6 +131,7 @@ class Config(object):
         'iib.workers.tasks.build_create_empty_index',
         'iib.workers.tasks.build_fbc_operations',
         'iib.workers.tasks.build_add_deprecations',
+        'iib.workers.tasks.build_prefetch',
         'iib.workers.tasks.general',
     ]
     # Path to hidden location of SQLite database
@@ -107,7 +153,8 @@ class Config(object):
     temp_index_db_path: str = 'database/index.db'
     # Path to fbc_fragment's catalog in our temp directories
     temp_fbc_fragment_path = 'fbc-fragment'
-    # For now, only allow a single process so that all tasks are processed serially
+    # Only allow a single process so that all tasks are processed serially, unless the worker
+    # processes run in their own slots, see iib_worker_slots_dir
     worker_concurrency: int = 1
     # Before each task execution, instruct the worker to check if this task is a duplicate message.
     # Deduplication occurs only with tasks that have the same identifier,
@@ -257,6 +304,10 @@ class TestingConfig(DevelopmentConfig):
     iib_request_related_bundles_dir: Optional[str] = None
     # disable dogpile cache for tests
     iib_dogpile_backend: str = 'dogpile.cache.null'
+    # inspect images serially so that the side effects of mocks are consumed in order
+    iib_image_inspection_max_workers: int = 1
+    # build the arches serially for the same reason
+    iib_max_concurrent_builds: int = 1
 
 
 def configure_celery(celery_app: Celery) -> None:
@@ -324,6 +375,41 @@ def validate_celery_config(conf: app.utils.Settings, **kwargs) -> None:
     ):
         raise ConfigError('iib_related_image_registry_replacement must be a dictionary')
 
+    for option in (
+        'iib_artifact_cache_max_size',
+        'iib_blob_cache_max_size',
+        'iib_catalog_layer_buckets',
+        'iib_dogpile_local_cache_max_size',
+        'iib_image_inspection_max_workers',
+        'iib_max_concurrent_builds',
+        'iib_registry_concurrency_limit',
+    ):
+        value = conf.get(option)
+        if value is not None and (not isinstance(value, int) or value < 1):
+            raise ConfigError(f'{option} must be a positive integer')
+
+    for option in (
+        'iib_from_index_rebase_attempts',
+        'iib_max_coalesced_requests',
+        'iib_resolved_image_cache_ttl',
+    ):
+        value = conf.get(option)
+        if value is not None and (not isinstance(value, int) or value < 0):
+            raise ConfigError(f'{option} must be a non-negative integer')
+
+    if conf.get('iib_catalog_layers') not in (None, 'package', 'bucket'):
+        raise ConfigError('iib_catalog_layers must be one of "package" or "bucket"')
+
+    if conf.get('iib_worker_slots_dir') and not conf.get('iib_isolated_registry_auths'):
+        # The worker processes would otherwise share ~/.docker/config.json
+        raise ConfigError('iib_isolated_registry_auths must be enabled with iib_worker_slots_dir')
+
+    if conf.get('iib_index_db_reader', 'native') not in ('native', 'opm', 'compat'):
+        raise ConfigError('iib_index_db_reader must be one of "native", "opm" or "compat"')
+
+    if conf.get('iib_registry_client', 'skopeo') not in ('skopeo', 'native'):
+        raise ConfigError('iib_registry_client must be either "skopeo" or "native"')
+
     _validate_multiple_opm_mapping(conf['iib_ocp_opm_mapping'])
     _validate_iib_org_customizations(conf['iib_organization_customizations'])
 
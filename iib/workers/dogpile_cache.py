@@ -1,25 +1,188 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+from collections import Counter, defaultdict
 import functools
 import hashlib
-from typing import Callable
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, DefaultDict, Dict, Mapping, Optional, Sequence
 
-from dogpile.cache import make_region
+from dogpile.cache import make_region, register_backend
+from dogpile.cache.api import BytesBackend, NO_VALUE, SerializedReturnType
 from dogpile.cache.region import CacheRegion
 
 from iib.workers.config import get_worker_config
 
+log = logging.getLogger(__name__)
+
+_cache_stats: DefaultDict[str, Counter] = defaultdict(Counter)
+_cache_stats_lock = threading.Lock()
+
+
+class SQLiteBackend(BytesBackend):
+    """
+    Dogpile backend storing the values in a local SQLite database file.
+
+    The least recently used values are evicted once the total size of the stored values exceeds
+    ``max_size``. The database can be shared by multiple processes on the same host.
+
+    The backend is created when the worker modules are imported, before the Celery worker forks
+    its child processes, and SQLite connections can't be used across a fork. The connection is
+    therefore opened on the first use, once per process and thread.
+
+    :param dict arguments: the backend arguments: ``filename`` is the path to the database file
+        and ``max_size`` is the maximum total size of the stored values in bytes
+    """
+
+    def __init__(self, arguments: Mapping[str, Any]):
+        """Initialize the SQLiteBackend object."""
+        self.filename = arguments['filename']
+        self.max_size = arguments.get('max_size', 512 * 1024 * 1024)
+        self._local = threading.local()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Get the connection to the database of the current process and thread.
+
+        :return: the connection, which is opened on the first use
+        :rtype: sqlite3.Connection
+        """
+        pid = os.getpid()
+        # A forked process inherits the connection of the thread which forked it, which must not
+        # be used, nor closed, in the forked process
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.filename, timeout=30)
+            with connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS cache '
+                    '(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                    'accessed REAL NOT NULL)'
+                )
+                connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def get_serialized(self, key: str) -> SerializedReturnType:
+        """
+        Get the serialized value and mark it as recently used.
+
+        :param str key: the cache key
+        :return: the serialized value or ``NO_VALUE`` if it's not cached
+        """
+        connection = self._connection
+        with connection:
+            row = connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return NO_VALUE
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def get_serialized_multi(self, keys: Sequence[str]) -> Sequence[SerializedReturnType]:
+        """
+        Get multiple serialized values.
+
+        :param list keys: the cache keys
+        :return: the serialized values or ``NO_VALUE`` for the values which are not cached
+        """
+        return [self.get_serialized(key) for key in keys]
+
+    def set_serialized(self, key: str, value: bytes) -> None:
+        """
+        Store the serialized value and evict the least recently used values if needed.
+
+        :param str key: the cache key
+        :param bytes value: the serialized value
+        """
+        connection = self._connection
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time()),
+            )
+            self._evict(connection)
+
+    def set_serialized_multi(self, mapping: Mapping[str, bytes]) -> None:
+        """
+        Store multiple serialized values.
+
+        :param dict mapping: the mapping of the cache keys to the serialized values
+        """
+        for key, value in mapping.items():
+            self.set_serialized(key, value)
+
+    def delete(self, key: str) -> None:
+        """
+        Delete the value.
+
+        :param str key: the cache key
+        """
+        connection = self._connection
+        with connection:
+            connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_multi(self, keys: Sequence[str]) -> None:
+        """
+        Delete multiple values.
+
+        :param list keys: the cache keys
+        """
+        for key in keys:
+            self.delete(key)
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """
+        Delete the least recently used values until the total size fits into ``max_size``.
+
+        :param sqlite3.Connection connection: the connection of the current transaction
+        """
+        total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        evicted_keys = []
+        for key, size in connection.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            if total_size <= self.max_size:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        connection.executemany('DELETE FROM cache WHERE key = ?', evicted_keys)
+        log.debug('Evicted %d values from the local cache %s', len(evicted_keys), self.filename)
+
+
+register_backend('iib.sqlite', 'iib.workers.dogpile_cache', 'SQLiteBackend')
+
 
 def skopeo_inspect_should_use_cache(*args, **kwargs) -> bool:
-    """Return true in case this requests can be taken from or stored in cache."""
+    """
+    Return true in case this requests can be taken from or stored in cache.
+
+    Only images referenced by digest are cached, so the cached values are immutable.
+    """
     return any(arg.find('@sha256:') != -1 for arg in args)
 
 
-def dogpile_cache(dogpile_region: CacheRegion, should_use_cache_fn: Callable) -> Callable:
+def dogpile_cache(
+    dogpile_region: CacheRegion,
+    should_use_cache_fn: Callable,
+    local_dogpile_region: Optional[CacheRegion] = None,
+    immutable: bool = False,
+) -> Callable:
     """
     Dogpile cache decorator.
 
+    When ``local_dogpile_region`` is set, it's checked before ``dogpile_region`` and the values
+    found in ``dogpile_region`` are copied to it. The hits and misses are counted per function,
+    see ``get_cache_stats``.
+
     :params dogpile_region: Dogpile CacheRegion object
     :params should_use_cache_fn: function which determines if cache should be used
+    :params local_dogpile_region: Dogpile CacheRegion object used as the local tier of the cache
+    :params immutable: if ``True``, the cached values never expire
     """
 
     def cache_decorator(func):
@@ -30,13 +193,26 @@ def dogpile_cache(dogpile_region: CacheRegion, should_use_cache_fn: Callable) ->
 
             if should_cache:
                 # get data from cache
-                output_cache = dogpile_region.get(cache_key)
+                if local_dogpile_region is not None:
+                    output_cache = local_dogpile_region.get(cache_key, ignore_expiration=immutable)
+                    if output_cache:
+                        _count_cache_event(func.__name__, 'local_hits')
+                        return output_cache
+
+                output_cache = dogpile_region.get(cache_key, ignore_expiration=immutable)
                 if output_cache:
+                    _count_cache_event(func.__name__, 'shared_hits')
+                    if local_dogpile_region is not None:
+                        local_dogpile_region.set(cache_key, output_cache)
                     return output_cache
 
+                _count_cache_event(func.__name__, 'misses')
+
             output = func(*args, **kwargs)
 
             if should_cache:
+                if local_dogpile_region is not None:
+                    local_dogpile_region.set(cache_key, output)
                 dogpile_region.set(cache_key, output)
 
             return output
@@ -46,6 +222,26 @@ def dogpile_cache(dogpile_region: CacheRegion, should_use_cache_fn: Callable) ->
     return cache_decorator
 
 
+def _count_cache_event(fn: str, event: str) -> None:
+    with _cache_stats_lock:
+        _cache_stats[fn][event] += 1
+
+
+def get_cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Get the numbers of cache hits and misses per cached function since the worker started.
+
+    :return: a dictionary mapping the function names to their ``local_hits``, ``shared_hits``
+        and ``misses`` counts
+    :rtype: dict
+    """
+    with _cache_stats_lock:
+        return {
+            fn: {event: stats[event] for event in ('local_hits', 'shared_hits', 'misses')}
+            for fn, stats in _cache_stats.items()
+        }
+
+
 def generate_cache_key(fn: str, *args, **kwargs) -> str:
     """Generate key that is used in dogpile cache."""
     arguments = '|'.join(
@@ -69,3 +265,24 @@ def create_dogpile_region() -> CacheRegion:
         expiration_time=conf.iib_dogpile_expiration_time,
         arguments=conf.iib_dogpile_arguments,
     )
+
+
+def create_local_dogpile_region() -> Optional[CacheRegion]:
+    """
+    Create and configure the dogpile region used as the local tier of the cache.
+
+    :return: the dogpile region or ``None`` if ``iib_dogpile_local_cache_path`` is not set
+    :rtype: CacheRegion
+    """
+    conf = get_worker_config()
+    if not conf.iib_dogpile_local_cache_path:
+        return None
+
+    os.makedirs(os.path.dirname(os.path.abspath(conf.iib_dogpile_local_cache_path)), exist_ok=True)
+    return make_region().configure(
+        'iib.sqlite',
+        arguments={
+            'filename': conf.iib_dogpile_local_cache_path,
+            'max_size': conf.iib_dogpile_local_cache_max_size,
+        },
+    )
@@ -0,0 +1,552 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import contextvars
+import json
+import logging
+import os
+import platform
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+import urllib.parse
+
+import requests
+from operator_manifest.operator import ImageName
+
+from iib.exceptions import IIBError
+from iib.workers.config import get_worker_config
+
+log = logging.getLogger(__name__)
+
+MANIFEST_LIST_MEDIA_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+)
+MANIFEST_MEDIA_TYPES = MANIFEST_LIST_MEDIA_TYPES + (
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v1+prettyjws',
+    'application/vnd.docker.distribution.manifest.v1+json',
+)
+DOCKER_HUB_REGISTRY = 'docker.io'
+DOCKER_HUB_HOST = 'registry-1.docker.io'
+DOCKER_HUB_AUTH_KEY = 'https://index.docker.io/v1/'
+# Refresh the bearer tokens a bit before they expire to account for slow requests
+TOKEN_EXPIRATION_MARGIN = 10
+# The default lifetime of a bearer token as defined by the Docker token authentication spec
+DEFAULT_TOKEN_EXPIRATION = 60
+
+# The auth file with the registry credentials of the current request, see set_registry_auths
+registry_auth_file: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'registry_auth_file', default=None
+)
+
+
+def _parse_challenge(header: str) -> Tuple[str, Dict[str, str]]:
+    """
+    Parse the ``WWW-Authenticate`` header of a registry response.
+
+    :param str header: the value of the ``WWW-Authenticate`` header
+    :return: a tuple of the lowercase authentication scheme and its parameters
+    :rtype: tuple
+    """
+    scheme, _, params = header.strip().partition(' ')
+    return scheme.lower(), dict(re.findall(r'(\w+)="([^"]*)"', params))
+
+
+class ImageReference:
+    """
+    The location of a container image in a container registry.
+
+    :param str pull_spec: the pull specification of the image, optionally prefixed with
+        ``docker://``
+    """
+
+    def __init__(self, pull_spec: str):
+        """Initialize the ImageReference object."""
+        image = ImageName.parse(pull_spec.removeprefix('docker://'))
+        self.registry = image.registry or DOCKER_HUB_REGISTRY
+        self.repository = image.to_str(registry=False, tag=False)
+        if self.registry == DOCKER_HUB_REGISTRY and '/' not in self.repository:
+            self.repository = f'library/{self.repository}'
+        self.reference = image.tag or 'latest'
+
+    @property
+    def host(self) -> str:
+        """
+        Get the host serving the registry API.
+
+        :return: the host of the registry API
+        :rtype: str
+        """
+        if self.registry == DOCKER_HUB_REGISTRY:
+            return DOCKER_HUB_HOST
+        return self.registry
+
+
+class RegistryClient:
+    """
+    Client for the OCI distribution API of container registries.
+
+    The HTTP connections are pooled and the bearer tokens are cached per registry, repository
+    and credentials, so subsequent requests to the same registry skip the TLS handshake and the
+    token exchange. The credentials are read from the same auth file that ``skopeo`` uses.
+
+    :param int timeout: the timeout in seconds of each HTTP request
+    """
+
+    def __init__(self, timeout: int):
+        """Initialize the RegistryClient object."""
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=20)
+        self._session.mount('https://', adapter)
+        self._tokens: Dict[Tuple[str, str, Optional[str]], Tuple[str, float]] = {}
+        self._tokens_lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def _get_auth_file_path() -> str:
+        """
+        Get the path to the auth file honored by ``skopeo``.
+
+        :return: the path to the auth file
+        :rtype: str
+        """
+        return (
+            registry_auth_file.get()
+            or os.environ.get('REGISTRY_AUTH_FILE')
+            or os.path.join(os.path.expanduser('~'), '.docker', 'config.json')
+        )
+
+    def _get_auth(self, image: ImageReference) -> Optional[str]:
+        """
+        Get the base64 encoded credentials for the image from the auth file.
+
+        The most specific entry wins, so ``registry/namespace`` takes precedence over ``registry``.
+
+        :param ImageReference image: the image to get the credentials for
+        :return: the base64 encoded ``user:password`` or ``None`` if there are no credentials
+        :rtype: str
+        """
+        try:
+            with open(self._get_auth_file_path(), 'r') as f:
+                auths = json.load(f).get('auths', {})
+        except (OSError, ValueError):
+            return None
+
+        repository_parts = image.repository.split('/')
+        keys = [
+            '/'.join([image.registry] + repository_parts[:i])
+            for i in range(len(repository_parts), -1, -1)
+        ]
+        if image.registry == DOCKER_HUB_REGISTRY:
+            keys.append(DOCKER_HUB_AUTH_KEY)
+        keys.append(f'https://{image.registry}')
+        for key in keys:
+            if auths.get(key, {}).get('auth'):
+                return auths[key]['auth']
+        return None
+
+    def _count_round_trip(self) -> None:
+        self._local.round_trips = self.get_round_trips() + 1
+
+    def get_round_trips(self) -> int:
+        """
+        Get the number of HTTP requests the current thread has sent with the client.
+
+        The difference of the values before and after an operation is the number of registry round
+        trips it took, including the ones to get tokens and to retry with credentials.
+
+        :return: the number of HTTP requests sent by the current thread
+        :rtype: int
+        """
+        return getattr(self._local, 'round_trips', 0)
+
+    def _get_cached_token(self, token_key: Tuple[str, str, Optional[str]]) -> Optional[str]:
+        with self._tokens_lock:
+            token, expires_at = self._tokens.get(token_key, (None, 0.0))
+        if token and expires_at > time.monotonic():
+            return token
+        return None
+
+    def _fetch_token(
+        self,
+        challenge: Dict[str, str],
+        scope: str,
+        auth: Optional[str],
+        token_key: Tuple[str, str, Optional[str]],
+    ) -> str:
+        """
+        Get a bearer token from the token server of the registry and cache it.
+
+        :param dict challenge: the parameters of the ``Bearer`` authentication challenge
+        :param str scope: the space separated scopes of the token
+        :param str auth: the base64 encoded credentials or ``None`` to get an anonymous token
+        :param tuple token_key: the key to cache the token with
+        :return: the bearer token
+        :rtype: str
+        :raises IIBError: if the token can't be obtained
+        """
+        # Every scope is a separate query parameter
+        scopes = scope.split(' ')
+        params: Dict[str, Any] = {'scope': scopes if len(scopes) > 1 else scope}
+        if challenge.get('service'):
+            params['service'] = challenge['service']
+        headers = {'Authorization': f'Basic {auth}'} if auth else {}
+        try:
+            self._count_round_trip()
+            rv = self._session.get(
+                challenge['realm'], params=params, headers=headers, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise IIBError(f'Failed to get a token from {challenge["realm"]}: {e}')
+        if not rv.ok:
+            raise IIBError(
+                f'Failed to get a token from {challenge["realm"]}. The status was '
+                f'{rv.status_code}.'
+            )
+
+        token_info = rv.json()
+        token = token_info.get('token') or token_info.get('access_token')
+        if not token:
+            raise IIBError(f'The token server {challenge["realm"]} did not return a token')
+        expires_in = token_info.get('expires_in') or DEFAULT_TOKEN_EXPIRATION
+        with self._tokens_lock:
+            self._tokens[token_key] = (
+                token,
+                time.monotonic() + max(expires_in - TOKEN_EXPIRATION_MARGIN, 0),
+            )
+        return token
+
+    def _request(
+        self,
+        method: str,
+        image: ImageReference,
+        path: str,
+        accept: Optional[str] = None,
+        stream: bool = False,
+        push: bool = False,
+        url: Optional[str] = None,
+        params: Optional[Dict[str, str]] = None,
+        data: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+        ok_statuses: Tuple[int, ...] = (),
+        extra_scopes: Tuple[str, ...] = (),
+    ) -> requests.Response:
+        """
+        Perform an authenticated request against the registry API of the image repository.
+
+        :param str method: the HTTP method
+        :param ImageReference image: the image whose repository is queried
+        :param str path: the path relative to ``/v2/<repository>/``
+        :param str accept: the value of the ``Accept`` header
+        :param bool stream: if ``True``, the body of the response is not downloaded right away
+        :param bool push: if ``True``, request a token which allows pushing to the repository
+        :param str url: the absolute URL to use instead of ``path``, e.g. an upload location
+        :param dict params: the query parameters of the request
+        :param data: the body of the request. File objects are rewound if the request is retried.
+            A stream which can't be rewound, such as a blob streamed from a registry, is only sent
+            once.
+        :param dict headers: additional headers of the request
+        :param tuple ok_statuses: unsuccessful status codes which are returned instead of raising
+        :param tuple extra_scopes: the scopes requested for the token in addition to the one of the
+            image repository, e.g. to pull from another repository
+        :return: the response
+        :rtype: requests.Response
+        :raises IIBError: if the request fails or its body can't be sent again
+        """
+        url = url or f'https://{image.host}/v2/{image.repository}/{path}'
+        actions = 'pull,push' if push else 'pull'
+        scope = ' '.join((f'repository:{image.repository}:{actions}',) + extra_scopes)
+        auth = self._get_auth(image)
+        token_key = (image.registry, scope, auth)
+        headers = dict(headers or {})
+        if accept:
+            headers['Accept'] = accept
+
+        kwargs: Dict[str, Any] = {}
+        if params:
+            kwargs['params'] = params
+        if data is not None:
+            kwargs['data'] = data
+
+        sent = False
+
+        def _send() -> requests.Response:
+            nonlocal sent
+            if hasattr(data, 'read'):
+                if hasattr(data, 'seekable') and data.seekable():
+                    data.seek(0)
+                elif sent:
+                    raise IIBError(f'The body of the request to {url} can\'t be sent again')
+            sent = True
+            self._count_round_trip()
+            return self._session.request(
+                method, url, headers=headers, timeout=self.timeout, stream=stream, **kwargs
+            )
+
+        token = self._get_cached_token(token_key)
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        try:
+            rv = _send()
+            if rv.status_code == 401:
+                scheme, challenge = _parse_challenge(rv.headers.get('WWW-Authenticate', ''))
+                if scheme == 'bearer' and challenge.get('realm'):
+                    token = self._fetch_token(challenge, scope, auth, token_key)
+                    headers['Authorization'] = f'Bearer {token}'
+                    rv = _send()
+                elif scheme == 'basic' and auth:
+                    headers['Authorization'] = f'Basic {auth}'
+                    rv = _send()
+        except requests.RequestException as e:
+            raise IIBError(f'The connection failed when getting {url}: {e}')
+
+        if not rv.ok and rv.status_code not in ok_statuses:
+            action = 'get' if method in ('GET', 'HEAD') else method.lower()
+            raise IIBError(f'Failed to {action} {url}. The status was {rv.status_code}.')
+        return rv
+
+    def _get(self, image: ImageReference, path: str, accept: Optional[str] = None) -> bytes:
+        """
+        Perform an authenticated GET request against the registry API of the image repository.
+
+        The body is returned as bytes, since decoding it could change the content digests are
+        computed from. The registry responses don't always specify their charset.
+
+        :param ImageReference image: the image whose repository is queried
+        :param str path: the path relative to ``/v2/<repository>/``
+        :param str accept: the value of the ``Accept`` header
+        :return: the body of the response
+        :rtype: bytes
+        :raises IIBError: if the request fails
+        """
+        return self._request('GET', image, path, accept=accept).content
+
+    def get_manifest_digest(self, pull_spec: str) -> Optional[str]:
+        """
+        Get the digest of the manifest of the image without downloading it.
+
+        The digest is read from the ``Docker-Content-Digest`` header of a ``HEAD`` request.
+
+        :param str pull_spec: the pull specification of the image
+        :return: the digest or ``None`` if the registry didn't provide it
+        :rtype: str
+        :raises IIBError: if the request fails
+        """
+        image = ImageReference(pull_spec)
+        log.debug('Getting the manifest digest of %s from the registry', pull_spec)
+        rv = self._request(
+            'HEAD', image, f'manifests/{image.reference}', accept=','.join(MANIFEST_MEDIA_TYPES)
+        )
+        return rv.headers.get('Docker-Content-Digest')
+
+    def get_raw_manifest(self, pull_spec: str) -> bytes:
+        """
+        Get the raw manifest of the image, the same as ``skopeo inspect --raw``.
+
+        :param str pull_spec: the pull specification of the image
+        :return: the manifest or manifest list exactly as returned by the registry
+        :rtype: bytes
+        :raises IIBError: if the manifest can't be obtained
+        """
+        image = ImageReference(pull_spec)
+        log.debug('Getting the manifest of %s from the registry', pull_spec)
+        return self._get(
+            image, f'manifests/{image.reference}', accept=','.join(MANIFEST_MEDIA_TYPES)
+        )
+
+    def get_image_manifest(
+        self, pull_spec: str, arch: Optional[str] = None
+    ) -> Tuple[ImageReference, Dict[str, Any]]:
+        """
+        Get the manifest of the image for the platform of the host or the given architecture.
+
+        :param str pull_spec: the pull specification of the image or manifest list
+        :param str arch: the architecture to pick from a manifest list, e.g. ``amd64``. It
+            defaults to the architecture of the host.
+        :return: a tuple of the reference to the image manifest and the image manifest. The
+            reference points to the platform specific image when ``pull_spec`` is a manifest list.
+        :rtype: tuple
+        :raises IIBError: if the manifest can't be obtained
+        """
+        image = ImageReference(pull_spec)
+        manifest: Dict[str, Any] = json.loads(self.get_raw_manifest(pull_spec))
+        if manifest.get('mediaType') in MANIFEST_LIST_MEDIA_TYPES:
+            image.reference = self._get_platform_digest(pull_spec, manifest, arch)
+            manifest = json.loads(
+                self._get(
+                    image, f'manifests/{image.reference}', accept=','.join(MANIFEST_MEDIA_TYPES)
+                )
+            )
+        return image, manifest
+
+    def get_config(self, pull_spec: str, arch: Optional[str] = None) -> bytes:
+        """
+        Get the config of the image, the same as ``skopeo inspect --config``.
+
+        For manifest lists, the config of the image matching the platform of the host, or the
+        given architecture, is returned.
+
+        :param str pull_spec: the pull specification of the image
+        :param str arch: the architecture to pick from a manifest list, e.g. ``amd64``
+        :return: the config of the image exactly as returned by the registry
+        :rtype: bytes
+        :raises IIBError: if the config can't be obtained
+        """
+        image, manifest = self.get_image_manifest(pull_spec, arch)
+        config_digest = manifest.get('config', {}).get('digest')
+        if not config_digest:
+            raise IIBError(f'The manifest of {pull_spec} does not reference a config')
+        log.debug('Getting the config of %s from the registry', pull_spec)
+        return self._get(image, f'blobs/{config_digest}')
+
+    def get_blob(self, image: ImageReference, digest: str) -> requests.Response:
+        """
+        Get a streamed response with the content of a blob in the image repository.
+
+        The caller is responsible for closing the response.
+
+        :param ImageReference image: the image whose repository contains the blob
+        :param str digest: the digest of the blob
+        :return: the streamed response
+        :rtype: requests.Response
+        :raises IIBError: if the request fails
+        """
+        log.debug('Streaming the blob %s of %s', digest, image.repository)
+        return self._request('GET', image, f'blobs/{digest}', stream=True)
+
+    def blob_exists(self, image: ImageReference, digest: str) -> bool:
+        """
+        Check if the blob exists in the image repository, asking for push access.
+
+        :param ImageReference image: the image whose repository is checked
+        :param str digest: the digest of the blob
+        :return: ``True`` if the blob exists
+        :rtype: bool
+        :raises IIBError: if the request fails
+        """
+        rv = self._request('HEAD', image, f'blobs/{digest}', push=True, ok_statuses=(404,))
+        return rv.status_code != 404
+
+    def mount_blob(self, image: ImageReference, digest: str, from_image: ImageReference) -> bool:
+        """
+        Mount the blob from another repository of the same registry instead of uploading it.
+
+        :param ImageReference image: the image whose repository the blob is mounted to
+        :param str digest: the digest of the blob
+        :param ImageReference from_image: the image whose repository contains the blob
+        :return: ``True`` if the blob was mounted and ``False`` if it must be uploaded
+        :rtype: bool
+        :raises IIBError: if the request fails
+        """
+        if from_image.registry != image.registry:
+            return False
+
+        log.debug(
+            'Mounting the blob %s from %s to %s', digest, from_image.repository, image.repository
+        )
+        rv = self._request(
+            'POST',
+            image,
+            'blobs/uploads/',
+            push=True,
+            params={'mount': digest, 'from': from_image.repository},
+            ok_statuses=(401, 403, 404),
+            extra_scopes=(f'repository:{from_image.repository}:pull',),
+        )
+        # The registry starts a regular upload instead with the status 202 if it can't mount the
+        # blob, e.g. if the credentials don't allow pulling from the other repository. The unused
+        # upload expires on the registry.
+        return rv.status_code == 201
+
+    def upload_blob(self, image: ImageReference, digest: str, data: Any, size: int) -> None:
+        """
+        Upload the blob to the image repository in a single request.
+
+        :param ImageReference image: the image whose repository the blob is uploaded to
+        :param str digest: the digest of the blob
+        :param data: the content of the blob as bytes or a file object
+        :param int size: the size of the blob in bytes
+        :raises IIBError: if the upload fails
+        """
+        log.debug('Uploading the blob %s to %s', digest, image.repository)
+        rv = self._request('POST', image, 'blobs/uploads/', push=True)
+        location = rv.headers.get('Location')
+        if not location:
+            raise IIBError(f'The registry {image.registry} did not return an upload location')
+        self._request(
+            'PUT',
+            image,
+            '',
+            push=True,
+            url=urllib.parse.urljoin(f'https://{image.host}', location),
+            params={'digest': digest},
+            data=data,
+            headers={'Content-Type': 'application/octet-stream', 'Content-Length': str(size)},
+        )
+
+    def put_manifest(self, image: ImageReference, manifest: bytes, media_type: str) -> None:
+        """
+        Push the manifest to the image repository, tagged with the reference of the image.
+
+        :param ImageReference image: the image to push the manifest as
+        :param bytes manifest: the manifest exactly as it should be stored
+        :param str media_type: the media type of the manifest
+        :raises IIBError: if the push fails
+        """
+        log.debug('Pushing the manifest of %s:%s', image.repository, image.reference)
+        self._request(
+            'PUT',
+            image,
+            f'manifests/{image.reference}',
+            push=True,
+            data=manifest,
+            headers={'Content-Type': media_type},
+        )
+
+    @staticmethod
+    def _get_platform_digest(
+        pull_spec: str, manifest_list: Dict[str, Any], arch: Optional[str] = None
+    ) -> str:
+        """
+        Get the digest of the manifest matching the platform from the manifest list.
+
+        :param str pull_spec: the pull specification of the manifest list
+        :param dict manifest_list: the manifest list
+        :param str arch: the architecture to look for. It defaults to the architecture of the host.
+        :return: the digest of the manifest for the platform
+        :rtype: str
+        :raises IIBError: if there is no manifest for the platform
+        """
+        machine_to_arch = {
+            machine: arch for arch, machine in get_worker_config().iib_supported_archs.items()
+        }
+        host_arch = arch or machine_to_arch.get(platform.machine(), platform.machine())
+        for manifest in manifest_list.get('manifests', []):
+            manifest_platform = manifest.get('platform', {})
+            if (
+                manifest_platform.get('os', 'linux') == 'linux'
+                and manifest_platform.get('architecture') == host_arch
+            ):
+                return manifest['digest']
+        raise IIBError(f'{pull_spec} has no image for the linux/{host_arch} platform')
+
+
+_registry_client: Optional[RegistryClient] = None
+_registry_client_lock = threading.Lock()
+
+
+def get_registry_client() -> RegistryClient:
+    """
+    Get the registry client shared by the worker process.
+
+    :return: the registry client
+    :rtype: RegistryClient
+    """
+    global _registry_client
+    with _registry_client_lock:
+        if _registry_client is None:
+            _registry_client = RegistryClient(get_worker_config().iib_registry_client_timeout)
+        return _registry_client
@@ -0,0 +1,249 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Generator, List, Optional
+
+log = logging.getLogger(__name__)
+
+DEFAULT_STORAGE_CONF = '/etc/containers/storage.conf'
+_STORAGE_SECTION_RE = re.compile(r'^\s*\[\s*([^\]\s]+)\s*\]')
+_STORAGE_ROOT_RE = re.compile(r'^\s*(graphroot|runroot|rootless_storage_path)\s*=')
+
+
+class ContainerStorage:
+    """
+    A container storage with its own run root and libpod temporary directory.
+
+    The storage is configured by the ``storage.conf`` and ``containers.conf`` files in
+    ``directory``, which are used by ``podman``, ``buildah`` and ``skopeo`` through the
+    ``CONTAINERS_STORAGE_CONF`` and ``CONTAINERS_CONF_OVERRIDE`` environment variables.
+
+    :param str directory: the directory of the container storage
+    """
+
+    def __init__(self, directory: str):
+        """Initialize the ContainerStorage object."""
+        self.directory = directory
+        self.storage_dir = os.path.join(self.directory, 'storage')
+        self.run_dir = os.path.join(self.directory, 'run')
+        self.storage_conf = os.path.join(self.directory, 'storage.conf')
+        self.containers_conf = os.path.join(self.directory, 'containers.conf')
+
+    def __repr__(self):
+        """
+        Return string representation of the ContainerStorage Object.
+
+        :return: String representation of the ContainerStorage Object
+        :rtype: str
+        """
+        return f'ContainerStorage(directory: {self.directory})'
+
+    def get_storage_conf(self, base_storage_conf: str) -> str:
+        """
+        Get the storage configuration based on the storage configuration of the host.
+
+        Only the roots of the container storage are changed, so the other settings, such as the
+        storage driver and its mount program, still apply.
+
+        :param str base_storage_conf: the content of the storage configuration of the host
+        :return: the content of the storage configuration
+        :rtype: str
+        """
+        roots = [f'graphroot = "{self.storage_dir}"', f'runroot = "{self.run_dir}"']
+        lines: List[str] = []
+        has_storage_section = False
+        section = None
+        for line in base_storage_conf.splitlines():
+            match = _STORAGE_SECTION_RE.match(line)
+            if match:
+                section = match.group(1)
+                lines.append(line)
+                if section == 'storage':
+                    has_storage_section = True
+                    lines.extend(roots)
+                continue
+            if section == 'storage' and _STORAGE_ROOT_RE.match(line):
+                continue
+            lines.append(line)
+
+        if not has_storage_section:
+            lines = ['[storage]', 'driver = "overlay"'] + roots + lines
+        return '\n'.join(lines) + '\n'
+
+    def create(self) -> None:
+        """Create the directories and the configuration files of the container storage."""
+        for path in (self.storage_dir, self.run_dir):
+            os.makedirs(path, exist_ok=True)
+
+        base_storage_conf_path = _original_storage_conf or DEFAULT_STORAGE_CONF
+        try:
+            with open(base_storage_conf_path, 'r') as f:
+                base_storage_conf = f.read()
+        except FileNotFoundError:
+            base_storage_conf = ''
+        with open(self.storage_conf, 'w') as f:
+            f.write(self.get_storage_conf(base_storage_conf))
+        with open(self.containers_conf, 'w') as f:
+            f.write(f'[engine]\ntmp_dir = "{os.path.join(self.run_dir, "libpod")}"\n')
+
+    def get_env(self, env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        Get the environment of a command using the container storage.
+
+        :param dict env: the environment to base it on, defaults to the environment of the process
+        :return: the environment
+        :rtype: dict
+        """
+        env = dict(env or os.environ)
+        env['CONTAINERS_STORAGE_CONF'] = self.storage_conf
+        env['CONTAINERS_CONF_OVERRIDE'] = self.containers_conf
+        return env
+
+
+class WorkerSlot(ContainerStorage):
+    """
+    A slot of a worker running several requests concurrently, one per worker process.
+
+    Every slot has its own container storage, run root, libpod temporary directory and temporary
+    directory under ``<directory>/slot-<index>``. This way, the container images of the requests
+    running in the other slots are never removed by ``podman rmi --all`` and their files are never
+    mixed up.
+
+    :param int index: the index of the slot, from ``0`` to ``count - 1``
+    :param int count: the number of slots of the worker
+    :param str directory: the directory of the slots of the worker
+    """
+
+    def __init__(self, index: int, count: int, directory: str):
+        """Initialize the WorkerSlot object."""
+        super().__init__(os.path.join(directory, f'slot-{index}'))
+        self.index = index
+        self.count = count
+        self.tmp_dir = os.path.join(self.directory, 'tmp')
+
+    def __repr__(self):
+        """
+        Return string representation of the WorkerSlot Object.
+
+        :return: String representation of the WorkerSlot Object
+        :rtype: str
+        """
+        return f'WorkerSlot(index: {self.index}, count: {self.count})'
+
+    def setup(self) -> None:
+        """
+        Create the directories of the slot and use them in the current process.
+
+        The commands run by the process inherit the configuration from its environment:
+        ``CONTAINERS_STORAGE_CONF`` for the container storage, ``CONTAINERS_CONF_OVERRIDE`` for the
+        libpod temporary directory and ``TMPDIR`` for the temporary files.
+        """
+        self.create()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        os.environ['CONTAINERS_STORAGE_CONF'] = self.storage_conf
+        os.environ['CONTAINERS_CONF_OVERRIDE'] = self.containers_conf
+        os.environ['TMPDIR'] = self.tmp_dir
+        tempfile.tempdir = self.tmp_dir
+        log.info('Using the worker slot %d of %d in %s', self.index, self.count, self.directory)
+
+
+_original_storage_conf: Optional[str] = os.environ.get('CONTAINERS_STORAGE_CONF')
+_current_slot: Optional[WorkerSlot] = None
+# The container storage used by the commands run in the current context instead of the one of the
+# process, see ``use_container_storage``
+container_storage: ContextVar[Optional[ContainerStorage]] = ContextVar(
+    'container_storage', default=None
+)
+
+
+def setup_worker_slot(index: int) -> Optional[WorkerSlot]:
+    """
+    Set up the slot of the current worker process if ``iib_worker_slots_dir`` is set.
+
+    :param int index: the index of the worker process
+    :return: the slot of the worker process or ``None`` if the worker has no slots
+    :rtype: WorkerSlot
+    """
+    from iib.workers.config import get_worker_config
+
+    global _current_slot
+    conf = get_worker_config()
+    if not conf.get('iib_worker_slots_dir'):
+        return None
+
+    _current_slot = WorkerSlot(index, conf.worker_concurrency, conf.iib_worker_slots_dir)
+    _current_slot.setup()
+    return _current_slot
+
+
+def get_current_slot() -> Optional[WorkerSlot]:
+    """
+    Get the slot of the current worker process.
+
+    :return: the slot or ``None`` if the worker has no slots
+    :rtype: WorkerSlot
+    """
+    return _current_slot
+
+
+def _get_arch_storages_dir() -> str:
+    """
+    Get the directory of the container storages of the architectures built concurrently.
+
+    :return: the path to the directory
+    :rtype: str
+    """
+    slot = get_current_slot()
+    if slot:
+        return os.path.join(slot.directory, 'arches')
+    return os.path.join(tempfile.gettempdir(), 'iib-arches')
+
+
+def get_arch_container_storage(arch: str) -> ContainerStorage:
+    """
+    Get the container storage of the architecture when the architectures are built concurrently.
+
+    The storage is kept across the requests, like the storage of the worker, so the layers of the
+    base images are not pulled again by every request.
+
+    :param str arch: the architecture
+    :return: the container storage of the architecture
+    :rtype: ContainerStorage
+    """
+    return ContainerStorage(os.path.join(_get_arch_storages_dir(), arch))
+
+
+def get_arch_container_storages() -> List[ContainerStorage]:
+    """
+    Get the existing container storages of the architectures of the worker.
+
+    :return: the container storages
+    :rtype: list
+    """
+    arch_storages_dir = _get_arch_storages_dir()
+    if not os.path.isdir(arch_storages_dir):
+        return []
+    return [
+        ContainerStorage(os.path.join(arch_storages_dir, arch))
+        for arch in sorted(os.listdir(arch_storages_dir))
+    ]
+
+
+@contextmanager
+def use_container_storage(storage: ContainerStorage) -> Generator[None, None, None]:
+    """
+    Use the container storage for the commands run in the current context.
+
+    :param ContainerStorage storage: the container storage to use, created if needed
+    """
+    storage.create()
+    token = container_storage.set(storage)
+    try:
+        yield
+    finally:
+        container_storage.reset(token)
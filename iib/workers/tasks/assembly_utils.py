@@ -0,0 +1,467 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# This file contains functions to assemble index images through the registry API without buildah
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shlex
+import tarfile
+import threading
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from iib.exceptions import IIBError
+from iib.workers.config import get_worker_config
+from iib.workers.registry_client import (
+    get_registry_client,
+    ImageReference,
+    MANIFEST_LIST_MEDIA_TYPES,
+)
+from iib.workers.tasks.extraction_utils import open_blob
+
+log = logging.getLogger(__name__)
+
+DOCKER_MANIFEST_MEDIA_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+DOCKER_CONFIG_MEDIA_TYPE = 'application/vnd.docker.container.image.v1+json'
+DOCKER_LAYER_MEDIA_TYPE = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+DOCKER_FOREIGN_LAYER_MEDIA_TYPE = 'application/vnd.docker.image.rootfs.foreign.diff.tar.gzip'
+# The layer media types which can be referenced by a Docker v2 schema 2 manifest as they are
+_LAYER_MEDIA_TYPES = {
+    DOCKER_LAYER_MEDIA_TYPE: DOCKER_LAYER_MEDIA_TYPE,
+    DOCKER_FOREIGN_LAYER_MEDIA_TYPE: DOCKER_FOREIGN_LAYER_MEDIA_TYPE,
+    'application/vnd.oci.image.layer.v1.tar+gzip': DOCKER_LAYER_MEDIA_TYPE,
+    'application/vnd.oci.image.layer.nondistributable.v1.tar+gzip': (
+        DOCKER_FOREIGN_LAYER_MEDIA_TYPE
+    ),
+}
+LAYERS_DIR = '.iib-assembly'
+_CHOWN_RE = re.compile(r'^--chown=(\d+):(\d+)$')
+_layers_lock = threading.Lock()
+
+
+class UnsupportedDockerfile(IIBError):
+    """The Dockerfile can't be assembled without buildah."""
+
+
+class DockerfileSpec:
+    """
+    The image described by a Dockerfile generated by IIB.
+
+    :param str base_image: the pull specification of the base image or ``scratch``
+    """
+
+    def __init__(self, base_image: str):
+        """Initialize the DockerfileSpec object."""
+        self.base_image = base_image
+        self.labels: Dict[str, str] = {}
+        self.entrypoint: Optional[List[str]] = None
+        self.cmd: Optional[List[str]] = None
+        # The source path relative to the context directory, the destination path within the
+        # image, the owner and the group of the copied files
+        self.copies: List[Tuple[str, str, int, int]] = []
+        # The instructions in the Dockerfile order, used to write the history of the image
+        self.history: List[Tuple[str, bool]] = []
+
+
+def _parse_exec_form(instruction: str, value: str) -> List[str]:
+    """
+    Parse the value of the ``ENTRYPOINT`` or ``CMD`` instruction.
+
+    :param str instruction: the name of the instruction
+    :param str value: the value of the instruction
+    :return: the command as a list of arguments
+    :rtype: list
+    :raises UnsupportedDockerfile: if the value is not a valid JSON array of strings
+    """
+    if not value.startswith('['):
+        return ['/bin/sh', '-c', value]
+    try:
+        command = json.loads(value)
+    except ValueError:
+        raise UnsupportedDockerfile(f'The {instruction} instruction is not valid JSON')
+    if not isinstance(command, list) or not all(isinstance(arg, str) for arg in command):
+        raise UnsupportedDockerfile(f'The {instruction} instruction is not a list of strings')
+    return command
+
+
+def parse_dockerfile(dockerfile_path: str) -> DockerfileSpec:
+    """
+    Parse the Dockerfile generated by IIB.
+
+    Only the instructions used in the index image Dockerfiles are supported, which are ``FROM``
+    with a single stage and ``LABEL``, ``ENTRYPOINT``, ``CMD``, ``ADD`` and ``COPY`` of a single
+    local source.
+
+    :param str dockerfile_path: the path to the Dockerfile
+    :return: the image described by the Dockerfile
+    :rtype: DockerfileSpec
+    :raises UnsupportedDockerfile: if the Dockerfile uses an unsupported instruction
+    """
+    with open(dockerfile_path) as f:
+        content = re.sub(r'\\\n', ' ', f.read())
+
+    spec: Optional[DockerfileSpec] = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        instruction, _, value = line.partition(' ')
+        instruction = instruction.upper()
+        value = value.strip()
+
+        if instruction == 'FROM':
+            if spec is not None or len(value.split()) != 1:
+                raise UnsupportedDockerfile('Only a single stage without options is supported')
+            spec = DockerfileSpec(value)
+            continue
+        if spec is None:
+            raise UnsupportedDockerfile(f'The {instruction} instruction precedes FROM')
+
+        if instruction == 'LABEL':
+            for pair in shlex.split(value):
+                key, sep, label_value = pair.partition('=')
+                if not sep:
+                    raise UnsupportedDockerfile('Only the LABEL key=value form is supported')
+                spec.labels[key] = label_value
+        elif instruction == 'ENTRYPOINT':
+            spec.entrypoint = _parse_exec_form(instruction, value)
+            if spec.cmd is None:
+                # Setting the entrypoint resets the command inherited from the base image
+                spec.cmd = []
+        elif instruction == 'CMD':
+            spec.cmd = _parse_exec_form(instruction, value)
+        elif instruction in ('ADD', 'COPY'):
+            args = value.split()
+            uid, gid = 0, 0
+            if args and args[0].startswith('--'):
+                match = _CHOWN_RE.match(args.pop(0))
+                if not match:
+                    raise UnsupportedDockerfile(f'Only the numeric --chown of {instruction} works')
+                uid, gid = int(match.group(1)), int(match.group(2))
+            if len(args) != 2 or '://' in args[0]:
+                raise UnsupportedDockerfile(f'Only {instruction} of a single local source works')
+            spec.copies.append((args[0], args[1], uid, gid))
+        else:
+            raise UnsupportedDockerfile(f'The {instruction} instruction is not supported')
+        spec.history.append((f'{instruction} {value}', instruction not in ('ADD', 'COPY')))
+
+    if spec is None:
+        raise UnsupportedDockerfile('The Dockerfile has no FROM instruction')
+    return spec
+
+
+class _HashingWriter:
+    """
+    A write-only file object computing the digest and size of the data written through it.
+
+    :param file fileobj: the file object to write the data to
+    """
+
+    def __init__(self, fileobj: Any):
+        """Initialize the _HashingWriter object."""
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        """Write the data and update the digest."""
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self) -> None:
+        """Flush the underlying file object."""
+        self.fileobj.flush()
+
+    @property
+    def digest(self) -> str:
+        """Get the digest of the data written so far."""
+        return f'sha256:{self.hasher.hexdigest()}'
+
+
+def _create_layer(
+    context_dir: str, src: str, dest: str, uid: int, gid: int, layer_path: str
+) -> Dict[str, Any]:
+    """
+    Create the gzip compressed layer with the result of copying the source to the image.
+
+    The copy follows the ``ADD`` and ``COPY`` semantics, so the contents of a source directory are
+    copied to the destination directory. The layer only contains the copied paths, so the parent
+    directories keep their attributes from the base image.
+
+    :param str context_dir: the build context directory
+    :param str src: the source path relative to the build context directory
+    :param str dest: the destination path within the image
+    :param int uid: the owner of the copied files
+    :param int gid: the group of the copied files
+    :param str layer_path: the path to write the layer to
+    :return: the descriptor of the layer with its ``diff_id``
+    :rtype: dict
+    :raises UnsupportedDockerfile: if the source can't be copied without buildah
+    """
+    src_path = os.path.normpath(os.path.join(context_dir, src))
+    if os.path.commonpath([src_path, os.path.abspath(context_dir)]) != os.path.abspath(context_dir):
+        raise UnsupportedDockerfile(f'The source {src} is outside of the build context')
+    if not os.path.exists(src_path):
+        raise UnsupportedDockerfile(f'The source {src} does not exist')
+    if os.path.isfile(src_path) and tarfile.is_tarfile(src_path):
+        raise UnsupportedDockerfile(f'The source {src} is an archive which ADD would extract')
+
+    if os.path.isdir(src_path) or dest.endswith('/'):
+        if os.path.isfile(src_path):
+            dest = posixpath.join(dest, os.path.basename(src_path))
+    arcname = posixpath.normpath(f'/{dest}').lstrip('/')
+
+    def _set_owner(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+        tarinfo.uid, tarinfo.gid = uid, gid
+        tarinfo.uname, tarinfo.gname = '', ''
+        if tarinfo.name == arcname and tarinfo.isdir():
+            tarinfo.mode = 0o755
+        return tarinfo
+
+    with open(layer_path, 'wb') as layer_file:
+        compressed = _HashingWriter(layer_file)
+        with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as gz:  # type: ignore
+            uncompressed = _HashingWriter(gz)
+            with tarfile.open(fileobj=uncompressed, mode='w|') as tar:  # type: ignore
+                tar.add(src_path, arcname=arcname, filter=_set_owner)
+
+    return {
+        'mediaType': DOCKER_LAYER_MEDIA_TYPE,
+        'size': compressed.size,
+        'digest': compressed.digest,
+        'diff_id': uncompressed.digest,
+        'path': layer_path,
+    }
+
+
+def _get_layers(dockerfile_dir: str, dockerfile_path: str, spec: DockerfileSpec) -> List[Dict]:
+    """
+    Get the layers added by the Dockerfile, creating them on the first call.
+
+    The layers don't depend on the architecture, so they are created once and shared by the
+    images of all the architectures.
+
+    :param str dockerfile_dir: the build context directory
+    :param str dockerfile_path: the path to the Dockerfile
+    :param DockerfileSpec spec: the parsed Dockerfile
+    :return: the descriptors of the layers with their ``diff_id`` and local ``path``
+    :rtype: list
+    """
+    with open(dockerfile_path, 'rb') as f:
+        key = hashlib.sha256(f.read()).hexdigest()
+    layers_dir = os.path.join(dockerfile_dir, LAYERS_DIR)
+    metadata_path = os.path.join(layers_dir, f'{key}.json')
+
+    with _layers_lock:
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                return json.load(f)
+
+        os.makedirs(layers_dir, exist_ok=True)
+        layers = []
+        for index, (src, dest, uid, gid) in enumerate(spec.copies):
+            log.debug('Creating the layer with %s copied to %s', src, dest)
+            layer_path = os.path.join(layers_dir, f'{key}-{index}.tar.gz')
+            layers.append(_create_layer(dockerfile_dir, src, dest, uid, gid, layer_path))
+        with open(metadata_path, 'w') as f:
+            json.dump(layers, f)
+        return layers
+
+
+def _get_base_image(spec: DockerfileSpec, arch: str) -> Tuple[Optional[ImageReference], List, Dict]:
+    """
+    Get the layers and the config of the base image for the architecture.
+
+    :param DockerfileSpec spec: the parsed Dockerfile
+    :param str arch: the architecture of the image to assemble
+    :return: a tuple of the reference to the base image manifest, its layer descriptors converted
+        to the Docker v2 schema 2 media types and its config
+    :rtype: tuple
+    :raises UnsupportedDockerfile: if the base image can't be used without buildah
+    """
+    if spec.base_image == 'scratch':
+        config = {'architecture': arch, 'os': 'linux', 'config': {}}
+        return None, [], config
+
+    client = get_registry_client()
+    image, manifest = client.get_image_manifest(spec.base_image, arch)
+    if manifest.get('mediaType') in MANIFEST_LIST_MEDIA_TYPES or 'layers' not in manifest:
+        raise UnsupportedDockerfile(f'The manifest of {spec.base_image} is not supported')
+
+    layers = []
+    for layer in manifest['layers']:
+        media_type = _LAYER_MEDIA_TYPES.get(layer.get('mediaType', ''))
+        if not media_type:
+            raise UnsupportedDockerfile(f'The layer media type {layer.get("mediaType")} is unknown')
+        descriptor = {'mediaType': media_type, 'size': layer['size'], 'digest': layer['digest']}
+        if layer.get('urls'):
+            descriptor['urls'] = layer['urls']
+        layers.append(descriptor)
+
+    config = json.loads(client.get_config(spec.base_image, arch))
+    if config.get('architecture') != arch:
+        raise UnsupportedDockerfile(f'The base image {spec.base_image} has no {arch} image')
+    return image, layers, config
+
+
+def _create_config(
+    spec: DockerfileSpec, base_config: Dict[str, Any], layers: List[Dict], arch: str
+) -> Dict[str, Any]:
+    """
+    Create the config of the assembled image on top of the config of the base image.
+
+    :param DockerfileSpec spec: the parsed Dockerfile
+    :param dict base_config: the config of the base image
+    :param list layers: the descriptors of the layers added by the Dockerfile
+    :param str arch: the architecture of the image
+    :return: the config of the assembled image
+    :rtype: dict
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    config = dict(base_config)
+    container_config = dict(config.get('config') or {})
+    container_config['Labels'] = {**(container_config.get('Labels') or {}), **spec.labels}
+    if spec.entrypoint is not None:
+        container_config['Entrypoint'] = spec.entrypoint
+    if spec.cmd is not None:
+        container_config['Cmd'] = spec.cmd or None
+    config['config'] = container_config
+    config['architecture'] = arch
+    config['os'] = config.get('os') or 'linux'
+    config['created'] = now
+
+    rootfs = dict(config.get('rootfs') or {'type': 'layers'})
+    rootfs['diff_ids'] = list(rootfs.get('diff_ids') or []) + [layer['diff_id'] for layer in layers]
+    config['rootfs'] = rootfs
+    # The history must have an entry for every layer, so it's only kept if the base image has one
+    if config.get('history') or not base_config.get('rootfs', {}).get('diff_ids'):
+        history = list(config.get('history') or [])
+        for created_by, empty_layer in spec.history:
+            entry: Dict[str, Any] = {
+                'created': now,
+                'created_by': f'/bin/sh -c #(nop) {created_by}',
+            }
+            if empty_layer:
+                entry['empty_layer'] = True
+            history.append(entry)
+        config['history'] = history
+    return config
+
+
+def _verify_arch_label(config: Dict[str, Any], destination: str, arch: str) -> None:
+    """
+    Verify that the ``architecture`` label of the image matches the architecture, as buildah does.
+
+    :param dict config: the config of the assembled image
+    :param str destination: the pull specification of the image
+    :param str arch: the architecture of the image
+    :raises UnsupportedDockerfile: if the label doesn't match the architecture
+    """
+    archmap = get_worker_config().iib_supported_archs
+    destination_arch = config['config']['Labels'].get('architecture')
+    if destination_arch and destination_arch != archmap.get(arch):
+        raise UnsupportedDockerfile(
+            f'The image {destination} would have the architecture label {destination_arch} '
+            f'instead of {archmap.get(arch)}'
+        )
+
+
+def _push_blob(
+    base_image: Optional[ImageReference], destination: ImageReference, layer: Dict[str, Any]
+) -> None:
+    """
+    Push the layer to the destination repository unless it's already there.
+
+    The layers of the base image are mounted from its repository when it's on the same registry,
+    so they are only downloaded and uploaded again when the registry can't mount them.
+
+    :param ImageReference base_image: the base image the layer is copied from, if it's not local
+    :param ImageReference destination: the image the layer is pushed for
+    :param dict layer: the descriptor of the layer
+    """
+    if layer['mediaType'] == DOCKER_FOREIGN_LAYER_MEDIA_TYPE:
+        return
+    client = get_registry_client()
+    if client.blob_exists(destination, layer['digest']):
+        log.debug('The blob %s already exists in %s', layer['digest'], destination.repository)
+        return
+    if 'path' not in layer and base_image is not None:
+        if client.mount_blob(destination, layer['digest'], base_image):
+            return
+
+    blob: BinaryIO
+    if 'path' in layer:
+        with open(layer['path'], 'rb') as blob:
+            client.upload_blob(destination, layer['digest'], blob, layer['size'])
+    else:
+        assert base_image is not None
+        with open_blob(client, base_image, layer['digest']) as blob:
+            client.upload_blob(destination, layer['digest'], blob, layer['size'])
+
+
+def assemble_and_push_image(
+    dockerfile_dir: str, dockerfile_name: str, destination: str, arch: str
+) -> bool:
+    """
+    Assemble the image for the architecture through the registry API instead of building it.
+
+    The files added by the Dockerfile are packed into layers which are appended to the layers of
+    the base image, and the image config and manifest are written on top of the ones of the base
+    image. Only the blobs missing in the destination repository are pushed. This is only done when
+    ``iib_buildless_index_assembly`` is enabled and the Dockerfile only uses the supported
+    instructions, see ``parse_dockerfile``.
+
+    :param str dockerfile_dir: the path to the build context directory
+    :param str dockerfile_name: the name of the Dockerfile in the ``dockerfile_dir``
+    :param str destination: the pull specification to push the image to
+    :param str arch: the architecture of the image
+    :return: ``True`` if the image was pushed and ``False`` if it must be built with buildah
+    :rtype: bool
+    """
+    if not get_worker_config().iib_buildless_index_assembly:
+        return False
+
+    dockerfile_path = os.path.join(dockerfile_dir, dockerfile_name)
+    try:
+        spec = parse_dockerfile(dockerfile_path)
+        layers = _get_layers(dockerfile_dir, dockerfile_path, spec)
+        base_image, base_layers, base_config = _get_base_image(spec, arch)
+        config = _create_config(spec, base_config, layers, arch)
+        _verify_arch_label(config, destination, arch)
+
+        log.info(
+            'Assembling the image %s for the arch %s from %s', destination, arch, spec.base_image
+        )
+        destination_ref = ImageReference(destination)
+        for layer in base_layers:
+            _push_blob(base_image, destination_ref, layer)
+        for layer in layers:
+            _push_blob(None, destination_ref, layer)
+
+        client = get_registry_client()
+        config_blob = json.dumps(config).encode()
+        config_digest = f'sha256:{hashlib.sha256(config_blob).hexdigest()}'
+        client.upload_blob(destination_ref, config_digest, config_blob, len(config_blob))
+        manifest = {
+            'schemaVersion': 2,
+            'mediaType': DOCKER_MANIFEST_MEDIA_TYPE,
+            'config': {
+                'mediaType': DOCKER_CONFIG_MEDIA_TYPE,
+                'size': len(config_blob),
+                'digest': config_digest,
+            },
+            'layers': base_layers
+            + [{key: layer[key] for key in ('mediaType', 'size', 'digest')} for layer in layers],
+        }
+        client.put_manifest(
+            destination_ref, json.dumps(manifest, indent=3).encode(), DOCKER_MANIFEST_MEDIA_TYPE
+        )
+    except (IIBError, OSError) as e:
+        log.warning('Falling back to building %s for the arch %s: %s', destination, arch, e)
+        return False
+
+    return True
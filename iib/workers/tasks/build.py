@@ -1,11 +1,15 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import contextvars
+import hashlib
+import json
 import logging
 import os
 import shutil
+import sqlite3
 import stat
 import tempfile
 import ruamel.yaml
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from operator_manifest.operator import ImageName, OperatorManifest
 from tenacity import (
@@ -19,12 +23,34 @@ from tenacity import (
 
 from iib.common.common_utils import get_binary_versions
 from iib.common.tracing import instrument_tracing
-from iib.exceptions import IIBError, ExternalServiceError
-from iib.workers.api_utils import set_request_state, update_request
+from iib.exceptions import IIBError, ExternalServiceError, FromIndexChangedError
+from iib.workers.api_utils import get_requests, set_request_state, update_request
+from iib.workers.artifact_cache import get_artifact_cache
 from iib.workers.config import get_worker_config
+from iib.workers.dogpile_cache import get_cache_stats
+from iib.workers.registry_client import get_registry_client, ImageReference
+from iib.workers.slots import (
+    get_arch_container_storages,
+    get_current_slot,
+    use_container_storage,
+)
+from iib.workers.tasks.assembly_utils import _push_blob, assemble_and_push_image
 from iib.workers.tasks.celery import app
+from iib.workers.tasks.coalescing_utils import coalesce_requests
+from iib.workers.tasks.concurrency_utils import (
+    run_per_arch_concurrently,
+    run_per_image_concurrently,
+)
+from iib.workers.tasks.extraction_utils import extract_files_from_image
 from iib.workers.greenwave import gate_bundles
-from iib.workers.tasks.fbc_utils import is_image_fbc, get_catalog_dir, merge_catalogs_dirs
+from iib.workers.tasks.fbc_utils import (
+    is_image_fbc,
+    get_catalog_dir,
+    merge_catalog_packages,
+    merge_catalogs_dirs,
+    split_catalog_into_layers,
+)
+from iib.workers.tasks.index_db_utils import get_changed_packages
 from iib.workers.tasks.git_utils import push_configs_to_git, revert_last_commit
 from iib.workers.tasks.opm_operations import (
     opm_registry_add_fbc,
@@ -45,10 +71,13 @@ from iib.workers.tasks.opm_operations import (
 from iib.workers.tasks.utils import (
     add_max_ocp_version_property,
     chmod_recursively,
+    clear_image_metadata_cache,
     get_bundles_from_deprecation_list,
     get_resolved_bundles,
     get_resolved_image,
+    invalidate_resolved_image_cache,
     podman_pull,
+    rebase_on_from_index_change,
     request_logger,
     reset_docker_config,
     run_cmd,
@@ -72,6 +101,35 @@ __all__ = ['handle_add_request', 'handle_rm_request']
 log = logging.getLogger(__name__)
 worker_config = get_worker_config()
 
+# Whether the files which can't be extracted from the layers of an image are copied with podman,
+# which pulls the image into the container storage, see _copy_files_from_image_uncached
+podman_copy_fallback: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    'podman_copy_fallback', default=True
+)
+
+
+def _assemble_image(dockerfile_dir: str, dockerfile_name: str, request_id: int, arch: str) -> bool:
+    """
+    Assemble and push the index image for the specified architecture without building it.
+
+    See ``assemble_and_push_image`` for when this is possible. The caller must build and push the
+    image with ``_build_image`` and ``_push_image`` when this returns ``False``.
+
+    :param str dockerfile_dir: the path to the directory containing the data used for
+        building the container image
+    :param str dockerfile_name: the name of the Dockerfile in the dockerfile_dir to
+        be used when building the container image
+    :param int request_id: the ID of the IIB build request
+    :param str arch: the architecture to assemble this image for
+    :return: ``True`` if the image was pushed to the registry
+    :rtype: bool
+    """
+    destination = _get_external_arch_pull_spec(request_id, arch)
+    if not assemble_and_push_image(dockerfile_dir, dockerfile_name, destination, arch):
+        return False
+    invalidate_resolved_image_cache(destination)
+    return True
+
 
 @retry(
     before_sleep=before_sleep_log(log, logging.WARNING),
@@ -109,22 +167,27 @@ def _build_image(dockerfile_dir: str, dockerfile_name: str, request_id: int, arc
     #
     # NOTE: The argument "--format docker" ensures buildah will not generate an index image with
     # default OCI v1 manifest but always use Docker v2 format.
+    cmd = [
+        'buildah',
+        'bud',
+        '--no-cache',
+        '--format',
+        'docker',
+        '--override-arch',
+        arch,
+        '--arch',
+        arch,
+        '-t',
+        destination,
+        '-f',
+        dockerfile_path,
+    ]
+    if get_worker_config().iib_catalog_layers:
+        # NOTE: buildah sets the modification time of the files added to the time of the build
+        # otherwise, which would change the digests of the layers of the unchanged packages
+        cmd[3:3] = ['--timestamp', '0']
     run_cmd(
-        [
-            'buildah',
-            'bud',
-            '--no-cache',
-            '--format',
-            'docker',
-            '--override-arch',
-            arch,
-            '--arch',
-            arch,
-            '-t',
-            destination,
-            '-f',
-            dockerfile_path,
-        ],
+        cmd,
         {'cwd': dockerfile_dir},
         exc_msg=f'Failed to build the container image on the arch {arch}',
     )
@@ -152,19 +215,39 @@ def _cleanup() -> None:
     Remove all existing container images on the host.
 
     This will ensure that the host will not run out of disk space due to stale data, and that
-    all images referenced using floating tags will be up to date on the host.
+    all images referenced using floating tags will be up to date on the host. When the worker runs
+    in slots, only the container images in the storage of the slot of the worker process are
+    removed, so the requests running in the other slots are not affected. The container images in
+    the storages of the architectures built concurrently are removed too.
 
     Additionally, this function will reset the Docker ``config.json`` to
-    ``iib_docker_config_template``.
+    ``iib_docker_config_template`` and forget the metadata of the inspected container images.
+    Only the state of the request is cleared, the content-addressed caches of the worker, such as
+    the blob cache, stay valid across requests and are kept.
 
     :raises IIBError: if the command to remove the container images fails
     """
-    log.info('Removing all existing container images')
+    slot = get_current_slot()
+    if slot:
+        log.info('Removing all existing container images of the worker slot %d', slot.index)
+    else:
+        log.info('Removing all existing container images')
     run_cmd(
         ['podman', 'rmi', '--all', '--force'],
         exc_msg='Failed to remove the existing container images',
     )
-    reset_docker_config()
+    for storage in get_arch_container_storages():
+        log.debug('Removing all existing container images in %s', storage.directory)
+        with use_container_storage(storage):
+            run_cmd(
+                ['podman', 'rmi', '--all', '--force'],
+                exc_msg='Failed to remove the existing container images',
+            )
+    if not slot:
+        # The slots use their own auth files, the shared Docker config is never modified
+        reset_docker_config()
+    clear_image_metadata_cache()
+    log.debug('Image inspection cache statistics of the worker: %s', get_cache_stats())
 
 
 @retry(
@@ -182,6 +265,9 @@ def _create_and_push_manifest_list(
     """
     Create and push the manifest list to the configured registry.
 
+    The manifest list is created and pushed once with the request ID as the tag, and then tagged
+    with the extra build tags, see ``_tag_manifest_list``.
+
     :param int request_id: the ID of the IIB build request
     :param set arches: an set of arches to create the manifest list for
     :param build_tags: list of extra tag to use for intermediate index image
@@ -194,55 +280,161 @@ def _create_and_push_manifest_list(
     if build_tags:
         _tags.extend(build_tags)
     conf = get_worker_config()
-    output_pull_specs = []
-    for tag in _tags:
-        output_pull_spec = conf['iib_image_push_template'].format(
-            registry=conf['iib_registry'], request_id=tag
+    output_pull_specs = [
+        conf['iib_image_push_template'].format(registry=conf['iib_registry'], request_id=tag)
+        for tag in _tags
+    ]
+    # The 1st item holds the production tag
+    output_pull_spec = output_pull_specs[0]
+    try:
+        run_cmd(
+            buildah_manifest_cmd + ['rm', output_pull_spec],
+            exc_msg=f'Failed to remove local manifest list. {output_pull_spec} does not exist',
         )
-        output_pull_specs.append(output_pull_spec)
-        try:
-            run_cmd(
-                buildah_manifest_cmd + ['rm', output_pull_spec],
-                exc_msg=f'Failed to remove local manifest list. {output_pull_spec} does not exist',
-            )
-        except IIBError as e:
-            error_msg = str(e)
-            if 'Manifest list not found locally.' not in error_msg:
-                raise IIBError(f'Error removing local manifest list: {error_msg}')
-            log.debug(
-                'Manifest list cannot be removed. No manifest list %s found', output_pull_spec
-            )
-        log.info('Creating the manifest list %s locally', output_pull_spec)
+    except IIBError as e:
+        error_msg = str(e)
+        if 'Manifest list not found locally.' not in error_msg:
+            raise IIBError(f'Error removing local manifest list: {error_msg}')
+        log.debug('Manifest list cannot be removed. No manifest list %s found', output_pull_spec)
+    log.info('Creating the manifest list %s locally', output_pull_spec)
+    run_cmd(
+        buildah_manifest_cmd + ['create', output_pull_spec],
+        exc_msg=f'Failed to create the manifest list locally: {output_pull_spec}',
+    )
+    for arch in sorted(arches):
+        arch_pull_spec = _get_external_arch_pull_spec(request_id, arch, include_transport=True)
         run_cmd(
-            buildah_manifest_cmd + ['create', output_pull_spec],
-            exc_msg=f'Failed to create the manifest list locally: {output_pull_spec}',
+            buildah_manifest_cmd + ['add', output_pull_spec, arch_pull_spec],
+            exc_msg=(
+                f'Failed to add {arch_pull_spec} to the local manifest list: {output_pull_spec}'
+            ),
         )
-        for arch in sorted(arches):
-            arch_pull_spec = _get_external_arch_pull_spec(request_id, arch, include_transport=True)
-            run_cmd(
-                buildah_manifest_cmd + ['add', output_pull_spec, arch_pull_spec],
-                exc_msg=(
-                    f'Failed to add {arch_pull_spec} to the'
-                    f' local manifest list: {output_pull_spec}'
-                ),
+
+    log.debug('Pushing manifest list %s', output_pull_spec)
+    _push_manifest_list(output_pull_spec, output_pull_spec)
+    invalidate_resolved_image_cache(output_pull_spec)
+
+    if len(output_pull_specs) > 1:
+        _tag_manifest_list(output_pull_spec, output_pull_specs[1:])
+
+    return output_pull_spec
+
+
+def _push_manifest_list(local_manifest_list: str, destination: str) -> None:
+    """
+    Push the local manifest list and the images it references to the destination.
+
+    :param str local_manifest_list: the name of the local manifest list
+    :param str destination: the pull specification to push the manifest list to
+    :raises IIBError: if the push fails
+    """
+    run_cmd(
+        [
+            'buildah',
+            'manifest',
+            'push',
+            '--all',
+            '--format',
+            'v2s2',
+            local_manifest_list,
+            f'docker://{destination}',
+        ],
+        exc_msg=f'Failed to push the manifest list to {destination}',
+    )
+
+
+def _copy_manifest_list(source: str, raw_manifest: bytes, destination: str) -> None:
+    """
+    Copy the manifest list to another repository through the registry API.
+
+    The blobs are mounted from the repository of the source when the registry allows it and are
+    only uploaded otherwise. The manifests are uploaded as they are, so their digests are kept.
+
+    :param str source: the pull specification of the manifest list to copy
+    :param bytes raw_manifest: the manifest list exactly as stored in the registry
+    :param str destination: the pull specification to copy the manifest list to
+    :raises IIBError: if the copy fails
+    """
+    client = get_registry_client()
+    source_ref = ImageReference(source)
+    destination_ref = ImageReference(destination)
+    manifest_list = json.loads(raw_manifest)
+    for descriptor in manifest_list.get('manifests', []):
+        raw_image_manifest = client.get_raw_manifest(
+            f'{source_ref.registry}/{source_ref.repository}@{descriptor["digest"]}'
+        )
+        image_manifest = json.loads(raw_image_manifest)
+        for blob in [image_manifest['config'], *image_manifest.get('layers', [])]:
+            _push_blob(source_ref, destination_ref, blob)
+        client.put_manifest(
+            ImageReference(
+                f'{destination_ref.registry}/{destination_ref.repository}@{descriptor["digest"]}'
+            ),
+            raw_image_manifest,
+            descriptor['mediaType'],
+        )
+    client.put_manifest(destination_ref, raw_manifest, manifest_list['mediaType'])
+
+
+def _tag_manifest_list(source: str, destinations: List[str]) -> None:
+    """
+    Tag the pushed manifest list with the extra pull specifications.
+
+    With the native registry client, the manifest list is read once and uploaded as it is to the
+    destinations in the same repository, which doesn't upload any blob or manifest again and keeps
+    the digest. The destinations in other repositories get the images of the manifest list copied
+    first, see ``_copy_manifest_list``. Otherwise, the manifest list is copied to every destination
+    with ``skopeo``. Either way, the manifest list is only read from the registry, so it doesn't
+    need to exist locally.
+
+    :param str source: the pull specification of the pushed manifest list
+    :param list destinations: the pull specifications to tag the manifest list with
+    :raises IIBError: if tagging the manifest list fails
+    """
+    if get_worker_config()['iib_registry_client'] != 'native':
+
+        def _copy(destination: str) -> None:
+            _skopeo_copy(
+                f'docker://{source}',
+                f'docker://{destination}',
+                copy_all=True,
+                exc_msg=f'Failed to tag the manifest list {source} as {destination}',
             )
+            log.info('Tagged the manifest list %s as %s with skopeo', source, destination)
 
-        log.debug('Pushing manifest list %s', output_pull_spec)
-        run_cmd(
-            buildah_manifest_cmd
-            + [
-                'push',
-                '--all',
-                '--format',
-                'v2s2',
-                output_pull_spec,
-                f'docker://{output_pull_spec}',
-            ],
-            exc_msg=f'Failed to push the manifest list to {output_pull_spec}',
+        run_per_image_concurrently(_copy, destinations)
+        return
+
+    client = get_registry_client()
+    source_ref = ImageReference(source)
+    round_trips = client.get_round_trips()
+    raw_manifest = client.get_raw_manifest(source)
+    media_type = json.loads(raw_manifest)['mediaType']
+    log.debug(
+        'Read the manifest list %s in %d registry round trips',
+        source,
+        client.get_round_trips() - round_trips,
+    )
+
+    def _tag(destination: str) -> None:
+        destination_ref = ImageReference(destination)
+        round_trips = client.get_round_trips()
+        if (destination_ref.registry, destination_ref.repository) == (
+            source_ref.registry,
+            source_ref.repository,
+        ):
+            client.put_manifest(destination_ref, raw_manifest, media_type)
+        else:
+            _copy_manifest_list(source, raw_manifest, destination)
+        log.info(
+            'Tagged the manifest list %s as %s in %d registry round trips',
+            source,
+            destination,
+            client.get_round_trips() - round_trips,
         )
+        invalidate_resolved_image_cache(destination)
 
-    # return 1st item as it holds production tag
-    return output_pull_specs[0]
+    run_per_image_concurrently(_tag, destinations)
 
 
 def _update_index_image_pull_spec(
@@ -369,6 +561,94 @@ def get_rebuilt_image_pull_spec(request_id: int) -> str:
     )
 
 
+# The parameters of the requests which don't change the index image that is built
+_INPUT_DIGEST_IGNORED_PARAMS = (
+    # The arches of the request are used instead
+    'add_arches',
+    # The extra tags are applied to the reused index image
+    'build_tags',
+    # The legacy app registry support is disabled, so these are ignored
+    'cnr_token',
+    'force_backport',
+    'organization',
+    # These are applied to the reused index image
+    'index_to_gitlab_push_map',
+    'overwrite_from_index',
+    'overwrite_from_index_token',
+    'request_id',
+    'traceparent',
+)
+
+
+def _get_request_input_digest(request_type: str, inputs: Dict[str, Any]) -> str:
+    """
+    Get the digest of the resolved inputs of a request.
+
+    Two requests with the same digest build the same index image, so the index image built by one
+    of them can be reused by the other one. The inputs must have every parameter of the request
+    except the ones in ``_INPUT_DIGEST_IGNORED_PARAMS``, with the resolved values of the images,
+    and the ``arches`` of the request instead of ``add_arches``.
+
+    :param str request_type: the type of the request
+    :param dict inputs: the resolved inputs of the request, which must be serializable to JSON
+    :return: the digest of the inputs in the ``sha256:<hex>`` format
+    :rtype: str
+    """
+    content = json.dumps({'request_type': request_type, **inputs}, sort_keys=True)
+    return f'sha256:{hashlib.sha256(content.encode("utf-8")).hexdigest()}'
+
+
+def _reuse_duplicate_index_image(
+    request_id: int, input_digest: str, build_tags: Optional[Iterable[str]]
+) -> Optional[str]:
+    """
+    Reuse the index image built by a completed request with the same resolved inputs.
+
+    When ``iib_request_deduplication`` is set, the digest of the inputs is set on the request, so
+    that later requests can reuse its index image. The index image of the duplicate request is
+    tagged with the pull specifications of the request instead of being built again.
+
+    :param int request_id: the ID of the IIB build request
+    :param str input_digest: the digest of the resolved inputs of the request
+    :param iterable build_tags: the extra tags to apply to the index image
+    :return: the pull specification of the index image of the request, or ``None`` if there is
+        no duplicate request and the index image must be built
+    :rtype: str
+    """
+    if not get_worker_config().get('iib_request_deduplication'):
+        return None
+
+    update_request(
+        request_id,
+        {'input_digest': input_digest},
+        exc_msg='Failed setting the input digest on the request',
+    )
+    duplicate_requests = get_requests({'input_digest': input_digest, 'state': 'complete'})
+    for duplicate_request in duplicate_requests:
+        source = duplicate_request.get('internal_index_image_copy_resolved')
+        if duplicate_request['id'] != request_id and source:
+            break
+    else:
+        return None
+
+    state_reason = (
+        f'Reusing the index image built by the identical request {duplicate_request["id"]}'
+    )
+    log.info(state_reason)
+    set_request_state(request_id, 'in_progress', state_reason)
+    conf = get_worker_config()
+    output_pull_specs = [
+        conf['iib_image_push_template'].format(registry=conf['iib_registry'], request_id=tag)
+        for tag in [str(request_id), *(build_tags or [])]
+    ]
+    try:
+        _tag_manifest_list(source, output_pull_specs)
+    except IIBError as e:
+        log.warning('Failed to reuse the index image %s, building it instead: %s', source, e)
+        return None
+    return output_pull_specs[0]
+
+
 def _get_index_database(from_index: str, base_dir: str) -> str:
     """
     Get database file from the specified index image and save it locally.
@@ -672,6 +952,7 @@ def _skopeo_copy(
     cmd.extend([source, destination])
 
     run_cmd(cmd, exc_msg=exc_msg or f'Failed to copy {source} to {destination}')
+    invalidate_resolved_image_cache(destination)
 
 
 def _verify_index_image(
@@ -687,13 +968,15 @@ def _verify_index_image(
     :param str overwrite_from_index_token: the token used for overwriting the input
         ``from_index`` image. This is required to use ``overwrite_from_index``.
         The format of the token must be in the format "user:password".
-    :raises IIBError: if the index image has changed since IIB build started.
+    :raises FromIndexChangedError: if the index image has changed since IIB build started.
     """
+    # Always ask the registry since the from_index may have changed within the cache TTL
+    invalidate_resolved_image_cache(unresolved_from_index)
     with set_registry_token(overwrite_from_index_token, unresolved_from_index, append=True):
         resolved_post_build_from_index = get_resolved_image(unresolved_from_index)
 
     if resolved_post_build_from_index != resolved_prebuild_from_index:
-        raise IIBError(
+        raise FromIndexChangedError(
             'The supplied from_index image changed during the IIB request.'
             ' Please resubmit the request.'
         )
@@ -710,7 +993,7 @@ def inspect_related_images(
     :param int request_id: the ID of the request this index image is for.
     :raises IIBError: if one of the bundles does not have the pullable related_image.
     """
-    invalid_related_images = []
+    related_images: List[str] = []
     for bundle in bundles:
         manifest_location = get_image_label(
             bundle, "operators.operatorframework.io.bundle.manifests.v1"
@@ -736,19 +1019,41 @@ def inspect_related_images(
                     related_image_pull_spec = related_image_pull_spec.replace(
                         related_image_regsitry, replace_registry_config.get(related_image_regsitry)
                     )
-                try:
-                    skopeo_inspect(f'docker://{related_image_pull_spec}', '--raw')
-                except IIBError as e:
-                    log.error(e)
-                    invalid_related_images.append(related_image_pull_spec)
+                related_images.append(related_image_pull_spec)
 
+    related_images_accessible = run_per_image_concurrently(
+        _is_related_image_accessible, related_images
+    )
+    invalid_related_images = [
+        related_image
+        for related_image, accessible in zip(related_images, related_images_accessible)
+        if not accessible
+    ]
     if invalid_related_images:
         raise IIBError(f"IIB cannot access the following related images {invalid_related_images}")
 
 
+def _is_related_image_accessible(related_image_pull_spec: str) -> bool:
+    """
+    Check if the related image can be inspected by IIB.
+
+    :param str related_image_pull_spec: the pull specification of the related image.
+    :return: True if the related image can be inspected, False otherwise
+    :rtype: bool
+    """
+    try:
+        skopeo_inspect(f'docker://{related_image_pull_spec}', '--raw')
+    except IIBError as e:
+        log.error(e)
+        return False
+    return True
+
+
 @app.task
 @request_logger
-@instrument_tracing(span_name="workers.tasks.handle_add_request", attributes=get_binary_versions())
+@coalesce_requests(merge_params=('bundles', 'deprecation_list'))
+@rebase_on_from_index_change
+@instrument_tracing(span_name="workers.tasks.handle_add_request", attributes=get_binary_versions)
 def handle_add_request(
     bundles: List[str],
     request_id: int,
@@ -859,6 +1164,44 @@ def handle_add_request(
         )
 
     _update_index_image_build_state(request_id, prebuild_info)
+    input_digest = _get_request_input_digest(
+        'add',
+        {
+            'arches': sorted(prebuild_info['arches']),
+            'binary_image': prebuild_info['binary_image_resolved'],
+            'binary_image_config': binary_image_config,
+            'bundles': sorted(resolved_bundles),
+            'check_related_images': check_related_images,
+            'deprecation_list': sorted(deprecation_list or []),
+            'distribution_scope': prebuild_info['distribution_scope'],
+            'from_index': from_index_resolved,
+            'graph_update_mode': graph_update_mode,
+            'greenwave_config': greenwave_config,
+            'username': username,
+        },
+    )
+    output_pull_spec = _reuse_duplicate_index_image(request_id, input_digest, build_tags)
+    if output_pull_spec:
+        _update_index_image_pull_spec(
+            output_pull_spec=output_pull_spec,
+            request_id=request_id,
+            arches=prebuild_info['arches'],
+            from_index=from_index,
+            overwrite_from_index=overwrite_from_index,
+            overwrite_from_index_token=overwrite_from_index_token,
+            resolved_prebuild_from_index=from_index_resolved,
+            add_or_rm=True,
+            is_image_fbc=is_fbc,
+            index_repo_map=index_to_gitlab_push_map or {},
+        )
+        _cleanup()
+        set_request_state(
+            request_id,
+            'complete',
+            'The operator bundle(s) were successfully added to the index image',
+        )
+        return
+
     present_bundles: List[BundleImage] = []
     present_bundles_pull_spec: List[str] = []
     with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-') as temp_dir:
@@ -884,8 +1227,9 @@ def handle_add_request(
                     ' '.join(excluded_bundles),
                 )
 
+        package_digests = None
         if is_fbc:
-            opm_registry_add_fbc(
+            package_digests = opm_registry_add_fbc(
                 base_dir=temp_dir,
                 bundles=resolved_bundles,
                 binary_image=prebuild_info['binary_image_resolved'],
@@ -893,6 +1237,7 @@ def handle_add_request(
                 graph_update_mode=graph_update_mode,
                 overwrite_from_index_token=overwrite_from_index_token,
                 overwrite_csv=(prebuild_info['distribution_scope'] in ['dev', 'stage']),
+                incremental=get_worker_config().iib_incremental_fbc_migration,
             )
         else:
             opm_index_add(
@@ -966,11 +1311,18 @@ def handle_add_request(
         if is_fbc:
             os.makedirs(os.path.join(temp_dir, 'from_db'), exist_ok=True)
             index_db_file = os.path.join(temp_dir, get_worker_config()['temp_index_db_path'])
+            changed_packages = None
+            if package_digests is not None and not deprecation_bundles:
+                try:
+                    changed_packages = get_changed_packages(package_digests, index_db_file)
+                except sqlite3.Error as e:
+                    log.warning('Failed to find the changed packages, migrating all of them: %s', e)
             # get catalog from SQLite index.db (hidden db) - not opted in operators
             catalog_from_db, _ = opm_migrate(
                 index_db=index_db_file,
                 base_dir=os.path.join(temp_dir, 'from_db'),
                 generate_cache=False,
+                packages=changed_packages,
             )
             # get catalog with opted-in operators
             os.makedirs(os.path.join(temp_dir, 'from_index'), exist_ok=True)
@@ -998,7 +1350,10 @@ def handle_add_request(
 
             # overwrite data in `catalog_from_index` by data from `catalog_from_db`
             # this adds changes on not opted in operators to final
-            merge_catalogs_dirs(catalog_from_db, catalog_from_index)
+            if changed_packages is not None:
+                merge_catalog_packages(catalog_from_db, catalog_from_index, changed_packages)
+            else:
+                merge_catalogs_dirs(catalog_from_db, catalog_from_index)
 
             fbc_dir_path = os.path.join(temp_dir, 'catalog')
             # We need to regenerate file-based catalog because we merged changes
@@ -1011,12 +1366,21 @@ def handle_add_request(
             local_cache_path = os.path.join(temp_dir, 'cache')
             if os.path.exists(local_cache_path):
                 shutil.rmtree(local_cache_path)
-            generate_cache_locally(temp_dir, fbc_dir_path, local_cache_path)
+            with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+                generate_cache_locally(
+                    temp_dir, fbc_dir_path, local_cache_path, from_index=from_index_resolved
+                )
+
+        split_catalog_into_layers(temp_dir, 'index.Dockerfile')
 
-        for arch in sorted(arches):
+        def _build_and_push(arch: str) -> None:
+            if _assemble_image(temp_dir, 'index.Dockerfile', request_id, arch):
+                return
             _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
             _push_image(request_id, arch)
 
+        run_per_arch_concurrently(_build_and_push, arches)
+
         # If the container-tool podman is used in the opm commands above, opm will create temporary
         # files and directories without the write permission. This will cause the context manager
         # to fail to delete these files. Adjust the file modes to avoid this error.
@@ -1049,7 +1413,9 @@ def handle_add_request(
 
 @app.task
 @request_logger
-@instrument_tracing(span_name="workers.tasks.handle_rm_request", attributes=get_binary_versions())
+@coalesce_requests(merge_params=('operators',))
+@rebase_on_from_index_change
+@instrument_tracing(span_name="workers.tasks.handle_rm_request", attributes=get_binary_versions)
 def handle_rm_request(
     operators: List[str],
     request_id: int,
@@ -1106,6 +1472,39 @@ def handle_rm_request(
     from_index_resolved = prebuild_info['from_index_resolved']
     Opm.set_opm_version(from_index_resolved)
 
+    input_digest = _get_request_input_digest(
+        'rm',
+        {
+            'arches': sorted(prebuild_info['arches']),
+            'binary_image': prebuild_info['binary_image_resolved'],
+            'binary_image_config': binary_image_config,
+            'distribution_scope': prebuild_info['distribution_scope'],
+            'from_index': from_index_resolved,
+            'operators': sorted(operators),
+        },
+    )
+    output_pull_spec = _reuse_duplicate_index_image(request_id, input_digest, build_tags)
+    if output_pull_spec:
+        with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+            image_is_fbc = is_image_fbc(from_index_resolved)
+        _update_index_image_pull_spec(
+            output_pull_spec=output_pull_spec,
+            request_id=request_id,
+            arches=prebuild_info['arches'],
+            from_index=from_index,
+            overwrite_from_index=overwrite_from_index,
+            overwrite_from_index_token=overwrite_from_index_token,
+            resolved_prebuild_from_index=from_index_resolved,
+            add_or_rm=True,
+            is_image_fbc=image_is_fbc,
+            index_repo_map=index_to_gitlab_push_map or {},
+        )
+        _cleanup()
+        set_request_state(
+            request_id, 'complete', 'The operator(s) were successfully removed from the index image'
+        )
+        return
+
     with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-') as temp_dir:
         with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
             image_is_fbc = is_image_fbc(from_index_resolved)
@@ -1180,7 +1579,10 @@ def handle_rm_request(
             local_cache_path = os.path.join(temp_dir, 'cache')
             if os.path.exists(local_cache_path):
                 shutil.rmtree(local_cache_path)
-            generate_cache_locally(temp_dir, fbc_dir_path, local_cache_path)
+            with set_registry_token(overwrite_from_index_token, from_index_resolved, append=True):
+                generate_cache_locally(
+                    temp_dir, fbc_dir_path, local_cache_path, from_index=from_index_resolved
+                )
 
         else:
             opm_index_rm(
@@ -1207,10 +1609,17 @@ def handle_rm_request(
         )
 
         arches = prebuild_info['arches']
-        for arch in sorted(arches):
+
+        split_catalog_into_layers(temp_dir, 'index.Dockerfile')
+
+        def _build_and_push(arch: str) -> None:
+            if _assemble_image(temp_dir, 'index.Dockerfile', request_id, arch):
+                return
             _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
             _push_image(request_id, arch)
 
+        run_per_arch_concurrently(_build_and_push, arches)
+
         # If the container-tool podman is used in the opm commands above, opm will create temporary
         # files and directories without the write permission. This will cause the context manager
         # to fail to delete these files. Adjust the file modes to avoid this error.
@@ -1251,6 +1660,45 @@ def _copy_files_from_image(image: str, src_path: str, dest_path: str) -> None:
     :param str src_path: the full path within the container image to copy from.
     :param str dest_path: the full path on the local host to copy into.
     """
+    artifact_cache = get_artifact_cache()
+    if not artifact_cache or '@sha256:' not in image:
+        _copy_files_from_image_uncached(image, src_path, dest_path)
+        return
+
+    # Follow the podman cp semantics to find where the file is copied to
+    if os.path.isdir(dest_path):
+        dest_root = os.path.join(dest_path, os.path.basename(os.path.normpath(src_path)))
+    else:
+        dest_root = dest_path
+    digest = image.split('@', 1)[1]
+    if artifact_cache.get(digest, src_path, dest_root):
+        return
+
+    _copy_files_from_image_uncached(image, src_path, dest_path)
+    artifact_cache.put(digest, src_path, dest_root)
+
+
+def _copy_files_from_image_uncached(image: str, src_path: str, dest_path: str) -> None:
+    """
+    Copy a file from the container image into the given destination path without the cache.
+
+    :param str image: the pull specification of the container image.
+    :param str src_path: the full path within the container image to copy from.
+    :param str dest_path: the full path on the local host to copy into.
+    :raises IIBError: if the files can't be copied, or can't be extracted from the layers when
+        ``podman_copy_fallback`` is unset
+    """
+    if get_worker_config().iib_extract_files_from_layers:
+        try:
+            extract_files_from_image(image, src_path, dest_path)
+            return
+        except IIBError as e:
+            if not podman_copy_fallback.get():
+                raise
+            log.warning('%s Falling back to copying the files with podman.', e)
+    elif not podman_copy_fallback.get():
+        raise IIBError(f'Copying the files of {image} with podman is not allowed')
+
     # Check that image is pullable
     podman_pull(image)
 
@@ -10,6 +10,7 @@ from iib.common.tracing import instrument_tracing
 from iib.workers.api_utils import set_request_state
 from iib.workers.tasks.build import (
     _add_label_to_index,
+    _assemble_image,
     _build_image,
     _cleanup,
     _create_and_push_manifest_list,
@@ -18,7 +19,8 @@ from iib.workers.tasks.build import (
     _update_index_image_pull_spec,
 )
 from iib.workers.tasks.celery import app
-from iib.workers.tasks.fbc_utils import get_catalog_dir
+from iib.workers.tasks.concurrency_utils import run_per_arch_concurrently
+from iib.workers.tasks.fbc_utils import get_catalog_dir, split_catalog_into_layers
 from iib.workers.tasks.opm_operations import (
     Opm,
     create_dockerfile,
@@ -28,6 +30,7 @@ from iib.workers.tasks.opm_operations import (
 )
 from iib.workers.tasks.utils import (
     prepare_request_for_build,
+    rebase_on_from_index_change,
     request_logger,
     RequestConfigAddDeprecations,
     IIBError,
@@ -41,9 +44,10 @@ log = logging.getLogger(__name__)
 
 @app.task
 @request_logger
+@rebase_on_from_index_change
 @instrument_tracing(
     span_name="workers.tasks.build.handle_add_deprecations_request",
-    attributes=get_binary_versions(),
+    attributes=get_binary_versions,
 )
 def handle_add_deprecations_request(
     deprecation_schema: str,
@@ -136,10 +140,17 @@ def handle_add_deprecations_request(
         )
 
         arches = prebuild_info['arches']
-        for arch in sorted(arches):
+
+        split_catalog_into_layers(temp_dir, 'index.Dockerfile')
+
+        def _build_and_push(arch: str) -> None:
+            if _assemble_image(temp_dir, 'index.Dockerfile', request_id, arch):
+                return
             _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
             _push_image(request_id, arch)
 
+        run_per_arch_concurrently(_build_and_push, arches)
+
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
 
@@ -204,7 +215,10 @@ def add_deprecations_to_index(
 
     local_cache_path = os.path.join(temp_dir, 'cache')
     generate_cache_locally(
-        base_dir=temp_dir, fbc_dir=from_index_configs_dir, local_cache_path=local_cache_path
+        base_dir=temp_dir,
+        fbc_dir=from_index_configs_dir,
+        local_cache_path=local_cache_path,
+        from_index=from_index_resolved,
     )
 
     log.info("Dockerfile generated from %s", from_index_configs_dir)
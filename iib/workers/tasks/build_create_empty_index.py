@@ -9,6 +9,7 @@ from iib.workers.api_utils import set_request_state
 from iib.common.common_utils import get_binary_versions
 from iib.workers.tasks.build import (
     _add_label_to_index,
+    _assemble_image,
     _build_image,
     _cleanup,
     _create_and_push_manifest_list,
@@ -17,7 +18,8 @@ from iib.workers.tasks.build import (
     _update_index_image_pull_spec,
 )
 from iib.workers.tasks.celery import app
-from iib.workers.tasks.fbc_utils import is_image_fbc
+from iib.workers.tasks.concurrency_utils import run_per_arch_concurrently
+from iib.workers.tasks.fbc_utils import is_image_fbc, split_catalog_into_layers
 from iib.workers.tasks.opm_operations import (
     opm_create_empty_fbc,
     opm_index_rm,
@@ -39,7 +41,7 @@ log = logging.getLogger(__name__)
 @app.task
 @request_logger
 @instrument_tracing(
-    span_name="workers.tasks.handle_create_empty_index_request", attributes=get_binary_versions()
+    span_name="workers.tasks.handle_create_empty_index_request", attributes=get_binary_versions
 )
 def handle_create_empty_index_request(
     from_index: str,
@@ -125,10 +127,16 @@ def handle_create_empty_index_request(
 
         arches = prebuild_info['arches']
 
-        for arch in sorted(arches):
+        split_catalog_into_layers(temp_dir, 'index.Dockerfile')
+
+        def _build_and_push(arch: str) -> None:
+            if _assemble_image(temp_dir, 'index.Dockerfile', request_id, arch):
+                return
             _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
             _push_image(request_id, arch)
 
+        run_per_arch_concurrently(_build_and_push, arches)
+
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, [])
 
@@ -8,18 +8,24 @@ from iib.common.tracing import instrument_tracing
 from iib.workers.api_utils import set_request_state
 from iib.workers.tasks.build import (
     _add_label_to_index,
+    _assemble_image,
     _build_image,
     _cleanup,
     _create_and_push_manifest_list,
+    _get_request_input_digest,
     _push_image,
+    _reuse_duplicate_index_image,
     _update_index_image_build_state,
     _update_index_image_pull_spec,
 )
 from iib.workers.tasks.celery import app
+from iib.workers.tasks.concurrency_utils import run_per_arch_concurrently
+from iib.workers.tasks.fbc_utils import split_catalog_into_layers
 from iib.workers.tasks.opm_operations import opm_registry_add_fbc_fragment, Opm
 from iib.workers.tasks.utils import (
     get_resolved_image,
     prepare_request_for_build,
+    rebase_on_from_index_change,
     request_logger,
     set_registry_token,
     RequestConfigFBCOperation,
@@ -32,8 +38,9 @@ log = logging.getLogger(__name__)
 
 @app.task
 @request_logger
+@rebase_on_from_index_change
 @instrument_tracing(
-    span_name="workers.tasks.build.handle_fbc_operation_request", attributes=get_binary_versions()
+    span_name="workers.tasks.build.handle_fbc_operation_request", attributes=get_binary_versions
 )
 def handle_fbc_operation_request(
     request_id: int,
@@ -99,6 +106,38 @@ def handle_fbc_operation_request(
 
     _update_index_image_build_state(request_id, prebuild_info)
 
+    input_digest = _get_request_input_digest(
+        'fbc-operations',
+        {
+            'arches': sorted(prebuild_info['arches']),
+            'binary_image': binary_image_resolved,
+            'binary_image_config': binary_image_config,
+            'distribution_scope': prebuild_info['distribution_scope'],
+            'fbc_fragments': resolved_fbc_fragments,
+            'from_index': from_index_resolved,
+        },
+    )
+    output_pull_spec = _reuse_duplicate_index_image(request_id, input_digest, build_tags)
+    if output_pull_spec:
+        _update_index_image_pull_spec(
+            output_pull_spec=output_pull_spec,
+            request_id=request_id,
+            arches=prebuild_info['arches'],
+            from_index=from_index,
+            overwrite_from_index=overwrite_from_index,
+            overwrite_from_index_token=overwrite_from_index_token,
+            resolved_prebuild_from_index=from_index_resolved,
+            add_or_rm=True,
+        )
+        _cleanup()
+        set_request_state(
+            request_id,
+            'complete',
+            f"The {len(resolved_fbc_fragments)} FBC fragment(s) were successfully added"
+            "in the index image",
+        )
+        return
+
     with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-') as temp_dir:
         # Process all resolved fbc fragments at once
         opm_registry_add_fbc_fragment(
@@ -125,10 +164,17 @@ def handle_fbc_operation_request(
         )
 
         arches = prebuild_info['arches']
-        for arch in sorted(arches):
+
+        split_catalog_into_layers(temp_dir, 'index.Dockerfile')
+
+        def _build_and_push(arch: str) -> None:
+            if _assemble_image(temp_dir, 'index.Dockerfile', request_id, arch):
+                return
             _build_image(temp_dir, 'index.Dockerfile', request_id, arch)
             _push_image(request_id, arch)
 
+        run_per_arch_concurrently(_build_and_push, arches)
+
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, build_tags)
 
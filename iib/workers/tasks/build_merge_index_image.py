@@ -26,6 +26,7 @@ from iib.exceptions import IIBError
 from iib.workers.api_utils import set_request_state
 from iib.workers.tasks.build import (
     _add_label_to_index,
+    _assemble_image,
     _build_image,
     _cleanup,
     _create_and_push_manifest_list,
@@ -37,7 +38,8 @@ from iib.workers.tasks.build import (
     _update_index_image_pull_spec,
 )
 from iib.workers.tasks.celery import app
-from iib.workers.tasks.fbc_utils import is_image_fbc
+from iib.workers.tasks.concurrency_utils import run_per_arch_concurrently
+from iib.workers.tasks.fbc_utils import is_image_fbc, split_catalog_into_layers
 from iib.workers.tasks.utils import (
     add_max_ocp_version_property,
     chmod_recursively,
@@ -197,7 +199,7 @@ def _add_bundles_missing_in_source(
 @app.task
 @request_logger
 @instrument_tracing(
-    span_name="workers.tasks.build.handle_merge_request", attributes=get_binary_versions()
+    span_name="workers.tasks.build.handle_merge_request", attributes=get_binary_versions
 )
 def handle_merge_request(
     source_from_index: str,
@@ -422,10 +424,16 @@ def handle_merge_request(
             dockerfile_name,
         )
 
-        for arch in sorted(prebuild_info['arches']):
+        split_catalog_into_layers(temp_dir, dockerfile_name)
+
+        def _build_and_push(arch: str) -> None:
+            if _assemble_image(temp_dir, dockerfile_name, request_id, arch):
+                return
             _build_image(temp_dir, dockerfile_name, request_id, arch)
             _push_image(request_id, arch)
 
+        run_per_arch_concurrently(_build_and_push, prebuild_info['arches'])
+
         # If the container-tool podman is used in the opm commands above, opm will create temporary
         # files and directories without the write permission. This will cause the context manager
         # to fail to delete these files. Adjust the file modes to avoid this error.
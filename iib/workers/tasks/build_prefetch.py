@@ -0,0 +1,151 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+import tempfile
+from typing import List, Optional
+
+from iib.common.tracing import instrument_tracing
+from iib.exceptions import IIBError
+from iib.workers.artifact_cache import get_artifact_cache
+from iib.workers.blob_cache import get_blob_cache
+from iib.workers.config import get_worker_config
+from iib.workers.tasks.build import (
+    _copy_files_from_image,
+    _get_index_database,
+    podman_copy_fallback,
+)
+from iib.workers.tasks.celery import app
+from iib.workers.tasks.concurrency_utils import run_per_image_concurrently
+from iib.workers.tasks.fbc_utils import get_catalog_dir, get_hidden_index_database, is_image_fbc
+from iib.workers.tasks.utils import (
+    get_image_arches,
+    get_image_label,
+    get_image_labels,
+    get_resolved_bundles,
+    get_resolved_image,
+)
+
+__all__ = ['handle_prefetch_request']
+
+log = logging.getLogger(__name__)
+
+
+def _prefetch_index_image(request_id: int, from_index: str, copy_files: bool) -> None:
+    """
+    Prefetch the metadata and the catalog of the index image.
+
+    :param int request_id: the ID of the IIB build request
+    :param str from_index: the pull specification of the index image
+    :param bool copy_files: whether the catalog is copied out of the index image
+    """
+    from_index_resolved = get_resolved_image(from_index)
+    get_image_arches(from_index_resolved)
+    image_is_fbc = is_image_fbc(from_index_resolved)
+    if not copy_files:
+        return
+
+    with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-prefetch-') as temp_dir:
+        if image_is_fbc:
+            get_catalog_dir(from_index_resolved, temp_dir)
+            get_hidden_index_database(from_index_resolved, temp_dir)
+        else:
+            _get_index_database(from_index_resolved, temp_dir)
+
+
+def _prefetch_bundle(bundle: str, request_id: int, copy_files: bool) -> None:
+    """
+    Prefetch the metadata and the manifests of the resolved bundle image.
+
+    :param str bundle: the pull specification of the bundle image using its digest
+    :param int request_id: the ID of the IIB build request
+    :param bool copy_files: whether the manifests are copied out of the bundle image
+    """
+    get_image_labels(bundle)
+    if not copy_files:
+        return
+
+    manifest_location = get_image_label(
+        bundle, 'operators.operatorframework.io.bundle.manifests.v1'
+    )
+    if not manifest_location:
+        return
+    with tempfile.TemporaryDirectory(prefix=f'iib-{request_id}-prefetch-') as temp_dir:
+        _copy_files_from_image(bundle, manifest_location, temp_dir)
+
+
+def _prefetch_images(
+    request_id: int,
+    from_index: Optional[str],
+    binary_image: Optional[str],
+    bundles: Optional[List[str]],
+    copy_files: bool,
+) -> None:
+    """
+    Prefetch the images of the request, only logging the failures.
+
+    :param int request_id: the ID of the IIB build request
+    :param str from_index: the pull specification of the index image of the request
+    :param str binary_image: the pull specification of the binary image of the request
+    :param list bundles: the pull specifications of the bundles of the request
+    :param bool copy_files: whether the files are copied out of the images
+    """
+    if from_index:
+        try:
+            _prefetch_index_image(request_id, from_index, copy_files)
+        except IIBError as e:
+            log.warning('Failed to prefetch the index image %s: %s', from_index, e)
+
+    if binary_image:
+        try:
+            get_image_arches(get_resolved_image(binary_image))
+        except IIBError as e:
+            log.warning('Failed to prefetch the binary image %s: %s', binary_image, e)
+
+    if bundles:
+        try:
+            resolved_bundles = get_resolved_bundles(bundles)
+            run_per_image_concurrently(
+                lambda bundle: _prefetch_bundle(bundle, request_id, copy_files), resolved_bundles
+            )
+        except IIBError as e:
+            log.warning('Failed to prefetch the bundles of the request %d: %s', request_id, e)
+
+
+@app.task(ignore_result=True)
+@instrument_tracing(span_name="workers.tasks.handle_prefetch_request")
+def handle_prefetch_request(
+    request_id: int,
+    from_index: Optional[str] = None,
+    binary_image: Optional[str] = None,
+    bundles: Optional[List[str]] = None,
+) -> None:
+    """
+    Warm the caches of the worker with the images of a request before the request is processed.
+
+    The tags are resolved and the images are inspected, which fills the inspection cache shared by
+    the workers, see ``iib_dogpile_backend``. When ``iib_blob_cache_dir`` or
+    ``iib_artifact_cache_dir`` is set, the catalog of ``from_index`` and the manifests of the
+    bundles are also copied out of the images, so they are cached on the worker host. These caches
+    are local to the host, so this only helps if ``IIB_PREFETCH_QUEUE`` is consumed on the same
+    host as the queues of the requests. The files are only extracted from the layers of the images,
+    see ``iib_extract_files_from_layers``, and never copied with podman, so the images aren't pulled
+    into the container storage which nothing cleans up after this task.
+
+    This task never changes the state of the request and any failure is only logged, since the
+    request will do the same work again when it is processed.
+
+    :param int request_id: the ID of the IIB build request
+    :param str from_index: the pull specification of the index image of the request
+    :param str binary_image: the pull specification of the binary image of the request
+    :param list bundles: the pull specifications of the bundles of the request
+    """
+    log.info('Prefetching the images of the request %d', request_id)
+    copy_files = bool(
+        (get_blob_cache() or get_artifact_cache())
+        and get_worker_config().iib_extract_files_from_layers
+    )
+    token = podman_copy_fallback.set(False)
+    try:
+        _prefetch_images(request_id, from_index, binary_image, bundles, copy_files)
+    finally:
+        podman_copy_fallback.reset(token)
+    log.info('Prefetched the images of the request %d', request_id)
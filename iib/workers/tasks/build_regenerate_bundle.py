@@ -24,6 +24,7 @@ from iib.workers.tasks.build import (
 )
 from iib.workers.config import get_worker_config
 from iib.workers.tasks.celery import app
+from iib.workers.tasks.concurrency_utils import run_per_arch_concurrently
 from iib.workers.tasks.utils import (
     get_image_labels,
     get_resolved_image,
@@ -55,7 +56,7 @@ log = logging.getLogger(__name__)
 @request_logger
 @instrument_tracing(
     span_name="workers.tasks.build.handle_regenerate_bundle_request",
-    attributes=get_binary_versions(),
+    attributes=get_binary_versions,
 )
 def handle_regenerate_bundle_request(
     from_bundle_image: str,
@@ -135,10 +136,12 @@ def handle_regenerate_bundle_request(
                 for name, value in new_labels.items():
                     dockerfile.write(f'LABEL {name}={value}\n')
 
-            for arch in sorted(arches):
+            def _build_and_push(arch: str) -> None:
                 _build_image(temp_dir, 'Dockerfile', request_id, arch)
                 _push_image(request_id, arch)
 
+            run_per_arch_concurrently(_build_and_push, arches)
+
     set_request_state(request_id, 'in_progress', 'Creating the manifest list')
     output_pull_spec = _create_and_push_manifest_list(request_id, arches, [])
 
@@ -6,8 +6,10 @@ from celery.signals import celeryd_init
 from opentelemetry.instrumentation.celery import CeleryInstrumentor
 from opentelemetry.instrumentation.requests import RequestsInstrumentor
 from celery.signals import worker_process_init
+from billiard.process import current_process
 
 from iib.workers.config import configure_celery, validate_celery_config
+from iib.workers.slots import setup_worker_slot
 from iib.common.tracing import TracingWrapper
 
 tracerWrapper = TracingWrapper()
@@ -27,3 +29,20 @@ def init_celery_tracing(*args, **kwargs):
     """Initialize the tracing for celery."""
     if os.getenv('IIB_OTEL_TRACING', '').lower() == 'true':
         CeleryInstrumentor().instrument(trace_provider=tracerWrapper.provider)
+
+
+@worker_process_init.connect(weak=False)
+def init_worker_slot(*args, **kwargs):
+    """Set up the slot of the worker process when the worker runs several requests at once."""
+    setup_worker_slot(getattr(current_process(), 'index', 0) or 0)
+
+
+@celeryd_init.connect(weak=False)
+def probe_binary_versions(*args, **kwargs):
+    """Probe the versions of the binaries once, before the worker processes are forked."""
+    # Import this here to avoid a circular import
+    from iib.common.common_utils import get_binary_versions
+    from iib.workers.tasks.opm_operations import Opm
+
+    Opm.probe_opm_versions()
+    get_binary_versions()
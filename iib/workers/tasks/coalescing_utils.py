@@ -0,0 +1,327 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from contextlib import contextmanager
+import functools
+import inspect
+import logging
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+from celery import current_task
+import kombu
+
+from iib.exceptions import IIBError
+from iib.workers.api_utils import get_request, set_request_state, update_request
+from iib.workers.config import get_worker_config
+from iib.workers.tasks.celery import app
+from iib.workers.tasks.iib_static_types import UpdateRequestPayload
+
+log = logging.getLogger(__name__)
+
+# The parameters of a request which don't need to match for it to be coalesced with another one
+_IGNORED_PARAMS = ('request_id', 'traceparent')
+# The keys copied to the coalesced requests from the request they were coalesced into
+_RESULT_KEYS = (
+    'arches',
+    'binary_image',
+    'binary_image_resolved',
+    'bundle_mapping',
+    'distribution_scope',
+    'from_index_resolved',
+    'index_image',
+    'index_image_resolved',
+    'internal_index_image_copy',
+    'internal_index_image_copy_resolved',
+)
+
+
+def _get_call_arguments(func: Callable, args: Iterable[Any], kwargs: Dict[str, Any]) -> Dict:
+    """
+    Get the arguments of a call to the function by the name of their parameter.
+
+    :param function func: the function called
+    :param iterable args: the positional arguments of the call
+    :param dict kwargs: the keyword arguments of the call
+    :return: the arguments of the call, including the default ones
+    :rtype: dict
+    :raises TypeError: if the arguments don't match the parameters of the function
+    """
+    bound_arguments = inspect.signature(inspect.unwrap(func)).bind(*args, **kwargs)
+    bound_arguments.apply_defaults()
+    return dict(bound_arguments.arguments)
+
+
+def _merge_lists(first: Optional[List[Any]], second: Optional[List[Any]]) -> List[Any]:
+    """
+    Merge two lists, keeping the order of their items and dropping the duplicates.
+
+    :param list first: the first list
+    :param list second: the list appended to the first one
+    :return: the merged list
+    :rtype: list
+    """
+    return list(dict.fromkeys((first or []) + (second or [])))
+
+
+@contextmanager
+def _take_coalescable_requests(
+    func: Callable,
+    call_args: Dict[str, Any],
+    merge_params: Iterable[str],
+    max_requests: int,
+) -> Generator[List[Tuple[Dict[str, Any], kombu.Message]], None, None]:
+    """
+    Take the requests compatible with the current one from the head of its queue.
+
+    The messages are taken in order and only until the first message which can't be coalesced,
+    which is put back, so the requests are still processed in the order they were submitted.
+
+    The messages taken are left unacknowledged and the connection to the broker stays open until
+    the context exits, so the caller acknowledges them once the requests are processed. If the
+    worker is lost in the meantime, the broker delivers them again. The messages which are not
+    acknowledged when the context exits are put back in the queue.
+
+    :param function func: the task function of the current request
+    :param dict call_args: the arguments of the current request
+    :param iterable merge_params: the parameters whose values are merged across the requests
+    :param int max_requests: the maximum number of requests to take
+    :return: the arguments of the requests taken from the queue and their messages
+    :rtype: list
+    """
+    queue_name = current_task.request.delivery_info.get('routing_key')
+    if not queue_name:
+        yield []
+        return
+
+    ignored_params = set(_IGNORED_PARAMS).union(merge_params)
+    expected_args = {k: v for k, v in call_args.items() if k not in ignored_params}
+    coalescable_requests: List[Tuple[Dict[str, Any], kombu.Message]] = []
+    # The heartbeats are disabled since nothing sends them while the request is processed, which
+    # would make the broker close the connection and deliver the messages again
+    with app.connection_for_read(heartbeat=0) as connection:
+        queue = kombu.Queue(queue_name, channel=connection.default_channel)
+        while len(coalescable_requests) < max_requests:
+            message = queue.get(no_ack=False, accept=app.conf.accept_content)
+            if message is None:
+                break
+
+            pending_args = None
+            if message.headers.get('task') == current_task.name:
+                args, kwargs, _ = message.decode()
+                try:
+                    pending_args = _get_call_arguments(func, args, kwargs)
+                except TypeError:
+                    log.warning('Failed to get the arguments of the task %s', message.headers)
+
+            if pending_args is None or expected_args != {
+                k: v for k, v in pending_args.items() if k not in ignored_params
+            }:
+                message.requeue()
+                break
+
+            coalescable_requests.append((pending_args, message))
+
+        try:
+            yield coalescable_requests
+        finally:
+            for _, message in coalescable_requests:
+                if not message.acknowledged:
+                    message.requeue()
+
+
+def _ack_messages(messages: List[kombu.Message]) -> None:
+    """
+    Acknowledge the messages of the coalesced requests once they are processed.
+
+    :param list messages: the messages to acknowledge
+    """
+    for message in messages:
+        try:
+            message.ack()
+        except Exception:
+            # The broker delivers the message again, the request is then processed on its own
+            log.exception('Failed to acknowledge the message %s', message.delivery_tag)
+
+
+def _requeue_messages(messages: List[kombu.Message]) -> None:
+    """
+    Put the messages of the coalesced requests back in the queue to be processed on their own.
+
+    :param list messages: the messages to put back in the queue
+    """
+    for message in messages:
+        try:
+            message.requeue()
+        except Exception:
+            # The broker delivers the message again once the connection is closed
+            log.exception('Failed to requeue the message %s', message.delivery_tag)
+
+
+def _get_own_bundle_mapping(
+    bundle_mapping: Dict[str, List[str]], bundles: Optional[List[str]]
+) -> Dict[str, List[str]]:
+    """
+    Get the part of the bundle mapping of the merged request with the bundles of a request.
+
+    :param dict bundle_mapping: the bundles of the merged request by their operator package
+    :param list bundles: the bundles of the request
+    :return: the bundles of the request by their operator package
+    :rtype: dict
+    """
+    own_bundle_mapping = {}
+    for operator, operator_bundles in bundle_mapping.items():
+        own_bundles = [bundle for bundle in operator_bundles if bundle in (bundles or [])]
+        if own_bundles:
+            own_bundle_mapping[operator] = own_bundles
+    return own_bundle_mapping
+
+
+def _complete_coalesced_requests(request_id: int, coalesced_args: List[Dict[str, Any]]) -> None:
+    """
+    Set the results of the request on the requests which were coalesced into it.
+
+    The ``bundle_mapping`` of every coalesced request only has the bundles it added.
+
+    :param int request_id: the ID of the request the other requests were coalesced into
+    :param list coalesced_args: the arguments of the coalesced requests
+    """
+    request = get_request(request_id)
+    result: UpdateRequestPayload = {  # type: ignore
+        key: request[key] for key in _RESULT_KEYS if request.get(key)
+    }
+    result['state'] = 'complete'
+    result['state_reason'] = f'{request["state_reason"]} in the request {request_id}'
+    for args in coalesced_args:
+        payload = dict(result)
+        if 'bundle_mapping' in result:
+            payload['bundle_mapping'] = _get_own_bundle_mapping(
+                result['bundle_mapping'], args.get('bundles')
+            )
+        update_request(
+            args['request_id'],
+            payload,  # type: ignore
+            exc_msg='Failed setting the results of the coalesced request',
+        )
+
+
+def _fail_coalesced_requests(
+    request_id: int, coalesced_request_ids: List[int], exc: Exception
+) -> None:
+    """
+    Fail the coalesced requests when the error can't be caused by merging them.
+
+    :param int request_id: the ID of the request the other requests were coalesced into
+    :param list coalesced_request_ids: the IDs of the coalesced requests
+    :param Exception exc: the exception the request failed with
+    """
+    if isinstance(exc, IIBError):
+        msg = str(exc)
+    else:
+        msg = 'An unknown error occurred. See logs for details'
+    for coalesced_request_id in coalesced_request_ids:
+        try:
+            set_request_state(
+                coalesced_request_id, 'failed', f'{msg} (in the request {request_id})'
+            )
+        except Exception:
+            log.exception(
+                'Failed to set the state of the coalesced request %d', coalesced_request_id
+            )
+
+
+def _process_coalesced_requests(
+    func: Callable,
+    call_args: Dict[str, Any],
+    merge_params: Iterable[str],
+    coalesced: List[Tuple[Dict[str, Any], kombu.Message]],
+) -> Any:
+    """
+    Process the current request together with the requests coalesced into it.
+
+    The messages of the coalesced requests are only acknowledged once their state is final. If
+    their results can't be set, they are put back in the queue to be processed on their own.
+
+    A failure of the merged requests may be caused by the arguments of any of them, so the
+    coalesced requests are put back in the queue and the current request is processed again on
+    its own. A request is then only failed by its own failure.
+
+    :param function func: the task function of the current request
+    :param dict call_args: the arguments of the current request
+    :param iterable merge_params: the parameters whose values are merged across the requests
+    :param list coalesced: the arguments of the coalesced requests and their messages
+    :return: the return value of the task function
+    """
+    request_id = call_args['request_id']
+    coalesced_request_ids = [coalesced_args['request_id'] for coalesced_args, _ in coalesced]
+    messages = [message for _, message in coalesced]
+    log.info(
+        'Coalescing the requests %s into the request %d',
+        ', '.join(str(r) for r in coalesced_request_ids),
+        request_id,
+    )
+    merged_args = dict(call_args)
+    for coalesced_args, _ in coalesced:
+        for param in merge_params:
+            merged_args[param] = _merge_lists(merged_args[param], coalesced_args[param])
+    try:
+        for coalesced_request_id in coalesced_request_ids:
+            set_request_state(
+                coalesced_request_id,
+                'in_progress',
+                f'The request is processed as part of the request {request_id}',
+            )
+    except Exception as e:
+        # Nothing was processed yet, so the error isn't caused by merging the requests
+        _fail_coalesced_requests(request_id, coalesced_request_ids, e)
+        _ack_messages(messages)
+        raise
+
+    try:
+        rv = func(**merged_args)
+    except Exception:
+        log.exception(
+            'Failed to process the requests coalesced into the request %d, processing them on '
+            'their own',
+            request_id,
+        )
+        _requeue_messages(messages)
+        return func(**call_args)
+
+    _complete_coalesced_requests(request_id, [coalesced_args for coalesced_args, _ in coalesced])
+    _ack_messages(messages)
+    return rv
+
+
+def coalesce_requests(merge_params: Iterable[str]) -> Callable:
+    """
+    Process the compatible requests waiting in the queue together with the current request.
+
+    If ``iib_max_coalesced_requests`` is set, the requests at the head of the queue of the current
+    request which run the same task with the same arguments, except for the ``merge_params``, are
+    taken from the queue. The values of their ``merge_params`` are appended to the ones of the
+    current request, so the index image is built once for all of them. The coalesced requests then
+    get the results of the current request. Their messages are acknowledged afterwards, so they
+    are delivered again if the worker is lost while building the index image. If the merged
+    requests fail, every request is processed again on its own.
+
+    :param iterable merge_params: the names of the list parameters merged across the requests
+    :return: the decorator
+    :rtype: function
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            max_requests = get_worker_config().iib_max_coalesced_requests
+            if not max_requests or not current_task or not current_task.request.delivery_info:
+                return func(*args, **kwargs)
+
+            call_args = _get_call_arguments(func, args, kwargs)
+            with _take_coalescable_requests(
+                func, call_args, merge_params, max_requests
+            ) as coalesced:
+                if coalesced:
+                    return _process_coalesced_requests(func, call_args, merge_params, coalesced)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,163 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# This file contains helpers to run container registry operations concurrently
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from operator_manifest.operator import ImageName
+
+from iib.exceptions import IIBError
+from iib.workers.config import get_worker_config
+from iib.workers.slots import get_arch_container_storage, use_container_storage
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def _get_registry(pull_spec: str) -> str:
+    """
+    Get the registry of the pull specification.
+
+    :param str pull_spec: the pull specification, optionally prefixed with ``docker://``
+    :return: the registry hostname or an empty string if the pull specification has no registry
+    :rtype: str
+    """
+    return ImageName.parse(pull_spec.removeprefix('docker://')).registry or ''
+
+
+class RegistryThrottle:
+    """
+    Limit the number of concurrent operations against each container registry.
+
+    :param int limit: the maximum number of concurrent operations against a single registry
+    """
+
+    def __init__(self, limit: int):
+        """Initialize the RegistryThrottle object."""
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _get_semaphore(self, registry: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if registry not in self._semaphores:
+                self._semaphores[registry] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[registry]
+
+    def run(self, pull_spec: str, func: Callable[[str], T]) -> T:
+        """
+        Run ``func`` for ``pull_spec`` once a slot for its registry is available.
+
+        :param str pull_spec: the pull specification passed to ``func``
+        :param callable func: the function to run
+        :return: the return value of ``func``
+        """
+        with self._get_semaphore(_get_registry(pull_spec)):
+            return func(pull_spec)
+
+
+def run_per_image_concurrently(
+    func: Callable[[str], T],
+    pull_specs: List[str],
+    max_workers: Optional[int] = None,
+) -> List[T]:
+    """
+    Run ``func`` for every pull specification using a bounded thread pool.
+
+    The total number of threads is limited by ``iib_image_inspection_max_workers`` and the number
+    of concurrent calls against the same registry by ``iib_registry_concurrency_limit``.
+
+    The results are returned in the same order as ``pull_specs``. If any call fails, the exception
+    of the first failing pull specification (in the order of ``pull_specs``) is raised, the same as
+    if ``func`` was called in a serial loop. Calls which were not started yet are cancelled.
+
+    :param callable func: the function to call with each pull specification
+    :param list pull_specs: the pull specifications to process
+    :param int max_workers: overrides ``iib_image_inspection_max_workers`` when set
+    :return: the list of return values of ``func``
+    :rtype: list
+    """
+    conf = get_worker_config()
+    max_workers = max_workers or conf.iib_image_inspection_max_workers
+    if len(pull_specs) <= 1 or max_workers <= 1:
+        return [func(pull_spec) for pull_spec in pull_specs]
+
+    throttle = RegistryThrottle(conf.iib_registry_concurrency_limit)
+    max_workers = min(max_workers, len(pull_specs))
+    log.debug('Processing %d images with %d threads', len(pull_specs), max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='iib-image') as executor:
+        # Every call gets a copy of the context, e.g. for the registry auth file of the request
+        futures: List[Future] = [
+            executor.submit(contextvars.copy_context().run, throttle.run, pull_spec, func)
+            for pull_spec in pull_specs
+        ]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def _run_in_arch_container_storage(func: Callable[[str], None], arch: str) -> None:
+    """
+    Run ``func`` for the architecture using the container storage of the architecture.
+
+    :param callable func: the function to call with the architecture
+    :param str arch: the architecture
+    """
+    with use_container_storage(get_arch_container_storage(arch)):
+        func(arch)
+
+
+def run_per_arch_concurrently(func: Callable[[str], None], arches: Iterable[str]) -> None:
+    """
+    Run ``func`` for every architecture, such as building and pushing the image for it.
+
+    The architectures are processed in sorted order using up to ``iib_max_concurrent_builds``
+    threads. Every architecture is processed even if another one fails. If a single one fails, its
+    exception is raised, otherwise an exception listing all the failures is raised. When
+    ``iib_max_concurrent_builds`` is ``1``, the architectures are processed serially and the first
+    failure is raised immediately.
+
+    When processed concurrently, every architecture uses its own container storage, see
+    ``get_arch_container_storage``. This way, the builds never share the local images, such as the
+    base image which has the same tag for all the architectures, and every image built is pushed
+    from the storage it was built in.
+
+    :param callable func: the function to call with each architecture
+    :param iterable arches: the architectures to process
+    :raises IIBError: if ``func`` fails for any of the architectures
+    """
+    sorted_arches = sorted(arches)
+    max_workers = min(get_worker_config().iib_max_concurrent_builds, len(sorted_arches))
+    if max_workers <= 1:
+        for arch in sorted_arches:
+            func(arch)
+        return
+
+    log.debug('Processing the arches %s with %d threads', ', '.join(sorted_arches), max_workers)
+    errors: List[Tuple[str, Exception]] = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='iib-arch') as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, _run_in_arch_container_storage, func, arch
+            )
+            for arch in sorted_arches
+        ]
+        for arch, future in zip(sorted_arches, futures):
+            try:
+                future.result()
+            except Exception as e:
+                log.error('Failed to process the arch %s: %s', arch, e)
+                errors.append((arch, e))
+
+    if len(errors) == 1:
+        raise errors[0][1]
+    if errors:
+        exc_types = {type(error) for _, error in errors}
+        exc_type = exc_types.pop() if len(exc_types) == 1 else IIBError
+        raise exc_type('; '.join(f'{arch}: {error}' for arch, error in errors))
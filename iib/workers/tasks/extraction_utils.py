@@ -0,0 +1,354 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# This file contains functions to extract files from container images without pulling them
+from contextlib import closing, contextmanager
+import functools
+import logging
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+from typing import Any, BinaryIO, Dict, Generator, List, Set
+
+import requests
+import urllib3
+
+from iib.exceptions import IIBError
+from iib.workers.blob_cache import get_blob_cache
+from iib.workers.registry_client import get_registry_client, ImageReference, RegistryClient
+
+log = logging.getLogger(__name__)
+
+WHITEOUT_PREFIX = '.wh.'
+OPAQUE_WHITEOUT = '.wh..wh..opq'
+
+
+def _normalize_path(path: str) -> str:
+    """
+    Normalize a path within the container image.
+
+    :param str path: the path, absolute or relative to the root of the image
+    :return: the path relative to the root of the image, or an empty string for the root
+    :rtype: str
+    """
+    return posixpath.normpath(f'/{path}').lstrip('/')
+
+
+def _is_under(path: str, parent: str) -> bool:
+    """
+    Check if the path is the same as or located under the parent path.
+
+    :param str path: the normalized path to check
+    :param str parent: the normalized parent path
+    :return: ``True`` if ``path`` is ``parent`` or one of its descendants
+    :rtype: bool
+    """
+    return parent == '' or path == parent or path.startswith(f'{parent}/')
+
+
+def _get_ancestors(path: str) -> List[str]:
+    """
+    Get the ancestors of the normalized path, from the closest one up to the root.
+
+    :param str path: the normalized path
+    :return: the list of the ancestor paths, the root being an empty string
+    :rtype: list
+    """
+    ancestors = []
+    while path:
+        path = posixpath.dirname(path)
+        ancestors.append(path)
+    return ancestors
+
+
+class LayeredFilesystem:
+    """
+    The state of walking the layers of a container image from the top layer down.
+
+    An entry in a lower layer is only visible if no upper layer has an entry at the same path or a
+    non-directory entry at one of its ancestors, removed it with a whiteout or hid the contents of
+    one of its ancestors with an opaque whiteout. The changes of a layer only affect the layers
+    below it, so they are applied with ``commit_layer`` once the whole layer is processed.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the LayeredFilesystem object."""
+        self.seen: Set[str] = set()
+        self.non_dirs: Set[str] = set()
+        self.removed: Set[str] = set()
+        self.opaque: Set[str] = set()
+        self._layer_seen: Set[str] = set()
+        self._layer_non_dirs: Set[str] = set()
+        self._layer_removed: Set[str] = set()
+        self._layer_opaque: Set[str] = set()
+
+    def is_visible(self, path: str) -> bool:
+        """
+        Check if an entry of the current layer at the path is visible in the final filesystem.
+
+        :param str path: the normalized path of the entry
+        :return: ``True`` if the entry is not hidden by the upper layers
+        :rtype: bool
+        """
+        if path in self.seen or path in self.removed:
+            return False
+        return not any(
+            ancestor in self.removed or ancestor in self.non_dirs or ancestor in self.opaque
+            for ancestor in _get_ancestors(path)
+        )
+
+    def add_entry(self, path: str, is_dir: bool) -> None:
+        """
+        Record a visible entry of the current layer.
+
+        :param str path: the normalized path of the entry
+        :param bool is_dir: ``True`` if the entry is a directory
+        """
+        self._layer_seen.add(path)
+        if not is_dir:
+            self._layer_non_dirs.add(path)
+
+    def add_whiteout(self, path: str) -> None:
+        """
+        Record a whiteout of the current layer.
+
+        :param str path: the normalized path of the whiteout file
+        """
+        directory, name = posixpath.split(path)
+        if name == OPAQUE_WHITEOUT:
+            self._layer_opaque.add(directory)
+        else:
+            self._layer_removed.add(posixpath.join(directory, name.removeprefix(WHITEOUT_PREFIX)))
+
+    def commit_layer(self) -> None:
+        """Apply the changes of the current layer to the layers below it."""
+        self.seen |= self._layer_seen
+        self.non_dirs |= self._layer_non_dirs
+        self.removed |= self._layer_removed
+        self.opaque |= self._layer_opaque
+        self._layer_seen = set()
+        self._layer_non_dirs = set()
+        self._layer_removed = set()
+        self._layer_opaque = set()
+
+    def is_final(self, path: str) -> bool:
+        """
+        Check if the lower layers can no longer change the contents at the path.
+
+        :param str path: the normalized path
+        :return: ``True`` if the walk through the layers can stop
+        :rtype: bool
+        """
+        if path in self.non_dirs or path in self.removed or path in self.opaque:
+            return True
+        return any(
+            ancestor in self.removed or ancestor in self.non_dirs or ancestor in self.opaque
+            for ancestor in _get_ancestors(path)
+        )
+
+
+def _extract_member(
+    tar: tarfile.TarFile,
+    member: tarfile.TarInfo,
+    target: str,
+    src: str,
+    root: str,
+) -> None:
+    """
+    Write the tar member to the target path.
+
+    :param tarfile.TarFile tar: the tar archive of the layer being streamed
+    :param tarfile.TarInfo member: the member to extract
+    :param str target: the local path to write the member to
+    :param str src: the normalized path within the image which is extracted
+    :param str root: the local path the ``src`` path is extracted to
+    :raises IIBError: if the member can't be extracted safely
+    """
+    boundary = os.path.realpath(os.path.dirname(root))
+    if os.path.commonpath([os.path.realpath(os.path.dirname(target)), boundary]) != boundary:
+        raise IIBError(f'The layer entry {member.name} points outside of the extracted directory')
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if member.isdir():
+        os.makedirs(target, exist_ok=True)
+        return
+
+    if os.path.lexists(target):
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        else:
+            os.remove(target)
+
+    if member.isfile():
+        file_obj = tar.extractfile(member)
+        with closing(file_obj), open(target, 'wb') as f:  # type: ignore
+            shutil.copyfileobj(file_obj, f)  # type: ignore
+        os.chmod(target, member.mode & 0o777)
+    elif member.issym():
+        os.symlink(member.linkname, target)
+    elif member.islnk():
+        link_path = _normalize_path(member.linkname)
+        link_target = os.path.join(root, posixpath.relpath(link_path, src))
+        if not _is_under(link_path, src) or not os.path.isfile(link_target):
+            raise IIBError(f'The hard link {member.name} points outside of the extracted directory')
+        os.link(link_target, target)
+    else:
+        log.debug('Skipping the special file %s', member.name)
+
+
+def _extract_layer(tar: tarfile.TarFile, src: str, root: str, fs: LayeredFilesystem) -> None:
+    """
+    Extract the visible entries under the ``src`` path from the layer.
+
+    :param tarfile.TarFile tar: the tar archive of the layer being streamed
+    :param str src: the normalized path within the image to extract
+    :param str root: the local path to extract the ``src`` path to
+    :param LayeredFilesystem fs: the state of the walk through the layers
+    """
+    for member in tar:
+        path = _normalize_path(member.name)
+        if posixpath.basename(path).startswith(WHITEOUT_PREFIX):
+            fs.add_whiteout(path)
+            continue
+
+        if _is_under(path, src):
+            if not fs.is_visible(path):
+                continue
+            fs.add_entry(path, member.isdir())
+            target = root if path == src else os.path.join(root, posixpath.relpath(path, src))
+            _extract_member(tar, member, target, src, root)
+        elif _is_under(src, path) and fs.is_visible(path):
+            # Track the ancestors of src, since a file or symlink replacing one of them
+            # hides everything under it in the lower layers
+            fs.add_entry(path, member.isdir())
+
+
+def _stream_blob(client: RegistryClient, image: ImageReference, digest: str) -> BinaryIO:
+    """
+    Stream the compressed blob from the registry.
+
+    :param RegistryClient client: the registry client to stream the blob with
+    :param ImageReference image: the image the blob belongs to
+    :param str digest: the digest of the blob
+    :return: the raw stream of the response, which closes the connection when closed
+    :rtype: file
+    """
+    rv = client.get_blob(image, digest)
+    # Let tarfile decompress the stream instead of urllib3
+    rv.raw.decode_content = False
+    return rv.raw  # type: ignore
+
+
+@contextmanager
+def open_blob(
+    client: RegistryClient, image: ImageReference, digest: str
+) -> Generator[BinaryIO, None, None]:
+    """
+    Open the blob from the blob cache, or stream it from the registry if the cache is disabled.
+
+    :param RegistryClient client: the registry client to stream the blob with
+    :param ImageReference image: the image the blob belongs to
+    :param str digest: the digest of the blob
+    :return: the blob, e.g. a compressed layer
+    :rtype: file
+    """
+    fetch = functools.partial(_stream_blob, client, image, digest)
+    blob_cache = get_blob_cache()
+    if blob_cache:
+        with blob_cache.open(digest, fetch) as blob:
+            yield blob
+    else:
+        with closing(fetch()) as blob:
+            yield blob
+
+
+def _extract_layers(
+    client: RegistryClient,
+    image: ImageReference,
+    layers: List[Dict[str, Any]],
+    src: str,
+    root: str,
+) -> bool:
+    """
+    Walk the layers from the top layer down and extract the ``src`` path.
+
+    :param RegistryClient client: the registry client to stream the layers with
+    :param ImageReference image: the image the layers belong to
+    :param list layers: the layer descriptors from the image manifest
+    :param str src: the normalized path within the image to extract
+    :param str root: the local path to extract the ``src`` path to
+    :return: ``True`` if the ``src`` path was found
+    :rtype: bool
+    :raises IIBError: if a layer can't be streamed or extracted
+    """
+    fs = LayeredFilesystem()
+    for layer in reversed(layers):
+        media_type = layer.get('mediaType', '')
+        if 'zstd' in media_type:
+            raise IIBError(f'The layer media type {media_type} is not supported')
+
+        with open_blob(client, image, layer['digest']) as blob:
+            with tarfile.open(fileobj=blob, mode='r|*') as tar:
+                _extract_layer(tar, src, root, fs)
+        fs.commit_layer()
+
+        if fs.is_final(src):
+            break
+
+    return src in fs.seen
+
+
+def extract_files_from_image(image: str, src_path: str, dest_path: str) -> None:
+    """
+    Copy a file or directory from the container image through the registry API.
+
+    Only the layers are streamed, nothing is stored in the container storage. When
+    ``iib_blob_cache_dir`` is set, the layers are read through the blob cache. The destination
+    follows the ``podman cp`` semantics: if ``dest_path`` is an existing directory, the file is
+    copied into it, otherwise it's copied to ``dest_path``.
+
+    :param str image: the pull specification of the container image
+    :param str src_path: the full path within the container image to copy from
+    :param str dest_path: the full path on the local host to copy into
+    :raises IIBError: if the file can't be extracted
+    """
+    client = get_registry_client()
+    image_ref, manifest = client.get_image_manifest(image)
+    if 'layers' not in manifest:
+        raise IIBError(f'The manifest of {image} is not a v2 or OCI image manifest')
+
+    src = _normalize_path(src_path)
+    if os.path.isdir(dest_path):
+        dest_root = os.path.join(dest_path, posixpath.basename(src))
+    else:
+        dest_root = dest_path
+
+    log.info('Extracting %s from the layers of %s', src_path, image)
+    staging_dir = tempfile.mkdtemp(
+        prefix='iib-extract-', dir=os.path.dirname(os.path.abspath(dest_root))
+    )
+    staging_root = os.path.join(staging_dir, 'root')
+    try:
+        try:
+            found = _extract_layers(client, image_ref, manifest['layers'], src, staging_root)
+        except (
+            tarfile.TarError,
+            OSError,
+            requests.RequestException,
+            urllib3.exceptions.HTTPError,
+        ) as e:
+            raise IIBError(f'Failed to extract {src_path} from {image}: {e}')
+        if not found:
+            raise IIBError(f'{src_path} does not exist in {image}')
+        if os.path.islink(staging_root):
+            raise IIBError(f'{src_path} is a symbolic link in {image}')
+
+        try:
+            if os.path.isdir(dest_root) and os.path.isdir(staging_root):
+                shutil.copytree(staging_root, dest_root, symlinks=True, dirs_exist_ok=True)
+            else:
+                os.replace(staging_root, dest_root)
+        except OSError as e:
+            raise IIBError(f'Failed to extract {src_path} from {image}: {e}')
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
@@ -1,13 +1,15 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # This file contains functions that are common for File-Based Catalog image type
 import contextlib
+import hashlib
 import os
 import logging
+import re
 import shutil
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Tuple, List
+from typing import List, Set, Tuple
 
 import ruamel.yaml
 
@@ -16,6 +18,10 @@ from iib.workers.config import get_worker_config
 from iib.common.tracing import instrument_tracing
 
 log = logging.getLogger(__name__)
+
+# The line of the Dockerfile written by create_dockerfile which adds the catalog to the image
+_CATALOG_ADD_RE = re.compile(r'^ADD (\S+) /configs$', re.MULTILINE)
+CATALOG_LAYERS_COMMENT = '# The catalog is split into layers by package'
 yaml = ruamel.yaml.YAML()
 
 
@@ -102,6 +108,65 @@ def merge_catalogs_dirs(src_config: str, dest_config: str):
     opm_validate(conf_dir)
 
 
+def get_catalog_digest(catalog_dir: str) -> str:
+    """
+    Get the digest of the contents of the catalog directory tree.
+
+    The digest only depends on the relative paths, the contents of the files and the targets of
+    the symbolic links, so identical catalogs have the same digest wherever they are stored.
+
+    :param str catalog_dir: the path to the catalog directory
+    :return: the digest of the catalog
+    :rtype: str
+    """
+    hasher = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(catalog_dir):
+        dirnames.sort()
+        for name in sorted(
+            filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+        ):
+            path = os.path.join(dirpath, name)
+            hasher.update(os.path.relpath(path, catalog_dir).encode('utf-8') + b'\0')
+            if os.path.islink(path):
+                hasher.update(b'link:' + os.readlink(path).encode('utf-8') + b'\0')
+                continue
+            file_hasher = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_hasher.update(chunk)
+            hasher.update(file_hasher.hexdigest().encode('utf-8') + b'\0')
+    return f'sha256:{hasher.hexdigest()}'
+
+
+def merge_catalog_packages(src_config: str, dest_config: str, packages: Set[str]) -> None:
+    """
+    Replace the packages in dest_config by the ones from src_config.
+
+    The packages missing in src_config are removed from dest_config. The merged catalog is
+    validated like in ``merge_catalogs_dirs``, since a package directory of dest_config could
+    declare a package with another name, which would then be in the catalog twice.
+
+    :param str src_config: source config directory
+    :param str dest_config: destination config directory
+    :param set packages: the names of the packages to replace
+    :raises IIBError: if the merged catalog is invalid
+    """
+    from iib.workers.tasks.opm_operations import opm_validate
+
+    log.info("Merging the packages %s from %s to %s", sorted(packages), src_config, dest_config)
+    for package in sorted(packages):
+        src_package = os.path.join(src_config, package)
+        dest_package = os.path.join(dest_config, package)
+        if os.path.isdir(dest_package):
+            shutil.rmtree(dest_package)
+        elif os.path.lexists(dest_package):
+            os.remove(dest_package)
+        if os.path.isdir(src_package):
+            shutil.copytree(src_package, dest_package)
+    enforce_json_config_dir(dest_config)
+    opm_validate(dest_config)
+
+
 def extract_fbc_fragment(temp_dir: str, fbc_fragment: str) -> Tuple[str, List[str]]:
     """
     Extract operator packages from the fbc_fragment image.
@@ -166,3 +231,101 @@ def enforce_json_config_dir(config_dir: str) -> None:
                     for chunk in data:
                         json.dump(chunk, json_out, default=_serialize_datetime)
                 os.remove(in_file)
+
+
+def _reset_mtimes(path: str) -> None:
+    """
+    Reset the modification times of the directory tree, so it's archived the same on every build.
+
+    :param str path: the path of the directory tree
+    """
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        for name in filenames + dirnames:
+            os.utime(os.path.join(dirpath, name), (0, 0), follow_symlinks=False)
+    os.utime(path, (0, 0))
+
+
+def _get_package_bucket(package: str, buckets: int) -> str:
+    """
+    Get the bucket of the package, which only depends on its name.
+
+    :param str package: the name of the package
+    :param int buckets: the number of buckets
+    :return: the name of the bucket
+    :rtype: str
+    """
+    bucket = int(hashlib.sha256(package.encode('utf-8')).hexdigest(), 16) % buckets
+    return f'{bucket:03d}'
+
+
+def split_catalog_into_layers(dockerfile_dir: str, dockerfile_name: str) -> None:
+    """
+    Replace the instruction adding the whole catalog to the index image with one per package.
+
+    This is only done when ``iib_catalog_layers`` is set. With ``package``, every package of the
+    catalog is added in its own layer. With ``bucket``, or when a catalog has more packages than
+    ``iib_catalog_layer_buckets``, the packages are distributed to ``iib_catalog_layer_buckets``
+    layers by the hash of their name. The modification times of the catalog are reset, so the
+    layers of the unchanged packages are identical across builds and aren't uploaded or pulled
+    again. This must be called right before the image is built, since the catalog is final then.
+
+    :param str dockerfile_dir: the path to the directory containing the Dockerfile and the catalog
+    :param str dockerfile_name: the name of the Dockerfile in the ``dockerfile_dir``
+    """
+    conf = get_worker_config()
+    mode = conf.iib_catalog_layers
+    if not mode:
+        return
+
+    dockerfile_path = os.path.join(dockerfile_dir, dockerfile_name)
+    with open(dockerfile_path) as f:
+        dockerfile = f.read()
+    match = _CATALOG_ADD_RE.search(dockerfile)
+    if CATALOG_LAYERS_COMMENT in dockerfile or not match:
+        log.debug('The catalog in %s is not added as a single layer', dockerfile_path)
+        return
+
+    catalog = match.group(1).rstrip('/')
+    catalog_dir = os.path.join(dockerfile_dir, catalog)
+    packages = sorted(os.listdir(catalog_dir)) if os.path.isdir(catalog_dir) else []
+    if not packages:
+        return
+
+    buckets = conf.iib_catalog_layer_buckets
+    if mode == 'package' and len(packages) > buckets:
+        log.info(
+            'The catalog has %d packages, distributing them to %d layers', len(packages), buckets
+        )
+        mode = 'bucket'
+
+    _reset_mtimes(catalog_dir)
+    if mode == 'package':
+        sources = [(f'{catalog}/{package}', f'/configs/{package}') for package in packages]
+    else:
+        layers_dir = f'{catalog_dir}-layers'
+        if os.path.exists(layers_dir):
+            shutil.rmtree(layers_dir)
+        for package in packages:
+            bucket_dir = os.path.join(layers_dir, _get_package_bucket(package, buckets))
+            os.makedirs(bucket_dir, exist_ok=True)
+            src = os.path.join(catalog_dir, package)
+            # Hard links avoid copying the catalog, the files aren't modified anymore
+            if os.path.isdir(src) and not os.path.islink(src):
+                shutil.copytree(
+                    src, os.path.join(bucket_dir, package), symlinks=True, copy_function=os.link
+                )
+            else:
+                os.link(src, os.path.join(bucket_dir, package), follow_symlinks=False)
+        _reset_mtimes(layers_dir)
+        sources = [
+            (f'{catalog}-layers/{bucket}', '/configs') for bucket in sorted(os.listdir(layers_dir))
+        ]
+
+    log.info('Adding the catalog %s in %d layers', catalog_dir, len(sources))
+    instructions = '\n'.join(f'ADD {src} {dest}' for src, dest in sources)
+    dockerfile = (
+        f'{dockerfile[:match.start()]}{CATALOG_LAYERS_COMMENT}\n{instructions}'
+        f'{dockerfile[match.end():]}'
+    )
+    with open(dockerfile_path, 'w') as f:
+        f.write(dockerfile)
@@ -80,6 +80,7 @@ class UpdateRequestPayload(TypedDict, total=False):
     fbc_fragments_resolved: NotRequired[List[str]]
     index_image: NotRequired[str]
     index_image_resolved: NotRequired[str]
+    input_digest: NotRequired[str]
     internal_index_image_copy: NotRequired[str]
     internal_index_image_copy_resolved: NotRequired[str]
     omps_operator_version: NotRequired[str]
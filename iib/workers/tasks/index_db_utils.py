@@ -0,0 +1,216 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+# This file contains functions to read the SQLite index database without running opm
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+import urllib.parse
+
+from iib.workers.tasks.iib_static_types import BundleImage
+
+log = logging.getLogger(__name__)
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+# The bundles opm renders from the database are the ones in a channel of an existing package
+_BUNDLES_QUERY = '''
+SELECT DISTINCT operatorbundle.name, operatorbundle.bundlepath, operatorbundle.version, package.name
+FROM channel_entry
+INNER JOIN operatorbundle ON operatorbundle.name = channel_entry.operatorbundle_name
+INNER JOIN package ON package.name = channel_entry.package_name
+ORDER BY package.name, operatorbundle.name
+'''
+_PACKAGE_PROPERTIES_QUERY = '''
+SELECT operatorbundle_name, value FROM properties WHERE type = 'olm.package'
+'''
+
+
+def is_index_db(path: str) -> bool:
+    """
+    Check if the path is a SQLite database file.
+
+    :param str path: the path to check
+    :return: ``True`` if the path is a SQLite database file
+    :rtype: bool
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def _connect_read_only(db_path: str) -> sqlite3.Connection:
+    """
+    Open the database in the read-only mode.
+
+    :param str db_path: the path to the database file
+    :return: the connection to the database
+    :rtype: sqlite3.Connection
+    """
+    uri = f'file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro'
+    return sqlite3.connect(uri, uri=True)
+
+
+def iter_index_db_bundles(db_path: str) -> Iterator[BundleImage]:
+    """
+    Read the bundles from the index database, the same as ``opm render`` would list them.
+
+    The version of a bundle is taken from its ``olm.package`` property, the same as it's taken
+    from the output of ``opm render``, and from the ``operatorbundle`` table if it has none.
+
+    :param str db_path: the path to the index database
+    :return: an iterator of the bundles in the index database
+    :rtype: Iterator[BundleImage]
+    :raises sqlite3.Error: if the database can't be read
+    """
+    con = _connect_read_only(db_path)
+    try:
+        versions: Dict[str, str] = {}
+        for bundle_name, value in con.execute(_PACKAGE_PROPERTIES_QUERY):
+            if bundle_name in versions:
+                continue
+            try:
+                versions[bundle_name] = json.loads(value)['version']
+            except (ValueError, KeyError, TypeError):
+                log.debug('Ignoring the invalid olm.package property of %s', bundle_name)
+
+        for bundle_name, bundle_path, version, package_name in con.execute(_BUNDLES_QUERY):
+            yield BundleImage(
+                bundlePath=bundle_path or '',
+                csvName=bundle_name,
+                packageName=package_name,
+                version=versions.get(bundle_name, version or ''),
+            )
+    finally:
+        con.close()
+
+
+def _get_table_columns(con: sqlite3.Connection) -> Dict[str, List[str]]:
+    """
+    Get the columns of every table in the database.
+
+    :param sqlite3.Connection con: the connection to the database
+    :return: a dictionary mapping the table names to their column names
+    :rtype: dict
+    """
+    tables = [
+        row[0]
+        for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+    ]
+    return {
+        table: [row[1] for row in con.execute(f'PRAGMA table_info("{table}")')] for table in tables
+    }
+
+
+def get_index_db_package_digests(db_path: str) -> Dict[str, str]:
+    """
+    Get a digest of the rows of every package in the index database.
+
+    The rows of a package are the ones referencing it by its name, one of its bundles or one of
+    its channel entries. Comparing the digests before and after ``opm`` modifies the database
+    tells which packages it changed.
+
+    :param str db_path: the path to the index database
+    :return: a dictionary mapping the package names to the digests of their rows
+    :rtype: dict
+    :raises sqlite3.Error: if the database can't be read
+    """
+    con = _connect_read_only(db_path)
+    try:
+        bundle_packages: Dict[str, str] = {}
+        entry_packages: Dict[int, str] = {}
+        for entry_id, package, bundle in con.execute(
+            'SELECT entry_id, package_name, operatorbundle_name FROM channel_entry'
+        ):
+            bundle_packages[bundle] = package
+            entry_packages[entry_id] = package
+
+        row_digests: Dict[str, List[str]] = collections.defaultdict(list)
+        packages: Optional[Dict[Any, str]]
+        for table, columns in _get_table_columns(con).items():
+            if table == 'package':
+                key, packages = 'name', None
+            elif 'package_name' in columns:
+                key, packages = 'package_name', None
+            elif table == 'operatorbundle':
+                key, packages = 'name', bundle_packages
+            elif 'operatorbundle_name' in columns:
+                key, packages = 'operatorbundle_name', bundle_packages
+            elif 'channel_entry_id' in columns:
+                key, packages = 'channel_entry_id', entry_packages
+            else:
+                continue
+
+            key_index = columns.index(key)
+            for row in con.execute(f'SELECT * FROM "{table}"'):
+                package = row[key_index] if packages is None else packages.get(row[key_index])
+                if package is not None:
+                    row_digest = hashlib.sha256(repr((table, row)).encode('utf-8')).hexdigest()
+                    row_digests[package].append(row_digest)
+    finally:
+        con.close()
+
+    return {
+        package: hashlib.sha256(''.join(sorted(digests)).encode('utf-8')).hexdigest()
+        for package, digests in row_digests.items()
+    }
+
+
+def get_changed_packages(package_digests: Dict[str, str], db_path: str) -> Set[str]:
+    """
+    Get the packages which were added, changed or removed since the digests were taken.
+
+    :param dict package_digests: the digests returned by ``get_index_db_package_digests``
+    :param str db_path: the path to the index database
+    :return: the names of the changed packages
+    :rtype: set
+    :raises sqlite3.Error: if the database can't be read
+    """
+    current_digests = get_index_db_package_digests(db_path)
+    return {
+        package
+        for package in package_digests.keys() | current_digests.keys()
+        if package_digests.get(package) != current_digests.get(package)
+    }
+
+
+def create_package_subset_db(db_path: str, packages: Iterable[str], subset_db_path: str) -> None:
+    """
+    Create a copy of the index database only containing the packages.
+
+    :param str db_path: the path to the index database
+    :param packages: the names of the packages to keep
+    :param str subset_db_path: the path of the copy to create
+    :raises sqlite3.Error: if the copy can't be created
+    """
+    shutil.copyfile(db_path, subset_db_path)
+    con = sqlite3.connect(subset_db_path)
+    try:
+        con.execute('CREATE TEMP TABLE keep_package (name TEXT PRIMARY KEY)')
+        con.executemany('INSERT INTO keep_package VALUES (?)', [(p,) for p in set(packages)])
+        table_columns = _get_table_columns(con)
+        kept_packages = 'SELECT name FROM keep_package'
+        for table, columns in table_columns.items():
+            if table == 'package':
+                con.execute(f'DELETE FROM package WHERE name NOT IN ({kept_packages})')
+            elif 'package_name' in columns:
+                con.execute(f'DELETE FROM "{table}" WHERE package_name NOT IN ({kept_packages})')
+
+        kept_bundles = 'SELECT operatorbundle_name FROM channel_entry'
+        kept_entries = 'SELECT entry_id FROM channel_entry'
+        for table, columns in table_columns.items():
+            if table == 'operatorbundle':
+                con.execute(f'DELETE FROM operatorbundle WHERE name NOT IN ({kept_bundles})')
+            elif 'operatorbundle_name' in columns and 'package_name' not in columns:
+                con.execute(
+                    f'DELETE FROM "{table}" WHERE operatorbundle_name NOT IN ({kept_bundles})'
+                )
+            elif 'channel_entry_id' in columns:
+                con.execute(f'DELETE FROM "{table}" WHERE channel_entry_id NOT IN ({kept_entries})')
+        con.commit()
+    finally:
+        con.close()
@@ -7,9 +7,11 @@ import random
 import re
 import shutil
 import socket
+import sqlite3
 import tempfile
 import textwrap
-from typing import Callable, List, Optional, Set, Tuple, Union
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 from packaging.version import Version
 
 from tenacity import (
@@ -21,17 +23,29 @@ from tenacity import (
 
 from iib.exceptions import AddressAlreadyInUse, IIBError
 from iib.workers.api_utils import set_request_state
+from iib.workers.artifact_cache import get_artifact_cache
 from iib.workers.config import get_worker_config
+from iib.workers.slots import get_current_slot
 from iib.workers.tasks.fbc_utils import (
     is_image_fbc,
+    get_catalog_digest,
     get_catalog_dir,
     get_hidden_index_database,
     extract_fbc_fragment,
 )
 from iib.workers.tasks.iib_static_types import BundleImage
+from iib.workers.tasks.index_db_utils import (
+    create_package_subset_db,
+    get_index_db_package_digests,
+    is_index_db,
+    iter_index_db_bundles,
+)
 
 log = logging.getLogger(__name__)
 
+# The path of the cache of opm serve in the index images
+OPM_CACHE_PATH = '/tmp/cache'
+
 
 class PortFileLock:
     """A class representing file-lock used during OPM operations."""
@@ -183,8 +197,7 @@ def get_opm_port_stacks(port_purposes: List[str]) -> Tuple[List[List[int]], List
     log.debug("get_opm_port_stacks called with port_purposes: %s", str(port_purposes))
     conf = get_worker_config()
 
-    opm_version = Opm.get_opm_version_number()
-    if Version(opm_version) < Version(conf.iib_opm_pprof_lock_required_min_version):
+    if Opm.get_opm_version() < Version(conf.iib_opm_pprof_lock_required_min_version):
         if 'opm_pprof_port' in port_purposes:
             port_purposes.remove('opm_pprof_port')
             log.debug("get_opm_port_stacks Port purposes after remove method %s", port_purposes)
@@ -194,6 +207,11 @@ def get_opm_port_stacks(port_purposes: List[str]) -> Tuple[List[List[int]], List
 
     ports_list = list(map(list, zip(*port_ranges)))
 
+    # every worker slot only uses its own share of the ports so the slots never compete for them
+    slot = get_current_slot()
+    if slot:
+        ports_list = ports_list[slot.index :: slot.count]
+
     # shuffles the order, port pairs remain
     random.shuffle(ports_list)
 
@@ -308,7 +326,7 @@ def get_operator_package_list(
     :return: list of package names present in input data.
     :rtype: [str]
     """
-    olm_packages = opm_render(input_image_or_path, base_dir)
+    olm_packages = opm_render(input_image_or_path, base_dir, schemas={'olm.package'})
 
     package_names = [
         olm_package['name']
@@ -377,7 +395,36 @@ def get_list_bundles(
     """
     log.info("Get list of bundles from %s", input_data)
 
-    opm_data = opm_render(input_data, base_dir)
+    input_data_path = _get_input_data_path(input_data, base_dir)
+    index_db_reader = get_worker_config().iib_index_db_reader
+    if index_db_reader != 'opm' and is_index_db(input_data_path):
+        try:
+            bundles = list(iter_index_db_bundles(input_data_path))
+        except sqlite3.Error as e:
+            log.warning('Failed to read %s directly, falling back to opm render: %s', input_data, e)
+        else:
+            if index_db_reader == 'native':
+                return bundles
+            return _compare_bundles_with_opm_render(bundles, input_data, input_data_path, base_dir)
+
+    return _get_list_bundles_from_opm_render(input_data, input_data_path, base_dir)
+
+
+def _get_list_bundles_from_opm_render(
+    input_data: str, input_data_path: str, base_dir: str
+) -> List[BundleImage]:
+    """
+    Run OPM render to get list of bundles present in input data.
+
+    :param str input_data: input data for opm render
+    :param str input_data_path: the local path ``input_data`` was extracted to
+    :param str base_dir: temp directory where opm will be executed.
+    :return: list of bundle images parsed from input data
+    :rtype: list(dict)
+    """
+    opm_data = opm_render(
+        input_data, base_dir, input_data_path=input_data_path, schemas={'olm.bundle'}
+    )
 
     # convert opm data to list of BundleImage
     olm_bundles: List[BundleImage] = [
@@ -394,26 +441,82 @@ def get_list_bundles(
     return olm_bundles
 
 
+def _compare_bundles_with_opm_render(
+    bundles: List[BundleImage], input_data: str, db_path: str, base_dir: str
+) -> List[BundleImage]:
+    """
+    Validate the bundles read directly from the index database against the output of opm render.
+
+    :param list bundles: the bundles read directly from the index database
+    :param str input_data: the input data the index database was extracted from
+    :param str db_path: path to the index database
+    :param str base_dir: temp directory where opm will be executed.
+    :return: the bundles listed by opm render
+    :rtype: list(dict)
+    """
+    opm_bundles = _get_list_bundles_from_opm_render(input_data, db_path, base_dir)
+
+    def _to_set(bundle_list: List[BundleImage]) -> Set[Tuple[str, str, str, str]]:
+        return {
+            (b['bundlePath'], b.get('csvName', ''), b['packageName'], b['version'])
+            for b in bundle_list
+        }
+
+    native_set = _to_set(bundles)
+    opm_set = _to_set(opm_bundles)
+    if native_set != opm_set:
+        log.error(
+            'The bundles read from %s differ from opm render. Only read directly: %s. '
+            'Only rendered by opm: %s',
+            db_path,
+            sorted(native_set - opm_set),
+            sorted(opm_set - native_set),
+        )
+    else:
+        log.debug('The bundles read from %s match opm render', db_path)
+    return opm_bundles
+
+
 def opm_render(
     input_data: str,
     base_dir: str,
+    input_data_path: Optional[str] = None,
+    schemas: Optional[Set[str]] = None,
 ):
     """
     Run OPM render and extract data as valid JSON.
 
+    When ``iib_opm_render_streaming`` is set, the output of opm is parsed while it's written, so
+    only a single object is held in memory at a time.
+
     :param str input_data: input data for opm render
         Example: catalog-image | catalog-directory | bundle-image | bundle-directory | sqlite-file
     :param str base_dir: temp directory where opm will be executed.
+    :param str input_data_path: the local path ``input_data`` was already extracted to, if any
+    :param set schemas: if set, only the objects with one of these schemas are returned
     :return: list of parsed data from input
     :rtype: list(dict)
     """
-    from iib.workers.tasks.utils import run_cmd
+    from iib.workers.tasks.utils import run_cmd, run_cmd_stream
 
-    input_data_path = _get_input_data_path(input_data, base_dir)
+    if not input_data_path:
+        input_data_path = _get_input_data_path(input_data, base_dir)
     cmd = [Opm.opm_version, 'render', input_data_path]
-    opm_render_output = run_cmd(
-        cmd, {'cwd': base_dir}, exc_msg=f'Failed to run opm render with input: {input_data}'
-    )
+    exc_msg = f'Failed to run opm render with input: {input_data}'
+
+    if get_worker_config().iib_opm_render_streaming:
+        log.debug("Parsing data from opm render while it's running")
+        empty = True
+        for olm_object in _parse_opm_render_stream(
+            run_cmd_stream(cmd, {'cwd': base_dir}, exc_msg=exc_msg), schemas
+        ):
+            empty = False
+            yield olm_object
+        if empty:
+            log.info("There are no data in %s", input_data)
+        return
+
+    opm_render_output = run_cmd(cmd, {'cwd': base_dir}, exc_msg=exc_msg)
 
     if not opm_render_output:
         log.info("There are no data in %s", input_data)
@@ -421,7 +524,49 @@ def opm_render(
 
     log.debug("Parsing data from opm render")
     for package in re.split(r'(?<=})\n(?={)', opm_render_output):
-        yield json.loads(package)
+        olm_object = json.loads(package)
+        if schemas is None or olm_object.get('schema') in schemas:
+            yield olm_object
+
+
+def _parse_opm_render_stream(
+    chunks: Iterable[str], schemas: Optional[Set[str]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Parse the objects from the output of opm render while it's read.
+
+    The chunks are appended to a buffer which is decoded with ``json.JSONDecoder.raw_decode``
+    whenever it may hold a complete object, so the parsing doesn't depend on how opm formats its
+    output. Only the object being read is held in memory.
+
+    :param Iterable chunks: the chunks of the opm render output, such as its lines
+    :param set schemas: if set, only the objects with one of these schemas are returned
+    :return: an iterator of the parsed objects
+    :rtype: Iterator[dict]
+    :raises IIBError: if the output ends with an incomplete object
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        # Every object ends with a closing brace, so there is nothing to decode before one is read
+        if not chunk.rstrip().endswith('}'):
+            continue
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            try:
+                olm_object, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # The object isn't complete yet
+                break
+            buffer = buffer[end:]
+            if schemas is None or olm_object.get('schema') in schemas:
+                yield olm_object
+
+    if buffer.strip():
+        raise IIBError('The output of opm render ends with an incomplete object')
 
 
 def _get_or_create_temp_index_db_file(
@@ -544,7 +689,10 @@ def deprecate_bundles_fbc(
 
 
 def opm_migrate(
-    index_db: str, base_dir: str, generate_cache: bool = True
+    index_db: str,
+    base_dir: str,
+    generate_cache: bool = True,
+    packages: Optional[Set[str]] = None,
 ) -> Union[Tuple[str, str], Tuple[str, None]]:
     """
     Migrate SQLite database to File-Based catalog and generate cache using opm command.
@@ -552,6 +700,7 @@ def opm_migrate(
     :param str index_db: path to SQLite index.db which should migrated to FBC.
     :param str base_dir: base directory where catalog should be created.
     :param bool generate_cache: if set cache will be generated
+    :param set packages: if set, only these packages are migrated and validated
     :return: Returns paths to directories for containing file-based catalog and it's cache
     :rtype: str, str|None
     """
@@ -567,13 +716,29 @@ def opm_migrate(
 
     migrate_args = []
     opm_new_migrate_version = get_worker_config().get('iib_opm_new_migrate_version')
-    opm_version_number = Opm.get_opm_version_number()
-    if Version(opm_version_number) > Version(opm_new_migrate_version):
+    if Opm.get_opm_version() > Version(opm_new_migrate_version):
         migrate_args = ['--migrate-level', 'bundle-object-to-csv-metadata']
 
+    if packages is not None:
+        if not packages:
+            log.info('No package was changed in %s, skipping the migration', index_db)
+            os.makedirs(fbc_dir_path)
+            return fbc_dir_path, None
+        log.info('Migrating the packages %s of %s', ', '.join(sorted(packages)), index_db)
+        subset_db = os.path.join(base_dir, 'packages-subset.db')
+        try:
+            create_package_subset_db(index_db, packages, subset_db)
+        except sqlite3.Error as e:
+            raise IIBError(f'Failed to select the packages to migrate from {index_db}: {e}')
+        index_db = subset_db
+
     cmd = [Opm.opm_version, 'migrate', *migrate_args, index_db, fbc_dir_path]
 
-    run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to migrate index.db to file-based catalog')
+    try:
+        run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to migrate index.db to file-based catalog')
+    finally:
+        if packages:
+            os.remove(index_db)
     log.info("Migration to file-based catalog was completed.")
     opm_validate(fbc_dir_path)
 
@@ -664,19 +829,46 @@ def create_dockerfile(
     return dockerfile_path
 
 
+def _seed_opm_cache(from_index: str, local_cache_path: str) -> None:
+    """
+    Copy the cache shipped in the index image to be reused by ``opm serve``.
+
+    Failing to copy the cache is only logged, since the cache is then generated from scratch.
+
+    :param str from_index: the pull specification of the index image
+    :param str local_cache_path: the path to copy the cache to
+    """
+    from iib.workers.tasks.build import _copy_files_from_image
+
+    try:
+        _copy_files_from_image(from_index, OPM_CACHE_PATH, local_cache_path)
+    except IIBError as e:
+        log.info('The cache of %s cannot be reused: %s', from_index, e)
+        shutil.rmtree(local_cache_path, ignore_errors=True)
+        return
+    log.info('Seeded the cache for the file-based catalog from %s', from_index)
+
+
 @create_port_filelocks(port_purposes=["opm_pprof_port"])
 def generate_cache_locally(
     base_dir: str,
     fbc_dir: str,
     local_cache_path: str,
     opm_pprof_port: Optional[int] = None,
+    from_index: Optional[str] = None,
 ) -> None:
     """
     Generate the cache for the index image locally before building it.
 
+    When ``iib_opm_cache_reuse`` is enabled, the cache generated before for an identical catalog
+    is taken from the artifact cache of the worker, see ``iib_artifact_cache_dir``. Otherwise the
+    cache shipped in ``from_index`` is copied first, and ``opm serve`` only rebuilds it if it
+    doesn't match the catalog.
+
     :param str base_dir: base directory where cache should be created.
     :param str fbc_dir: directory containing file-based catalog (JSON or YAML files).
     :param str local_cache_path: path to the locally generated cache.
+    :param str from_index: the index image whose cache can be reused
     :return: Returns path to generated cache
     :rtype: str
     :raises: IIBError when cache was not generated
@@ -701,6 +893,18 @@ def generate_cache_locally(
     log.info('Generating cache for the file-based catalog')
     if os.path.exists(local_cache_path):
         shutil.rmtree(local_cache_path)
+
+    cache_key = None
+    artifact_cache = get_artifact_cache() if get_worker_config().iib_opm_cache_reuse else None
+    if artifact_cache:
+        # The format of the cache depends on the opm version
+        cache_key = f'opm-cache:{Opm.opm_version}:{get_catalog_digest(fbc_dir)}'
+        if artifact_cache.get(cache_key, OPM_CACHE_PATH, local_cache_path):
+            log.info('Reusing the cache generated for the identical file-based catalog')
+            return
+    if get_worker_config().iib_opm_cache_reuse and from_index:
+        _seed_opm_cache(from_index, local_cache_path)
+
     run_cmd(cmd, {'cwd': base_dir}, exc_msg='Failed to generate cache for file-based catalog')
 
     # Check if the opm command generated cache successfully
@@ -709,6 +913,9 @@ def generate_cache_locally(
         log.error(error_msg)
         raise IIBError(error_msg)
 
+    if artifact_cache and cache_key:
+        artifact_cache.put(cache_key, OPM_CACHE_PATH, local_cache_path)
+
 
 @retry(
     before_sleep=before_sleep_log(log, logging.WARNING),
@@ -801,12 +1008,17 @@ def opm_registry_add_fbc(
     overwrite_csv: bool = False,
     overwrite_from_index_token: Optional[str] = None,
     container_tool: Optional[str] = None,
-) -> None:
+    incremental: bool = False,
+) -> Optional[Dict[str, str]]:
     """
     Add the input bundles to an operator index.
 
     This only produces the index.Dockerfile file and does not build the container image.
 
+    With ``incremental``, the catalog is not migrated from the whole index.db. The caller is
+    expected to migrate the packages changed since the returned digests were taken, see
+    ``get_changed_packages``, and to create the ``catalog`` directory in ``base_dir``.
+
     :param str base_dir: the base directory to generate the database and index.Dockerfile in.
     :param list bundles: a list of strings representing the pull specifications of the bundles to
         add to the index image being built.
@@ -822,6 +1034,11 @@ def opm_registry_add_fbc(
         ``source_from_index`` image. This is required to use ``overwrite_target_index``.
         The format of the token must be in the format "user:password".
     :param str container_tool: the container tool to be used to operate on the index image
+    :param bool incremental: if set, only record the packages of index.db instead of migrating it
+    :return: the digests of the packages of index.db before the bundles were added, if
+        ``incremental`` is set
+    :rtype: dict or None
+    :raises IIBError: if the bundles can't be added
     """
     index_db_file = _get_or_create_temp_index_db_file(
         base_dir=base_dir,
@@ -830,6 +1047,15 @@ def opm_registry_add_fbc(
         ignore_existing=True,
     )
 
+    package_digests = None
+    if incremental:
+        try:
+            package_digests = get_index_db_package_digests(index_db_file)
+        except sqlite3.Error as e:
+            log.warning(
+                'Failed to read the packages of %s, migrating all of them: %s', from_index, e
+            )
+
     _opm_registry_add(
         base_dir=base_dir,
         index_db=index_db_file,
@@ -839,7 +1065,10 @@ def opm_registry_add_fbc(
         graph_update_mode=graph_update_mode,
     )
 
-    fbc_dir, _ = opm_migrate(index_db=index_db_file, base_dir=base_dir)
+    if package_digests is not None:
+        fbc_dir = os.path.join(base_dir, 'catalog')
+    else:
+        fbc_dir, _ = opm_migrate(index_db=index_db_file, base_dir=base_dir)
     # we should keep generating Dockerfile here
     # to have the same behavior as we run `opm index add` with '--generate' option
     create_dockerfile(
@@ -849,6 +1078,7 @@ def opm_registry_add_fbc(
         binary_image=binary_image,
         dockerfile_name='index.Dockerfile',
     )
+    return package_digests
 
 
 def _opm_registry_rm(
@@ -1084,7 +1314,10 @@ def opm_registry_add_fbc_fragment(
 
     local_cache_path = os.path.join(temp_dir, 'cache')
     generate_cache_locally(
-        base_dir=temp_dir, fbc_dir=from_index_configs_dir, local_cache_path=local_cache_path
+        base_dir=temp_dir,
+        fbc_dir=from_index_configs_dir,
+        local_cache_path=local_cache_path,
+        from_index=from_index,
     )
 
     log.info("Dockerfile generated from %s", from_index_configs_dir)
@@ -1392,20 +1625,101 @@ class Opm:
         log.info("OPM version set to %s", Opm.opm_version)
 
     @classmethod
-    def get_opm_version_number(cls):
+    def get_opm_version_number(cls, opm_binary: Optional[str] = None) -> str:
         """
         Get the opm version number to be used for the entire IIB operation.
 
+        The version of every opm binary is only probed once per process, until the binary changes.
+
+        :param str opm_binary: the opm binary to get the version of, the one set-up if not set
         :return: currently set-up Opm version number
         :rtype: str
+        :raises IIBError: if the version can't be determined
         """
-        log.info("Determining the OPM version number")
+        return _get_opm_version_entry(opm_binary or Opm.opm_version)[0]
 
-        from iib.workers.tasks.utils import run_cmd
+    @classmethod
+    def get_opm_version(cls, opm_binary: Optional[str] = None) -> Version:
+        """
+        Get the parsed version of the opm binary to be used for the entire IIB operation.
 
-        opm_version_output = run_cmd([Opm.opm_version, 'version'])
-        match = re.search(r'OpmVersion:"v([\d.]+)"', opm_version_output)
-        if match:
-            return match.group(1)
-        else:
-            raise IIBError("Opm version not found in the output of \"OPM version\" command")
+        :param str opm_binary: the opm binary to get the version of, the one set-up if not set
+        :return: currently set-up Opm version
+        :rtype: Version
+        :raises IIBError: if the version can't be determined
+        """
+        return _get_opm_version_entry(opm_binary or Opm.opm_version)[1]
+
+    @classmethod
+    def probe_opm_versions(cls) -> None:
+        """
+        Probe the versions of all the configured opm binaries ahead of the requests.
+
+        Failing to probe a binary is only logged, it's then probed again when it's used.
+        """
+        conf = get_worker_config()
+        opm_binaries = {conf.get('iib_default_opm')}
+        opm_binaries.update((conf.get('iib_ocp_opm_mapping') or {}).values())
+        for opm_binary in sorted(b for b in opm_binaries if b):
+            try:
+                log.info('The version of %s is %s', opm_binary, cls.get_opm_version(opm_binary))
+            except IIBError as e:
+                log.warning('Failed to probe the version of %s: %s', opm_binary, e)
+
+
+# The versions of the opm binaries keyed by the binary, with the inode and mtime they were probed at
+_opm_versions: Dict[str, Tuple[Optional[Tuple[int, int]], str, Version]] = {}
+_opm_versions_lock = threading.Lock()
+
+
+def _get_binary_signature(binary: str) -> Optional[Tuple[int, int]]:
+    """
+    Get the inode and modification time of the binary, which change when it's replaced.
+
+    :param str binary: the path or the name of the binary in ``PATH``
+    :return: the inode and modification time or ``None`` if the binary can't be found
+    :rtype: tuple
+    """
+    path = shutil.which(binary)
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _get_opm_version_entry(opm_binary: str) -> Tuple[str, Version]:
+    """
+    Get the version of the opm binary, probing it only if it wasn't probed before.
+
+    :param str opm_binary: the path or the name of the opm binary
+    :return: the version number and the parsed version
+    :rtype: tuple
+    :raises IIBError: if the version can't be determined
+    """
+    from iib.workers.tasks.utils import run_cmd
+
+    signature = _get_binary_signature(opm_binary)
+    with _opm_versions_lock:
+        entry = _opm_versions.get(opm_binary)
+    if entry and entry[0] == signature:
+        return entry[1], entry[2]
+
+    log.info("Determining the OPM version number of %s", opm_binary)
+    opm_version_output = run_cmd([opm_binary, 'version'])
+    match = re.search(r'OpmVersion:"v([\d.]+)"', opm_version_output)
+    if not match:
+        raise IIBError("Opm version not found in the output of \"OPM version\" command")
+
+    version_number = match.group(1)
+    with _opm_versions_lock:
+        _opm_versions[opm_binary] = (signature, version_number, Version(version_number))
+    return version_number, Version(version_number)
+
+
+def clear_opm_version_cache() -> None:
+    """Forget the versions of all the opm binaries probed so far."""
+    with _opm_versions_lock:
+        _opm_versions.clear()
@@ -11,8 +11,12 @@ import json
 import logging
 import os
 import re
+import shutil
 import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
 
 from pathlib import Path
 from tenacity import (
@@ -29,14 +33,18 @@ from operator_manifest.operator import ImageName, OperatorManifest
 from iib.common.common_utils import get_binary_versions
 from iib.workers.dogpile_cache import (
     create_dogpile_region,
+    create_local_dogpile_region,
     dogpile_cache,
     skopeo_inspect_should_use_cache,
 )
 
-from iib.exceptions import IIBError, ExternalServiceError
+from iib.exceptions import IIBError, ExternalServiceError, FromIndexChangedError
 from iib.workers.config import get_worker_config
+from iib.workers.registry_client import get_registry_client, registry_auth_file
 from iib.workers.s3_utils import upload_file_to_s3_bucket
+from iib.workers.slots import container_storage, get_current_slot
 from iib.workers.api_utils import set_request_state
+from iib.workers.tasks.concurrency_utils import run_per_image_concurrently
 from iib.workers.tasks.opm_operations import get_list_bundles
 from iib.workers.tasks.iib_static_types import (
     IndexImageInfo,
@@ -51,6 +59,7 @@ from iib.common.tracing import instrument_tracing
 
 log = logging.getLogger(__name__)
 dogpile_cache_region = create_dogpile_region()
+local_dogpile_cache_region = create_local_dogpile_region()
 
 
 def _add_property_to_index(db_path: str, property: Dict[str, str]) -> None:
@@ -455,39 +464,46 @@ def get_resolved_bundles(bundles: List[str]) -> List[str]:
     If so, simply use the digest of the first item in the manifest list.
     If not a manifest list, it must be a v2s2 image manifest and should be used as it is.
 
+    The bundles are resolved concurrently, see ``run_per_image_concurrently``.
+
     :param list bundles: the list of bundle images to be resolved.
-    :return: the list of bundle images resolved to their digests.
+    :return: the list of unique bundle images resolved to their digests.
     :rtype: list
     :raises IIBError: if unable to resolve a bundle image.
     """
     log.info('Resolving bundles %s', ', '.join(bundles))
-    resolved_bundles = set()
-    for bundle_pull_spec in bundles:
-        skopeo_raw = skopeo_inspect(
-            f'docker://{bundle_pull_spec}', '--raw', require_media_type=True
-        )
-        if (
-            skopeo_raw.get('mediaType')
-            == 'application/vnd.docker.distribution.manifest.list.v2+json'
-        ):
-            # Get the digest of the first item in the manifest list
-            digest = skopeo_raw['manifests'][0]['digest']
-            name = _get_container_image_name(bundle_pull_spec)
-            resolved_bundles.add(f'{name}@{digest}')
-        elif (
-            skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json'
-            and skopeo_raw.get('schemaVersion') == 2
-        ):
-            resolved_bundles.add(get_resolved_image(bundle_pull_spec))
-        else:
-            error_msg = (
-                f'The pull specification of {bundle_pull_spec} is neither '
-                f'a v2 manifest list nor a v2s2 manifest. Type {skopeo_raw.get("mediaType")}'
-                f' and schema version {skopeo_raw.get("schemaVersion")} is not supported by IIB.'
-            )
-            raise IIBError(error_msg)
+    resolved_bundles = run_per_image_concurrently(_get_resolved_bundle, bundles)
+    # Remove duplicates while keeping the order of the input bundles
+    return list(dict.fromkeys(resolved_bundles))
+
 
-    return list(resolved_bundles)
+def _get_resolved_bundle(bundle_pull_spec: str) -> str:
+    """
+    Get the pull specification of a single bundle image using its digest.
+
+    :param str bundle_pull_spec: the bundle image to be resolved.
+    :return: the bundle image resolved to its digest.
+    :rtype: str
+    :raises IIBError: if unable to resolve the bundle image.
+    """
+    skopeo_raw = skopeo_inspect(f'docker://{bundle_pull_spec}', '--raw', require_media_type=True)
+    if skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.list.v2+json':
+        # Get the digest of the first item in the manifest list
+        digest = skopeo_raw['manifests'][0]['digest']
+        name = _get_container_image_name(bundle_pull_spec)
+        return f'{name}@{digest}'
+    elif (
+        skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json'
+        and skopeo_raw.get('schemaVersion') == 2
+    ):
+        return get_resolved_image(bundle_pull_spec)
+
+    error_msg = (
+        f'The pull specification of {bundle_pull_spec} is neither '
+        f'a v2 manifest list nor a v2s2 manifest. Type {skopeo_raw.get("mediaType")}'
+        f' and schema version {skopeo_raw.get("schemaVersion")} is not supported by IIB.'
+    )
+    raise IIBError(error_msg)
 
 
 def _get_container_image_name(pull_spec: str) -> str:
@@ -503,20 +519,78 @@ def _get_container_image_name(pull_spec: str) -> str:
         return pull_spec.rsplit(':', 1)[0]
 
 
+_resolved_image_cache: Dict[str, Tuple[str, float]] = {}
+_resolved_image_cache_lock = threading.Lock()
+
+
+def invalidate_resolved_image_cache(pull_spec: Optional[str] = None) -> None:
+    """
+    Forget the cached resolution of the pull specification.
+
+    :param str pull_spec: the pull specification to forget. If ``None``, all the cached
+        resolutions are forgotten.
+    """
+    with _resolved_image_cache_lock:
+        if pull_spec is None:
+            _resolved_image_cache.clear()
+        else:
+            _resolved_image_cache.pop(pull_spec.removeprefix('docker://'), None)
+
+
 def get_resolved_image(pull_spec: str) -> str:
     """
     Get the pull specification of the container image using its digest.
 
+    The resolution is cached for ``iib_resolved_image_cache_ttl`` seconds.
+
+    :param str pull_spec: the pull specification of the container image to resolve
+    :return: the resolved pull specification
+    :rtype: str
+    """
+    ttl = get_worker_config().iib_resolved_image_cache_ttl
+    if ttl:
+        with _resolved_image_cache_lock:
+            pull_spec_resolved, expires_at = _resolved_image_cache.get(pull_spec, ('', 0.0))
+        if pull_spec_resolved and expires_at > time.monotonic():
+            log.debug('%s resolved to %s (cached)', pull_spec, pull_spec_resolved)
+            return pull_spec_resolved
+
+    pull_spec_resolved = _resolve_image(pull_spec)
+    if ttl:
+        with _resolved_image_cache_lock:
+            _resolved_image_cache[pull_spec] = (pull_spec_resolved, time.monotonic() + ttl)
+    return pull_spec_resolved
+
+
+def _resolve_image(pull_spec: str) -> str:
+    """
+    Get the pull specification of the container image using its digest from the registry.
+
     :param str pull_spec: the pull specification of the container image to resolve
     :return: the resolved pull specification
     :rtype: str
     """
     log.debug('Resolving %s', pull_spec)
     name = _get_container_image_name(pull_spec)
+    if get_worker_config().iib_registry_client == 'native':
+        # A HEAD request is enough when the registry provides the digest of the manifest
+        try:
+            digest = get_registry_client().get_manifest_digest(pull_spec)
+        except IIBError as e:
+            log.warning('Failed to get the digest of %s with a HEAD request: %s', pull_spec, e)
+            digest = None
+        if digest:
+            pull_spec_resolved = f'{name}@{digest}'
+            log.debug('%s resolved to %s', pull_spec, pull_spec_resolved)
+            return pull_spec_resolved
+
     skopeo_output = skopeo_inspect(f'docker://{pull_spec}', '--raw', return_json=False)
-    if json.loads(skopeo_output).get('schemaVersion') == 2:
+    raw_manifest = json.loads(skopeo_output)
+    if raw_manifest.get('schemaVersion') == 2:
         raw_digest = hashlib.sha256(skopeo_output.encode('utf-8')).hexdigest()
         digest = f'sha256:{raw_digest}'
+        # The digest was computed from this exact manifest, so there's no need to fetch it again
+        get_image_metadata(f'{name}@{digest}').raw_manifest = raw_manifest
     else:
         # Schema 1 is not a stable format. The contents of the manifest may change slightly
         # between requests causing a different digest to be computed. Instead, let's leverage
@@ -529,6 +603,142 @@ def get_resolved_image(pull_spec: str) -> str:
     return pull_spec_resolved
 
 
+class ImageMetadata:
+    """
+    The metadata of a container image in a container registry.
+
+    The raw manifest and the config of the image are fetched lazily, at most once, and the labels,
+    architectures, media type and digest are served from them.
+
+    :param str pull_spec: the pull specification of the image, optionally prefixed with
+        ``docker://``
+    """
+
+    def __init__(self, pull_spec: str):
+        """Initialize the ImageMetadata object."""
+        self.pull_spec = pull_spec.removeprefix('docker://')
+        self._lock = threading.Lock()
+        self._raw_manifest: Optional[Dict[str, Any]] = None
+        self._config: Optional[Dict[str, Any]] = None
+
+    @property
+    def raw_manifest(self) -> Dict[str, Any]:
+        """
+        Get the raw manifest of the image as returned by ``skopeo inspect --raw``.
+
+        :return: the raw manifest or manifest list of the image
+        :rtype: dict
+        """
+        with self._lock:
+            if self._raw_manifest is None:
+                self._raw_manifest = skopeo_inspect(f'docker://{self.pull_spec}', '--raw')
+            return self._raw_manifest
+
+    @raw_manifest.setter
+    def raw_manifest(self, raw_manifest: Dict[str, Any]) -> None:
+        with self._lock:
+            self._raw_manifest = raw_manifest
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """
+        Get the config of the image as returned by ``skopeo inspect --config``.
+
+        :return: the config of the image
+        :rtype: dict
+        """
+        with self._lock:
+            if self._config is None:
+                self._config = skopeo_inspect(f'docker://{self.pull_spec}', '--config')
+            return self._config
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        """
+        Get the labels of the image.
+
+        :return: the dictionary of the labels on the image
+        :rtype: dict
+        """
+        return self.config.get('config', {}).get('Labels', {})
+
+    @property
+    def media_type(self) -> Optional[str]:
+        """
+        Get the media type of the raw manifest of the image.
+
+        :return: the media type or ``None`` if the manifest does not specify one
+        :rtype: str
+        """
+        return self.raw_manifest.get('mediaType')
+
+    @property
+    def digest(self) -> Optional[str]:
+        """
+        Get the digest of the image from its pull specification.
+
+        :return: the digest or ``None`` if the image is not referenced by digest
+        :rtype: str
+        """
+        if '@' not in self.pull_spec:
+            return None
+        return self.pull_spec.split('@', 1)[1]
+
+    @property
+    def arches(self) -> Set[str]:
+        """
+        Get the architectures the image was built for.
+
+        :return: a set of architectures of the container images contained in the manifest list
+        :rtype: set
+        :raises IIBError: if the image is neither a v2 manifest list nor a v2 manifest
+        """
+        arches = set()
+        if self.media_type == 'application/vnd.docker.distribution.manifest.list.v2+json':
+            for manifest in self.raw_manifest['manifests']:
+                arches.add(manifest['platform']['architecture'])
+        elif self.media_type == 'application/vnd.docker.distribution.manifest.v2+json':
+            arches.add(self.config['architecture'])
+        else:
+            raise IIBError(
+                f'The pull specification of {self.pull_spec} is neither a v2 manifest list nor a '
+                'v2 manifest'
+            )
+        return arches
+
+
+_image_metadata_cache: Dict[str, ImageMetadata] = {}
+_image_metadata_cache_lock = threading.Lock()
+
+
+def get_image_metadata(pull_spec: str) -> ImageMetadata:
+    """
+    Get the metadata of the container image.
+
+    Images referenced by digest are immutable, so their metadata is cached until
+    ``clear_image_metadata_cache`` is called. Images referenced by tag always get a new object.
+
+    :param str pull_spec: the pull specification of the image, optionally prefixed with
+        ``docker://``
+    :return: the metadata of the image
+    :rtype: ImageMetadata
+    """
+    pull_spec = pull_spec.removeprefix('docker://')
+    if '@' not in pull_spec:
+        return ImageMetadata(pull_spec)
+
+    with _image_metadata_cache_lock:
+        if pull_spec not in _image_metadata_cache:
+            _image_metadata_cache[pull_spec] = ImageMetadata(pull_spec)
+        return _image_metadata_cache[pull_spec]
+
+
+def clear_image_metadata_cache() -> None:
+    """Forget the metadata of all the container images inspected so far."""
+    with _image_metadata_cache_lock:
+        _image_metadata_cache.clear()
+
+
 def get_image_labels(pull_spec: str) -> Dict[str, str]:
     """
     Get the labels from the image.
@@ -537,12 +747,12 @@ def get_image_labels(pull_spec: str) -> Dict[str, str]:
     :return: the dictionary of the labels on the image
     :rtype: dict
     """
-    if pull_spec.startswith('docker://') or pull_spec.startswith('containers-storage'):
-        full_pull_spec = pull_spec
-    else:
-        full_pull_spec = f'docker://{pull_spec}'
-    log.debug('Getting the labels from %s', full_pull_spec)
-    return skopeo_inspect(full_pull_spec, '--config').get('config', {}).get('Labels', {})
+    log.debug('Getting the labels from %s', pull_spec)
+    if pull_spec.startswith('containers-storage'):
+        # Local images are referenced by tag and are rebuilt within the request
+        return skopeo_inspect(pull_spec, '--config').get('config', {}).get('Labels', {})
+
+    return get_image_metadata(pull_spec).labels
 
 
 def reset_docker_config() -> None:
@@ -599,7 +809,9 @@ def set_registry_token(
     encoded_token = base64.b64encode(token.encode('utf-8')).decode('utf-8')
     registry_auths: Dict[str, Any] = {'auths': {}}
     if append:
-        docker_config_path = os.path.join(os.path.expanduser('~'), '.docker', 'config.json')
+        docker_config_path = registry_auth_file.get() or os.path.join(
+            os.path.expanduser('~'), '.docker', 'config.json'
+        )
         if os.path.exists(docker_config_path):
             with open(docker_config_path, 'r') as f:
                 try:
@@ -638,6 +850,11 @@ def set_registry_auths(
         yield
         return
 
+    if get_worker_config().iib_isolated_registry_auths:
+        with _set_isolated_registry_auths(_get_docker_config(registry_auths, use_empty_config)):
+            yield
+        return
+
     docker_config_path = os.path.join(os.path.expanduser('~'), '.docker', 'config.json')
     try:
         log.debug('Removing the Docker config symlink at %s', docker_config_path)
@@ -646,26 +863,7 @@ def set_registry_auths(
         except FileNotFoundError:
             log.debug('The Docker config symlink at %s does not exist', docker_config_path)
 
-        if use_empty_config:
-            # When use_empty_config is True, only use the provided registry_auths
-            docker_config = registry_auths
-        else:
-            # Original behavior: use template and merge with all provided credentials
-            conf = get_worker_config()
-            if os.path.exists(conf.iib_docker_config_template):
-                with open(conf.iib_docker_config_template, 'r') as f:
-                    docker_config = json.load(f)
-            else:
-                docker_config = {'auths': {}}
-
-            registries = list(registry_auths.get('auths', {}).keys())
-            log.debug(
-                'Setting the override token for the registries %s in the Docker config',
-                registries,
-            )
-            docker_config.setdefault('auths', {})
-            docker_config['auths'].update(registry_auths.get('auths', {}))
-
+        docker_config = _get_docker_config(registry_auths, use_empty_config)
         with open(docker_config_path, 'w') as f:
             json.dump(docker_config, f)
 
@@ -674,6 +872,144 @@ def set_registry_auths(
         reset_docker_config()
 
 
+def _get_docker_config(registry_auths: Dict[str, Any], use_empty_config: bool) -> Dict[str, Any]:
+    """
+    Get the Docker config with the registry credentials.
+
+    :param dict registry_auths: dockerconfig.json auth only information to private registries
+    :param bool use_empty_config: When True, only use provided credentials in config.json
+        (no template merging)
+    :return: the Docker config
+    :rtype: dict
+    """
+    if use_empty_config:
+        # When use_empty_config is True, only use the provided registry_auths
+        return registry_auths
+
+    # Original behavior: use template and merge with all provided credentials
+    conf = get_worker_config()
+    if os.path.exists(conf.iib_docker_config_template):
+        with open(conf.iib_docker_config_template, 'r') as f:
+            docker_config = json.load(f)
+    else:
+        docker_config = {'auths': {}}
+
+    registries = list(registry_auths.get('auths', {}).keys())
+    log.debug(
+        'Setting the override token for the registries %s in the Docker config',
+        registries,
+    )
+    docker_config.setdefault('auths', {})
+    docker_config['auths'].update(registry_auths.get('auths', {}))
+    return docker_config
+
+
+@contextmanager
+def _set_isolated_registry_auths(docker_config: Dict[str, Any]) -> Generator:
+    """
+    Write the Docker config to a private auth file used by the current request only.
+
+    The auth file is passed to the commands run by ``run_cmd`` and used by the registry client
+    while the context manager is active, in the current thread and the threads it starts through
+    ``concurrency_utils``. The shared ``~/.docker/config.json`` is left untouched, so several
+    requests can run concurrently in the same worker.
+
+    :param dict docker_config: the Docker config to write
+    :return: None
+    :rtype: None
+    """
+    auth_dir = tempfile.mkdtemp(prefix='iib-auth-')
+    try:
+        auth_file = os.path.join(auth_dir, 'config.json')
+        with open(os.open(auth_file, os.O_CREAT | os.O_WRONLY, 0o600), 'w') as f:
+            json.dump(docker_config, f)
+        log.debug('Using the registry auth file %s', auth_file)
+        token = registry_auth_file.set(auth_file)
+        try:
+            yield
+        finally:
+            registry_auth_file.reset(token)
+    finally:
+        shutil.rmtree(auth_dir, ignore_errors=True)
+
+
+def _get_registry_auth_env(params: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    Get the environment of a command using the registry auth file of the current request.
+
+    ``REGISTRY_AUTH_FILE`` is honored by ``skopeo``, ``podman`` and ``buildah``, ``DOCKER_CONFIG``
+    by ``opm`` and ``oras``.
+
+    :param dict params: keyword parameters for command execution
+    :return: the environment or ``None`` if the command uses the default one
+    :rtype: dict
+    """
+    auth_file = registry_auth_file.get()
+    if not auth_file:
+        return None
+    env = dict(params.get('env') or os.environ)
+    env['REGISTRY_AUTH_FILE'] = auth_file
+    env['DOCKER_CONFIG'] = os.path.dirname(auth_file)
+    return env
+
+
+def _get_command_env(params: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    Get the environment of a command using the registry auth file and the container storage.
+
+    The container storage is only set in the context of an architecture built concurrently with
+    the others, see ``run_per_arch_concurrently``.
+
+    :param dict params: keyword parameters for command execution
+    :return: the environment or ``None`` if the command uses the default one
+    :rtype: dict
+    """
+    env = _get_registry_auth_env(params)
+    storage = container_storage.get()
+    if storage:
+        env = storage.get_env(env or params.get('env'))
+    return env
+
+
+def _can_inspect_natively(args: Tuple[str, ...]) -> bool:
+    """
+    Check if the ``skopeo inspect`` arguments are supported by the built-in registry client.
+
+    Only getting the raw manifest or the config of an image in a container registry is supported.
+    Anything else, such as the schema 1 digest computed by ``skopeo``, is left to ``skopeo``.
+
+    :param tuple args: the arguments for ``skopeo inspect``
+    :return: ``True`` if the registry client can be used instead of ``skopeo``
+    :rtype: bool
+    """
+    return len(args) == 2 and args[0].startswith('docker://') and args[1] in ('--raw', '--config')
+
+
+def _registry_client_inspect(pull_spec: str, flag: str, exc_msg: Optional[str] = None) -> str:
+    """
+    Inspect the image with the built-in registry client instead of ``skopeo``.
+
+    :param str pull_spec: the pull specification of the image prefixed with ``docker://``
+    :param str flag: either ``--raw`` or ``--config``
+    :param str exc_msg: the error message to raise if the inspection fails
+    :return: the output ``skopeo inspect`` would have produced
+    :rtype: str
+    :raises IIBError: if the inspection fails
+    """
+    client = get_registry_client()
+    try:
+        if flag == '--raw':
+            output = client.get_raw_manifest(pull_spec)
+        else:
+            output = client.get_config(pull_spec)
+        # The registry API requires UTF-8, which is decoded back to the exact same bytes when
+        # the digest is computed from the output
+        return output.decode('utf-8')
+    except (IIBError, UnicodeDecodeError) as e:
+        log.error('The registry client failed to inspect %s: %s', pull_spec, e)
+        raise IIBError(exc_msg or str(e))
+
+
 @retry(
     before_sleep=before_sleep_log(log, logging.WARNING),
     reraise=True,
@@ -682,7 +1018,10 @@ def set_registry_auths(
     wait=wait_chain(wait_exponential(multiplier=get_worker_config().iib_retry_multiplier)),
 )
 @dogpile_cache(
-    dogpile_region=dogpile_cache_region, should_use_cache_fn=skopeo_inspect_should_use_cache
+    dogpile_region=dogpile_cache_region,
+    should_use_cache_fn=skopeo_inspect_should_use_cache,
+    local_dogpile_region=local_dogpile_cache_region,
+    immutable=True,
 )
 def skopeo_inspect(
     *args,
@@ -707,9 +1046,12 @@ def skopeo_inspect(
             exc_msg = f'Failed to inspect {arg}. Make sure it exists and is accessible to IIB.'
             break
 
-    skopeo_timeout = get_worker_config().iib_skopeo_timeout
-    cmd = ['skopeo', '--command-timeout', skopeo_timeout, 'inspect'] + list(args)
-    output = run_cmd(cmd, exc_msg=exc_msg)
+    conf = get_worker_config()
+    if conf.iib_registry_client == 'native' and _can_inspect_natively(args):
+        output = _registry_client_inspect(args[0], args[1], exc_msg=exc_msg)
+    else:
+        cmd = ['skopeo', '--command-timeout', conf.iib_skopeo_timeout, 'inspect'] + list(args)
+        output = run_cmd(cmd, exc_msg=exc_msg)
     if not return_json:
         return output
 
@@ -803,40 +1145,105 @@ def run_cmd(
     params.setdefault('stderr', subprocess.PIPE)
     params.setdefault('stdout', subprocess.PIPE)
 
+    env = _get_command_env(params)
+    if env:
+        params['env'] = env
+
     log.debug('Running the command "%s"', ' '.join(_sanitize_cmd_log(cmd)))
     response: subprocess.CompletedProcess = subprocess.run(cmd, **params)
 
     if strict and response.returncode != 0:
-        if set(['buildah', 'manifest', 'rm']) <= set(cmd) and 'image not known' in response.stderr:
-            raise IIBError('Manifest list not found locally.')
-        log.error('The command "%s" failed with: %s', ' '.join(cmd), response.stderr)
-        regex: str
-        match: Optional[re.Match]
-        if Path(cmd[0]).stem.startswith('opm'):
-            # Capture the error message right before the help display
-            regex = r'^(?:Error: )(.+)$'
+        _raise_cmd_error(cmd, response, exc_msg)
+
+    return response.stdout
+
+
+def _raise_cmd_error(cmd: List[str], response: subprocess.CompletedProcess, exc_msg: str) -> None:
+    """
+    Raise the exception describing the failed command.
+
+    This is a complementary function for ``run_cmd`` and ``run_cmd_stream``.
+
+    :param list cmd: list of strings representing the executed command
+    :param subprocess.CompletedProcess response: the response of the failed command
+    :param str exc_msg: the exception message
+    :raises IIBError: always
+    """
+    if set(['buildah', 'manifest', 'rm']) <= set(cmd) and 'image not known' in response.stderr:
+        raise IIBError('Manifest list not found locally.')
+    log.error('The command "%s" failed with: %s', ' '.join(cmd), response.stderr)
+    regex: str
+    match: Optional[re.Match]
+    if Path(cmd[0]).stem.startswith('opm'):
+        # Capture the error message right before the help display
+        regex = r'^(?:Error: )(.+)$'
+        match = _regex_reverse_search(regex, response)
+        if match:
+            raise IIBError(f'{exc_msg.rstrip(".")}: {match.groups()[0]}')
+        elif (
+            '"permissive mode disabled" error="error deleting packages from'
+            ' database: error removing operator package' in response.stderr
+        ):
+            raise IIBError("Error deleting packages from database")
+    elif cmd[0] == 'buildah':
+        # Check for HTTP 403 or 50X errors on buildah
+        network_regexes = [
+            r'.*([e,E]rror:? creating build container).*(:?(403|50[0-9]|125)\s?.*$)',
+            r'.*(read\/write on closed pipe.*$)',
+        ]
+        for regex in network_regexes:
             match = _regex_reverse_search(regex, response)
             if match:
-                raise IIBError(f'{exc_msg.rstrip(".")}: {match.groups()[0]}')
-            elif (
-                '"permissive mode disabled" error="error deleting packages from'
-                ' database: error removing operator package' in response.stderr
-            ):
-                raise IIBError("Error deleting packages from database")
-        elif cmd[0] == 'buildah':
-            # Check for HTTP 403 or 50X errors on buildah
-            network_regexes = [
-                r'.*([e,E]rror:? creating build container).*(:?(403|50[0-9]|125)\s?.*$)',
-                r'.*(read\/write on closed pipe.*$)',
-            ]
-            for regex in network_regexes:
-                match = _regex_reverse_search(regex, response)
-                if match:
-                    raise ExternalServiceError(f'{exc_msg}: {": ".join(match.groups()).strip()}')
-
-        raise IIBError(exc_msg)
+                raise ExternalServiceError(f'{exc_msg}: {": ".join(match.groups()).strip()}')
 
-    return response.stdout
+    raise IIBError(exc_msg)
+
+
+def run_cmd_stream(
+    cmd: List[str],
+    params: Optional[Dict[str, Any]] = None,
+    exc_msg: Optional[str] = None,
+) -> Generator[str, None, None]:
+    """
+    Run the given command and yield the lines of its output as they are written.
+
+    Unlike ``run_cmd``, the output is never held in memory as a whole. The standard error is
+    spooled to a temporary file, so the command can't block on a full pipe. If the generator is
+    closed before the output is consumed, the command is killed.
+
+    :param list cmd: list of strings representing the command to be executed
+    :param dict params: keyword parameters for command execution
+    :param str exc_msg: an optional exception message when the command fails
+    :return: a generator of the lines of the command output
+    :rtype: Generator[str, None, None]
+    :raises IIBError: if the command fails, once its output is consumed
+    """
+    exc_msg = exc_msg or 'An unexpected error occurred'
+    params = dict(params or {})
+    params.setdefault('universal_newlines', True)
+    params.setdefault('encoding', 'utf-8')
+    env = _get_command_env(params)
+    if env:
+        params['env'] = env
+
+    log.debug('Running the command "%s"', ' '.join(_sanitize_cmd_log(cmd)))
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8') as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, **params)
+        try:
+            yield from proc.stdout  # type: ignore
+        except GeneratorExit:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            proc.stdout.close()  # type: ignore
+        returncode = proc.wait()
+
+        if returncode != 0:
+            stderr.seek(0)
+            _raise_cmd_error(
+                cmd, subprocess.CompletedProcess(cmd, returncode, '', stderr.read()), exc_msg
+            )
 
 
 def terminate_process(proc: subprocess.Popen, timeout: int = 5) -> None:
@@ -896,6 +1303,9 @@ def request_logger(func: Callable) -> Callable:
             logger = logging.getLogger()
             logger.addHandler(request_log_handler)
             worker_info = f'Host: {socket.getfqdn()}; User: {getpass.getuser()}'
+            slot = get_current_slot()
+            if slot:
+                worker_info += f'; Slot: {slot.index}'
             logger.info(worker_info)
             versions = get_binary_versions()
             logger.info(f"opm {versions['opm']}\n{versions['podman']}\n{versions['buildah']}")
@@ -911,6 +1321,45 @@ def request_logger(func: Callable) -> Callable:
     return wrapper
 
 
+def rebase_on_from_index_change(func: Callable) -> Callable:
+    """
+    Build the request again on top of ``from_index`` if it changed before it could be overwritten.
+
+    If ``iib_from_index_rebase_attempts`` is set and another request overwrote ``from_index``
+    while the decorated function was building the index image, the function is run again to apply
+    the changes of the request on top of the new ``from_index``, instead of failing the request.
+    The bundles, images and ``opm serve`` caches already resolved or generated by the worker are
+    reused from its caches.
+
+    :param function func: the function to be decorated. The function must take the ``request_id``
+        parameter.
+    :return: the decorated function
+    :rtype: function
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> Any:
+        max_attempts = get_worker_config().iib_from_index_rebase_attempts
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except FromIndexChangedError:
+                if attempt >= max_attempts:
+                    raise
+                attempt += 1
+
+            request_id = _get_function_arg_value('request_id', func, args, kwargs)
+            state_reason = (
+                'The supplied from_index image changed during the IIB request. Rebuilding the '
+                f'index image on top of it (attempt {attempt} of {max_attempts})'
+            )
+            log.warning(state_reason)
+            set_request_state(request_id, 'in_progress', state_reason)
+
+    return wrapper
+
+
 def _get_function_arg_value(
     arg_name: str,
     func: Callable,
@@ -1001,20 +1450,7 @@ def get_image_arches(pull_spec: str) -> Set[str]:
     :raises IIBError: if the pull specification is not a v2 manifest list
     """
     log.debug('Get the available arches for %s', pull_spec)
-    skopeo_raw = skopeo_inspect(f'docker://{pull_spec}', '--raw')
-    arches = set()
-    if skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.list.v2+json':
-        for manifest in skopeo_raw['manifests']:
-            arches.add(manifest['platform']['architecture'])
-    elif skopeo_raw.get('mediaType') == 'application/vnd.docker.distribution.manifest.v2+json':
-        skopeo_out = skopeo_inspect(f'docker://{pull_spec}', '--config')
-        arches.add(skopeo_out['architecture'])
-    else:
-        raise IIBError(
-            f'The pull specification of {pull_spec} is neither a v2 manifest list nor a v2 manifest'
-        )
-
-    return arches
+    return get_image_metadata(pull_spec).arches
 
 
 def get_index_image_info(
@@ -1120,8 +1556,8 @@ def verify_labels(bundles: List[str]) -> None:
     if not conf['iib_required_labels']:
         return
 
-    for bundle in bundles:
-        labels = get_image_labels(bundle)
+    bundles_labels = run_per_image_concurrently(get_image_labels, bundles)
+    for bundle, labels in zip(bundles, bundles_labels):
         for label, value in conf['iib_required_labels'].items():
             if labels.get(label) != value:
                 raise IIBError(f'The bundle {bundle} does not have the label {label}={value}')
@@ -1230,8 +1666,13 @@ def prepare_request_for_build(
     log.debug('Set to build the index image for the following arches: %s', arches_str)
 
     bundle_mapping: Dict[str, Any] = {}
-    for bundle in bundles:
-        operator = get_image_label(bundle, 'operators.operatorframework.io.bundle.package.v1')
+    bundles_operators = run_per_image_concurrently(
+        functools.partial(
+            get_image_label, label='operators.operatorframework.io.bundle.package.v1'
+        ),
+        bundles,
+    )
+    for bundle, operator in zip(bundles, bundles_operators):
         if operator:
             bundle_mapping.setdefault(operator, []).append(bundle)
     source_from_index_resolved = index_info['source_from_index']['resolved_from_index']
@@ -4,6 +4,7 @@ from unittest import mock
 
 from botocore.response import StreamingBody
 from io import StringIO
+from kombu.exceptions import OperationalError
 import pytest
 from sqlalchemy.exc import DisconnectionError
 
@@ -282,6 +283,112 @@ def test_from_index_startswith_filter(
     }
 
 
+def test_input_digest_filter(
+    app, client, db, minimal_request_add, minimal_request_rm, minimal_request_fbc_operations
+):
+    for minimal_request in (
+        minimal_request_add,
+        minimal_request_rm,
+        minimal_request_fbc_operations,
+    ):
+        minimal_request.add_state('complete', 'The request is complete')
+    minimal_request_add.input_digest = 'sha256:123456'
+    minimal_request_rm.input_digest = 'sha256:abcdef'
+    minimal_request_fbc_operations.input_digest = 'sha256:123456'
+    db.session.commit()
+
+    rv_json = client.get('/api/v1/builds?input_digest=sha256:123456').json
+    assert rv_json['meta']['total'] == 2
+    assert 'input_digest=sha256' in rv_json['meta']['first']
+    assert {item['id'] for item in rv_json['items']} == {
+        minimal_request_add.id,
+        minimal_request_fbc_operations.id,
+    }
+
+    rv_json = client.get('/api/v1/builds?input_digest=sha256:abcdef').json
+    assert rv_json['meta']['total'] == 1
+    assert rv_json['items'][0]['id'] == minimal_request_rm.id
+
+    rv_json = client.get('/api/v1/builds?input_digest=sha256:000000').json
+    assert rv_json['meta']['total'] == 0
+
+
+def test_get_builds_keyset(app, auth_env, client, db):
+    total_requests = 25
+    with app.test_request_context(environ_base=auth_env):
+        for i in range(total_requests):
+            data = {
+                'binary_image': 'quay.io/namespace/binary_image:latest',
+                'bundles': [f'quay.io/namespace/bundle:{i}'],
+                'from_index': f'quay.io/namespace/repo:{i}',
+            }
+            request = RequestAdd.from_json(data)
+            if i % 5 == 0:
+                request.add_state('failed', 'Failed due to an unknown error')
+            db.session.add(request)
+        db.session.commit()
+
+    rv_json = client.get('/api/v1/builds?after_id=26&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == list(range(25, 15, -1))
+    assert 'page' not in rv_json['meta']
+    assert rv_json['meta']['per_page'] == 10
+    assert rv_json['meta']['total'] == total_requests
+    assert 'after_id=&' in rv_json['meta']['first']
+    assert 'before_id=0' in rv_json['meta']['last']
+    assert 'before_id=25' in rv_json['meta']['previous']
+    assert 'after_id=16' in rv_json['meta']['next']
+
+    rv_json = client.get(rv_json['meta']['next']).json
+    assert [item['id'] for item in rv_json['items']] == list(range(15, 5, -1))
+    assert 'after_id=6' in rv_json['meta']['next']
+
+    rv_json = client.get(rv_json['meta']['next']).json
+    assert [item['id'] for item in rv_json['items']] == list(range(5, 0, -1))
+    assert rv_json['meta']['next'] is None
+    assert 'before_id=5' in rv_json['meta']['previous']
+
+    rv_json = client.get('/api/v1/builds?before_id=15&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == list(range(25, 15, -1))
+    assert rv_json['meta']['previous'] is None
+    assert 'after_id=16' in rv_json['meta']['next']
+
+    # The first page stays paginated by the IDs
+    first_page_json = client.get(rv_json['meta']['first']).json
+    assert [item['id'] for item in first_page_json['items']] == list(range(25, 15, -1))
+    assert 'page' not in first_page_json['meta']
+    assert first_page_json['meta']['previous'] is None
+    assert 'after_id=16' in first_page_json['meta']['next']
+    assert first_page_json['meta']['first'] == rv_json['meta']['first']
+
+    rv_json = client.get('/api/v1/builds?before_id=0&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == list(range(10, 0, -1))
+    assert 'before_id=10' in rv_json['meta']['previous']
+    assert rv_json['meta']['next'] is None
+
+    rv_json = client.get('/api/v1/builds?after_id=26&state=failed&estimate_total=true').json
+    assert [item['id'] for item in rv_json['items']] == [21, 16, 11, 6, 1]
+    assert rv_json['meta']['total'] == 5
+    assert rv_json['meta']['next'] is None
+    assert 'state=failed' in rv_json['meta']['first']
+    assert 'estimate_total=true' in rv_json['meta']['first']
+
+
+@pytest.mark.parametrize(
+    'query_params, error',
+    (
+        ('after_id=abc', 'The after_id value must be a non-negative integer'),
+        ('before_id=-1', 'The before_id value must be a non-negative integer'),
+        ('after_id=3&before_id=1', 'The after_id and before_id parameters are mutually exclusive'),
+        ('after_id=&before_id=1', 'The after_id and before_id parameters are mutually exclusive'),
+        ('after_id=3&per_page=0', 'The per_page value must be a positive integer'),
+    ),
+)
+def test_get_builds_keyset_invalid(app, client, db, query_params, error):
+    rv = client.get(f'/api/v1/builds?{query_params}')
+    assert rv.status_code == 400
+    assert rv.json == {'error': error}
+
+
 def test_get_builds_invalid_state(app, client, db):
     rv = client.get('/api/v1/builds?state=is_it_lunch_yet%3F')
     assert rv.status_code == 400
@@ -1191,6 +1298,22 @@ def test_patch_request_forbidden_user(mock_smfsc, minimal_request, worker_forbid
     mock_smfsc.assert_not_called()
 
 
+@mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
+def test_patch_request_input_digest(mock_smfsc, db, minimal_request_rm, worker_auth_env, client):
+    minimal_request_rm.add_state('in_progress', 'Starting things up!')
+    db.session.commit()
+
+    rv = client.patch(
+        f'/api/v1/builds/{minimal_request_rm.id}',
+        json={'input_digest': 'sha256:123456'},
+        environ_base=worker_auth_env,
+    )
+
+    assert rv.status_code == 200, rv.json
+    assert db.session.get(RequestRm, minimal_request_rm.id).input_digest == 'sha256:123456'
+    mock_smfsc.assert_not_called()
+
+
 @pytest.mark.parametrize('distribution_scope', (None, 'stage'))
 @mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
 def test_patch_request_add_success(
@@ -1475,6 +1598,71 @@ def test_remove_operator_success(mock_smfsc, mock_rm, binary_image, db, auth_env
     mock_smfsc.assert_called_once_with(mock.ANY, new_batch_msg=True)
 
 
+@pytest.mark.parametrize('prefetch_queue', (None, 'iib_prefetch'))
+@mock.patch('iib.web.api_v1.handle_prefetch_request')
+@mock.patch('iib.web.api_v1.handle_add_request')
+@mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
+def test_add_bundle_prefetch(
+    mock_smfsc, mock_har, mock_hpr, prefetch_queue, app, db, auth_env, client
+):
+    app.config['IIB_PREFETCH_QUEUE'] = prefetch_queue
+    data = {
+        'binary_image': 'binary:image',
+        'bundles': ['some:thing'],
+        'from_index': 'index:image',
+    }
+
+    rv = client.post('/api/v1/builds/add', json=data, environ_base=auth_env)
+
+    assert rv.status_code == 201, rv.json
+    mock_har.apply_async.assert_called_once()
+    if prefetch_queue:
+        mock_hpr.apply_async.assert_called_once_with(
+            args=[1, 'index:image', 'binary:image', ['some:thing']], queue='iib_prefetch'
+        )
+    else:
+        mock_hpr.apply_async.assert_not_called()
+
+
+@mock.patch('iib.web.api_v1.handle_prefetch_request')
+@mock.patch('iib.web.api_v1.handle_rm_request')
+@mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
+def test_remove_operator_prefetch(mock_smfsc, mock_hrr, mock_hpr, app, db, auth_env, client):
+    app.config['IIB_PREFETCH_QUEUE'] = 'iib_prefetch'
+    data = {
+        'binary_image': 'binary:image',
+        'operators': ['some:thing'],
+        'from_index': 'index:image',
+    }
+
+    rv = client.post('/api/v1/builds/rm', json=data, environ_base=auth_env)
+
+    assert rv.status_code == 201, rv.json
+    mock_hpr.apply_async.assert_called_once_with(
+        args=[1, 'index:image', 'binary:image', None], queue='iib_prefetch'
+    )
+
+
+@mock.patch('iib.web.api_v1.handle_prefetch_request')
+@mock.patch('iib.web.api_v1.handle_rm_request')
+@mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
+def test_remove_operator_prefetch_broker_error(
+    mock_smfsc, mock_hrr, mock_hpr, app, db, auth_env, client
+):
+    app.config['IIB_PREFETCH_QUEUE'] = 'iib_prefetch'
+    mock_hpr.apply_async.side_effect = OperationalError('Connection refused')
+    data = {
+        'binary_image': 'binary:image',
+        'operators': ['some:thing'],
+        'from_index': 'index:image',
+    }
+
+    rv = client.post('/api/v1/builds/rm', json=data, environ_base=auth_env)
+
+    assert rv.status_code == 201, rv.json
+    assert rv.json['state'] == 'in_progress'
+
+
 @mock.patch('iib.web.api_v1.handle_rm_request')
 @mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
 def test_remove_operator_overwrite_token_redacted(mock_smfsc, mock_hrr, app, auth_env, client, db):
@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from iib.web.models import RequestAdd
+from iib.web.utils import get_estimated_total
+
+
+def test_get_estimated_total(app, db, minimal_request_add, minimal_request_rm):
+    assert get_estimated_total(RequestAdd.query) == 1
+
+
+@mock.patch('iib.web.utils.db')
+def test_get_estimated_total_postgresql(mock_db, app, db):
+    connection = mock_db.session.connection.return_value
+    connection.dialect = postgresql.dialect()
+    connection.exec_driver_sql.return_value.scalar_one.return_value = [
+        {'Plan': {'Node Type': 'Seq Scan', 'Plan Rows': 1234}}
+    ]
+
+    assert get_estimated_total(RequestAdd.query.filter(RequestAdd.id > 3)) == 1234
+
+    sql, params = connection.exec_driver_sql.call_args[0]
+    assert sql.startswith('EXPLAIN (FORMAT JSON) SELECT')
+    assert 'ORDER BY' not in sql
+    assert list(params.values()) == [3]
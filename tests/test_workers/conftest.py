@@ -0,0 +1,20 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import pytest
+
+from iib.common.common_utils import clear_binary_versions_cache
+from iib.workers.tasks.opm_operations import clear_opm_version_cache
+from iib.workers.tasks.utils import clear_image_metadata_cache, invalidate_resolved_image_cache
+
+
+@pytest.fixture(autouse=True)
+def image_metadata_cache():
+    """Ensure that the data cached by a test is not visible to other tests."""
+    clear_image_metadata_cache()
+    invalidate_resolved_image_cache()
+    clear_opm_version_cache()
+    clear_binary_versions_cache()
+    yield
+    clear_image_metadata_cache()
+    invalidate_resolved_image_cache()
+    clear_opm_version_cache()
+    clear_binary_versions_cache()
@@ -37,6 +37,26 @@ def test_get_request_not_ok(mock_session):
         api_utils.get_request(3)
 
 
+@mock.patch('iib.workers.api_utils.requests_session')
+def test_get_requests(mock_session):
+    mock_session.get.return_value.ok = True
+    mock_session.get.return_value.json.return_value = {'items': [{'id': 3}], 'meta': {}}
+
+    assert api_utils.get_requests({'state': 'complete'}) == [{'id': 3}]
+
+    mock_session.get.assert_called_once_with(
+        'http://iib-api:8080/api/v1/builds', params={'state': 'complete'}, timeout=120
+    )
+
+
+@mock.patch('iib.workers.api_utils.requests_session')
+def test_get_requests_not_ok(mock_session):
+    mock_session.get.return_value.ok = False
+
+    with pytest.raises(IIBError, match='The worker failed to get the requests matching'):
+        api_utils.get_requests({'state': 'complete'})
+
+
 @mock.patch('iib.workers.api_utils.update_request')
 def test_set_request_state(mock_update_request):
     state = 'failed'
@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import errno
+import fcntl
+import os
+from unittest import mock
+
+from iib.workers import artifact_cache
+from iib.workers.artifact_cache import ArtifactCache, get_artifact_cache
+
+
+def _read_tree(path):
+    contents = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename)) as f:
+                contents[os.path.relpath(os.path.join(dirpath, filename), path)] = f.read()
+    return contents
+
+
+def test_artifact_cache_directory(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), 1024)
+    extracted = tmpdir.mkdir('extracted').mkdir('configs')
+    extracted.mkdir('operator').join('catalog.json').write('{}')
+
+    assert cache.get('sha256:abc', '/configs', str(tmpdir.join('first'))) is False
+    cache.put('sha256:abc', '/configs', str(extracted))
+    assert cache.get('sha256:abc', '/configs/', str(tmpdir.join('first'))) is True
+    # The clone can be modified without affecting the cache
+    tmpdir.join('first', 'operator', 'catalog.json').write('modified')
+    existing = tmpdir.mkdir('second')
+    existing.join('other.json').write('other')
+    assert cache.get('sha256:abc', '/configs', str(existing)) is True
+
+    assert _read_tree(str(tmpdir.join('first'))) == {'operator/catalog.json': 'modified'}
+    assert _read_tree(str(existing)) == {'operator/catalog.json': '{}', 'other.json': 'other'}
+    assert cache.get('sha256:def', '/configs', str(tmpdir.join('third'))) is False
+
+
+def test_artifact_cache_file_corrupted(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), 1024)
+    tmpdir.join('index.db').write('database')
+    cache.put('sha256:abc', '/var/lib/iib/index.db', str(tmpdir.join('index.db')))
+    assert cache.get('sha256:abc', '/var/lib/iib/index.db', str(tmpdir.join('copy.db'))) is True
+    assert tmpdir.join('copy.db').read() == 'database'
+
+    entry_dir = cache._get_entry_dir('sha256:abc', '/var/lib/iib/index.db')
+    with open(os.path.join(entry_dir, 'content'), 'a') as f:
+        f.write('corruption')
+
+    assert cache.get('sha256:abc', '/var/lib/iib/index.db', str(tmpdir.join('bad.db'))) is False
+    assert not os.path.exists(entry_dir)
+    assert not tmpdir.join('bad.db').exists()
+
+
+def test_artifact_cache_file_corrupted_same_size_and_mtime(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), 1024)
+    tmpdir.join('index.db').write('database')
+    cache.put('sha256:abc', '/var/lib/iib/index.db', str(tmpdir.join('index.db')))
+
+    content = os.path.join(cache._get_entry_dir('sha256:abc', '/var/lib/iib/index.db'), 'content')
+    stat = os.stat(content)
+    with open(content, 'w') as f:
+        f.write('corrupt!')
+    os.utime(content, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert cache.get('sha256:abc', '/var/lib/iib/index.db', str(tmpdir.join('bad.db'))) is False
+    assert not tmpdir.join('bad.db').exists()
+
+
+def test_artifact_cache_removes_stale_staging_dirs(tmpdir):
+    cache_dir = tmpdir.mkdir('cache')
+    for name in ('.tmp-stale', '.trash-stale', '.tmp-in-use'):
+        cache_dir.mkdir(name).join('content').write('x' * 4)
+    for name in ('.tmp-stale', '.trash-stale'):
+        os.utime(str(cache_dir.join(name)), (1, 1))
+
+    cache = ArtifactCache(str(cache_dir), 1024)
+
+    assert sorted(os.listdir(str(cache_dir))) == ['.tmp-in-use']
+    os.utime(str(cache_dir.join('.tmp-in-use')), (1, 1))
+    tmpdir.join('file').write('x')
+    cache.put('sha256:1', '/file', str(tmpdir.join('file')))
+    assert os.listdir(str(cache_dir)) == [
+        os.path.basename(cache._get_entry_dir('sha256:1', '/file'))
+    ]
+
+
+def test_artifact_cache_evicts_least_recently_used(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), 10)
+    for name in ('first', 'second', 'third'):
+        tmpdir.join(name).write('x' * 4)
+
+    cache.put('sha256:1', '/file', str(tmpdir.join('first')))
+    os.utime(os.path.join(cache._get_entry_dir('sha256:1', '/file'), 'manifest.json'), (1, 1))
+    cache.put('sha256:2', '/file', str(tmpdir.join('second')))
+    os.utime(os.path.join(cache._get_entry_dir('sha256:2', '/file'), 'manifest.json'), (2, 2))
+    # Using the first entry makes the second one the least recently used
+    assert cache.get('sha256:1', '/file', str(tmpdir.join('copy'))) is True
+    cache.put('sha256:3', '/file', str(tmpdir.join('third')))
+
+    assert os.path.exists(cache._get_entry_dir('sha256:1', '/file'))
+    assert not os.path.exists(cache._get_entry_dir('sha256:2', '/file'))
+    assert os.path.exists(cache._get_entry_dir('sha256:3', '/file'))
+
+
+def test_artifact_cache_keeps_entries_in_use(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), 4)
+    for name in ('first', 'second'):
+        tmpdir.join(name).write('x' * 4)
+    cache.put('sha256:1', '/file', str(tmpdir.join('first')))
+
+    with open(os.path.join(cache._get_entry_dir('sha256:1', '/file'), 'manifest.json')) as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        cache.put('sha256:2', '/file', str(tmpdir.join('second')))
+        assert os.path.exists(cache._get_entry_dir('sha256:1', '/file'))
+
+    assert not os.path.exists(cache._get_entry_dir('sha256:2', '/file'))
+
+
+@mock.patch('iib.workers.artifact_cache.fcntl.ioctl')
+def test_clone_file_fallback(mock_ioctl, tmpdir):
+    mock_ioctl.side_effect = OSError(errno.EOPNOTSUPP, 'Operation not supported')
+    src = tmpdir.join('src')
+    src.write('content')
+    os.chmod(str(src), 0o755)
+
+    artifact_cache._clone_file(str(src), str(tmpdir.join('dst')))
+
+    assert tmpdir.join('dst').read() == 'content'
+    assert os.stat(str(tmpdir.join('dst'))).st_mode & 0o777 == 0o755
+
+
+@mock.patch('iib.workers.artifact_cache._artifact_cache', None)
+@mock.patch('iib.workers.artifact_cache.get_worker_config')
+def test_get_artifact_cache(mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(iib_artifact_cache_dir=None)
+    assert get_artifact_cache() is None
+
+    mock_gwc.return_value = mock.Mock(
+        iib_artifact_cache_dir=str(tmpdir), iib_artifact_cache_max_size=10
+    )
+    cache = get_artifact_cache()
+    assert cache.max_size == 10
+    assert get_artifact_cache() is cache
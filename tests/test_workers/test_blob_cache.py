@@ -0,0 +1,95 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import fcntl
+import hashlib
+import io
+import os
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers.blob_cache import BlobCache, get_blob_cache
+
+
+def _digest(content):
+    return f'sha256:{hashlib.sha256(content).hexdigest()}'
+
+
+def test_blob_cache_open(tmpdir):
+    cache = BlobCache(str(tmpdir), 1024)
+    fetch = mock.Mock(side_effect=lambda: io.BytesIO(b'layer'))
+
+    for _ in range(2):
+        with cache.open(_digest(b'layer'), fetch) as blob:
+            assert blob.read() == b'layer'
+
+    fetch.assert_called_once()
+    assert os.listdir(tmpdir.join('sha256')) == [_digest(b'layer').split(':')[1]]
+
+
+def test_blob_cache_open_digest_mismatch(tmpdir):
+    cache = BlobCache(str(tmpdir), 1024)
+
+    with pytest.raises(IIBError, match='does not match its digest'):
+        with cache.open(_digest(b'layer'), lambda: io.BytesIO(b'tampered')):
+            pass
+
+    assert os.listdir(tmpdir.join('sha256')) == []
+
+
+def test_blob_cache_open_invalid_digest(tmpdir):
+    cache = BlobCache(str(tmpdir), 1024)
+
+    with pytest.raises(IIBError, match='The blob digest sha256:../../etc is not supported'):
+        with cache.open('sha256:../../etc', lambda: io.BytesIO(b'')):
+            pass
+
+
+def test_blob_cache_evicts_least_recently_used(tmpdir):
+    cache = BlobCache(str(tmpdir), 10)
+    blobs = [b'a' * 4, b'b' * 4, b'c' * 4]
+    for i, content in enumerate(blobs[:2]):
+        with cache.open(_digest(content), lambda content=content: io.BytesIO(content)):
+            pass
+        os.utime(cache._get_path(_digest(content)), (i, i))
+    # Using the first blob makes the second one the least recently used
+    with cache.open(_digest(blobs[0]), mock.Mock()):
+        pass
+
+    with cache.open(_digest(blobs[2]), lambda: io.BytesIO(blobs[2])):
+        pass
+
+    assert os.path.exists(cache._get_path(_digest(blobs[0])))
+    assert not os.path.exists(cache._get_path(_digest(blobs[1])))
+    assert os.path.exists(cache._get_path(_digest(blobs[2])))
+
+
+def test_blob_cache_keeps_blobs_in_use(tmpdir):
+    cache = BlobCache(str(tmpdir), 4)
+    other_process, in_process, new = b'a' * 4, b'b' * 4, b'c' * 4
+    with cache.open(_digest(other_process), lambda: io.BytesIO(other_process)):
+        pass
+
+    # Simulate another worker process reading the blob
+    with open(cache._get_path(_digest(other_process)), 'rb') as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        with cache.open(_digest(in_process), lambda: io.BytesIO(in_process)) as blob:
+            with cache.open(_digest(new), lambda: io.BytesIO(new)):
+                pass
+            assert blob.read() == in_process
+
+    # All the blobs were in use, so the budget is exceeded until the next eviction
+    for content in (other_process, in_process, new):
+        assert os.path.exists(cache._get_path(_digest(content)))
+
+
+@mock.patch('iib.workers.blob_cache._blob_cache', None)
+@mock.patch('iib.workers.blob_cache.get_worker_config')
+def test_get_blob_cache(mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(iib_blob_cache_dir=None)
+    assert get_blob_cache() is None
+
+    mock_gwc.return_value = mock.Mock(iib_blob_cache_dir=str(tmpdir), iib_blob_cache_max_size=10)
+    cache = get_blob_cache()
+    assert cache.max_size == 10
+    assert get_blob_cache() is cache
@@ -80,6 +80,107 @@ def test_validate_celery_config_iib_required_labels_not_dict():
         validate_celery_config(conf)
 
 
+@pytest.mark.parametrize(
+    'option, value',
+    (
+        ('iib_image_inspection_max_workers', 0),
+        ('iib_image_inspection_max_workers', '10'),
+        ('iib_registry_concurrency_limit', -1),
+        ('iib_max_concurrent_builds', 0),
+    ),
+)
+def test_validate_celery_config_invalid_concurrency(option, value):
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_required_labels': {},
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        option: value,
+    }
+    with pytest.raises(ConfigError, match=f'{option} must be a positive integer'):
+        validate_celery_config(conf)
+
+
+@pytest.mark.parametrize(
+    'option, value',
+    (
+        ('iib_from_index_rebase_attempts', -1),
+        ('iib_max_coalesced_requests', -1),
+        ('iib_max_coalesced_requests', '4'),
+        ('iib_resolved_image_cache_ttl', -30),
+    ),
+)
+def test_validate_celery_config_invalid_non_negative_integer(option, value):
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_required_labels': {},
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        option: value,
+    }
+    with pytest.raises(ConfigError, match=f'{option} must be a non-negative integer'):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_registry_client():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_required_labels': {},
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_registry_client': 'curl',
+    }
+    with pytest.raises(
+        ConfigError, match='iib_registry_client must be either "skopeo" or "native"'
+    ):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_index_db_reader():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_required_labels': {},
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_index_db_reader': 'sqlite',
+    }
+    with pytest.raises(
+        ConfigError, match='iib_index_db_reader must be one of "native", "opm" or "compat"'
+    ):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_invalid_catalog_layers():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_required_labels': {},
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_catalog_layers': 'file',
+    }
+    with pytest.raises(ConfigError, match='iib_catalog_layers must be one of'):
+        validate_celery_config(conf)
+
+
+def test_validate_celery_config_worker_slots_without_isolated_auths():
+    conf = {
+        'iib_api_url': 'http://localhost:8080/api/v1/',
+        'iib_registry': 'registry',
+        'iib_required_labels': {},
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {},
+        'iib_worker_slots_dir': '/var/lib/iib-slots',
+        'worker_concurrency': 4,
+    }
+    with pytest.raises(ConfigError, match='iib_isolated_registry_auths must be enabled'):
+        validate_celery_config(conf)
+
+
 def test_validate_celery_config_iib_replace_registry_not_dict():
     conf = {
         'iib_api_url': 'http://localhost:8080/api/v1/',
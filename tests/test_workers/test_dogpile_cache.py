@@ -1,7 +1,20 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import threading
+import time
+from unittest import mock
+
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
 import pytest
 
-from iib.workers.dogpile_cache import generate_cache_key
+from iib.workers.dogpile_cache import (
+    create_local_dogpile_region,
+    dogpile_cache,
+    generate_cache_key,
+    get_cache_stats,
+    SQLiteBackend,
+)
 
 
 @pytest.mark.parametrize(
@@ -33,3 +46,89 @@ from iib.workers.dogpile_cache import generate_cache_key
 def test_generate_cache_key(args, kwargs):
     passwd = generate_cache_key('function_name', *args, **kwargs)
     assert len(passwd) <= 250
+
+
+def test_sqlite_backend_lru_eviction(tmpdir):
+    backend = SQLiteBackend({'filename': str(tmpdir.join('cache.db')), 'max_size': 10})
+    backend.set_serialized('a', b'aaaa')
+    backend.set_serialized('b', b'bbbb')
+    # Reading "a" makes "b" the least recently used value
+    assert backend.get_serialized('a') == b'aaaa'
+    backend.set_serialized('c', b'cccc')
+
+    assert backend.get_serialized('a') == b'aaaa'
+    assert backend.get_serialized('b') is NO_VALUE
+    assert backend.get_serialized('c') == b'cccc'
+
+    backend.delete('a')
+    assert backend.get_serialized('a') is NO_VALUE
+
+
+def test_sqlite_backend_connection_per_process_and_thread(tmpdir):
+    filename = tmpdir.join('cache.db')
+    backend = SQLiteBackend({'filename': str(filename)})
+    # The database isn't opened before the worker forks its child processes
+    assert not filename.exists()
+
+    backend.set_serialized('a', b'aaaa')
+    connection = backend._connection
+    assert backend._connection is connection
+
+    thread_connections = []
+    thread = threading.Thread(target=lambda: thread_connections.append(backend._connection))
+    thread.start()
+    thread.join()
+    assert thread_connections[0] is not connection
+
+    # A forked process opens its own connection instead of using the inherited one
+    with mock.patch('iib.workers.dogpile_cache.os.getpid', return_value=os.getpid() + 1):
+        assert backend._connection is not connection
+        assert backend.get_serialized('a') == b'aaaa'
+
+
+def test_sqlite_backend_persistent(tmpdir):
+    filename = str(tmpdir.join('cache.db'))
+    region = make_region().configure('iib.sqlite', arguments={'filename': filename})
+    region.set('key', {'Name': 'some-image'})
+
+    other_region = make_region().configure('iib.sqlite', arguments={'filename': filename})
+    assert other_region.get('key') == {'Name': 'some-image'}
+
+
+def test_dogpile_cache_two_tiers(tmpdir):
+    local_region = make_region().configure(
+        'iib.sqlite', arguments={'filename': str(tmpdir.join('cache.db'))}
+    )
+    shared_region = make_region().configure('dogpile.cache.memory', expiration_time=1)
+    inspect = mock.Mock(return_value={'Name': 'some-image'})
+    inspect.__name__ = 'two_tiers_inspect'
+
+    cached_inspect = dogpile_cache(
+        shared_region,
+        should_use_cache_fn=lambda image: '@sha256:' in image,
+        local_dogpile_region=local_region,
+        immutable=True,
+    )(inspect)
+
+    assert cached_inspect('image@sha256:123') == {'Name': 'some-image'}
+    assert cached_inspect('image@sha256:123') == {'Name': 'some-image'}
+    assert cached_inspect('image:latest') == {'Name': 'some-image'}
+    # A value only present in the shared tier is copied to the local tier
+    shared_region.set(generate_cache_key('two_tiers_inspect', 'image@sha256:456'), 'shared')
+    with mock.patch('time.time', return_value=time.time() + 3600):
+        # Immutable values don't expire
+        assert cached_inspect('image@sha256:456') == 'shared'
+    assert cached_inspect('image@sha256:456') == 'shared'
+
+    assert inspect.call_count == 2
+    assert get_cache_stats()['two_tiers_inspect'] == {
+        'local_hits': 2,
+        'shared_hits': 1,
+        'misses': 1,
+    }
+
+
+@mock.patch('iib.workers.dogpile_cache.get_worker_config')
+def test_create_local_dogpile_region_disabled(mock_gwc):
+    mock_gwc.return_value = mock.Mock(iib_dogpile_local_cache_path=None)
+    assert create_local_dogpile_region() is None
@@ -0,0 +1,355 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import io
+import json
+import threading
+from unittest import mock
+
+import pytest
+import requests
+import urllib3
+
+from iib.exceptions import IIBError
+from iib.workers import registry_client
+
+
+def _response(status_code=200, body='', headers=None):
+    rv = mock.Mock(
+        status_code=status_code,
+        ok=status_code < 400,
+        content=body.encode('utf-8'),
+        text=body,
+        headers=headers or {},
+    )
+    rv.json.side_effect = lambda: json.loads(body)
+    return rv
+
+
+@pytest.mark.parametrize(
+    'pull_spec, registry, host, repository, reference',
+    (
+        (
+            'docker://quay.io/ns/repo@sha256:123',
+            'quay.io',
+            'quay.io',
+            'ns/repo',
+            'sha256:123',
+        ),
+        ('registry:8443/ns/repo', 'registry:8443', 'registry:8443', 'ns/repo', 'latest'),
+        ('busybox:1', 'docker.io', 'registry-1.docker.io', 'library/busybox', '1'),
+    ),
+)
+def test_image_reference(pull_spec, registry, host, repository, reference):
+    image = registry_client.ImageReference(pull_spec)
+    assert image.registry == registry
+    assert image.host == host
+    assert image.repository == repository
+    assert image.reference == reference
+
+
+def test_parse_challenge():
+    rv = registry_client._parse_challenge(
+        'Bearer realm="https://quay.io/v2/auth",service="quay.io",scope="repository:ns/repo:pull"'
+    )
+    assert rv == (
+        'bearer',
+        {
+            'realm': 'https://quay.io/v2/auth',
+            'service': 'quay.io',
+            'scope': 'repository:ns/repo:pull',
+        },
+    )
+
+
+def test_get_auth(tmpdir, monkeypatch):
+    auth_file = tmpdir.join('auth.json')
+    auth_file.write(
+        json.dumps(
+            {
+                'auths': {
+                    'quay.io': {'auth': 'cmVnaXN0cnk='},
+                    'quay.io/ns': {'auth': 'bmFtZXNwYWNl'},
+                }
+            }
+        )
+    )
+    monkeypatch.setenv('REGISTRY_AUTH_FILE', str(auth_file))
+    client = registry_client.RegistryClient(timeout=30)
+
+    assert client._get_auth(registry_client.ImageReference('quay.io/ns/repo:1')) == 'bmFtZXNwYWNl'
+    assert client._get_auth(registry_client.ImageReference('quay.io/other/repo:1')) == (
+        'cmVnaXN0cnk='
+    )
+    assert client._get_auth(registry_client.ImageReference('registry.io/ns/repo:1')) is None
+
+
+def test_get_auth_file_of_request(tmpdir, monkeypatch):
+    request_auth_file = tmpdir.join('request.json')
+    request_auth_file.write(json.dumps({'auths': {'quay.io': {'auth': 'cmVxdWVzdA=='}}}))
+    monkeypatch.setenv('REGISTRY_AUTH_FILE', str(tmpdir.join('missing.json')))
+    client = registry_client.RegistryClient(timeout=30)
+    image = registry_client.ImageReference('quay.io/ns/repo:1')
+
+    token = registry_client.registry_auth_file.set(str(request_auth_file))
+    try:
+        assert client._get_auth(image) == 'cmVxdWVzdA=='
+    finally:
+        registry_client.registry_auth_file.reset(token)
+    assert client._get_auth(image) is None
+
+
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_get_raw_manifest_caches_token(mock_ga):
+    mock_ga.return_value = 'dXNlcjpwYXNz'
+    manifest = '{"schemaVersion": 2, "mediaType": "application/vnd.oci.image.index.v1+json"}'
+    client = registry_client.RegistryClient(timeout=30)
+    challenge = 'Bearer realm="https://quay.io/v2/auth",service="quay.io"'
+    client._session = mock.Mock()
+    client._session.request.side_effect = [
+        _response(401, headers={'WWW-Authenticate': challenge}),
+        _response(body=manifest),
+        _response(body=manifest),
+    ]
+    client._session.get.return_value = _response(body='{"token": "some-token", "expires_in": 300}')
+
+    assert client.get_raw_manifest('docker://quay.io/ns/repo:1') == manifest.encode('utf-8')
+    assert client.get_raw_manifest('quay.io/ns/repo@sha256:123') == manifest.encode('utf-8')
+
+    client._session.get.assert_called_once_with(
+        'https://quay.io/v2/auth',
+        params={'scope': 'repository:ns/repo:pull', 'service': 'quay.io'},
+        headers={'Authorization': 'Basic dXNlcjpwYXNz'},
+        timeout=30,
+    )
+    request_calls = client._session.request.call_args_list
+    assert len(request_calls) == 3
+    assert request_calls[1][0] == ('GET', 'https://quay.io/v2/ns/repo/manifests/1')
+    assert request_calls[1][1]['headers']['Authorization'] == 'Bearer some-token'
+    # The cached token is used right away for the following requests
+    assert request_calls[2][0] == ('GET', 'https://quay.io/v2/ns/repo/manifests/sha256:123')
+    assert request_calls[2][1]['headers']['Authorization'] == 'Bearer some-token'
+    # The token request is a round trip too
+    assert client.get_round_trips() == 4
+
+
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_get_round_trips_per_thread(mock_ga):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    client._session = mock.Mock()
+    client._session.request.return_value = _response(body='{}')
+
+    client.get_raw_manifest('quay.io/ns/repo:1')
+    thread = threading.Thread(target=client.get_raw_manifest, args=('quay.io/ns/repo:2',))
+    thread.start()
+    thread.join()
+
+    assert client._session.request.call_count == 2
+    assert client.get_round_trips() == 1
+
+
+@mock.patch('iib.workers.registry_client.platform.machine')
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_get_config_manifest_list(mock_ga, mock_machine):
+    mock_ga.return_value = None
+    mock_machine.return_value = 's390x'
+    manifest_list = {
+        'mediaType': 'application/vnd.docker.distribution.manifest.list.v2+json',
+        'manifests': [
+            {'digest': 'sha256:amd64', 'platform': {'architecture': 'amd64', 'os': 'linux'}},
+            {'digest': 'sha256:s390x', 'platform': {'architecture': 's390x', 'os': 'linux'}},
+        ],
+    }
+    manifest = {
+        'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+        'config': {'digest': 'sha256:config'},
+    }
+    config = '{"architecture": "s390x"}'
+    client = registry_client.RegistryClient(timeout=30)
+    client._session = mock.Mock()
+    client._session.request.side_effect = [
+        _response(body=json.dumps(manifest_list)),
+        _response(body=json.dumps(manifest)),
+        _response(body=config),
+    ]
+
+    assert client.get_config('quay.io/ns/repo:1') == config.encode('utf-8')
+    urls = [request_call[0][1] for request_call in client._session.request.call_args_list]
+    assert urls == [
+        'https://quay.io/v2/ns/repo/manifests/1',
+        'https://quay.io/v2/ns/repo/manifests/sha256:s390x',
+        'https://quay.io/v2/ns/repo/blobs/sha256:config',
+    ]
+
+
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_get_raw_manifest_not_decoded(mock_ga):
+    mock_ga.return_value = None
+    # The annotation isn't ASCII and the response doesn't specify its charset
+    manifest = json.dumps(
+        {
+            'schemaVersion': 2,
+            'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+            'annotations': {'org.opencontainers.image.authors': 'Jiří Novák'},
+        },
+        ensure_ascii=False,
+    ).encode('utf-8')
+    rv = requests.Response()
+    rv.status_code = 200
+    rv.headers['Content-Type'] = 'application/vnd.oci.image.manifest.v1+json'
+    rv._content = manifest
+    client = registry_client.RegistryClient(timeout=30)
+    client._session = mock.Mock()
+    client._session.request.return_value = rv
+
+    raw_manifest = client.get_raw_manifest('quay.io/ns/repo:1')
+
+    assert raw_manifest == manifest
+    assert hashlib.sha256(raw_manifest).hexdigest() == hashlib.sha256(manifest).hexdigest()
+
+
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_get_raw_manifest_not_found(mock_ga):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    client._session = mock.Mock()
+    client._session.request.return_value = _response(404)
+
+    expected = 'Failed to get https://quay.io/v2/ns/repo/manifests/1. The status was 404.'
+    with pytest.raises(IIBError, match=expected):
+        client.get_raw_manifest('quay.io/ns/repo:1')
+
+
+@pytest.mark.parametrize('digest', ('sha256:123', None))
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_get_manifest_digest(mock_ga, digest):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    client._session = mock.Mock()
+    headers = {'Docker-Content-Digest': digest} if digest else {}
+    client._session.request.return_value = _response(headers=headers)
+
+    assert client.get_manifest_digest('quay.io/ns/repo:1') == digest
+    client._session.request.assert_called_once_with(
+        'HEAD',
+        'https://quay.io/v2/ns/repo/manifests/1',
+        headers=mock.ANY,
+        timeout=30,
+        stream=False,
+    )
+
+
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_upload_blob(mock_ga, tmpdir):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    client._session = mock.Mock()
+    client._session.request.side_effect = [
+        _response(404),
+        _response(202, headers={'Location': '/v2/ns/repo/blobs/uploads/abc?_state=xyz'}),
+        _response(201),
+    ]
+    image = registry_client.ImageReference('quay.io/ns/repo:1-amd64')
+    tmpdir.join('blob').write('content')
+
+    assert client.blob_exists(image, 'sha256:123') is False
+    with open(str(tmpdir.join('blob')), 'rb') as blob:
+        client.upload_blob(image, 'sha256:123', blob, 7)
+
+    request_calls = client._session.request.call_args_list
+    assert [request_call[0] for request_call in request_calls] == [
+        ('HEAD', 'https://quay.io/v2/ns/repo/blobs/sha256:123'),
+        ('POST', 'https://quay.io/v2/ns/repo/blobs/uploads/'),
+        ('PUT', 'https://quay.io/v2/ns/repo/blobs/uploads/abc?_state=xyz'),
+    ]
+    assert request_calls[2][1]['params'] == {'digest': 'sha256:123'}
+    assert request_calls[2][1]['headers']['Content-Length'] == '7'
+
+
+@pytest.mark.parametrize('retried', (False, True))
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_upload_blob_stream(mock_ga, retried):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    challenge = 'Bearer realm="https://quay.io/v2/auth",service="quay.io"'
+    client._session = mock.Mock()
+    client._session.request.side_effect = [
+        _response(202, headers={'Location': '/v2/ns/repo/blobs/uploads/abc'}),
+        _response(401, headers={'WWW-Authenticate': challenge}) if retried else _response(201),
+    ]
+    client._session.get.return_value = _response(body='{"token": "some-token"}')
+    image = registry_client.ImageReference('quay.io/ns/repo:1-amd64')
+    # The blobs streamed from the registry can't be rewound
+    blob = urllib3.HTTPResponse(body=io.BytesIO(b'content'), preload_content=False)
+
+    if retried:
+        with pytest.raises(IIBError, match="can't be sent again"):
+            client.upload_blob(image, 'sha256:123', blob, 7)
+    else:
+        client.upload_blob(image, 'sha256:123', blob, 7)
+
+    assert client._session.request.call_args_list[1][1]['data'] is blob
+    assert client._session.request.call_count == 2
+
+
+@pytest.mark.parametrize(
+    'from_pull_spec, status_code, expected',
+    (
+        ('quay.io/ns/base@sha256:456', 201, True),
+        ('quay.io/ns/base@sha256:456', 202, False),
+        ('quay.io/ns/base@sha256:456', 403, False),
+        ('registry.io/ns/base@sha256:456', None, False),
+    ),
+)
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_mount_blob(mock_ga, from_pull_spec, status_code, expected):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    challenge = 'Bearer realm="https://quay.io/v2/auth",service="quay.io"'
+    client._session = mock.Mock()
+    client._session.request.side_effect = [
+        _response(401, headers={'WWW-Authenticate': challenge}),
+        _response(status_code or 201),
+    ]
+    client._session.get.return_value = _response(body='{"token": "some-token"}')
+    image = registry_client.ImageReference('quay.io/ns/repo:1-amd64')
+    from_image = registry_client.ImageReference(from_pull_spec)
+
+    assert client.mount_blob(image, 'sha256:123', from_image) is expected
+
+    if status_code is None:
+        client._session.request.assert_not_called()
+        return
+    assert client._session.request.call_args[0] == (
+        'POST',
+        'https://quay.io/v2/ns/repo/blobs/uploads/',
+    )
+    assert client._session.request.call_args[1]['params'] == {
+        'mount': 'sha256:123',
+        'from': 'ns/base',
+    }
+    assert client._session.get.call_args[1]['params']['scope'] == [
+        'repository:ns/repo:pull,push',
+        'repository:ns/base:pull',
+    ]
+
+
+@mock.patch.object(registry_client.RegistryClient, '_get_auth')
+def test_put_manifest_requests_push_scope(mock_ga):
+    mock_ga.return_value = None
+    client = registry_client.RegistryClient(timeout=30)
+    challenge = 'Bearer realm="https://quay.io/v2/auth",service="quay.io"'
+    client._session = mock.Mock()
+    client._session.request.side_effect = [
+        _response(401, headers={'WWW-Authenticate': challenge}),
+        _response(400),
+    ]
+    client._session.get.return_value = _response(body='{"token": "some-token"}')
+    image = registry_client.ImageReference('quay.io/ns/repo:1-amd64')
+
+    expected = 'Failed to put https://quay.io/v2/ns/repo/manifests/1-amd64. The status was 400.'
+    with pytest.raises(IIBError, match=expected):
+        client.put_manifest(image, b'{}', 'application/vnd.docker.distribution.manifest.v2+json')
+
+    assert client._session.get.call_args[1]['params']['scope'] == 'repository:ns/repo:pull,push'
+    assert client._session.request.call_args[1]['data'] == b'{}'
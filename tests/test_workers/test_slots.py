@@ -0,0 +1,116 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import tempfile
+from textwrap import dedent
+from unittest import mock
+
+import pytest
+
+from iib.workers import slots
+
+
+@pytest.fixture()
+def restore_environment(monkeypatch):
+    """Restore the environment and the temporary directory modified by the slot set up."""
+    for name in ('CONTAINERS_STORAGE_CONF', 'CONTAINERS_CONF_OVERRIDE', 'TMPDIR'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(tempfile, 'tempdir', tempfile.tempdir)
+    monkeypatch.setattr(slots, '_current_slot', None)
+
+
+def test_get_storage_conf():
+    slot = slots.WorkerSlot(1, 4, '/var/lib/iib-slots')
+    base_storage_conf = dedent(
+        '''\
+        [storage]
+        driver = "overlay"
+        runroot = "/run/containers/storage"
+        graphroot = "/var/lib/containers/storage"
+
+        [storage.options.overlay]
+        mount_program = "/usr/bin/fuse-overlayfs"
+        '''
+    )
+
+    assert slot.get_storage_conf(base_storage_conf) == dedent(
+        '''\
+        [storage]
+        graphroot = "/var/lib/iib-slots/slot-1/storage"
+        runroot = "/var/lib/iib-slots/slot-1/run"
+        driver = "overlay"
+
+        [storage.options.overlay]
+        mount_program = "/usr/bin/fuse-overlayfs"
+        '''
+    )
+    assert slot.get_storage_conf('') == dedent(
+        '''\
+        [storage]
+        driver = "overlay"
+        graphroot = "/var/lib/iib-slots/slot-1/storage"
+        runroot = "/var/lib/iib-slots/slot-1/run"
+        '''
+    )
+
+
+@mock.patch('iib.workers.config.get_worker_config')
+def test_setup_worker_slot(mock_gwc, restore_environment, tmpdir):
+    mock_gwc.return_value = {'iib_worker_slots_dir': None}
+    assert slots.setup_worker_slot(0) is None
+    assert slots.get_current_slot() is None
+
+    base_storage_conf = tmpdir.join('storage.conf')
+    base_storage_conf.write('[storage]\ndriver = "vfs"\n')
+    mock_gwc.return_value = mock.MagicMock(worker_concurrency=2)
+    mock_gwc.return_value.get.return_value = str(tmpdir.join('slots'))
+    mock_gwc.return_value.iib_worker_slots_dir = str(tmpdir.join('slots'))
+    with mock.patch.object(slots, '_original_storage_conf', str(base_storage_conf)):
+        slot = slots.setup_worker_slot(1)
+
+    assert slots.get_current_slot() is slot
+    assert (slot.index, slot.count) == (1, 2)
+    slot_dir = tmpdir.join('slots', 'slot-1')
+    for name in ('storage', 'run', 'tmp'):
+        assert slot_dir.join(name).isdir()
+    assert 'driver = "vfs"' in slot_dir.join('storage.conf').read()
+    assert f'graphroot = "{slot_dir.join("storage")}"' in slot_dir.join('storage.conf').read()
+    assert slot_dir.join('containers.conf').read() == (
+        f'[engine]\ntmp_dir = "{slot_dir.join("run", "libpod")}"\n'
+    )
+    assert os.environ['CONTAINERS_STORAGE_CONF'] == str(slot_dir.join('storage.conf'))
+    assert os.environ['CONTAINERS_CONF_OVERRIDE'] == str(slot_dir.join('containers.conf'))
+    assert os.environ['TMPDIR'] == str(slot_dir.join('tmp'))
+    assert tempfile.gettempdir() == str(slot_dir.join('tmp'))
+
+
+def test_get_arch_container_storage(restore_environment, tmpdir):
+    with mock.patch.object(tempfile, 'tempdir', str(tmpdir)):
+        assert slots.get_arch_container_storages() == []
+        storage = slots.get_arch_container_storage('s390x')
+        assert storage.directory == str(tmpdir.join('iib-arches', 's390x'))
+
+        with slots.use_container_storage(storage):
+            assert slots.container_storage.get() is storage
+        assert slots.container_storage.get() is None
+
+        assert [s.directory for s in slots.get_arch_container_storages()] == [storage.directory]
+        assert tmpdir.join('iib-arches', 's390x', 'storage').isdir()
+        assert tmpdir.join('iib-arches', 's390x', 'containers.conf').read() == (
+            f'[engine]\ntmp_dir = "{tmpdir.join("iib-arches", "s390x", "run", "libpod")}"\n'
+        )
+
+    slots._current_slot = slots.WorkerSlot(1, 2, str(tmpdir.join('slots')))
+    assert slots.get_arch_container_storage('s390x').directory == str(
+        tmpdir.join('slots', 'slot-1', 'arches', 's390x')
+    )
+    assert slots.container_storage.get() is None
+    env = slots.get_arch_container_storage('s390x').get_env({'PATH': '/usr/bin'})
+    assert env == {
+        'PATH': '/usr/bin',
+        'CONTAINERS_STORAGE_CONF': str(
+            tmpdir.join('slots', 'slot-1', 'arches', 's390x', 'storage.conf')
+        ),
+        'CONTAINERS_CONF_OVERRIDE': str(
+            tmpdir.join('slots', 'slot-1', 'arches', 's390x', 'containers.conf')
+        ),
+    }
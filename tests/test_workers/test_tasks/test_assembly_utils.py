@@ -0,0 +1,204 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import gzip
+import hashlib
+import json
+import tarfile
+import textwrap
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers.registry_client import ImageReference
+from iib.workers.tasks import assembly_utils
+
+DOCKERFILE = textwrap.dedent(
+    '''\
+    FROM registry.io/binary:latest
+    ENTRYPOINT ["/bin/opm"]
+    CMD ["serve", "/configs", "--cache-dir=/tmp/cache"]
+    ADD catalog /configs
+    COPY --chown=1001:0 cache /tmp/cache
+    LABEL operators.operatorframework.io.index.configs.v1=/configs
+    LABEL architecture="x86_64" com.redhat.index.delivery.version="v4.14"
+    '''
+)
+
+
+def _create_context(tmpdir):
+    tmpdir.mkdir('catalog').mkdir('operator').join('catalog.json').write('{}')
+    tmpdir.mkdir('cache').join('digest').write('123')
+    tmpdir.join('index.Dockerfile').write(DOCKERFILE)
+
+
+def test_parse_dockerfile(tmpdir):
+    tmpdir.join('index.Dockerfile').write(DOCKERFILE)
+
+    spec = assembly_utils.parse_dockerfile(str(tmpdir.join('index.Dockerfile')))
+
+    assert spec.base_image == 'registry.io/binary:latest'
+    assert spec.entrypoint == ['/bin/opm']
+    assert spec.cmd == ['serve', '/configs', '--cache-dir=/tmp/cache']
+    assert spec.copies == [('catalog', '/configs', 0, 0), ('cache', '/tmp/cache', 1001, 0)]
+    assert spec.labels == {
+        'operators.operatorframework.io.index.configs.v1': '/configs',
+        'architecture': 'x86_64',
+        'com.redhat.index.delivery.version': 'v4.14',
+    }
+
+
+@pytest.mark.parametrize(
+    'dockerfile, error',
+    (
+        ('FROM a\nRUN true\n', 'The RUN instruction is not supported'),
+        ('FROM a AS b\n', 'Only a single stage without options is supported'),
+        ('FROM a\nCOPY --from=b /c /d\n', 'Only the numeric --chown of COPY works'),
+        ('FROM a\nADD https://host/db /db\n', 'Only ADD of a single local source works'),
+        ('LABEL a=b\n', 'The LABEL instruction precedes FROM'),
+    ),
+)
+def test_parse_dockerfile_unsupported(dockerfile, error, tmpdir):
+    tmpdir.join('Dockerfile').write(dockerfile)
+
+    with pytest.raises(assembly_utils.UnsupportedDockerfile, match=error):
+        assembly_utils.parse_dockerfile(str(tmpdir.join('Dockerfile')))
+
+
+def test_create_layer(tmpdir):
+    _create_context(tmpdir)
+
+    layers = [
+        assembly_utils._create_layer(
+            str(tmpdir), 'cache', '/tmp/cache', 1001, 0, str(tmpdir.join(f'layer{i}.tar.gz'))
+        )
+        for i in range(2)
+    ]
+
+    # The layers are reproducible, so they are only pushed once to the registry
+    assert layers[0]['digest'] == layers[1]['digest']
+    with open(layers[0]['path'], 'rb') as f:
+        content = f.read()
+    assert layers[0]['digest'] == f'sha256:{hashlib.sha256(content).hexdigest()}'
+    assert layers[0]['size'] == len(content)
+    uncompressed = gzip.decompress(content)
+    assert layers[0]['diff_id'] == f'sha256:{hashlib.sha256(uncompressed).hexdigest()}'
+    with tarfile.open(layers[0]['path']) as tar:
+        members = {member.name: member for member in tar}
+    assert sorted(members) == ['tmp/cache', 'tmp/cache/digest']
+    assert members['tmp/cache'].mode == 0o755
+    assert {(member.uid, member.gid) for member in members.values()} == {(1001, 0)}
+
+
+@mock.patch('iib.workers.tasks.assembly_utils.get_worker_config')
+@mock.patch('iib.workers.tasks.assembly_utils.get_registry_client')
+def test_assemble_and_push_image(mock_grc, mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(
+        iib_buildless_index_assembly=True, iib_supported_archs={'amd64': 'x86_64'}
+    )
+    _create_context(tmpdir)
+    client = mock_grc.return_value
+    base_image = ImageReference('registry.io/binary@sha256:amd64')
+    client.get_image_manifest.return_value = (
+        base_image,
+        {
+            'mediaType': 'application/vnd.oci.image.manifest.v1+json',
+            'layers': [
+                {
+                    'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip',
+                    'size': 10,
+                    'digest': 'sha256:base',
+                }
+            ],
+        },
+    )
+    client.get_config.return_value = json.dumps(
+        {
+            'architecture': 'amd64',
+            'os': 'linux',
+            'config': {'Cmd': ['/bin/bash'], 'Labels': {'vendor': 'Red Hat'}},
+            'rootfs': {'type': 'layers', 'diff_ids': ['sha256:base-diff']},
+            'history': [{'created_by': 'base'}],
+        }
+    )
+    client.blob_exists.side_effect = lambda image, digest: digest == 'sha256:base'
+
+    assert assembly_utils.assemble_and_push_image(
+        str(tmpdir), 'index.Dockerfile', 'quay.io/iib/iib-build:1-amd64', 'amd64'
+    )
+
+    client.get_image_manifest.assert_called_once_with('registry.io/binary:latest', 'amd64')
+    uploaded = [upload_call[0][1] for upload_call in client.upload_blob.call_args_list]
+    assert len(uploaded) == 3
+    destination, manifest_blob, media_type = client.put_manifest.call_args[0]
+    assert str(destination.reference) == '1-amd64'
+    assert media_type == assembly_utils.DOCKER_MANIFEST_MEDIA_TYPE
+    manifest = json.loads(manifest_blob)
+    assert [layer['digest'] for layer in manifest['layers']] == ['sha256:base'] + uploaded[:2]
+    assert manifest['layers'][0]['mediaType'] == assembly_utils.DOCKER_LAYER_MEDIA_TYPE
+    assert manifest['config']['digest'] == uploaded[2]
+    config = json.loads(client.upload_blob.call_args_list[2][0][2])
+    assert config['config']['Entrypoint'] == ['/bin/opm']
+    assert config['config']['Cmd'] == ['serve', '/configs', '--cache-dir=/tmp/cache']
+    assert config['config']['Labels']['vendor'] == 'Red Hat'
+    assert config['config']['Labels']['architecture'] == 'x86_64'
+    assert len(config['rootfs']['diff_ids']) == 3
+    assert len([h for h in config['history'] if not h.get('empty_layer')]) == 3
+
+    # The layers are created once and shared by the images of the other architectures
+    layer_files = tmpdir.join(assembly_utils.LAYERS_DIR).listdir()
+    assembly_utils.assemble_and_push_image(
+        str(tmpdir), 'index.Dockerfile', 'quay.io/iib/iib-build:1-amd64', 'amd64'
+    )
+    assert tmpdir.join(assembly_utils.LAYERS_DIR).listdir() == layer_files
+
+
+@pytest.mark.parametrize('mounted', (True, False))
+@mock.patch('iib.workers.tasks.assembly_utils.open_blob')
+@mock.patch('iib.workers.tasks.assembly_utils.get_registry_client')
+def test_push_blob_base_layer(mock_grc, mock_ob, mounted):
+    client = mock_grc.return_value
+    client.blob_exists.return_value = False
+    client.mount_blob.return_value = mounted
+    base_image = ImageReference('quay.io/ns/binary@sha256:amd64')
+    destination = ImageReference('quay.io/iib/iib-build:1-amd64')
+    layer = {
+        'mediaType': assembly_utils.DOCKER_LAYER_MEDIA_TYPE,
+        'size': 10,
+        'digest': 'sha256:base',
+    }
+
+    assembly_utils._push_blob(base_image, destination, layer)
+
+    client.mount_blob.assert_called_once_with(destination, 'sha256:base', base_image)
+    if mounted:
+        mock_ob.assert_not_called()
+        client.upload_blob.assert_not_called()
+    else:
+        mock_ob.assert_called_once_with(client, base_image, 'sha256:base')
+        client.upload_blob.assert_called_once_with(
+            destination, 'sha256:base', mock_ob.return_value.__enter__.return_value, 10
+        )
+
+
+@pytest.mark.parametrize(
+    'enabled, dockerfile, manifest_error',
+    (
+        (False, DOCKERFILE, None),
+        (True, 'FROM registry.io/binary:latest\nRUN true\n', None),
+        (True, DOCKERFILE, IIBError('Failed to get the manifest')),
+    ),
+)
+@mock.patch('iib.workers.tasks.assembly_utils.get_worker_config')
+@mock.patch('iib.workers.tasks.assembly_utils.get_registry_client')
+def test_assemble_and_push_image_falls_back(
+    mock_grc, mock_gwc, enabled, dockerfile, manifest_error, tmpdir
+):
+    mock_gwc.return_value = mock.Mock(iib_buildless_index_assembly=enabled)
+    _create_context(tmpdir)
+    tmpdir.join('index.Dockerfile').write(dockerfile)
+    mock_grc.return_value.get_image_manifest.side_effect = manifest_error
+
+    assert not assembly_utils.assemble_and_push_image(
+        str(tmpdir), 'index.Dockerfile', 'quay.io/iib/iib-build:1-amd64', 'amd64'
+    )
+    mock_grc.return_value.put_manifest.assert_not_called()
@@ -1,5 +1,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 import copy
+import inspect
 import json
 import os
 import re
@@ -10,11 +11,13 @@ from unittest import mock
 import pytest
 
 from iib.exceptions import ExternalServiceError, IIBError
+from iib.workers import slots
 from iib.workers.tasks import build
 from iib.workers.tasks.iib_static_types import BundleImage
 from iib.workers.tasks.utils import RequestConfigAddRm
 from iib.workers.config import get_worker_config
 from operator_manifest.operator import ImageName
+from packaging.version import Version
 
 worker_config = get_worker_config()
 
@@ -56,6 +59,19 @@ def test_build_image(mock_run_cmd, mock_get_label, arch):
     mock_get_label.assert_called_with(local_destination, 'architecture')
 
 
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build.get_image_label')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+def test_build_image_catalog_layers(mock_run_cmd, mock_get_label, mock_gwc):
+    mock_gwc.return_value = mock.Mock(iib_catalog_layers='package')
+    mock_get_label.return_value = ''
+
+    build._build_image('/some/dir', 'some.Dockerfile', 3, 'amd64')
+
+    # The files added have the same modification time in every build
+    assert mock_run_cmd.call_args[0][0][:5] == ['buildah', 'bud', '--no-cache', '--timestamp', '0']
+
+
 @mock.patch('iib.workers.tasks.build.get_image_label')
 @mock.patch('iib.workers.tasks.build.run_cmd')
 def test_build_image_incorrect_arch(mock_run_cmd, mock_get_label):
@@ -92,21 +108,74 @@ def test_build_image_retry(mock_run_cmd):
     assert mock_run_cmd.call_count == worker_config.iib_total_attempts
 
 
+@mock.patch('iib.workers.tasks.build.get_arch_container_storages', return_value=[])
 @mock.patch('iib.workers.tasks.build.run_cmd')
 @mock.patch('iib.workers.tasks.build.reset_docker_config')
-def test_cleanup(mock_rdc, mock_run_cmd):
+@mock.patch('iib.workers.tasks.build.clear_image_metadata_cache')
+def test_cleanup(mock_cimc, mock_rdc, mock_run_cmd, mock_gacs):
     build._cleanup()
 
     mock_run_cmd.assert_called_once()
     rmi_args = mock_run_cmd.call_args[0][0]
     assert rmi_args[0:2] == ['podman', 'rmi']
     mock_rdc.assert_called_once_with()
+    mock_cimc.assert_called_once_with()
 
 
+@mock.patch('iib.workers.tasks.build.get_arch_container_storages')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.reset_docker_config')
+@mock.patch('iib.workers.tasks.build.clear_image_metadata_cache')
+def test_cleanup_arch_container_storages(mock_cimc, mock_rdc, mock_run_cmd, mock_gacs, tmp_path):
+    storages = [
+        slots.ContainerStorage(str(tmp_path / 'amd64')),
+        slots.ContainerStorage(str(tmp_path / 's390x')),
+    ]
+    mock_gacs.return_value = storages
+    used_storages = []
+    mock_run_cmd.side_effect = lambda *args, **kwargs: used_storages.append(
+        slots.container_storage.get()
+    )
+
+    build._cleanup()
+
+    assert mock_run_cmd.call_count == 3
+    for call in mock_run_cmd.call_args_list:
+        assert call[0][0] == ['podman', 'rmi', '--all', '--force']
+    assert used_storages == [None] + storages
+
+
+@mock.patch('iib.workers.tasks.build.get_arch_container_storages', return_value=[])
+@mock.patch('iib.workers.tasks.build.get_current_slot')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.reset_docker_config')
+@mock.patch('iib.workers.tasks.build.clear_image_metadata_cache')
+def test_cleanup_worker_slot(mock_cimc, mock_rdc, mock_run_cmd, mock_gcs, mock_gacs):
+    mock_gcs.return_value = mock.Mock(index=1, count=2)
+
+    build._cleanup()
+
+    mock_run_cmd.assert_called_once()
+    # The shared Docker config is left alone for the requests running in the other slots
+    mock_rdc.assert_not_called()
+    mock_cimc.assert_called_once_with()
+
+
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build.get_registry_client')
 @mock.patch('iib.workers.tasks.build.tempfile.TemporaryDirectory')
 @mock.patch('iib.workers.tasks.build.run_cmd')
 @mock.patch('iib.workers.tasks.build.open')
-def test_create_and_push_manifest_list(mock_open, mock_run_cmd, mock_td, tmp_path):
+def test_create_and_push_manifest_list(
+    mock_open, mock_run_cmd, mock_td, mock_grc, mock_gwc, tmp_path
+):
+    mock_gwc.return_value = {
+        'iib_image_push_template': '{registry}/iib-build:{request_id}',
+        'iib_registry': 'registry:8443',
+        'iib_registry_client': 'native',
+    }
+    manifest_list = b'{"mediaType": "application/vnd.docker.distribution.manifest.list.v2+json"}'
+    mock_grc.return_value.get_raw_manifest.return_value = manifest_list
     mock_td.return_value.__enter__.return_value = tmp_path
     mock_run_cmd.side_effect = [
         IIBError('Manifest list not found locally.'),
@@ -176,57 +245,74 @@ def test_create_and_push_manifest_list(mock_open, mock_run_cmd, mock_td, tmp_pat
             ],
             exc_msg='Failed to push the manifest list to registry:8443/iib-build:3',
         ),
-        mock.call(
-            ['buildah', 'manifest', 'rm', 'registry:8443/iib-build:extra_build_tag1'],
-            exc_msg='Failed to remove local manifest list. '
-            'registry:8443/iib-build:extra_build_tag1 does not exist',
-        ),
-        mock.call(
-            ['buildah', 'manifest', 'create', 'registry:8443/iib-build:extra_build_tag1'],
-            exc_msg='Failed to create the manifest list locally: '
-            'registry:8443/iib-build:extra_build_tag1',
-        ),
-        mock.call(
-            [
-                'buildah',
-                'manifest',
-                'add',
-                'registry:8443/iib-build:extra_build_tag1',
-                'docker://registry:8443/iib-build:3-amd64',
-            ],
-            exc_msg=(
-                'Failed to add docker://registry:8443/iib-build:3-amd64'
-                ' to the local manifest list: registry:8443/iib-build:extra_build_tag1'
-            ),
-        ),
-        mock.call(
-            [
-                'buildah',
-                'manifest',
-                'add',
-                'registry:8443/iib-build:extra_build_tag1',
-                'docker://registry:8443/iib-build:3-s390x',
-            ],
-            exc_msg=(
-                'Failed to add docker://registry:8443/iib-build:3-s390x'
-                ' to the local manifest list: registry:8443/iib-build:extra_build_tag1'
-            ),
-        ),
-        mock.call(
-            [
-                'buildah',
-                'manifest',
-                'push',
-                '--all',
-                '--format',
-                'v2s2',
-                'registry:8443/iib-build:extra_build_tag1',
-                'docker://registry:8443/iib-build:extra_build_tag1',
-            ],
-            exc_msg='Failed to push the manifest list to registry:8443/iib-build:extra_build_tag1',
-        ),
     ]
     assert mock_run_cmd.call_args_list == expected_calls
+    # The extra tags are applied by uploading the pushed manifest list as it is
+    mock_grc.return_value.get_raw_manifest.assert_called_once_with('registry:8443/iib-build:3')
+    destination, manifest, media_type = mock_grc.return_value.put_manifest.call_args[0]
+    assert (destination.repository, destination.reference) == ('iib-build', 'extra_build_tag1')
+    assert manifest == manifest_list
+    assert media_type == 'application/vnd.docker.distribution.manifest.list.v2+json'
+
+
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build._push_blob')
+@mock.patch('iib.workers.tasks.build.get_registry_client')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+def test_tag_manifest_list_other_repository(mock_run_cmd, mock_grc, mock_pb, mock_gwc):
+    mock_gwc.return_value = {'iib_registry_client': 'native'}
+    manifest_list = json.dumps(
+        {
+            'mediaType': 'application/vnd.docker.distribution.manifest.list.v2+json',
+            'manifests': [
+                {
+                    'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+                    'digest': 'sha256:amd64',
+                }
+            ],
+        }
+    ).encode('utf-8')
+    image_manifest = json.dumps(
+        {'config': {'digest': 'sha256:config'}, 'layers': [{'digest': 'sha256:layer'}]}
+    ).encode('utf-8')
+    mock_grc.return_value.get_raw_manifest.side_effect = [manifest_list, image_manifest]
+    mock_grc.return_value.get_round_trips.return_value = 0
+
+    # The source is the resolved index image of another request, which doesn't exist locally
+    build._tag_manifest_list('registry:8443/iib-build@sha256:list', ['registry:8443/iib:extra'])
+
+    mock_run_cmd.assert_not_called()
+    assert mock_grc.return_value.get_raw_manifest.call_args_list == [
+        mock.call('registry:8443/iib-build@sha256:list'),
+        mock.call('registry:8443/iib-build@sha256:amd64'),
+    ]
+    # The blobs are mounted from the repository of the source
+    assert [c[0][2]['digest'] for c in mock_pb.call_args_list] == ['sha256:config', 'sha256:layer']
+    for push_blob_call in mock_pb.call_args_list:
+        source, destination, _ = push_blob_call[0]
+        assert (source.repository, destination.repository) == ('iib-build', 'iib')
+    put_calls = mock_grc.return_value.put_manifest.call_args_list
+    assert [(c[0][0].repository, c[0][0].reference, c[0][1]) for c in put_calls] == [
+        ('iib', 'sha256:amd64', image_manifest),
+        ('iib', 'extra', manifest_list),
+    ]
+
+
+@mock.patch('iib.workers.tasks.build.get_registry_client')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+def test_create_and_push_manifest_list_skopeo(mock_run_cmd, mock_grc):
+    build._create_and_push_manifest_list(3, {'amd64'}, ['extra1', 'extra2'])
+
+    # Without the native registry client, the manifest list is copied with skopeo
+    mock_grc.assert_not_called()
+    copy_calls = [c for c in mock_run_cmd.call_args_list if c[0][0][0] == 'skopeo']
+    assert sorted(c[0][0][-1] for c in copy_calls) == [
+        'docker://registry:8443/iib-build:extra1',
+        'docker://registry:8443/iib-build:extra2',
+    ]
+    for copy_call in copy_calls:
+        assert copy_call[0][0][3:7] == ['copy', '--format', 'v2s2', '--all']
+        assert copy_call[0][0][-2] == 'docker://registry:8443/iib-build:3'
 
 
 @mock.patch('iib.workers.tasks.build.tempfile.TemporaryDirectory')
@@ -1196,6 +1282,191 @@ def test_handle_rm_request(
     assert mock_srs.call_args[0][1] == 'complete'
 
 
+@mock.patch('iib.workers.tasks.build._cleanup')
+@mock.patch('iib.workers.tasks.build.prepare_request_for_build')
+@mock.patch('iib.workers.tasks.build._update_index_image_build_state')
+@mock.patch('iib.workers.tasks.build.opm_index_rm')
+@mock.patch('iib.workers.tasks.build._reuse_duplicate_index_image')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build._create_and_push_manifest_list')
+@mock.patch('iib.workers.tasks.build._update_index_image_pull_spec')
+@mock.patch('iib.workers.tasks.build.is_image_fbc')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
+def test_handle_rm_request_duplicate(
+    mock_sov,
+    mock_iifbc,
+    mock_uiips,
+    mock_capml,
+    mock_srs,
+    mock_rdii,
+    mock_oir,
+    mock_uiibs,
+    mock_prfb,
+    mock_cleanup,
+):
+    mock_iifbc.return_value = False
+    mock_prfb.return_value = {
+        'arches': {'amd64'},
+        'binary_image': 'binary-image:latest',
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'from_index_resolved': 'from-index@sha256:bcdefg',
+        'ocp_version': 'v4.6',
+        'distribution_scope': 'prod',
+    }
+    mock_rdii.return_value = 'registry/iib-build:3'
+
+    build.handle_rm_request(['operator-b', 'operator-a'], 3, 'from-index:latest')
+
+    input_digest = build._get_request_input_digest(
+        'rm',
+        {
+            'arches': ['amd64'],
+            'binary_image': 'binary-image@sha256:abcdef',
+            'binary_image_config': None,
+            'distribution_scope': 'prod',
+            'from_index': 'from-index@sha256:bcdefg',
+            'operators': ['operator-a', 'operator-b'],
+        },
+    )
+    mock_rdii.assert_called_once_with(3, input_digest, None)
+    mock_oir.assert_not_called()
+    mock_capml.assert_not_called()
+    mock_uiips.assert_called_once_with(
+        output_pull_spec='registry/iib-build:3',
+        request_id=3,
+        arches={'amd64'},
+        from_index='from-index:latest',
+        overwrite_from_index=False,
+        overwrite_from_index_token=None,
+        resolved_prebuild_from_index='from-index@sha256:bcdefg',
+        add_or_rm=True,
+        is_image_fbc=False,
+        index_repo_map={},
+    )
+    assert mock_cleanup.call_count == 2
+    assert mock_srs.call_args[0][1] == 'complete'
+
+
+def get_input_digest_params(task):
+    """Get the parameters of the task which the digest of its inputs must have."""
+    params = set(inspect.signature(inspect.unwrap(task.run)).parameters)
+    return params - set(build._INPUT_DIGEST_IGNORED_PARAMS) | {'arches'}
+
+
+@pytest.mark.parametrize('task_name', ('handle_add_request', 'handle_rm_request'))
+@mock.patch('iib.workers.tasks.build._reuse_duplicate_index_image')
+@mock.patch('iib.workers.tasks.build._get_request_input_digest')
+@mock.patch('iib.workers.tasks.build._update_index_image_build_state')
+@mock.patch('iib.workers.tasks.build.prepare_request_for_build')
+@mock.patch('iib.workers.tasks.build.verify_labels')
+@mock.patch('iib.workers.tasks.build.get_resolved_bundles')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build._cleanup')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
+def test_request_input_digest_has_every_param(
+    mock_sov,
+    mock_cleanup,
+    mock_srs,
+    mock_grb,
+    mock_vl,
+    mock_prfb,
+    mock_uiibs,
+    mock_grid,
+    mock_rdii,
+    task_name,
+):
+    mock_grb.return_value = ['bundle@sha256:123']
+    mock_prfb.return_value = {
+        'arches': {'amd64'},
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'distribution_scope': 'prod',
+        'from_index_resolved': None,
+    }
+    mock_rdii.side_effect = IIBError('Stop once the input digest is known')
+    task = getattr(build, task_name)
+
+    with pytest.raises(IIBError, match='Stop once the input digest is known'):
+        task(['item'], 3, None)
+
+    # Every parameter which may change the index image built must be in the digest
+    assert set(mock_grid.call_args[0][1]) == get_input_digest_params(task)
+
+
+def test_get_request_input_digest():
+    digest = build._get_request_input_digest('add', {'bundles': ['b'], 'from_index': 'index'})
+
+    assert digest.startswith('sha256:')
+    assert digest == build._get_request_input_digest(
+        'add', {'from_index': 'index', 'bundles': ['b']}
+    )
+    assert digest != build._get_request_input_digest(
+        'rm', {'bundles': ['b'], 'from_index': 'index'}
+    )
+
+
+@pytest.mark.parametrize(
+    'duplicate_requests, tag_error, expected',
+    (
+        ([], None, None),
+        (
+            [{'id': 3, 'internal_index_image_copy_resolved': 'registry/iib-build@sha256:1'}],
+            None,
+            None,
+        ),
+        ([{'id': 2, 'internal_index_image_copy_resolved': None}], None, None),
+        (
+            [{'id': 2, 'internal_index_image_copy_resolved': 'registry/iib-build@sha256:1'}],
+            None,
+            'registry/iib-build:3',
+        ),
+        (
+            [{'id': 2, 'internal_index_image_copy_resolved': 'registry/iib-build@sha256:1'}],
+            IIBError('Failed to get the manifest'),
+            None,
+        ),
+    ),
+)
+@mock.patch('iib.workers.tasks.build._tag_manifest_list')
+@mock.patch('iib.workers.tasks.build.set_request_state')
+@mock.patch('iib.workers.tasks.build.get_requests')
+@mock.patch('iib.workers.tasks.build.update_request')
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+def test_reuse_duplicate_index_image(
+    mock_gwc, mock_ur, mock_gr, mock_srs, mock_tml, duplicate_requests, tag_error, expected
+):
+    mock_gwc.return_value = mock.MagicMock(iib_request_deduplication=True)
+    mock_gwc.return_value.__getitem__.side_effect = {
+        'iib_image_push_template': '{registry}/iib-build:{request_id}',
+        'iib_registry': 'registry',
+    }.__getitem__
+    mock_gr.return_value = duplicate_requests
+    mock_tml.side_effect = tag_error
+
+    rv = build._reuse_duplicate_index_image(3, 'sha256:123', ['extra'])
+
+    assert rv == expected
+    mock_ur.assert_called_once_with(3, {'input_digest': 'sha256:123'}, exc_msg=mock.ANY)
+    mock_gr.assert_called_once_with({'input_digest': 'sha256:123', 'state': 'complete'})
+    if expected or tag_error:
+        mock_tml.assert_called_once_with(
+            'registry/iib-build@sha256:1', ['registry/iib-build:3', 'registry/iib-build:extra']
+        )
+        mock_srs.assert_called_once_with(
+            3, 'in_progress', 'Reusing the index image built by the identical request 2'
+        )
+    else:
+        mock_tml.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.build.get_requests')
+@mock.patch('iib.workers.tasks.build.update_request')
+def test_reuse_duplicate_index_image_disabled(mock_ur, mock_gr):
+    assert build._reuse_duplicate_index_image(3, 'sha256:123', None) is None
+
+    mock_ur.assert_not_called()
+    mock_gr.assert_not_called()
+
+
 @mock.patch('iib.workers.tasks.build.opm_validate')
 @mock.patch('iib.workers.tasks.build.verify_operators_exists')
 @mock.patch('iib.workers.tasks.build._cleanup')
@@ -1220,7 +1491,7 @@ def test_handle_rm_request(
 @mock.patch('iib.workers.tasks.build.create_dockerfile')
 @mock.patch('os.rename')
 @mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
-@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version')
 def test_handle_rm_request_fbc(
     mock_govn,
     mock_sov,
@@ -1273,7 +1544,7 @@ def test_handle_rm_request_fbc(
     deprecation_file.write(deprecation_template)
 
     mock_voe.return_value = ['some-operator'], '/tmp/xyz/database/index.db'
-    mock_govn.return_value = '0.9.0'
+    mock_govn.return_value = Version('0.9.0')
     mock_iifbc.return_value = True
     from_index_resolved = 'from-index@sha256:bcdefg'
     mock_prfb.return_value = {
@@ -1346,6 +1617,92 @@ def test_verify_index_image_failure(mock_gri, mock_srt):
     mock_srt.assert_called_once_with('user:pass', 'unresolved_image', append=True)
 
 
+@mock.patch('iib.workers.tasks.build.set_registry_token')
+@mock.patch('iib.workers.tasks.build.get_resolved_image')
+@mock.patch('iib.workers.tasks.build.invalidate_resolved_image_cache')
+def test_verify_index_image_invalidates_cache(mock_iric, mock_gri, mock_srt):
+    mock_gri.return_value = 'image@sha256:123'
+
+    build._verify_index_image('image@sha256:123', 'image:latest')
+
+    mock_iric.assert_called_once_with('image:latest')
+    mock_gri.assert_called_once_with('image:latest')
+
+
+@pytest.mark.parametrize('extract_error', (None, IIBError('/configs does not exist in image')))
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build.extract_files_from_image')
+@mock.patch('iib.workers.tasks.build.run_cmd')
+@mock.patch('iib.workers.tasks.build.podman_pull')
+def test_copy_files_from_image_layers(
+    mock_podman_pull, mock_run_cmd, mock_efi, mock_gwc, extract_error
+):
+    mock_gwc.return_value = mock.Mock(iib_extract_files_from_layers=True)
+    mock_efi.side_effect = extract_error
+    mock_run_cmd.return_value = 'container-id\n'
+
+    build._copy_files_from_image('index-image:latest', '/configs', '/dest')
+
+    mock_efi.assert_called_once_with('index-image:latest', '/configs', '/dest')
+    if extract_error:
+        mock_podman_pull.assert_called_once_with('index-image:latest')
+        assert mock_run_cmd.call_count == 3
+    else:
+        mock_podman_pull.assert_not_called()
+        mock_run_cmd.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    'extract_from_layers, expected',
+    ((True, '/configs does not exist in image'), (False, 'with podman is not allowed')),
+)
+@mock.patch('iib.workers.tasks.build.get_worker_config')
+@mock.patch('iib.workers.tasks.build.extract_files_from_image')
+@mock.patch('iib.workers.tasks.build.podman_pull')
+def test_copy_files_from_image_no_podman_fallback(
+    mock_podman_pull, mock_efi, mock_gwc, extract_from_layers, expected
+):
+    mock_gwc.return_value = mock.Mock(iib_extract_files_from_layers=extract_from_layers)
+    mock_efi.side_effect = IIBError('/configs does not exist in image')
+
+    token = build.podman_copy_fallback.set(False)
+    try:
+        with pytest.raises(IIBError, match=expected):
+            build._copy_files_from_image('index-image:latest', '/configs', '/dest')
+    finally:
+        build.podman_copy_fallback.reset(token)
+
+    mock_podman_pull.assert_not_called()
+
+
+@pytest.mark.parametrize('cached', (True, False))
+@mock.patch('iib.workers.tasks.build._copy_files_from_image_uncached')
+@mock.patch('iib.workers.tasks.build.get_artifact_cache')
+def test_copy_files_from_image_artifact_cache(mock_gac, mock_cffiu, cached, tmpdir):
+    image = 'index-image@sha256:abc'
+    mock_gac.return_value.get.return_value = cached
+
+    build._copy_files_from_image(image, '/configs/', str(tmpdir))
+
+    dest_root = os.path.join(str(tmpdir), 'configs')
+    mock_gac.return_value.get.assert_called_once_with('sha256:abc', '/configs/', dest_root)
+    if cached:
+        mock_cffiu.assert_not_called()
+        mock_gac.return_value.put.assert_not_called()
+    else:
+        mock_cffiu.assert_called_once_with(image, '/configs/', str(tmpdir))
+        mock_gac.return_value.put.assert_called_once_with('sha256:abc', '/configs/', dest_root)
+
+
+@mock.patch('iib.workers.tasks.build._copy_files_from_image_uncached')
+@mock.patch('iib.workers.tasks.build.get_artifact_cache')
+def test_copy_files_from_image_artifact_cache_tag(mock_gac, mock_cffiu):
+    build._copy_files_from_image('index-image:latest', '/configs', '/dest')
+
+    mock_gac.return_value.get.assert_not_called()
+    mock_cffiu.assert_called_once_with('index-image:latest', '/configs', '/dest')
+
+
 @pytest.mark.parametrize('fail_rm', (True, False))
 @mock.patch('iib.workers.tasks.build.run_cmd')
 @mock.patch('iib.workers.tasks.build.podman_pull')
@@ -1455,11 +1812,11 @@ def test_get_missing_bundles_match_hash():
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
-def test_get_present_bundles(mock_run_cmd, mock_gidp, tmpdir):
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
+def test_get_present_bundles(mock_run_cmd_stream, mock_gidp, tmpdir):
     mock_gidp.return_value = '/tmp'
-    mock_run_cmd.return_value = '\n'.join(
-        json.dumps(a)
+    mock_run_cmd_stream.return_value = iter(
+        json.dumps(a) + '\n'
         for a in [
             {
                 "schema": "olm.bundle",
@@ -1503,23 +1860,23 @@ def test_get_present_bundles(mock_run_cmd, mock_gidp, tmpdir):
         ),
     ]
     assert bundles_pull_spec == ['bundle1', 'bundle2']
-    mock_run_cmd.assert_called_once()
+    mock_run_cmd_stream.assert_called_once()
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 def test_get_no_present_bundles(
-    mock_run_cmd,
+    mock_run_cmd_stream,
     mock_gidp,
     tmpdir,
 ):
-    mock_run_cmd.return_value = ''
+    mock_run_cmd_stream.return_value = iter([])
     mock_gidp.return_value = '/tmp'
 
     bundle, bundle_pull_spec = build._get_present_bundles('quay.io/index-image:4.5', str(tmpdir))
     assert bundle == []
     assert bundle_pull_spec == []
-    mock_run_cmd.assert_called_once()
+    mock_run_cmd_stream.assert_called_once()
 
 
 @mock.patch('iib.workers.tasks.build.skopeo_inspect')
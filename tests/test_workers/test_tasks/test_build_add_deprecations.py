@@ -217,6 +217,7 @@ def test_add_deprecations_to_index_dep_dir_not_exist(
         base_dir=tmpdir,
         fbc_dir=mock_gcd.return_value,
         local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index_resolved,
     )
     mock_cd.assert_called_once()
     # assert deprecations_file and dir exist
@@ -269,6 +270,7 @@ def test_add_deprecations_to_index_dep_dir_exist(
         base_dir=tmpdir,
         fbc_dir=mock_gcd.return_value,
         local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index_resolved,
     )
     mock_cd.assert_called_once()
     # assert file has right content
@@ -327,6 +329,7 @@ def test_add_deprecations_to_index_file_exist(
         base_dir=tmpdir,
         fbc_dir=mock_gcd.return_value,
         local_cache_path=os.path.join(tmpdir, 'cache'),
+        from_index=from_index_resolved,
     )
     mock_cd.assert_called_once()
 
@@ -1,7 +1,11 @@
 from unittest import mock
 
+import pytest
+
+from iib.exceptions import IIBError
 from iib.workers.tasks import build_fbc_operations
 from iib.workers.tasks.utils import RequestConfigFBCOperation
+from tests.test_workers.test_tasks.test_build import get_input_digest_params
 
 
 @mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_pull_spec')
@@ -601,3 +605,31 @@ def test_handle_fbc_operation_request_with_overwrite_from_index(
         resolved_prebuild_from_index=from_index_resolved,
         add_or_rm=True,
     )
+
+
+@mock.patch('iib.workers.tasks.build_fbc_operations._reuse_duplicate_index_image')
+@mock.patch('iib.workers.tasks.build_fbc_operations._get_request_input_digest')
+@mock.patch('iib.workers.tasks.build_fbc_operations._update_index_image_build_state')
+@mock.patch('iib.workers.tasks.build_fbc_operations.prepare_request_for_build')
+@mock.patch('iib.workers.tasks.build_fbc_operations.get_resolved_image')
+@mock.patch('iib.workers.tasks.build_fbc_operations.set_request_state')
+@mock.patch('iib.workers.tasks.build_fbc_operations._cleanup')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.set_opm_version')
+def test_handle_fbc_operation_request_input_digest_has_every_param(
+    mock_sov, mock_cleanup, mock_srs, mock_gri, mock_prfb, mock_uiibs, mock_grid, mock_rdii
+):
+    mock_gri.return_value = 'fbc-fragment@sha256:123'
+    mock_prfb.return_value = {
+        'arches': {'amd64'},
+        'binary_image_resolved': 'binary-image@sha256:abcdef',
+        'distribution_scope': 'prod',
+        'from_index_resolved': 'from-index@sha256:bcdefg',
+    }
+    mock_rdii.side_effect = IIBError('Stop once the input digest is known')
+    task = build_fbc_operations.handle_fbc_operation_request
+
+    with pytest.raises(IIBError, match='Stop once the input digest is known'):
+        task(3, ['fbc-fragment:latest'], 'from-index:latest')
+
+    # Every parameter which may change the index image built must be in the digest
+    assert set(mock_grid.call_args[0][1]) == get_input_digest_params(task)
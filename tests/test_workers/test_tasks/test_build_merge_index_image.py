@@ -20,7 +20,7 @@ from iib.workers.tasks.utils import RequestConfigMerge
     ),
 )
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch('iib.workers.tasks.build_merge_index_image._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build._verify_index_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.create_dockerfile')
@@ -73,7 +73,7 @@ def test_handle_merge_request(
     mock_ogd,
     mock_vii,
     mock_uiips,
-    mock_run_cmd,
+    mock_run_cmd_stream,
     mock_gidp,
     target_index,
     target_index_resolved,
@@ -123,15 +123,19 @@ def test_handle_merge_request(
     mock_verify_operator_exits.return_value = (mock_dep_b, "")
 
     mock_gidp.return_value = '/tmp'
-    mock_run_cmd.return_value = json.dumps(
-        {
-            "schema": "olm.bundle",
-            "image": "bundle1",
-            "name": "name1",
-            "package": "package1",
-            "version": "v1.0",
-            "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
-        }
+    mock_run_cmd_stream.return_value = iter(
+        [
+            json.dumps(
+                {
+                    "schema": "olm.bundle",
+                    "image": "bundle1",
+                    "name": "name1",
+                    "package": "package1",
+                    "version": "v1.0",
+                    "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
+                }
+            )
+        ]
     )
 
     build_merge_index_image.handle_merge_request(
@@ -181,7 +185,7 @@ def test_handle_merge_request(
     mock_uiips.assert_called_once()
 
     mock_sov.assert_called_once_with(target_index_resolved)
-    mock_run_cmd.assert_called_once()
+    mock_run_cmd_stream.assert_called_once()
 
 
 @pytest.mark.parametrize('source_fbc, target_fbc', [(False, False), (False, True), (True, True)])
@@ -197,7 +201,7 @@ def test_handle_merge_request(
     ],
 )
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch('iib.workers.tasks.build_merge_index_image._update_index_image_pull_spec')
 @mock.patch('iib.workers.tasks.build._verify_index_image')
 @mock.patch('iib.workers.tasks.build_merge_index_image.create_dockerfile')
@@ -250,7 +254,7 @@ def test_handle_merge_request_no_deprecate(
     mock_ogd,
     mock_vii,
     mock_uiips,
-    mock_run_cmd,
+    mock_run_cmd_stream,
     mock_gidp,
     invalid_bundles,
     filtered_invalid_version_bundles_names,
@@ -279,15 +283,19 @@ def test_handle_merge_request_no_deprecate(
     mock_abmis.return_value = ([], invalid_bundles)
     mock_gid.return_value = 'database/index.db'
     mock_om.return_value = 'catalog', 'cache'
-    mock_run_cmd.return_value = json.dumps(
-        {
-            "schema": "olm.bundle",
-            "image": "bundle1",
-            "name": "name1",
-            "package": "package1",
-            "version": "v1.0",
-            "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
-        }
+    mock_run_cmd_stream.return_value = iter(
+        [
+            json.dumps(
+                {
+                    "schema": "olm.bundle",
+                    "image": "bundle1",
+                    "name": "name1",
+                    "package": "package1",
+                    "version": "v1.0",
+                    "properties": [{"type": "olm.package", "value": {"version": "0.1.0"}}],
+                }
+            )
+        ]
     )
     mock_verify_operators_exists.return_value = (filtered_invalid_version_bundles_names, "db_path")
     build_merge_index_image.handle_merge_request(
@@ -354,7 +362,7 @@ def test_handle_merge_request_no_deprecate(
     mock_capml.assert_called_once_with(1, {'amd64', 'other_arch'}, None)
     mock_sov.assert_called_once_with(target_index_resolved)
     mock_uiips.assert_called_once()
-    mock_run_cmd.assert_not_called()
+    mock_run_cmd_stream.assert_not_called()
 
 
 @mock.patch('iib.workers.config.get_worker_config')
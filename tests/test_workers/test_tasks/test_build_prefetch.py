@@ -0,0 +1,140 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import logging
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers.tasks import build, build_prefetch
+
+
+@pytest.mark.parametrize('image_is_fbc', (True, False))
+@mock.patch('iib.workers.tasks.build_prefetch.get_worker_config')
+@mock.patch('iib.workers.tasks.build_prefetch._copy_files_from_image')
+@mock.patch('iib.workers.tasks.build_prefetch._get_index_database')
+@mock.patch('iib.workers.tasks.build_prefetch.get_hidden_index_database')
+@mock.patch('iib.workers.tasks.build_prefetch.get_catalog_dir')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_labels')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_label')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_bundles')
+@mock.patch('iib.workers.tasks.build_prefetch.is_image_fbc')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_arches')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_image')
+@mock.patch('iib.workers.tasks.build_prefetch.get_artifact_cache')
+@mock.patch('iib.workers.tasks.build_prefetch.get_blob_cache')
+def test_handle_prefetch_request(
+    mock_gbc,
+    mock_gac,
+    mock_gri,
+    mock_gia,
+    mock_iifbc,
+    mock_grb,
+    mock_gil,
+    mock_gils,
+    mock_gcd,
+    mock_ghid,
+    mock_gid,
+    mock_cffi,
+    mock_gwc,
+    image_is_fbc,
+):
+    mock_gwc.return_value = mock.Mock(iib_extract_files_from_layers=True)
+    mock_gbc.return_value = None
+    mock_gac.return_value = mock.Mock()
+    mock_gri.side_effect = lambda pull_spec: f'{pull_spec.split(":")[0]}@sha256:123'
+    mock_iifbc.return_value = image_is_fbc
+    mock_grb.return_value = ['bundle@sha256:456']
+    mock_gil.return_value = '/manifests'
+    podman_copy_fallbacks = []
+    mock_cffi.side_effect = lambda *args: podman_copy_fallbacks.append(
+        build.podman_copy_fallback.get()
+    )
+
+    build_prefetch.handle_prefetch_request(3, 'index:latest', 'binary:latest', ['bundle:v1'])
+
+    mock_gri.assert_has_calls([mock.call('index:latest'), mock.call('binary:latest')])
+    mock_gia.assert_has_calls([mock.call('index@sha256:123'), mock.call('binary@sha256:123')])
+    mock_iifbc.assert_called_once_with('index@sha256:123')
+    if image_is_fbc:
+        mock_gcd.assert_called_once_with('index@sha256:123', mock.ANY)
+        mock_ghid.assert_called_once_with('index@sha256:123', mock.ANY)
+        mock_gid.assert_not_called()
+    else:
+        mock_gcd.assert_not_called()
+        mock_ghid.assert_not_called()
+        mock_gid.assert_called_once_with('index@sha256:123', mock.ANY)
+    mock_grb.assert_called_once_with(['bundle:v1'])
+    mock_gils.assert_called_once_with('bundle@sha256:456')
+    mock_cffi.assert_called_once_with('bundle@sha256:456', '/manifests', mock.ANY)
+    # The files are never copied with podman by the prefetch, which would pull the images
+    assert podman_copy_fallbacks == [False]
+    assert build.podman_copy_fallback.get() is True
+
+
+@mock.patch('iib.workers.tasks.build_prefetch._copy_files_from_image')
+@mock.patch('iib.workers.tasks.build_prefetch._get_index_database')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_labels')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_bundles')
+@mock.patch('iib.workers.tasks.build_prefetch.is_image_fbc')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_arches')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_image')
+def test_handle_prefetch_request_no_file_cache(
+    mock_gri, mock_gia, mock_iifbc, mock_grb, mock_gils, mock_gid, mock_cffi
+):
+    mock_iifbc.return_value = False
+    mock_grb.return_value = ['bundle@sha256:456']
+
+    build_prefetch.handle_prefetch_request(3, 'index:latest', bundles=['bundle:v1'])
+
+    mock_gri.assert_called_once_with('index:latest')
+    mock_iifbc.assert_called_once()
+    mock_gils.assert_called_once_with('bundle@sha256:456')
+    mock_gid.assert_not_called()
+    mock_cffi.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.build_prefetch.get_worker_config')
+@mock.patch('iib.workers.tasks.build_prefetch._copy_files_from_image')
+@mock.patch('iib.workers.tasks.build_prefetch._get_index_database')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_labels')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_bundles')
+@mock.patch('iib.workers.tasks.build_prefetch.is_image_fbc')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_arches')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_image')
+@mock.patch('iib.workers.tasks.build_prefetch.get_artifact_cache')
+def test_handle_prefetch_request_no_layer_extraction(
+    mock_gac, mock_gri, mock_gia, mock_iifbc, mock_grb, mock_gils, mock_gid, mock_cffi, mock_gwc
+):
+    mock_gac.return_value = mock.Mock()
+    mock_gwc.return_value = mock.Mock(iib_extract_files_from_layers=False)
+    mock_iifbc.return_value = False
+    mock_grb.return_value = ['bundle@sha256:456']
+
+    build_prefetch.handle_prefetch_request(3, 'index:latest', bundles=['bundle:v1'])
+
+    # Copying the files would pull the images with podman, so only the metadata is prefetched
+    mock_gils.assert_called_once_with('bundle@sha256:456')
+    mock_gid.assert_not_called()
+    mock_cffi.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_bundles')
+@mock.patch('iib.workers.tasks.build_prefetch.get_image_arches')
+@mock.patch('iib.workers.tasks.build_prefetch.get_resolved_image')
+def test_handle_prefetch_request_failure(mock_gri, mock_gia, mock_grb, caplog):
+    # Setting the logging level via caplog.set_level is not sufficient. The flask
+    # related settings from previous tests interfere with this.
+    prefetch_logger = logging.getLogger('iib.workers.tasks.build_prefetch')
+    prefetch_logger.disabled = False
+    prefetch_logger.setLevel(logging.DEBUG)
+
+    mock_gri.side_effect = IIBError('Failed to inspect docker://index:latest')
+    mock_grb.side_effect = IIBError('Failed to inspect docker://bundle:v1')
+
+    build_prefetch.handle_prefetch_request(3, 'index:latest', 'binary:latest', ['bundle:v1'])
+
+    assert mock_gri.call_count == 2
+    mock_gia.assert_not_called()
+    assert 'Failed to prefetch the index image index:latest' in caplog.text
+    assert 'Failed to prefetch the binary image binary:latest' in caplog.text
+    assert 'Failed to prefetch the bundles of the request 3' in caplog.text
@@ -0,0 +1,316 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers.tasks import coalescing_utils
+
+
+def _handle_request(bundles, request_id, from_index=None, deprecation_list=None):
+    pass
+
+
+def _get_message(task, args, kwargs=None):
+    message = mock.Mock(headers={'task': task}, acknowledged=False)
+    message.decode.return_value = (args, kwargs or {}, {})
+
+    def _ack():
+        message.acknowledged = True
+
+    message.ack.side_effect = _ack
+    return message
+
+
+def _take_requests(coalesced):
+    @contextmanager
+    def _take_coalescable_requests(*args):
+        yield coalesced
+
+    return mock.Mock(side_effect=_take_coalescable_requests)
+
+
+@pytest.fixture()
+def mock_task():
+    with mock.patch.object(coalescing_utils, 'current_task') as mock_current_task:
+        mock_current_task.name = 'iib.workers.tasks.build.handle_add_request'
+        mock_current_task.request.delivery_info = {'routing_key': 'iib'}
+        yield mock_current_task
+
+
+@pytest.fixture()
+def mock_app(mock_task):
+    with mock.patch.object(coalescing_utils, 'app') as mock_app:
+        yield mock_app
+
+
+@pytest.fixture()
+def mock_queue(mock_app):
+    with mock.patch('kombu.Queue') as mock_queue:
+        yield mock_queue.return_value
+
+
+def test_merge_lists():
+    assert coalescing_utils._merge_lists(['a', 'b'], ['c', 'a']) == ['a', 'b', 'c']
+    assert coalescing_utils._merge_lists(None, ['a']) == ['a']
+
+
+def test_take_coalescable_requests(mock_task, mock_app, mock_queue):
+    task = mock_task.name
+    compatible_message = _get_message(task, [['bundle:2'], 2, 'index:4.15'])
+    compatible_kwargs_message = _get_message(
+        task, [['bundle:3']], {'request_id': 3, 'from_index': 'index:4.15'}
+    )
+    incompatible_message = _get_message(task, [['bundle:4'], 4, 'index:4.16'])
+    mock_queue.get.side_effect = [
+        compatible_message,
+        compatible_kwargs_message,
+        incompatible_message,
+    ]
+    call_args = {
+        'bundles': ['bundle:1'],
+        'request_id': 1,
+        'from_index': 'index:4.15',
+        'deprecation_list': None,
+    }
+
+    with coalescing_utils._take_coalescable_requests(
+        _handle_request, call_args, ['bundles', 'deprecation_list'], 5
+    ) as rv:
+        assert [r['request_id'] for r, _ in rv] == [2, 3]
+        assert [message for _, message in rv] == [compatible_message, compatible_kwargs_message]
+        # The messages are held until the requests are processed
+        compatible_message.ack.assert_not_called()
+        compatible_kwargs_message.ack.assert_not_called()
+        incompatible_message.requeue.assert_called_once_with()
+        compatible_message.ack()
+
+    # The messages which weren't acknowledged are put back
+    compatible_message.requeue.assert_not_called()
+    compatible_kwargs_message.requeue.assert_called_once_with()
+    incompatible_message.ack.assert_not_called()
+    mock_app.connection_for_read.assert_called_once_with(heartbeat=0)
+
+
+def test_take_coalescable_requests_other_task(mock_task, mock_queue):
+    message = _get_message('iib.workers.tasks.build.handle_rm_request', [['operator'], 2, 'index'])
+    mock_queue.get.side_effect = [message]
+
+    with coalescing_utils._take_coalescable_requests(
+        _handle_request, {'bundles': [], 'request_id': 1, 'from_index': 'index'}, ['bundles'], 5
+    ) as rv:
+        assert rv == []
+    message.decode.assert_not_called()
+    message.requeue.assert_called_once_with()
+
+
+def test_take_coalescable_requests_limit(mock_task, mock_queue):
+    mock_queue.get.side_effect = [
+        _get_message(mock_task.name, [['bundle:2'], 2]),
+        _get_message(mock_task.name, [['bundle:3'], 3]),
+    ]
+    call_args = {'bundles': [], 'request_id': 1, 'from_index': None, 'deprecation_list': None}
+
+    with coalescing_utils._take_coalescable_requests(
+        _handle_request, call_args, ['bundles', 'deprecation_list'], 1
+    ) as rv:
+        assert [r['request_id'] for r, _ in rv] == [2]
+    assert mock_queue.get.call_count == 1
+
+
+@mock.patch('iib.workers.tasks.coalescing_utils._take_coalescable_requests')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_worker_config')
+def test_coalesce_requests_disabled(mock_gwc, mock_gcr, mock_task):
+    mock_gwc.return_value.iib_max_coalesced_requests = 0
+    calls = []
+
+    @coalescing_utils.coalesce_requests(['bundles'])
+    def handle_request(bundles, request_id, from_index=None):
+        calls.append((bundles, request_id, from_index))
+
+    handle_request(['a'], 1, 'index')
+
+    assert calls == [(['a'], 1, 'index')]
+    mock_gcr.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.coalescing_utils.update_request')
+@mock.patch('iib.workers.tasks.coalescing_utils.set_request_state')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_request')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_worker_config')
+def test_coalesce_requests(mock_gwc, mock_gr, mock_srs, mock_ur, mock_task):
+    mock_gwc.return_value.iib_max_coalesced_requests = 5
+    messages = [mock.Mock(), mock.Mock()]
+    mock_tcr = _take_requests(
+        [
+            (
+                {
+                    'bundles': ['b', 'c'],
+                    'request_id': 2,
+                    'from_index': 'index',
+                    'deprecation_list': None,
+                },
+                messages[0],
+            ),
+            (
+                {
+                    'bundles': ['d'],
+                    'request_id': 3,
+                    'from_index': 'index',
+                    'deprecation_list': ['d'],
+                },
+                messages[1],
+            ),
+        ]
+    )
+    mock_gr.return_value = {
+        'arches': ['amd64'],
+        'bundle_mapping': {'operator': ['b', 'c', 'd']},
+        'index_image': 'registry/index:latest',
+        'index_image_resolved': 'registry/index@sha256:123',
+        'internal_index_image_copy': None,
+        'state_reason': 'The operator bundle(s) were successfully added to the index image',
+    }
+    calls = []
+
+    @coalescing_utils.coalesce_requests(['bundles', 'deprecation_list'])
+    def handle_request(bundles, request_id, from_index=None, deprecation_list=None):
+        # The messages of the coalesced requests are held while the index image is built
+        for message in messages:
+            message.ack.assert_not_called()
+        calls.append((bundles, request_id, from_index, deprecation_list))
+
+    with mock.patch.object(coalescing_utils, '_take_coalescable_requests', mock_tcr):
+        handle_request(['a', 'b'], 1, 'index')
+
+    assert calls == [(['a', 'b', 'c', 'd'], 1, 'index', ['d'])]
+    mock_tcr.assert_called_once_with(
+        mock.ANY,
+        {'bundles': ['a', 'b'], 'request_id': 1, 'from_index': 'index', 'deprecation_list': None},
+        ['bundles', 'deprecation_list'],
+        5,
+    )
+    mock_srs.assert_has_calls(
+        [
+            mock.call(2, 'in_progress', 'The request is processed as part of the request 1'),
+            mock.call(3, 'in_progress', 'The request is processed as part of the request 1'),
+        ]
+    )
+    mock_gr.assert_called_once_with(1)
+    expected_payload = {
+        'arches': ['amd64'],
+        'index_image': 'registry/index:latest',
+        'index_image_resolved': 'registry/index@sha256:123',
+        'state': 'complete',
+        'state_reason': (
+            'The operator bundle(s) were successfully added to the index image in the request 1'
+        ),
+    }
+    # Every coalesced request only gets the bundles it added in its bundle mapping
+    mock_ur.assert_has_calls(
+        [
+            mock.call(
+                2,
+                {**expected_payload, 'bundle_mapping': {'operator': ['b', 'c']}},
+                exc_msg=mock.ANY,
+            ),
+            mock.call(
+                3, {**expected_payload, 'bundle_mapping': {'operator': ['d']}}, exc_msg=mock.ANY
+            ),
+        ]
+    )
+    for message in messages:
+        message.ack.assert_called_once_with()
+
+
+@pytest.mark.parametrize('fails_on_its_own', (False, True))
+@mock.patch('iib.workers.tasks.coalescing_utils.update_request')
+@mock.patch('iib.workers.tasks.coalescing_utils.set_request_state')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_worker_config')
+def test_coalesce_requests_failed(mock_gwc, mock_srs, mock_ur, mock_task, fails_on_its_own):
+    mock_gwc.return_value.iib_max_coalesced_requests = 5
+    message = mock.Mock()
+    mock_tcr = _take_requests(
+        [({'operators': ['b'], 'request_id': 2, 'from_index': 'index'}, message)]
+    )
+    calls = []
+
+    @coalescing_utils.coalesce_requests(['operators'])
+    def handle_request(operators, request_id, from_index):
+        calls.append(operators)
+        # The operator b can't be removed, so the merged requests fail
+        if 'b' in operators or fails_on_its_own:
+            raise IIBError('Failed to build the index image')
+        return request_id
+
+    with mock.patch.object(coalescing_utils, '_take_coalescable_requests', mock_tcr):
+        if fails_on_its_own:
+            with pytest.raises(IIBError, match='Failed to build the index image'):
+                handle_request(['a'], 1, 'index')
+        else:
+            assert handle_request(['a'], 1, 'index') == 1
+
+    # The current request is processed again on its own
+    assert calls == [['a', 'b'], ['a']]
+    mock_srs.assert_called_once_with(
+        2, 'in_progress', 'The request is processed as part of the request 1'
+    )
+    mock_ur.assert_not_called()
+    # The coalesced request is put back in the queue to be processed on its own
+    message.ack.assert_not_called()
+    message.requeue.assert_called_once_with()
+
+
+@mock.patch('iib.workers.tasks.coalescing_utils.update_request')
+@mock.patch('iib.workers.tasks.coalescing_utils.set_request_state')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_worker_config')
+def test_coalesce_requests_failed_before_processing(mock_gwc, mock_srs, mock_ur, mock_task):
+    mock_gwc.return_value.iib_max_coalesced_requests = 5
+    message = mock.Mock()
+    mock_tcr = _take_requests(
+        [({'operators': ['b'], 'request_id': 2, 'from_index': 'index'}, message)]
+    )
+    mock_srs.side_effect = [IIBError('The IIB API is unavailable'), None]
+    calls = []
+
+    @coalescing_utils.coalesce_requests(['operators'])
+    def handle_request(operators, request_id, from_index):
+        calls.append(operators)
+
+    with mock.patch.object(coalescing_utils, '_take_coalescable_requests', mock_tcr):
+        with pytest.raises(IIBError, match='The IIB API is unavailable'):
+            handle_request(['a'], 1, 'index')
+
+    assert calls == []
+    mock_srs.assert_called_with(2, 'failed', 'The IIB API is unavailable (in the request 1)')
+    mock_ur.assert_not_called()
+    # The error isn't caused by the merged requests, so the coalesced request fails with it
+    message.ack.assert_called_once_with()
+
+
+@mock.patch('iib.workers.tasks.coalescing_utils.update_request')
+@mock.patch('iib.workers.tasks.coalescing_utils.set_request_state')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_request')
+@mock.patch('iib.workers.tasks.coalescing_utils.get_worker_config')
+def test_coalesce_requests_results_not_set(
+    mock_gwc, mock_gr, mock_srs, mock_ur, mock_task, mock_queue
+):
+    mock_gwc.return_value.iib_max_coalesced_requests = 5
+    message = _get_message(mock_task.name, [['b'], 2, 'index'])
+    mock_queue.get.side_effect = [message, None]
+    mock_gr.return_value = {'arches': ['amd64'], 'state_reason': 'Done'}
+    mock_ur.side_effect = IIBError('Failed setting the results of the coalesced request')
+    calls = []
+
+    @coalescing_utils.coalesce_requests(['bundles'])
+    def handle_request(bundles, request_id, from_index=None):
+        calls.append(bundles)
+
+    with pytest.raises(IIBError, match='Failed setting the results'):
+        handle_request(['a'], 1, 'index')
+
+    assert calls == [['a', 'b']]
+    # The coalesced request is processed again on its own
+    message.ack.assert_not_called()
+    message.requeue.assert_called_once_with()
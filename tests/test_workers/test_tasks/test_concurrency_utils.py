@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import contextvars
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import ExternalServiceError, IIBError
+from iib.workers import slots
+from iib.workers.tasks import concurrency_utils
+
+
+@pytest.fixture(autouse=True)
+def arch_storages_dir(tmp_path, monkeypatch):
+    """Keep the container storages of the architectures built concurrently in a temporary dir."""
+    monkeypatch.setattr(slots, '_get_arch_storages_dir', lambda: str(tmp_path / 'arches'))
+    return tmp_path / 'arches'
+
+
+@pytest.mark.parametrize(
+    'pull_spec, expected',
+    (
+        ('quay.io/ns/repo:latest', 'quay.io'),
+        ('docker://registry:8443/ns/repo@sha256:123', 'registry:8443'),
+        ('repo:latest', ''),
+    ),
+)
+def test_get_registry(pull_spec, expected):
+    assert concurrency_utils._get_registry(pull_spec) == expected
+
+
+@pytest.mark.parametrize('max_workers', (1, 4))
+def test_run_per_image_concurrently_keeps_order(max_workers):
+    pull_specs = [f'quay.io/ns/repo:{i}' for i in range(10)]
+
+    def func(pull_spec):
+        # Make the first items finish last
+        time.sleep(0.01 * (10 - int(pull_spec.rsplit(':', 1)[1])))
+        return pull_spec.upper()
+
+    rv = concurrency_utils.run_per_image_concurrently(func, pull_specs, max_workers=max_workers)
+
+    assert rv == [pull_spec.upper() for pull_spec in pull_specs]
+
+
+def test_run_per_image_concurrently_raises_first_failure():
+    pull_specs = ['quay.io/ns/repo:1', 'quay.io/ns/repo:2', 'quay.io/ns/repo:3']
+
+    def func(pull_spec):
+        if pull_spec.endswith(':2'):
+            time.sleep(0.05)
+            raise IIBError(f'Failed to inspect {pull_spec}')
+        if pull_spec.endswith(':3'):
+            raise IIBError(f'Failed to inspect {pull_spec}')
+        return pull_spec
+
+    with pytest.raises(IIBError, match='Failed to inspect quay.io/ns/repo:2'):
+        concurrency_utils.run_per_image_concurrently(func, pull_specs, max_workers=3)
+
+
+@mock.patch('iib.workers.tasks.concurrency_utils.get_worker_config')
+def test_run_per_image_concurrently_registry_limit(mock_gwc):
+    mock_gwc.return_value = mock.Mock(
+        iib_image_inspection_max_workers=10, iib_registry_concurrency_limit=2
+    )
+    pull_specs = [f'quay.io/ns/repo:{i}' for i in range(6)] + [
+        f'registry.io/ns/repo:{i}' for i in range(6)
+    ]
+    lock = threading.Lock()
+    running = {'quay.io': 0, 'registry.io': 0}
+    max_running = {'quay.io': 0, 'registry.io': 0}
+
+    def func(pull_spec):
+        registry = pull_spec.split('/', 1)[0]
+        with lock:
+            running[registry] += 1
+            max_running[registry] = max(max_running[registry], running[registry])
+        time.sleep(0.02)
+        with lock:
+            running[registry] -= 1
+        return pull_spec
+
+    rv = concurrency_utils.run_per_image_concurrently(func, pull_specs)
+
+    assert rv == pull_specs
+    assert all(1 <= count <= 2 for count in max_running.values())
+
+
+@pytest.mark.parametrize('max_builds', (1, 4))
+@mock.patch('iib.workers.tasks.concurrency_utils.get_worker_config')
+def test_run_per_arch_concurrently(mock_gwc, max_builds):
+    mock_gwc.return_value = mock.Mock(iib_max_concurrent_builds=max_builds)
+    lock = threading.Lock()
+    processed = []
+
+    def func(arch):
+        time.sleep(0.01)
+        with lock:
+            processed.append(arch)
+
+    concurrency_utils.run_per_arch_concurrently(func, {'s390x', 'amd64', 'ppc64le', 'arm64'})
+
+    if max_builds == 1:
+        assert processed == ['amd64', 'arm64', 'ppc64le', 's390x']
+    else:
+        assert sorted(processed) == ['amd64', 'arm64', 'ppc64le', 's390x']
+
+
+@mock.patch('iib.workers.tasks.concurrency_utils.get_worker_config')
+def test_run_per_arch_concurrently_container_storage(mock_gwc, arch_storages_dir):
+    mock_gwc.return_value = mock.Mock(iib_max_concurrent_builds=4)
+    lock = threading.Lock()
+    storages = {}
+
+    def func(arch):
+        with lock:
+            storages[arch] = slots.container_storage.get()
+
+    concurrency_utils.run_per_arch_concurrently(func, ['amd64', 's390x'])
+
+    assert slots.container_storage.get() is None
+    for arch in ('amd64', 's390x'):
+        assert storages[arch].directory == str(arch_storages_dir / arch)
+        assert (arch_storages_dir / arch / 'storage').is_dir()
+        assert (
+            f'graphroot = "{arch_storages_dir / arch / "storage"}"'
+            in (arch_storages_dir / arch / 'storage.conf').read_text()
+        )
+
+
+@mock.patch('iib.workers.tasks.concurrency_utils.get_worker_config')
+def test_run_per_arch_concurrently_serial_container_storage(mock_gwc, arch_storages_dir):
+    mock_gwc.return_value = mock.Mock(iib_max_concurrent_builds=1)
+    storages = []
+
+    concurrency_utils.run_per_arch_concurrently(
+        lambda arch: storages.append(slots.container_storage.get()), ['amd64', 's390x']
+    )
+
+    # The serial builds use the container storage of the worker
+    assert storages == [None, None]
+    assert not arch_storages_dir.exists()
+
+
+@mock.patch('iib.workers.tasks.concurrency_utils.get_worker_config')
+def test_run_concurrently_copies_context(mock_gwc):
+    mock_gwc.return_value = mock.Mock(
+        iib_max_concurrent_builds=4,
+        iib_image_inspection_max_workers=4,
+        iib_registry_concurrency_limit=4,
+    )
+    request_value = contextvars.ContextVar('request_value', default=None)
+    token = request_value.set('request-1')
+    try:
+        results = concurrency_utils.run_per_image_concurrently(
+            lambda pull_spec: request_value.get(), ['quay.io/ns/a:1', 'quay.io/ns/b:1']
+        )
+        arch_values = []
+        concurrency_utils.run_per_arch_concurrently(
+            lambda arch: arch_values.append(request_value.get()), ['amd64', 's390x']
+        )
+    finally:
+        request_value.reset(token)
+
+    assert results == ['request-1', 'request-1']
+    assert arch_values == ['request-1', 'request-1']
+
+
+@pytest.mark.parametrize(
+    'failures, expected_exc, expected_msg',
+    (
+        ({'arm64': IIBError('arm64 failed')}, IIBError, '^arm64 failed$'),
+        (
+            {'arm64': ExternalServiceError('arm64 failed'), 's390x': IIBError('s390x failed')},
+            IIBError,
+            '^arm64: arm64 failed; s390x: s390x failed$',
+        ),
+        (
+            {
+                'arm64': ExternalServiceError('arm64 failed'),
+                's390x': ExternalServiceError('s390x failed'),
+            },
+            ExternalServiceError,
+            '^arm64: arm64 failed; s390x: s390x failed$',
+        ),
+    ),
+)
+@mock.patch('iib.workers.tasks.concurrency_utils.get_worker_config')
+def test_run_per_arch_concurrently_aggregates_failures(
+    mock_gwc, failures, expected_exc, expected_msg
+):
+    mock_gwc.return_value = mock.Mock(iib_max_concurrent_builds=4)
+    processed = []
+
+    def func(arch):
+        processed.append(arch)
+        if arch in failures:
+            raise failures[arch]
+
+    with pytest.raises(expected_exc, match=expected_msg):
+        concurrency_utils.run_per_arch_concurrently(func, ['amd64', 'arm64', 's390x'])
+
+    # The failure of an arch doesn't stop the others
+    assert sorted(processed) == ['amd64', 'arm64', 's390x']
@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import io
+import os
+import tarfile
+from unittest import mock
+
+import pytest
+
+from iib.exceptions import IIBError
+from iib.workers.blob_cache import BlobCache
+from iib.workers.registry_client import ImageReference
+from iib.workers.tasks import extraction_utils
+
+
+def _make_layer(entries):
+    """Create a gzipped tar layer from a list of (path, content) tuples; None is a directory."""
+    layer = io.BytesIO()
+    with tarfile.open(fileobj=layer, mode='w:gz') as tar:
+        for path, content in entries:
+            info = tarfile.TarInfo(path)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(content))
+    return layer.getvalue()
+
+
+def _mock_registry_client(mock_grc, layers):
+    blobs = {f'sha256:{i}': layer for i, layer in enumerate(layers)}
+    manifest = {
+        'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+        'layers': [
+            {'mediaType': 'application/vnd.docker.image.rootfs.diff.tar.gzip', 'digest': digest}
+            for digest in blobs
+        ],
+    }
+    client = mock_grc.return_value
+    client.get_image_manifest.return_value = (ImageReference('quay.io/ns/index:1'), manifest)
+    client.get_blob.side_effect = lambda image, digest: mock.Mock(raw=io.BytesIO(blobs[digest]))
+    return client
+
+
+@mock.patch('iib.workers.tasks.extraction_utils.get_registry_client')
+def test_extract_files_from_image_directory(mock_grc, tmpdir):
+    base_layer = _make_layer(
+        [
+            ('configs', None),
+            ('configs/removed', None),
+            ('configs/removed/catalog.json', b'removed'),
+            ('configs/hidden', None),
+            ('configs/hidden/catalog.json', b'hidden'),
+            ('configs/operator', None),
+            ('configs/operator/catalog.json', b'old'),
+            ('configs/operator/bundle.json', b'bundle'),
+            ('usr/bin/opm', b'binary'),
+        ]
+    )
+    top_layer = _make_layer(
+        [
+            ('./configs/', None),
+            ('./configs/.wh.removed', b''),
+            ('./configs/hidden/', None),
+            ('./configs/hidden/.wh..wh..opq', b''),
+            ('./configs/hidden/new.json', b'new'),
+            ('./configs/operator/catalog.json', b'updated'),
+        ]
+    )
+    client = _mock_registry_client(mock_grc, [base_layer, top_layer])
+
+    extraction_utils.extract_files_from_image('quay.io/ns/index:1', '/configs', str(tmpdir))
+
+    extracted = {}
+    for dirpath, _, filenames in os.walk(tmpdir):
+        for filename in filenames:
+            with open(os.path.join(dirpath, filename)) as f:
+                extracted[os.path.relpath(os.path.join(dirpath, filename), tmpdir)] = f.read()
+    assert extracted == {
+        'configs/hidden/new.json': 'new',
+        'configs/operator/catalog.json': 'updated',
+        'configs/operator/bundle.json': 'bundle',
+    }
+    # The top layer is streamed first
+    assert [c[0][1] for c in client.get_blob.call_args_list] == ['sha256:1', 'sha256:0']
+
+
+@mock.patch('iib.workers.tasks.extraction_utils.get_registry_client')
+def test_extract_files_from_image_file(mock_grc, tmpdir):
+    base_layer = _make_layer([('var/lib/iib/index.db', b'database'), ('var/lib/other', b'x')])
+    top_layer = _make_layer([('var/lib/iib/index.db', b'new database')])
+    client = _mock_registry_client(mock_grc, [base_layer, top_layer])
+    dest_path = str(tmpdir.join('index.db'))
+
+    extraction_utils.extract_files_from_image(
+        'quay.io/ns/index:1', '/var/lib/iib/index.db', dest_path
+    )
+
+    with open(dest_path) as f:
+        assert f.read() == 'new database'
+    # The file was found in the top layer, so the base layer is never downloaded
+    client.get_blob.assert_called_once()
+    assert os.listdir(tmpdir) == ['index.db']
+
+
+@mock.patch('iib.workers.tasks.extraction_utils.get_registry_client')
+def test_extract_files_from_image_file_over_directory(mock_grc, tmpdir):
+    _mock_registry_client(mock_grc, [_make_layer([('var/lib/iib/index.db', b'database')])])
+    tmpdir.join('index.db').ensure('some-file')
+
+    with pytest.raises(IIBError, match='Failed to extract /var/lib/iib/index.db from'):
+        extraction_utils.extract_files_from_image(
+            'quay.io/ns/index:1', '/var/lib/iib/index.db', str(tmpdir)
+        )
+    assert os.listdir(tmpdir) == ['index.db']
+
+
+@mock.patch('iib.workers.tasks.extraction_utils.get_registry_client')
+def test_extract_files_from_image_removed(mock_grc, tmpdir):
+    base_layer = _make_layer([('configs', None), ('configs/catalog.json', b'{}')])
+    top_layer = _make_layer([('.wh.configs', b'')])
+    _mock_registry_client(mock_grc, [base_layer, top_layer])
+
+    with pytest.raises(IIBError, match='/configs does not exist in quay.io/ns/index:1'):
+        extraction_utils.extract_files_from_image('quay.io/ns/index:1', '/configs', str(tmpdir))
+    assert os.listdir(tmpdir) == []
+
+
+@mock.patch('iib.workers.tasks.extraction_utils.get_registry_client')
+def test_extract_files_from_image_path_traversal(mock_grc, tmpdir):
+    layer = io.BytesIO()
+    with tarfile.open(fileobj=layer, mode='w:gz') as tar:
+        link = tarfile.TarInfo('configs/link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/etc'
+        tar.addfile(link)
+        info = tarfile.TarInfo('configs/link/passwd')
+        info.size = 1
+        tar.addfile(info, io.BytesIO(b'x'))
+    _mock_registry_client(mock_grc, [layer.getvalue()])
+
+    with pytest.raises(IIBError, match='points outside of the extracted directory'):
+        extraction_utils.extract_files_from_image('quay.io/ns/index:1', '/configs', str(tmpdir))
+
+
+@mock.patch('iib.workers.tasks.extraction_utils.get_blob_cache')
+@mock.patch('iib.workers.tasks.extraction_utils.get_registry_client')
+def test_extract_files_from_image_blob_cache(mock_grc, mock_gbc, tmpdir):
+    layer = _make_layer([('configs', None), ('configs/catalog.json', b'{}')])
+    digest = f'sha256:{hashlib.sha256(layer).hexdigest()}'
+    client = mock_grc.return_value
+    client.get_image_manifest.return_value = (
+        ImageReference('quay.io/ns/index:1'),
+        {
+            'layers': [
+                {'mediaType': 'application/vnd.oci.image.layer.v1.tar+gzip', 'digest': digest}
+            ]
+        },
+    )
+    client.get_blob.side_effect = lambda image, digest: mock.Mock(raw=io.BytesIO(layer))
+    mock_gbc.return_value = BlobCache(str(tmpdir.join('cache')), 1024 * 1024)
+
+    for dest in ('first', 'second'):
+        tmpdir.mkdir(dest)
+        extraction_utils.extract_files_from_image(
+            'quay.io/ns/index:1', '/configs', str(tmpdir.join(dest))
+        )
+        assert tmpdir.join(dest, 'configs', 'catalog.json').read() == '{}'
+
+    # The second extraction reads the layer from the cache
+    client.get_blob.assert_called_once()
@@ -11,11 +11,15 @@ import ruamel.yaml
 
 from iib.exceptions import IIBError
 from iib.workers.config import get_worker_config
+from iib.workers.tasks import assembly_utils, fbc_utils
 from iib.workers.tasks.fbc_utils import (
+    CATALOG_LAYERS_COMMENT,
     is_image_fbc,
     merge_catalogs_dirs,
     enforce_json_config_dir,
     extract_fbc_fragment,
+    merge_catalog_packages,
+    split_catalog_into_layers,
     _serialize_datetime,
 )
 
@@ -233,3 +237,154 @@ def test__serialize_datetime():
 def test__serialize_datetime_raise():
     with pytest.raises(TypeError, match=f"Type <class 'int'> is not serializable."):
         _serialize_datetime(2025)
+
+
+def _create_layered_context(tmpdir, packages):
+    catalog = tmpdir.mkdir('catalog')
+    for package in packages:
+        catalog.mkdir(package).join('catalog.json').write(f'{{"name": "{package}"}}')
+    tmpdir.join('index.Dockerfile').write(
+        'FROM binary:latest\n'
+        '# Copy declarative config root and cache into image\n'
+        'ADD catalog /configs\n'
+        'COPY --chown=1001:0 cache /tmp/cache\n'
+    )
+
+
+@pytest.mark.parametrize('catalog_layers', (None, 'package'))
+@mock.patch('iib.workers.tasks.fbc_utils.get_worker_config')
+def test_split_catalog_into_layers_by_package(mock_gwc, catalog_layers, tmpdir):
+    mock_gwc.return_value = mock.Mock(
+        iib_catalog_layers=catalog_layers, iib_catalog_layer_buckets=32
+    )
+    _create_layered_context(tmpdir, ['operator-b', 'operator-a'])
+
+    split_catalog_into_layers(str(tmpdir), 'index.Dockerfile')
+    split_catalog_into_layers(str(tmpdir), 'index.Dockerfile')
+
+    dockerfile = tmpdir.join('index.Dockerfile').read()
+    if not catalog_layers:
+        assert 'ADD catalog /configs\n' in dockerfile
+        return
+    assert dockerfile == (
+        'FROM binary:latest\n'
+        '# Copy declarative config root and cache into image\n'
+        f'{CATALOG_LAYERS_COMMENT}\n'
+        'ADD catalog/operator-a /configs/operator-a\n'
+        'ADD catalog/operator-b /configs/operator-b\n'
+        'COPY --chown=1001:0 cache /tmp/cache\n'
+    )
+    assert os.stat(str(tmpdir.join('catalog', 'operator-a', 'catalog.json'))).st_mtime == 0
+
+
+@mock.patch('iib.workers.tasks.fbc_utils.get_worker_config')
+def test_split_catalog_into_layers_by_bucket(mock_gwc, tmpdir):
+    # Too many packages for a layer per package fall back to the buckets
+    mock_gwc.return_value = mock.Mock(iib_catalog_layers='package', iib_catalog_layer_buckets=2)
+    packages = [f'operator-{i}' for i in range(5)]
+    _create_layered_context(tmpdir, packages)
+
+    split_catalog_into_layers(str(tmpdir), 'index.Dockerfile')
+
+    layers_dir = tmpdir.join('catalog-layers')
+    buckets = sorted(os.listdir(str(layers_dir)))
+    assert set(buckets) <= {'000', '001'}
+    assert sorted(p for b in buckets for p in os.listdir(str(layers_dir.join(b)))) == packages
+    # The buckets only depend on the package name
+    for package in packages:
+        bucket = fbc_utils._get_package_bucket(package, 2)
+        assert layers_dir.join(bucket, package, 'catalog.json').read() == (
+            f'{{"name": "{package}"}}'
+        )
+    dockerfile = tmpdir.join('index.Dockerfile').read()
+    for bucket in buckets:
+        assert f'ADD catalog-layers/{bucket} /configs\n' in dockerfile
+    assert 'ADD catalog /configs' not in dockerfile
+
+
+@mock.patch('iib.workers.tasks.fbc_utils.get_worker_config')
+def test_split_catalog_into_layers_reproducible(mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(iib_catalog_layers='package', iib_catalog_layer_buckets=32)
+    digests = []
+    for build, mtime in (('first', 1700000000), ('second', 1800000000)):
+        context = tmpdir.mkdir(build)
+        _create_layered_context(context, ['operator-a', 'operator-b'])
+        if build == 'second':
+            context.join('catalog', 'operator-b', 'catalog.json').write('{"changed": true}')
+        for root, dirs, files in os.walk(str(context)):
+            for name in dirs + files:
+                os.utime(os.path.join(root, name), (mtime, mtime))
+
+        split_catalog_into_layers(str(context), 'index.Dockerfile')
+
+        digests.append(
+            {
+                package: assembly_utils._create_layer(
+                    str(context),
+                    f'catalog/{package}',
+                    f'/configs/{package}',
+                    0,
+                    0,
+                    str(context.join(f'{package}.tar.gz')),
+                )['digest']
+                for package in ('operator-a', 'operator-b')
+            }
+        )
+
+    # Only the layer of the changed package differs between the builds
+    assert digests[0]['operator-a'] == digests[1]['operator-a']
+    assert digests[0]['operator-b'] != digests[1]['operator-b']
+
+
+def test_get_catalog_digest(tmpdir):
+    first = tmpdir.mkdir('first')
+    first.mkdir('operator').join('catalog.json').write('{}')
+    first.mkdir('another').join('catalog.yaml').write('schema: olm.package')
+    second = tmpdir.mkdir('second')
+    second.mkdir('another').join('catalog.yaml').write('schema: olm.package')
+    second.mkdir('operator').join('catalog.json').write('{}')
+
+    digest = fbc_utils.get_catalog_digest(str(first))
+    assert digest.startswith('sha256:')
+    assert fbc_utils.get_catalog_digest(str(second)) == digest
+
+    second.join('operator', 'catalog.json').write('{"changed": true}')
+    assert fbc_utils.get_catalog_digest(str(second)) != digest
+    second.join('operator', 'catalog.json').write('{}')
+    second.join('operator', 'catalog.json').rename(second.join('operator', 'renamed.json'))
+    assert fbc_utils.get_catalog_digest(str(second)) != digest
+
+
+@mock.patch('iib.workers.tasks.opm_operations.opm_validate')
+def test_merge_catalog_packages(mock_ov, tmpdir):
+    src = tmpdir.mkdir('from_db')
+    src.mkdir('changed').join('catalog.json').write('{"new": true}')
+    src.mkdir('unchanged').join('catalog.json').write('{"migrated": true}')
+    dest = tmpdir.mkdir('from_index')
+    dest.mkdir('changed').join('old.json').write('{}')
+    dest.mkdir('removed').join('catalog.json').write('{}')
+    dest.mkdir('unchanged').join('catalog.json').write('{"migrated": false}')
+    dest.mkdir('opted-in').join('catalog.json').write('{}')
+
+    merge_catalog_packages(str(src), str(dest), {'changed', 'removed'})
+
+    assert sorted(os.listdir(str(dest))) == ['changed', 'opted-in', 'unchanged']
+    assert os.listdir(str(dest.join('changed'))) == ['catalog.json']
+    assert dest.join('changed', 'catalog.json').read() == '{"new": true}'
+    assert dest.join('unchanged', 'catalog.json').read() == '{"migrated": false}'
+    mock_ov.assert_called_once_with(str(dest))
+
+
+@mock.patch('iib.workers.tasks.opm_operations.opm_validate')
+def test_merge_catalog_packages_invalid(mock_ov, tmpdir):
+    src = tmpdir.mkdir('from_db')
+    src.mkdir('changed').join('catalog.json').write('{"schema": "olm.package", "name": "changed"}')
+    dest = tmpdir.mkdir('from_index')
+    # The package is stored in a directory with another name in from_index
+    dest.mkdir('changed-operator').join('catalog.json').write(
+        '{"schema": "olm.package", "name": "changed"}'
+    )
+    mock_ov.side_effect = IIBError('Failed to run opm validate: duplicate package "changed"')
+
+    with pytest.raises(IIBError, match='duplicate package'):
+        merge_catalog_packages(str(src), str(dest), {'changed'})
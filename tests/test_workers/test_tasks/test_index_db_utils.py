@@ -0,0 +1,164 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+import sqlite3
+
+import pytest
+
+from iib.workers.tasks import index_db_utils
+from iib.workers.tasks.iib_static_types import BundleImage
+
+
+def create_index_db(db_path, bundles):
+    """Create a minimal index database from a list of (name, path, version, package) tuples."""
+    con = sqlite3.connect(db_path)
+    con.executescript(
+        '''
+        CREATE TABLE operatorbundle (
+            name TEXT PRIMARY KEY, csv TEXT, bundle TEXT, bundlepath TEXT, skiprange TEXT,
+            version TEXT, replaces TEXT, skips TEXT
+        );
+        CREATE TABLE package (name TEXT PRIMARY KEY, default_channel TEXT);
+        CREATE TABLE channel_entry (
+            entry_id INTEGER PRIMARY KEY, channel_name TEXT, package_name TEXT,
+            operatorbundle_name TEXT, replaces INTEGER, depth INTEGER
+        );
+        CREATE TABLE properties (
+            type TEXT, value TEXT, operatorbundle_name TEXT, operatorbundle_version TEXT,
+            operatorbundle_path TEXT
+        );
+        '''
+    )
+    for name, path, version, package in bundles:
+        con.execute(
+            'INSERT INTO operatorbundle (name, bundlepath, version) VALUES (?, ?, ?)',
+            (name, path, version),
+        )
+        con.execute('INSERT OR IGNORE INTO package (name) VALUES (?)', (package,))
+        for channel in ('stable', 'fast'):
+            con.execute(
+                'INSERT INTO channel_entry (channel_name, package_name, operatorbundle_name) '
+                'VALUES (?, ?, ?)',
+                (channel, package, name),
+            )
+        con.execute(
+            'INSERT INTO properties VALUES (?, ?, ?, ?, ?)',
+            (
+                'olm.package',
+                json.dumps({'packageName': package, 'version': version}),
+                name,
+                version,
+                path,
+            ),
+        )
+    con.commit()
+    con.close()
+
+
+def test_iter_index_db_bundles(tmpdir):
+    db_path = str(tmpdir.join('index.db'))
+    create_index_db(
+        db_path,
+        [
+            ('operator.v1.0.0', 'quay.io/ns/bundle@sha256:1', '1.0.0', 'operator'),
+            ('another.v0.1.0', 'quay.io/ns/another@sha256:2', '0.1.0', 'another'),
+        ],
+    )
+    con = sqlite3.connect(db_path)
+    # A bundle which isn't in any channel isn't rendered by opm
+    con.execute("INSERT INTO operatorbundle (name, bundlepath) VALUES ('orphan', 'quay.io/o:1')")
+    # The version of the olm.package property wins over the operatorbundle table
+    con.execute("UPDATE operatorbundle SET version = 'stale' WHERE name = 'another.v0.1.0'")
+    con.commit()
+    con.close()
+
+    assert index_db_utils.is_index_db(db_path) is True
+    assert list(index_db_utils.iter_index_db_bundles(db_path)) == [
+        BundleImage(
+            bundlePath='quay.io/ns/another@sha256:2',
+            csvName='another.v0.1.0',
+            packageName='another',
+            version='0.1.0',
+        ),
+        BundleImage(
+            bundlePath='quay.io/ns/bundle@sha256:1',
+            csvName='operator.v1.0.0',
+            packageName='operator',
+            version='1.0.0',
+        ),
+    ]
+
+
+def test_iter_index_db_bundles_invalid_schema(tmpdir):
+    db_path = str(tmpdir.join('index.db'))
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE unrelated (name TEXT)')
+    con.close()
+
+    with pytest.raises(sqlite3.Error):
+        list(index_db_utils.iter_index_db_bundles(db_path))
+
+
+def test_is_index_db(tmpdir):
+    tmpdir.join('catalog.json').write('{}')
+
+    assert index_db_utils.is_index_db(str(tmpdir.join('catalog.json'))) is False
+    assert index_db_utils.is_index_db(str(tmpdir.join('missing.db'))) is False
+    assert index_db_utils.is_index_db(str(tmpdir)) is False
+
+
+def test_get_changed_packages(tmpdir):
+    db_path = str(tmpdir.join('index.db'))
+    create_index_db(
+        db_path,
+        [
+            ('operator.v1.0.0', 'quay.io/ns/bundle@sha256:1', '1.0.0', 'operator'),
+            ('another.v0.1.0', 'quay.io/ns/another@sha256:2', '0.1.0', 'another'),
+            ('removed.v0.1.0', 'quay.io/ns/removed@sha256:3', '0.1.0', 'removed'),
+        ],
+    )
+    package_digests = index_db_utils.get_index_db_package_digests(db_path)
+    assert sorted(package_digests) == ['another', 'operator', 'removed']
+    assert index_db_utils.get_changed_packages(package_digests, db_path) == set()
+
+    con = sqlite3.connect(db_path)
+    con.execute(
+        "INSERT INTO properties VALUES ('olm.maxOpenShiftVersion', '4.8', 'operator.v1.0.0', "
+        "'1.0.0', 'quay.io/ns/bundle@sha256:1')"
+    )
+    con.execute("INSERT INTO package (name) VALUES ('new')")
+    con.execute("DELETE FROM channel_entry WHERE package_name = 'removed'")
+    con.execute("DELETE FROM package WHERE name = 'removed'")
+    con.commit()
+    con.close()
+
+    assert index_db_utils.get_changed_packages(package_digests, db_path) == {
+        'new',
+        'operator',
+        'removed',
+    }
+
+
+def test_create_package_subset_db(tmpdir):
+    db_path = str(tmpdir.join('index.db'))
+    create_index_db(
+        db_path,
+        [
+            ('operator.v1.0.0', 'quay.io/ns/bundle@sha256:1', '1.0.0', 'operator'),
+            ('another.v0.1.0', 'quay.io/ns/another@sha256:2', '0.1.0', 'another'),
+        ],
+    )
+    subset_db_path = str(tmpdir.join('subset.db'))
+
+    index_db_utils.create_package_subset_db(db_path, {'another'}, subset_db_path)
+
+    assert [bundle['csvName'] for bundle in index_db_utils.iter_index_db_bundles(db_path)] == [
+        'another.v0.1.0',
+        'operator.v1.0.0',
+    ]
+    con = sqlite3.connect(subset_db_path)
+    assert con.execute('SELECT name FROM package').fetchall() == [('another',)]
+    assert con.execute('SELECT name FROM operatorbundle').fetchall() == [('another.v0.1.0',)]
+    assert con.execute('SELECT DISTINCT operatorbundle_name FROM properties').fetchall() == [
+        ('another.v0.1.0',)
+    ]
+    con.close()
@@ -1,14 +1,17 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import logging
 import os.path
 import pytest
 import textwrap
 import socket
+import sqlite3
 
 from unittest import mock
 
+from packaging.version import Version
 from iib.exceptions import IIBError, AddressAlreadyInUse
 from iib.workers.config import get_worker_config
-from iib.workers.tasks import opm_operations
+from iib.workers.tasks import fbc_utils, opm_operations
 from iib.workers.tasks.iib_static_types import BundleImage
 from iib.workers.tasks.opm_operations import (
     Opm,
@@ -186,7 +189,7 @@ def test_PortFileLockGenerator_no_ports_available():
         ([[5001], [5002]], ['opm_port'], '0.8.0'),
     ],
 )
-@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version_number')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version')
 def test_get_opm_port_stacks(
     mock_opm_gov,
     opm_version,
@@ -195,13 +198,26 @@ def test_get_opm_port_stacks(
     mock_config,
 ):
     """Test get_opm_port_stacks() is working correctly considering OPM opm_version attribute."""
-    mock_opm_gov.return_value = opm_version
+    mock_opm_gov.return_value = Version(opm_version)
 
     ports, purposes = get_opm_port_stacks(['opm_port', 'opm_pprof_port'])
     assert sorted(ports) == expected_ports
     assert purposes == expected_purposes
 
 
+@pytest.mark.parametrize('slot_index, expected_ports', ((0, [[5001, 6001]]), (1, [[5002, 6002]])))
+@mock.patch('iib.workers.tasks.opm_operations.get_current_slot')
+@mock.patch('iib.workers.tasks.opm_operations.Opm.get_opm_version')
+def test_get_opm_port_stacks_worker_slot(
+    mock_opm_gov, mock_gcs, slot_index, expected_ports, mock_config
+):
+    mock_opm_gov.return_value = Version('1.40.0')
+    mock_gcs.return_value = mock.Mock(index=slot_index, count=2)
+
+    ports, _ = get_opm_port_stacks(['opm_port', 'opm_pprof_port'])
+    assert ports == expected_ports
+
+
 @mock.patch(
     'iib.workers.tasks.opm_operations.get_opm_port_stacks',
     return_value=(
@@ -304,7 +320,7 @@ def test_opm_migrate(
     tmpdir,
 ):
     monkeypatch.setattr(opm_operations.Opm, 'opm_version', f'opm-{opm_version}')
-    monkeypatch.setattr(opm_operations.Opm, 'get_opm_version_number', lambda: opm_version)
+    monkeypatch.setattr(opm_operations.Opm, 'get_opm_version', lambda: Version(opm_version))
 
     index_db_file = os.path.join(tmpdir, 'database/index.db')
 
@@ -323,6 +339,33 @@ def test_opm_migrate(
     mock_gcl.assert_called_once_with(tmpdir, fbc_dir, mock.ANY)
 
 
+@mock.patch('iib.workers.tasks.opm_operations.opm_validate')
+@mock.patch('iib.workers.tasks.opm_operations.create_package_subset_db')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_opm_migrate_packages(mock_run_cmd, mock_cpsd, mock_opmvalidate, monkeypatch, tmpdir):
+    monkeypatch.setattr(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
+    monkeypatch.setattr(opm_operations.Opm, 'get_opm_version', lambda: Version('v1.26.8'))
+    index_db_file = os.path.join(tmpdir, 'database/index.db')
+    subset_db = os.path.join(tmpdir, 'packages-subset.db')
+    mock_cpsd.side_effect = lambda *args: open(subset_db, 'w').close()
+    fbc_dir = os.path.join(tmpdir, 'catalog')
+
+    assert opm_operations.opm_migrate(index_db_file, tmpdir, False, set()) == (fbc_dir, None)
+    mock_run_cmd.assert_not_called()
+    assert os.path.isdir(fbc_dir)
+
+    opm_operations.opm_migrate(index_db_file, tmpdir, False, {'operator'})
+
+    mock_cpsd.assert_called_once_with(index_db_file, {'operator'}, subset_db)
+    mock_run_cmd.assert_called_once_with(
+        ['opm-v1.26.8', 'migrate', subset_db, fbc_dir],
+        {'cwd': tmpdir},
+        exc_msg='Failed to migrate index.db to file-based catalog',
+    )
+    mock_opmvalidate.assert_called_once_with(fbc_dir)
+    assert not os.path.exists(subset_db)
+
+
 @pytest.mark.parametrize("dockerfile", (None, 'index.Dockerfile'))
 def test_create_dockerfile_binary(tmpdir, dockerfile):
     index_db_file = os.path.join(tmpdir, 'database/index.db')
@@ -456,6 +499,40 @@ def test_opm_registry_add(
     assert "--enable-alpha" in opm_args
 
 
+@mock.patch('iib.workers.tasks.opm_operations.create_dockerfile')
+@mock.patch('iib.workers.tasks.opm_operations.opm_migrate')
+@mock.patch('iib.workers.tasks.opm_operations._opm_registry_add')
+@mock.patch('iib.workers.tasks.opm_operations.get_index_db_package_digests')
+@mock.patch('iib.workers.tasks.opm_operations._get_or_create_temp_index_db_file')
+def test_opm_registry_add_fbc_incremental(
+    mock_gctidf, mock_gidpd, mock_ora, mock_om, mock_cd, tmpdir
+):
+    index_db_file = os.path.join(tmpdir, 'database/index.db')
+    mock_gctidf.return_value = index_db_file
+    mock_gidpd.return_value = {'operator': '123'}
+
+    package_digests = opm_operations.opm_registry_add_fbc(
+        base_dir=tmpdir,
+        bundles=['some-bundle:latest'],
+        binary_image='some:image',
+        from_index='some-index:latest',
+        incremental=True,
+    )
+
+    assert package_digests == {'operator': '123'}
+    mock_gidpd.assert_called_once_with(index_db_file)
+    mock_ora.assert_called_once()
+    # The changed packages are migrated by the caller
+    mock_om.assert_not_called()
+    mock_cd.assert_called_once_with(
+        fbc_dir=os.path.join(tmpdir, 'catalog'),
+        base_dir=tmpdir,
+        index_db=index_db_file,
+        binary_image='some:image',
+        dockerfile_name='index.Dockerfile',
+    )
+
+
 @pytest.mark.parametrize('is_fbc', (True, False))
 @pytest.mark.parametrize('from_index', (None, 'some_index:latest'))
 @pytest.mark.parametrize('bundles', (['bundle:1.2', 'bundle:1.3'], []))
@@ -820,6 +897,72 @@ def test_generate_cache_locally_failed(
         )
 
 
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.opm_operations.get_artifact_cache')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch(
+    'iib.workers.tasks.opm_operations.get_opm_port_stacks',
+    return_value=([None], []),
+)
+def test_generate_cache_locally_reuse(mock_gops, mock_cmd, mock_gac, mock_cffi, mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(iib_opm_cache_reuse=True)
+    fbc_dir = tmpdir.mkdir('catalog')
+    fbc_dir.mkdir('operator').join('catalog.json').write('{}')
+    local_cache_path = os.path.join(tmpdir, 'cache')
+    mock_cmd.side_effect = lambda *args, **kwargs: os.makedirs(local_cache_path, exist_ok=True)
+    mock_gac.return_value.get.return_value = False
+
+    opm_operations.generate_cache_locally(
+        tmpdir, str(fbc_dir), local_cache_path, from_index='quay.io/ns/index@sha256:123'
+    )
+
+    cache_key = f'opm-cache:opm:{fbc_utils.get_catalog_digest(str(fbc_dir))}'
+    mock_gac.return_value.get.assert_called_once_with(cache_key, '/tmp/cache', local_cache_path)
+    mock_cffi.assert_called_once_with('quay.io/ns/index@sha256:123', '/tmp/cache', local_cache_path)
+    mock_cmd.assert_called_once()
+    mock_gac.return_value.put.assert_called_once_with(cache_key, '/tmp/cache', local_cache_path)
+
+    # The cache generated for the identical catalog is reused without running opm
+    mock_gac.return_value.get.return_value = True
+    mock_cffi.reset_mock()
+    mock_cmd.reset_mock()
+    opm_operations.generate_cache_locally(
+        tmpdir, str(fbc_dir), local_cache_path, from_index='quay.io/ns/index@sha256:123'
+    )
+    mock_cffi.assert_not_called()
+    mock_cmd.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
+@mock.patch('iib.workers.tasks.build._copy_files_from_image')
+@mock.patch('iib.workers.tasks.opm_operations.get_artifact_cache', return_value=None)
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch(
+    'iib.workers.tasks.opm_operations.get_opm_port_stacks',
+    return_value=([None], []),
+)
+def test_generate_cache_locally_seed_failed(
+    mock_gops, mock_cmd, mock_gac, mock_cffi, mock_gwc, tmpdir
+):
+    mock_gwc.return_value = mock.Mock(iib_opm_cache_reuse=True)
+    local_cache_path = os.path.join(tmpdir, 'cache')
+
+    def _copy_partially(*args):
+        os.makedirs(os.path.join(local_cache_path, 'partial'))
+        raise IIBError('Failed to copy /tmp/cache')
+
+    mock_cffi.side_effect = _copy_partially
+    mock_cmd.side_effect = lambda *args, **kwargs: os.makedirs(local_cache_path)
+
+    opm_operations.generate_cache_locally(
+        tmpdir, str(tmpdir), local_cache_path, from_index='quay.io/ns/index@sha256:123'
+    )
+
+    mock_cmd.assert_called_once()
+    assert os.listdir(local_cache_path) == []
+
+
 @pytest.mark.parametrize(
     'operators_exists, index_db_path',
     [(['test-operator'], "index_path"), ([], "index_path")],
@@ -1117,6 +1260,55 @@ def test_get_opm_version_number_fail(mock_run_cmd):
         Opm.get_opm_version_number()
 
 
+@mock.patch('iib.workers.tasks.opm_operations._get_binary_signature')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_get_opm_version_memoized(mock_run_cmd, mock_gbs):
+    mock_gbs.return_value = (1, 100)
+    mock_run_cmd.side_effect = lambda cmd: f'version.Version{{OpmVersion:"v1.{len(cmd[0])}.0"}}'
+
+    assert Opm.get_opm_version('opm') == Version('1.3.0')
+    assert Opm.get_opm_version_number('opm') == '1.3.0'
+    assert Opm.get_opm_version('opm-v4.15') == Version('1.9.0')
+    assert mock_run_cmd.call_count == 2
+
+    # The binary is probed again once it's replaced
+    mock_gbs.return_value = (2, 200)
+    assert Opm.get_opm_version('opm') == Version('1.3.0')
+    assert mock_run_cmd.call_count == 3
+
+
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_probe_opm_versions(mock_run_cmd, mock_gwc, caplog):
+    # Setting the logging level via caplog.set_level is not sufficient. The flask
+    # related settings from previous tests interfere with this.
+    opm_logger = logging.getLogger('iib.workers.tasks.opm_operations')
+    opm_logger.disabled = False
+    opm_logger.setLevel(logging.DEBUG)
+
+    mock_gwc.return_value = {
+        'iib_default_opm': 'opm',
+        'iib_ocp_opm_mapping': {'v4.15': 'opm-v1.40.0', 'v4.16': 'missing'},
+    }
+
+    def _run_cmd(cmd):
+        if cmd[0] == 'missing':
+            raise IIBError('Failed to run missing')
+        return 'version.Version{OpmVersion:"v1.40.0"}'
+
+    mock_run_cmd.side_effect = _run_cmd
+
+    Opm.probe_opm_versions()
+    Opm.get_opm_version('opm-v1.40.0')
+
+    assert [call[0][0][0] for call in mock_run_cmd.call_args_list] == [
+        'missing',
+        'opm',
+        'opm-v1.40.0',
+    ]
+    assert 'Failed to probe the version of missing: Failed to run missing' in caplog.text
+
+
 @pytest.mark.parametrize(
     'input, is_input_dir, is_fbc',
     [
@@ -1211,9 +1403,9 @@ def test__get_olm_package_version_raise():
 
 
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
-@mock.patch('iib.workers.tasks.utils.run_cmd')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
 @mock.patch.object(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
-def test_get_list_bundles(mock_run_cmd, mock_gidp, tmpdir):
+def test_get_list_bundles(mock_run_cmd_stream, mock_gidp, tmpdir):
     input_image = 'registry.example.com/example_operator:tag'
     input_data_path = '/tmp/path'
     mock_gidp.return_value = input
@@ -1279,7 +1471,7 @@ def test_get_list_bundles(mock_run_cmd, mock_gidp, tmpdir):
 }
     """
 
-    mock_run_cmd.return_value = opm_render_output
+    mock_run_cmd_stream.return_value = iter(opm_render_output.splitlines(keepends=True))
 
     bundles = get_list_bundles(input_data=input_image, base_dir=tmpdir)
 
@@ -1297,17 +1489,207 @@ def test_get_list_bundles(mock_run_cmd, mock_gidp, tmpdir):
             version='0.2.0',
         ),
     ]
-    mock_run_cmd.assert_called_once_with(
+    mock_run_cmd_stream.assert_called_once_with(
         ['opm-v1.26.8', 'render', input_data_path],
         {'cwd': tmpdir},
         exc_msg=f'Failed to run opm render with input: {input_image}',
     )
 
 
+@pytest.mark.parametrize(
+    'reader, rendered, opm_called',
+    (
+        ('native', None, False),
+        ('compat', 'same', True),
+        ('compat', 'different', True),
+        ('opm', 'different', True),
+    ),
+)
+@mock.patch('iib.workers.tasks.opm_operations._get_list_bundles_from_opm_render')
+@mock.patch('iib.workers.tasks.opm_operations.iter_index_db_bundles')
+@mock.patch('iib.workers.tasks.opm_operations.is_index_db')
+@mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
+def test_get_list_bundles_index_db(
+    mock_gwc, mock_gidp, mock_iid, mock_iidb, mock_glbfor, reader, rendered, opm_called, tmpdir
+):
+    mock_gwc.return_value = mock.Mock(iib_index_db_reader=reader)
+    mock_gidp.return_value = '/tmp/index.db'
+    mock_iid.return_value = True
+    native_bundles = [
+        BundleImage(
+            bundlePath='quay.io/ns/bundle@sha256:1',
+            csvName='operator.v1.0.0',
+            packageName='operator',
+            version='1.0.0',
+        )
+    ]
+    mock_iidb.return_value = iter(native_bundles)
+    rendered_bundles = list(native_bundles)
+    if rendered == 'different':
+        rendered_bundles.append(
+            BundleImage(
+                bundlePath='quay.io/ns/bundle@sha256:2',
+                csvName='operator.v1.1.0',
+                packageName='operator',
+                version='1.1.0',
+            )
+        )
+    mock_glbfor.return_value = rendered_bundles
+
+    bundles = get_list_bundles(input_data='quay.io/ns/index:v4.14', base_dir=tmpdir)
+
+    if opm_called:
+        assert bundles == rendered_bundles
+        mock_glbfor.assert_called_once_with('quay.io/ns/index:v4.14', '/tmp/index.db', tmpdir)
+    else:
+        assert bundles == native_bundles
+        mock_glbfor.assert_not_called()
+    if reader == 'opm':
+        mock_iidb.assert_not_called()
+
+
+@mock.patch('iib.workers.tasks.opm_operations._get_list_bundles_from_opm_render')
+@mock.patch('iib.workers.tasks.opm_operations.iter_index_db_bundles')
+@mock.patch('iib.workers.tasks.opm_operations.is_index_db')
 @mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
+def test_get_list_bundles_index_db_fallback(mock_gidp, mock_iid, mock_iidb, mock_glbfor, tmpdir):
+    mock_gidp.return_value = '/tmp/index.db'
+    mock_iid.return_value = True
+    mock_iidb.side_effect = sqlite3.OperationalError('no such table: channel_entry')
+
+    bundles = get_list_bundles(input_data='/tmp/index.db', base_dir=tmpdir)
+
+    assert bundles == mock_glbfor.return_value
+    mock_glbfor.assert_called_once_with('/tmp/index.db', '/tmp/index.db', tmpdir)
+
+
+OPM_RENDER_STREAM = textwrap.dedent(
+    """\
+    {
+        "schema": "olm.package",
+        "name": "example-operator",
+        "defaultChannel": "stable"
+    }
+    {
+        "schema": "olm.bundle",
+        "name": "example-operator.v0.1.0",
+        "package": "example-operator",
+        "image": "quay.io/ns/example-operator-bundle:0.1.0",
+        "properties": [
+            {
+                "type": "olm.package",
+                "value": {
+                    "schema": "olm.package",
+                    "packageName": "example-operator",
+                    "version": "0.1.0"
+                }
+            }
+        ]
+    }
+
+    {"schema": "olm.channel", "name": "stable", "package": "example-operator", "entries": []}
+    """
+)
+
+
+@pytest.mark.parametrize(
+    'schemas, expected',
+    (
+        (None, ['olm.package', 'olm.bundle', 'olm.channel']),
+        ({'olm.bundle'}, ['olm.bundle']),
+        ({'olm.package', 'olm.channel'}, ['olm.package', 'olm.channel']),
+    ),
+)
+def test_parse_opm_render_stream(schemas, expected):
+    lines = OPM_RENDER_STREAM.splitlines(keepends=True)
+
+    olm_objects = list(opm_operations._parse_opm_render_stream(lines, schemas))
+
+    assert [olm_object['schema'] for olm_object in olm_objects] == expected
+    if 'olm.bundle' in expected:
+        bundle = olm_objects[expected.index('olm.bundle')]
+        assert bundle['properties'][0]['value']['version'] == '0.1.0'
+
+
+@pytest.mark.parametrize(
+    'chunks',
+    (
+        ['{"schema": "olm.package", "name": "a"}{"schema": "olm.bundle", "name": "b"}\n'],
+        [
+            '{"schema": "olm.package",\n',
+            '"name": "a"}\n',
+            '  {"schema": "olm.bundle",',
+            ' "name": "b"}',
+        ],
+        [
+            '{\n',
+            '  "schema": "olm.package", "name": "a", "extra": {"x": "}"}\n',
+            '}',
+            '{"schema"',
+            ': "olm.bundle", "name": "b"}',
+        ],
+    ),
+)
+def test_parse_opm_render_stream_any_formatting(chunks):
+    olm_objects = list(opm_operations._parse_opm_render_stream(iter(chunks)))
+
+    assert [olm_object['name'] for olm_object in olm_objects] == ['a', 'b']
+
+
+def test_parse_opm_render_stream_incomplete():
+    lines = OPM_RENDER_STREAM.splitlines(keepends=True)[:8]
+
+    with pytest.raises(IIBError, match='ends with an incomplete object'):
+        list(opm_operations._parse_opm_render_stream(lines))
+
+
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
+@mock.patch.object(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
+def test_opm_render_streaming(mock_rcs, mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(iib_opm_render_streaming=True)
+    mock_rcs.return_value = iter(OPM_RENDER_STREAM.splitlines(keepends=True))
+
+    olm_objects = list(
+        opm_operations.opm_render(
+            'quay.io/ns/index:v4.14', tmpdir, input_data_path='/tmp/configs', schemas={'olm.bundle'}
+        )
+    )
+
+    assert [olm_object['name'] for olm_object in olm_objects] == ['example-operator.v0.1.0']
+    mock_rcs.assert_called_once_with(
+        ['opm-v1.26.8', 'render', '/tmp/configs'],
+        {'cwd': tmpdir},
+        exc_msg='Failed to run opm render with input: quay.io/ns/index:v4.14',
+    )
+
+
+@mock.patch('iib.workers.tasks.opm_operations.get_worker_config')
 @mock.patch('iib.workers.tasks.utils.run_cmd')
 @mock.patch.object(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
-def test_get_operator_package_list(mock_run_cmd, mock_gidp, tmpdir):
+def test_opm_render_not_streaming(mock_run_cmd, mock_gwc, tmpdir):
+    mock_gwc.return_value = mock.Mock(iib_opm_render_streaming=False)
+    mock_run_cmd.return_value = OPM_RENDER_STREAM.replace('\n\n', '\n')
+
+    olm_objects = list(
+        opm_operations.opm_render(
+            'quay.io/ns/index:v4.14', tmpdir, input_data_path='/tmp/configs', schemas={'olm.bundle'}
+        )
+    )
+
+    assert [olm_object['name'] for olm_object in olm_objects] == ['example-operator.v0.1.0']
+    mock_run_cmd.assert_called_once_with(
+        ['opm-v1.26.8', 'render', '/tmp/configs'],
+        {'cwd': tmpdir},
+        exc_msg='Failed to run opm render with input: quay.io/ns/index:v4.14',
+    )
+
+
+@mock.patch('iib.workers.tasks.opm_operations._get_input_data_path')
+@mock.patch('iib.workers.tasks.utils.run_cmd_stream')
+@mock.patch.object(opm_operations.Opm, 'opm_version', 'opm-v1.26.8')
+def test_get_operator_package_list(mock_run_cmd_stream, mock_gidp, tmpdir):
     input_image = 'registry.example.com/example_operator:tag'
     input_data_path = '/tmp/path'
     mock_gidp.return_value = input
@@ -1352,11 +1734,11 @@ def test_get_operator_package_list(mock_run_cmd, mock_gidp, tmpdir):
 }
     """
 
-    mock_run_cmd.return_value = opm_render_output
+    mock_run_cmd_stream.return_value = iter(opm_render_output.splitlines(keepends=True))
     packages = get_operator_package_list(input_image_or_path=input_image, base_dir=tmpdir)
 
     assert packages == ['example-operator']
-    mock_run_cmd.assert_called_once_with(
+    mock_run_cmd_stream.assert_called_once_with(
         ['opm-v1.26.8', 'render', input_data_path],
         {'cwd': tmpdir},
         exc_msg=f'Failed to run opm render with input: {input_image}',
@@ -1,4 +1,6 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import json
 import logging
 import os
 import stat
@@ -8,7 +10,9 @@ from unittest import mock
 
 import pytest
 
-from iib.exceptions import ExternalServiceError, IIBError
+from iib.common import common_utils
+from iib.exceptions import ExternalServiceError, FromIndexChangedError, IIBError
+from iib.workers import registry_client, slots
 from iib.workers.config import get_worker_config
 from iib.workers.tasks import utils
 
@@ -177,6 +181,43 @@ def test_set_registry_auths(
     mock_rdc.assert_called_once_with()
 
 
+@mock.patch('iib.workers.tasks.utils.subprocess.run')
+@mock.patch('iib.workers.tasks.utils.reset_docker_config')
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+def test_set_registry_token_isolated(mock_gwc, mock_rdc, mock_run, tmpdir):
+    template = tmpdir.join('config.json.template')
+    template.write(json.dumps({'auths': {'quay.io': {'auth': 'dGVtcGxhdGU='}}}))
+    mock_gwc.return_value = mock.Mock(
+        iib_isolated_registry_auths=True, iib_docker_config_template=str(template)
+    )
+    mock_run.return_value = mock.Mock(returncode=0, stdout='')
+
+    with utils.set_registry_token('user:pass', 'registry.redhat.io/ns/repo:latest'):
+        auth_file = registry_client.registry_auth_file.get()
+        with utils.set_registry_token('other:pass', 'registry.io/ns/repo:1', append=True):
+            nested_auth_file = registry_client.registry_auth_file.get()
+            with open(nested_auth_file) as f:
+                assert json.load(f) == {
+                    'auths': {
+                        'quay.io': {'auth': 'dGVtcGxhdGU='},
+                        'registry.io': {'auth': 'b3RoZXI6cGFzcw=='},
+                        'registry.redhat.io': {'auth': 'dXNlcjpwYXNz'},
+                    }
+                }
+            utils.run_cmd(['skopeo', 'inspect', 'docker://registry.io/ns/repo:1'])
+        assert registry_client.registry_auth_file.get() == auth_file
+        assert os.stat(auth_file).st_mode & 0o777 == 0o600
+
+    assert registry_client.registry_auth_file.get() is None
+    assert not os.path.exists(auth_file)
+    assert not os.path.exists(nested_auth_file)
+    env = mock_run.call_args[1]['env']
+    assert env['REGISTRY_AUTH_FILE'] == nested_auth_file
+    assert env['DOCKER_CONFIG'] == os.path.dirname(nested_auth_file)
+    # The shared Docker config is never modified
+    mock_rdc.assert_not_called()
+
+
 @mock.patch('os.remove')
 def test_set_registry_token_null_token(mock_remove):
     with utils.set_registry_token(None, 'quay.io/ns/repo:latest'):
@@ -204,6 +245,23 @@ def test_run_cmd(mock_sub_run):
     mock_sub_run.assert_called_once()
 
 
+@mock.patch('iib.workers.tasks.utils.subprocess.run')
+def test_run_cmd_container_storage(mock_sub_run, tmp_path):
+    mock_sub_run.return_value = mock.Mock(returncode=0)
+    storage = slots.ContainerStorage(str(tmp_path / 'amd64'))
+
+    with slots.use_container_storage(storage):
+        utils.run_cmd(['podman', 'images'], {'env': {'PATH': '/usr/bin'}})
+    utils.run_cmd(['podman', 'images'])
+
+    assert mock_sub_run.call_args_list[0][1]['env'] == {
+        'PATH': '/usr/bin',
+        'CONTAINERS_STORAGE_CONF': str(tmp_path / 'amd64' / 'storage.conf'),
+        'CONTAINERS_CONF_OVERRIDE': str(tmp_path / 'amd64' / 'containers.conf'),
+    }
+    assert 'env' not in mock_sub_run.call_args_list[1][1]
+
+
 @pytest.mark.parametrize('exc_msg', (None, 'Houston, we have a problem!'))
 @mock.patch('iib.workers.tasks.utils.subprocess.run')
 def test_run_cmd_failed(mock_sub_run, exc_msg):
@@ -406,6 +464,39 @@ def test_run_cmd_failed_buildah_registry_unavailable(mock_sub_run: mock.MagicMoc
     mock_sub_run.assert_called_once()
 
 
+def test_run_cmd_stream(tmpdir):
+    tmpdir.join('marker').write('')
+
+    lines = utils.run_cmd_stream(['sh', '-c', 'printf "first\\nsecond\\n"; ls'], {'cwd': tmpdir})
+
+    assert list(lines) == ['first\n', 'second\n', 'marker\n']
+
+
+def test_run_cmd_stream_failed_opm(tmpdir):
+    script = tmpdir.join('opm-v1.26.8')
+    script.write('#!/bin/sh\necho "{"\necho "Error: invalid index" >&2\nexit 1\n')
+    os.chmod(str(script), 0o755)
+
+    lines = utils.run_cmd_stream([str(script), 'render'], exc_msg='Failed to run opm render')
+
+    assert next(lines) == '{\n'
+    with pytest.raises(IIBError, match='Failed to run opm render: invalid index'):
+        next(lines)
+
+
+@mock.patch('iib.workers.tasks.utils.subprocess.Popen')
+def test_run_cmd_stream_closed_early(mock_popen):
+    proc = mock_popen.return_value
+    proc.stdout = mock.MagicMock(__iter__=lambda self: iter(['first\n', 'second\n']))
+
+    lines = utils.run_cmd_stream(['opm', 'render', 'index.db'])
+    assert next(lines) == 'first\n'
+    lines.close()
+
+    proc.kill.assert_called_once()
+    proc.stdout.close.assert_called_once()
+
+
 @pytest.mark.parametrize("protocol", ["https", "ssh", "git"])
 @mock.patch('iib.workers.tasks.utils.subprocess.run')
 def test_run_cmd_git_clone_sanitized_success(mock_sub_run, protocol, caplog) -> None:
@@ -451,6 +542,43 @@ def test_skopeo_inspect(mock_run_cmd):
     assert skopeo_args == expected
 
 
+@pytest.mark.parametrize(
+    'args, native',
+    (
+        (('docker://some-image:latest', '--raw'), True),
+        (('docker://some-image:latest', '--config'), True),
+        (('docker://some-image:latest',), False),
+        (('containers-storage:some-image:latest', '--config'), False),
+    ),
+)
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.get_registry_client')
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_skopeo_inspect_registry_client(mock_run_cmd, mock_grc, mock_gwc, args, native):
+    mock_gwc.return_value = mock.Mock(iib_registry_client='native', iib_skopeo_timeout='300s')
+    mock_grc.return_value.get_raw_manifest.return_value = b'{"schemaVersion": 2}'
+    mock_grc.return_value.get_config.return_value = b'{"schemaVersion": 2}'
+    mock_run_cmd.return_value = '{"schemaVersion": 2}'
+
+    assert utils.skopeo_inspect(*args) == {'schemaVersion': 2}
+
+    if native:
+        mock_run_cmd.assert_not_called()
+    else:
+        mock_grc.assert_not_called()
+        mock_run_cmd.assert_called_once()
+
+
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.get_registry_client')
+def test_skopeo_inspect_registry_client_error(mock_grc, mock_gwc):
+    mock_gwc.return_value = mock.Mock(iib_registry_client='native', iib_skopeo_timeout='300s')
+    mock_grc.return_value.get_raw_manifest.side_effect = IIBError('The status was 404.')
+
+    with pytest.raises(IIBError, match='Failed to inspect docker://some-image:latest. Make sure'):
+        utils.skopeo_inspect('docker://some-image:latest', '--raw')
+
+
 @mock.patch('iib.workers.tasks.utils.run_cmd')
 def test_podman_pull(mock_run_cmd):
     image = 'some-image:latest'
@@ -528,6 +656,64 @@ def test_request_logger_no_request_id(tmpdir):
     assert not logs_dir.listdir()
 
 
+@pytest.mark.parametrize('failures, max_attempts, should_fail', ((2, 2, False), (2, 1, True)))
+@mock.patch('iib.workers.tasks.utils.set_request_state')
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+def test_rebase_on_from_index_change(mock_gwc, mock_srs, failures, max_attempts, should_fail):
+    mock_gwc.return_value.iib_from_index_rebase_attempts = max_attempts
+    calls = []
+
+    @utils.rebase_on_from_index_change
+    def mock_handler(spam, request_id):
+        calls.append(request_id)
+        if len(calls) <= failures:
+            raise FromIndexChangedError('The supplied from_index image changed')
+
+    if should_fail:
+        with pytest.raises(FromIndexChangedError):
+            mock_handler('spam', request_id=3)
+    else:
+        mock_handler('spam', request_id=3)
+
+    assert calls == [3] * (max_attempts + 1)
+    assert mock_srs.call_args_list == [
+        mock.call(
+            3,
+            'in_progress',
+            'The supplied from_index image changed during the IIB request. Rebuilding the index '
+            f'image on top of it (attempt {attempt} of {max_attempts})',
+        )
+        for attempt in range(1, max_attempts + 1)
+    ]
+
+
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_get_binary_versions(mock_run_cmd):
+    mock_run_cmd.side_effect = lambda cmd, **kwargs: f'{cmd[0]} version 1.0\n'
+
+    versions = common_utils.get_binary_versions()
+    assert sorted(versions['opm']) == [
+        'opm version 1.0',
+        'opm-v1.26.4 version 1.0',
+        'opm-v1.40.0 version 1.0',
+    ]
+    assert versions['podman'] == 'podman version 1.0'
+    assert versions['buildah'] == 'buildah version 1.0'
+    # The versions are only determined once
+    versions['podman'] = 'modified'
+    assert common_utils.get_binary_versions()['podman'] == 'podman version 1.0'
+    assert mock_run_cmd.call_count == 5
+
+
+@mock.patch('iib.workers.tasks.utils.run_cmd')
+def test_get_binary_versions_not_found(mock_run_cmd):
+    mock_run_cmd.side_effect = FileNotFoundError('podman')
+
+    assert common_utils.get_binary_versions() == {'opm': '', 'podman': '', 'buildah': ''}
+    common_utils.get_binary_versions()
+    assert mock_run_cmd.call_count == 2
+
+
 @pytest.mark.parametrize(
     'pull_spec, expected',
     (
@@ -714,6 +900,31 @@ def test_get_resolved_bundles_success(mock_si, mock_gri, skopeo_inspect_rv, expe
     assert response == expected_response
 
 
+@mock.patch('iib.workers.tasks.utils.get_resolved_image')
+@mock.patch('iib.workers.tasks.utils.skopeo_inspect')
+def test_get_resolved_bundles_keeps_order(mock_si, mock_gri):
+    mock_si.return_value = {
+        'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+        'schemaVersion': 2,
+    }
+    mock_gri.side_effect = [
+        'quay.io/bundle3@sha256:3',
+        'quay.io/bundle1@sha256:1',
+        'quay.io/bundle3@sha256:3',
+        'quay.io/bundle2@sha256:2',
+    ]
+
+    response = utils.get_resolved_bundles(
+        ['quay.io/bundle3:3', 'quay.io/bundle1:1', 'quay.io/bundle3:latest', 'quay.io/bundle2:2']
+    )
+
+    assert response == [
+        'quay.io/bundle3@sha256:3',
+        'quay.io/bundle1@sha256:1',
+        'quay.io/bundle2@sha256:2',
+    ]
+
+
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_resolved_bundles_failure(mock_si):
     skopeo_inspect_rv = {
@@ -837,6 +1048,73 @@ def test_get_image_arches_not_manifest_list(mock_si):
         utils.get_image_arches('image:latest')
 
 
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils._resolve_image')
+def test_get_resolved_image_cached(mock_ri, mock_gwc):
+    mock_gwc.return_value = mock.Mock(iib_resolved_image_cache_ttl=30)
+    mock_ri.side_effect = ['quay.io/ns/image@sha256:1', 'quay.io/ns/image@sha256:2']
+
+    assert utils.get_resolved_image('quay.io/ns/image:latest') == 'quay.io/ns/image@sha256:1'
+    assert utils.get_resolved_image('quay.io/ns/image:latest') == 'quay.io/ns/image@sha256:1'
+    utils.invalidate_resolved_image_cache('docker://quay.io/ns/image:latest')
+    assert utils.get_resolved_image('quay.io/ns/image:latest') == 'quay.io/ns/image@sha256:2'
+
+    assert mock_ri.call_count == 2
+
+
+@pytest.mark.parametrize('head_digest', ('sha256:123', None))
+@mock.patch('iib.workers.tasks.utils.get_worker_config')
+@mock.patch('iib.workers.tasks.utils.get_registry_client')
+@mock.patch('iib.workers.tasks.utils.skopeo_inspect')
+def test_get_resolved_image_head_request(mock_si, mock_grc, mock_gwc, head_digest):
+    mock_gwc.return_value = mock.Mock(iib_registry_client='native', iib_resolved_image_cache_ttl=0)
+    mock_grc.return_value.get_manifest_digest.return_value = head_digest
+    mock_si.return_value = '{"schemaVersion": 2}'
+
+    rv = utils.get_resolved_image('quay.io/ns/image:latest')
+
+    if head_digest:
+        assert rv == 'quay.io/ns/image@sha256:123'
+        mock_si.assert_not_called()
+    else:
+        raw_digest = hashlib.sha256(b'{"schemaVersion": 2}').hexdigest()
+        assert rv == f'quay.io/ns/image@sha256:{raw_digest}'
+        mock_si.assert_called_once()
+
+
+@mock.patch('iib.workers.tasks.utils.skopeo_inspect')
+def test_image_metadata_is_cached_by_digest(mock_si):
+    mock_si.side_effect = [
+        {'mediaType': 'application/vnd.docker.distribution.manifest.v2+json'},
+        {'architecture': 'amd64', 'config': {'Labels': {'some_label': 'value'}}},
+    ]
+    pull_spec = 'quay.io/ns/image@sha256:123'
+
+    assert utils.get_image_arches(pull_spec) == {'amd64'}
+    assert utils.get_image_label(pull_spec, 'some_label') == 'value'
+    assert utils.get_image_labels(f'docker://{pull_spec}') == {'some_label': 'value'}
+    metadata = utils.get_image_metadata(pull_spec)
+    assert metadata.media_type == 'application/vnd.docker.distribution.manifest.v2+json'
+    assert metadata.digest == 'sha256:123'
+    assert mock_si.call_args_list == [
+        mock.call(f'docker://{pull_spec}', '--raw'),
+        mock.call(f'docker://{pull_spec}', '--config'),
+    ]
+
+    utils.clear_image_metadata_cache()
+    assert utils.get_image_metadata(pull_spec) is not metadata
+
+
+@mock.patch('iib.workers.tasks.utils.skopeo_inspect')
+def test_image_metadata_not_cached_by_tag(mock_si):
+    mock_si.return_value = {'config': {'Labels': {'some_label': 'value'}}}
+
+    assert utils.get_image_label('quay.io/ns/image:latest', 'some_label') == 'value'
+    assert utils.get_image_label('quay.io/ns/image:latest', 'some_label') == 'value'
+    assert mock_si.call_count == 2
+    assert utils.get_image_metadata('quay.io/ns/image:latest').digest is None
+
+
 @pytest.mark.parametrize('label, expected', (('some_label', 'value'), ('not_there', '')))
 @mock.patch('iib.workers.tasks.utils.skopeo_inspect')
 def test_get_image_label(mock_si, label, expected):